@@ -0,0 +1,26 @@
+"""
+Ponto de entrada ASGI (ex.: uvicorn api.asgi:app --workers 1)
+As rotas de recomendação são assíncronas; o resto da aplicação Flask corre num pool de threads
+"""
+import sys
+import os
+
+# Adiciona o diretório raiz ao path
+root_dir = os.path.join(os.path.dirname(__file__), '..')
+root_dir = os.path.abspath(root_dir)
+if root_dir not in sys.path:
+    sys.path.insert(0, root_dir)
+
+# Muda para o diretório raiz
+os.chdir(root_dir)
+
+# Importa a aplicação ASGI (ver app/asgi.py)
+try:
+    from app.asgi import app as asgi_app
+except Exception as e:
+    print(f"Erro ao importar app ASGI: {e}")
+    import traceback
+    traceback.print_exc()
+    raise
+
+app = asgi_app
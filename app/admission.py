@@ -0,0 +1,251 @@
+# Nome do ficheiro: app/admission.py
+"""
+Controlo de admissão dos endpoints caros (análise de imagem e recomendações).
+
+Cada pedido destes pode chamar a Vision API, o Gemini várias vezes e o
+yt-dlp. Sem limite, uma rajada esgota a quota do Gemini e todos os pedidos
+ficam lentos ao mesmo tempo. Aqui:
+
+- `Bulkhead`: no máximo `limite` pedidos em execução por endpoint, com uma
+  fila de espera limitada (`fila_max`) e um prazo (`espera_max`); o que não
+  for admitido a tempo é recusado logo com 503 e Retry-After, em vez de
+  atrasar os pedidos já admitidos. Regista o tempo passado na fila.
+- `LimiteUtilizador`: token bucket por utilizador (429 com Retry-After).
+- `admitir(...)`: decorador que aplica os dois a uma rota.
+- `BulkheadAsync`/`admitir_async(...)`: o mesmo para as rotas servidas como
+  corrotinas no modo ASGI (app/asgi.py), onde esperar por uma vaga não ocupa
+  uma thread e por isso o limite pode ser muito maior.
+
+As recusas são `AdmissaoRecusadaError`; o servidor converte-as em resposta HTTP.
+"""
+import asyncio
+import functools
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+RECOMENDACAO_CONCORRENCIA = int(os.environ.get('RECOMENDACAO_CONCORRENCIA', '4'))
+RECOMENDACAO_FILA_MAX = int(os.environ.get('RECOMENDACAO_FILA_MAX', '8'))
+RECOMENDACAO_ESPERA_MAX = float(os.environ.get('RECOMENDACAO_ESPERA_MAX', '10'))
+# Pedidos de recomendação por utilizador: ritmo sustentado e rajada
+UTILIZADOR_PEDIDOS_POR_MINUTO = float(os.environ.get('UTILIZADOR_PEDIDOS_POR_MINUTO', '12'))
+UTILIZADOR_RAJADA = int(os.environ.get('UTILIZADOR_RAJADA', '4'))
+UTILIZADOR_MAX_BUCKETS = 10000
+# Modo ASGI: os pedidos admitidos esperam por I/O sem ocupar threads
+ASGI_RECOMENDACAO_CONCORRENCIA = int(os.environ.get('ASGI_RECOMENDACAO_CONCORRENCIA', '256'))
+ASGI_RECOMENDACAO_FILA_MAX = int(os.environ.get('ASGI_RECOMENDACAO_FILA_MAX', '512'))
+
+
+class AdmissaoRecusadaError(Exception):
+    """Pedido não admitido: `status` (429/503) e `retry_after` em segundos."""
+
+    def __init__(self, mensagem, status, retry_after):
+        super().__init__(mensagem)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Bulkhead:
+    """Semáforo com fila de espera limitada, prazo de admissão e contabilização do tempo em fila."""
+
+    def __init__(self, nome, limite, fila_max, espera_max):
+        self.nome = nome
+        self.limite = limite
+        self.fila_max = fila_max
+        self.espera_max = espera_max
+        self._cond = threading.Condition()
+        self._ativos = 0
+        self._em_espera = 0
+        # Média móvel (EWMA) da duração de um pedido admitido, para estimar o Retry-After
+        self._duracao_media = 1.0
+        self._stats = {'admitted': 0, 'rejected_queue_full': 0, 'rejected_timeout': 0,
+                       'queued': 0, 'total_queue_ms': 0.0, 'max_queue_ms': 0.0}
+
+    def _retry_after(self):
+        return max(1, math.ceil(self._duracao_media * (self._em_espera + 1) / self.limite))
+
+    def _recusar(self, motivo, mensagem):
+        self._stats[motivo] += 1
+        raise AdmissaoRecusadaError(mensagem, 503, self._retry_after())
+
+    def entrar(self):
+        """Espera por uma vaga (até `espera_max`). Retorna o tempo passado na fila, em segundos."""
+        inicio = time.monotonic()
+        with self._cond:
+            if self._ativos < self.limite and self._em_espera == 0:
+                self._ativos += 1
+                self._stats['admitted'] += 1
+                return 0.0
+            if self._em_espera >= self.fila_max:
+                self._recusar('rejected_queue_full', "O servidor está ocupado. Tente novamente em breve.")
+            self._em_espera += 1
+            self._stats['queued'] += 1
+            prazo = inicio + self.espera_max
+            try:
+                while self._ativos >= self.limite:
+                    restante = prazo - time.monotonic()
+                    if restante <= 0:
+                        self._recusar('rejected_timeout', "O servidor está ocupado. Tente novamente em breve.")
+                    self._cond.wait(restante)
+            finally:
+                self._em_espera -= 1
+            self._ativos += 1
+            espera = time.monotonic() - inicio
+            self._stats['admitted'] += 1
+            self._stats['total_queue_ms'] += espera * 1000
+            self._stats['max_queue_ms'] = max(self._stats['max_queue_ms'], espera * 1000)
+            return espera
+
+    def sair(self, duracao):
+        with self._cond:
+            self._ativos -= 1
+            self._duracao_media = 0.8 * self._duracao_media + 0.2 * duracao
+            self._cond.notify()
+
+    def snapshot(self):
+        with self._cond:
+            item = dict(self._stats)
+            item.update(limit=self.limite, queue_max=self.fila_max, in_flight=self._ativos,
+                        waiting=self._em_espera, avg_service_s=round(self._duracao_media, 3))
+            item['avg_queue_ms'] = round(item['total_queue_ms'] / item['queued'], 2) if item['queued'] else 0.0
+            item['total_queue_ms'] = round(item['total_queue_ms'], 1)
+            item['max_queue_ms'] = round(item['max_queue_ms'], 1)
+            return item
+
+
+class BulkheadAsync(Bulkhead):
+    """
+    Bulkhead para corrotinas: quem espera fica numa fila de futures (FIFO) e a vaga de quem
+    sai passa diretamente para o primeiro da fila. Usar sempre no mesmo event loop; o
+    snapshot pode ser lido de qualquer thread.
+    """
+
+    def __init__(self, nome, limite, fila_max, espera_max):
+        super().__init__(nome, limite, fila_max, espera_max)
+        self._fila = deque()
+
+    async def entrar(self):
+        inicio = time.monotonic()
+        with self._cond:
+            if self._ativos < self.limite and not self._fila:
+                self._ativos += 1
+                self._stats['admitted'] += 1
+                return 0.0
+            if len(self._fila) >= self.fila_max:
+                self._recusar('rejected_queue_full', "O servidor está ocupado. Tente novamente em breve.")
+            vez = asyncio.get_running_loop().create_future()
+            self._fila.append(vez)
+            self._em_espera += 1
+            self._stats['queued'] += 1
+        cancelado = False
+        try:
+            await asyncio.wait((vez,), timeout=self.espera_max)
+        except asyncio.CancelledError:
+            cancelado = True
+            raise
+        finally:
+            with self._cond:
+                self._em_espera -= 1
+                admitido = vez.done()
+                if not admitido:
+                    self._fila.remove(vez)
+                    vez.cancel()
+            if admitido and cancelado:
+                # Cancelado (cliente desligou) depois de receber a vaga: devolve-a
+                self.sair(0.0)
+        with self._cond:
+            if not admitido:
+                self._recusar('rejected_timeout', "O servidor está ocupado. Tente novamente em breve.")
+            espera = time.monotonic() - inicio
+            self._stats['admitted'] += 1
+            self._stats['total_queue_ms'] += espera * 1000
+            self._stats['max_queue_ms'] = max(self._stats['max_queue_ms'], espera * 1000)
+            return espera
+
+    def sair(self, duracao):
+        with self._cond:
+            if duracao:
+                self._duracao_media = 0.8 * self._duracao_media + 0.2 * duracao
+            while self._fila:
+                vez = self._fila.popleft()
+                if not vez.done():
+                    # A vaga passa para o próximo: _ativos não muda
+                    vez.set_result(True)
+                    return
+            self._ativos -= 1
+
+
+class LimiteUtilizador:
+    """Token bucket por utilizador, não bloqueante. Os buckets menos usados são descartados (LRU)."""
+
+    def __init__(self, por_minuto, rajada, max_utilizadores=UTILIZADOR_MAX_BUCKETS):
+        self.rate = por_minuto / 60.0
+        self.capacidade = float(rajada)
+        self.max_utilizadores = max_utilizadores
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.recusados = 0
+
+    def consumir(self, chave):
+        """Gasta uma ficha do utilizador. Retorna 0 se admitido, senão os segundos até haver ficha."""
+        agora = time.monotonic()
+        with self._lock:
+            fichas, ultimo = self._buckets.pop(chave, (self.capacidade, agora))
+            fichas = min(self.capacidade, fichas + (agora - ultimo) * self.rate)
+            if fichas >= 1.0:
+                fichas -= 1.0
+                espera = 0.0
+            else:
+                espera = (1.0 - fichas) / self.rate
+                self.recusados += 1
+            self._buckets[chave] = (fichas, agora)
+            if len(self._buckets) > self.max_utilizadores:
+                self._buckets.popitem(last=False)
+            return espera
+
+
+def admitir(bulkhead, limite_utilizador=None, chave_utilizador=None):
+    """
+    Decorador de rota: aplica o limite por utilizador (se `chave_utilizador()` devolver uma chave)
+    e depois o bulkhead. Levanta AdmissaoRecusadaError quando o pedido não é admitido.
+    """
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            chave = chave_utilizador() if chave_utilizador else None
+            if limite_utilizador is not None and chave is not None:
+                espera = limite_utilizador.consumir(chave)
+                if espera > 0:
+                    raise AdmissaoRecusadaError("Demasiados pedidos. Aguarde um pouco antes de tentar novamente.",
+                                                429, max(1, math.ceil(espera)))
+            bulkhead.entrar()
+            inicio = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                bulkhead.sair(time.monotonic() - inicio)
+        return wrapper
+    return decorador
+
+
+def admitir_async(bulkhead, limite_utilizador=None, chave_utilizador=None):
+    """Como `admitir`, para rotas que são corrotinas (com um BulkheadAsync)."""
+    def decorador(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            chave = chave_utilizador() if chave_utilizador else None
+            if limite_utilizador is not None and chave is not None:
+                espera = limite_utilizador.consumir(chave)
+                if espera > 0:
+                    raise AdmissaoRecusadaError("Demasiados pedidos. Aguarde um pouco antes de tentar novamente.",
+                                                429, max(1, math.ceil(espera)))
+            await bulkhead.entrar()
+            inicio = time.monotonic()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                bulkhead.sair(time.monotonic() - inicio)
+        return wrapper
+    return decorador
@@ -0,0 +1,301 @@
+# Nome do ficheiro: app/asgi.py
+"""
+Modo de execução ASGI (ex.: `uvicorn api.asgi:app`).
+
+Os endpoints de recomendação passam quase todo o tempo à espera da Vision, do
+Gemini, do Spotify e do yt-dlp. Em WSGI cada um ocupa uma thread e o bulkhead
+limita-os a RECOMENDACAO_CONCORRENCIA; aqui correm como corrotinas
+(app/async_engine.py) num único event loop, com um BulkheadAsync bem mais largo
+(ASGI_RECOMENDACAO_CONCORRENCIA).
+
+- POST /api/recommend_by_image e /api/recommend_from_tags: vistas assíncronas
+  servidas dentro de um contexto de pedido do Flask, por isso os hooks
+  (métricas, trace, Server-Timing), a sessão e os errorhandlers são os mesmos
+  do modo WSGI. O serviço de música é passado ao motor em vez de mudar
+  `engine.music_service`, que é partilhado entre pedidos.
+- Se o cliente desligar, o pedido é cancelado (e as chamadas em curso com ele)
+  e fica registado com o estado 499. ASGI_PRAZO_PEDIDO (s, 0 = sem prazo)
+  limita a duração destes pedidos (504).
+- Todas as outras rotas são servidas pela aplicação Flask tal como está, num
+  pool de threads (ASGI_WSGI_THREADS).
+- No arranque (lifespan) os componentes são criados antes de aceitar pedidos
+  (server.aquecer), como nos workers do gunicorn.conf.py.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import jsonify, request, session
+
+from . import admission
+from . import async_engine
+from . import logs
+from . import server
+from .async_engine import bloqueante
+from .errors import SpotifyRateLimitError
+from .uploads import ler_imagem, MAX_CONTENT_LENGTH
+
+log = logs.obter('asgi')
+
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '16'))
+ASGI_PRAZO_PEDIDO = float(os.environ.get('ASGI_PRAZO_PEDIDO', '0'))
+# Código usado nas métricas/traces quando o cliente desliga antes da resposta (convenção do nginx)
+ESTADO_CLIENTE_DESLIGOU = 499
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='asgi-wsgi')
+
+# Os bulkheads das rotas assíncronas substituem os do modo WSGI em server._bulkheads,
+# para /api/admission_stats e /metrics mostrarem os que estão em uso.
+for _nome in ('recommend_by_image', 'recommend_from_tags'):
+    server._bulkheads[_nome] = admission.BulkheadAsync(
+        _nome, admission.ASGI_RECOMENDACAO_CONCORRENCIA, admission.ASGI_RECOMENDACAO_FILA_MAX,
+        admission.RECOMENDACAO_ESPERA_MAX)
+
+_motor = None
+
+
+async def _obter_motor():
+    global _motor
+    if _motor is None:
+        # A criação do motor (base de dados, géneros) é bloqueante
+        _motor = async_engine.MotorAssincrono(await bloqueante(server.get_app_context().__getitem__, 'engine'))
+    return _motor
+
+
+def _admitir_recomendacao(nome):
+    return admission.admitir_async(server._bulkheads[nome], server._limite_recomendacoes,
+                                   lambda: session.get('internal_user_id'))
+
+
+@_admitir_recomendacao('recommend_by_image')
+async def recommend_by_image_api():
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    if 'image' not in request.files: return jsonify({"error": "Nenhum ficheiro de imagem."}), 400
+    file = request.files['image']
+    if not file or file.filename == '': return jsonify({"error": "Ficheiro inválido."}), 400
+    imagem = ler_imagem(file)
+    log.debug("Imagem recebida: %s bytes, %s, sha256 %s", imagem.tamanho, imagem.mime_type, imagem.sha256[:12])
+    motor = await _obter_motor()
+    servico = await bloqueante(server._get_active_service)
+    if not servico: return jsonify({"error": "Serviço de música não encontrado."}), 500
+    tags, playlist_title = await motor.analisar_imagem_bytes(imagem.conteudo, imagem.mime_type)
+    if not tags: return jsonify({"error": "Não foi possível analisar a imagem."}), 500
+    try:
+        recomendacoes = await motor.recomendar_musicas_por_tags(tags, servico, is_redo=False)
+    except SpotifyRateLimitError:
+        raise
+    except Exception as e:
+        log.error("Erro ao obter recomendações: %s", e)
+        return jsonify({"error": f"Erro ao obter recomendações: {str(e)}"}), 500
+    if recomendacoes is None: return jsonify({"error": "Erro ao obter recomendações."}), 500
+    return jsonify({"ambiente_detetado": tags, "recomendacoes": recomendacoes, "playlist_title": playlist_title})
+
+
+@_admitir_recomendacao('recommend_from_tags')
+async def recommend_from_tags_api():
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    motor = await _obter_motor()
+    servico = await bloqueante(server._get_active_service)
+    if not servico: return jsonify({"error": "Serviço de música não encontrado."}), 500
+    data = request.get_json(); tags = data.get('tags')
+    if not tags: return jsonify({"error": "Nenhuma tag fornecida."}), 400
+    recomendacoes = await motor.recomendar_musicas_por_tags(tags, servico, is_redo=True)
+    if recomendacoes is None: return jsonify({"error": "Erro ao obter recomendações."}), 500
+    return jsonify({"ambiente_detetado": tags, "recomendacoes": recomendacoes, "playlist_title": f"Novas recomendações para: {', '.join(map(str, tags))}"})
+
+
+ROTAS_ASSINCRONAS = {
+    ('POST', '/api/recommend_by_image'): recommend_by_image_api,
+    ('POST', '/api/recommend_from_tags'): recommend_from_tags_api,
+}
+
+
+def _environ(scope, corpo):
+    """Environ WSGI equivalente ao pedido ASGI (o corpo já foi lido para memória)."""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    servidor = scope.get('server') or ('localhost', 80)
+    cliente = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': servidor[0],
+        'SERVER_PORT': str(servidor[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': cliente[0],
+        'REMOTE_PORT': str(cliente[1]),
+        'CONTENT_LENGTH': str(len(corpo)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(corpo),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for nome, valor in scope.get('headers', []):
+        nome, valor = nome.decode('latin-1'), valor.decode('latin-1')
+        if nome == 'content-length':
+            continue
+        chave = 'CONTENT_TYPE' if nome == 'content-type' else 'HTTP_' + nome.upper().replace('-', '_')
+        if chave in environ:
+            valor = environ[chave] + ('; ' if chave == 'HTTP_COOKIE' else ',') + valor
+        environ[chave] = valor
+    return environ
+
+
+async def _ler_corpo(receive):
+    """Corpo completo do pedido, ou None se exceder MAX_CONTENT_LENGTH (ou o cliente desligar)."""
+    partes, tamanho = [], 0
+    while True:
+        mensagem = await receive()
+        if mensagem['type'] == 'http.disconnect':
+            return None
+        corpo = mensagem.get('body', b'')
+        tamanho += len(corpo)
+        if tamanho > MAX_CONTENT_LENGTH:
+            return None
+        partes.append(corpo)
+        if not mensagem.get('more_body', False):
+            return b''.join(partes)
+
+
+async def _enviar(send, estado, cabecalhos, corpo):
+    await send({'type': 'http.response.start', 'status': estado,
+                'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in cabecalhos]})
+    await send({'type': 'http.response.body', 'body': corpo})
+
+
+def _wsgi(flask_app, environ):
+    """Serve o pedido pela aplicação Flask (numa thread do pool). Retorna (estado, cabeçalhos, corpo)."""
+    resposta = {}
+
+    def start_response(status, headers, exc_info=None):
+        resposta['estado'], resposta['cabecalhos'] = int(status.split(' ', 1)[0]), headers
+
+    iteravel = flask_app(environ, start_response)
+    try:
+        corpo = b''.join(iteravel)
+    finally:
+        if hasattr(iteravel, 'close'):
+            iteravel.close()
+    return resposta['estado'], resposta['cabecalhos'], corpo
+
+
+class AplicacaoAsgi:
+    """Aplicação ASGI: rotas assíncronas de recomendação e o resto do Flask em threads."""
+
+    def __init__(self, flask_app, rotas=ROTAS_ASSINCRONAS):
+        self.flask_app = flask_app
+        self.rotas = rotas
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._ciclo_de_vida(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                await self._aquecer()
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                await self._encerrar()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _aquecer(self):
+        # O servidor só aceita pedidos depois do arranque: o primeiro pedido não paga a inicialização
+        try:
+            await bloqueante(server.aquecer)
+            await _obter_motor()
+        except Exception:
+            # Já registado; /readyz fica a 503 e volta a tentar
+            pass
+
+    async def _encerrar(self):
+        await async_engine.fechar()
+        contexto = server.get_app_context()
+        if contexto.inicializado('jobs'):
+            await bloqueante(contexto['jobs'].parar)
+        logs.parar()
+
+    async def _http(self, scope, receive, send):
+        corpo = await _ler_corpo(receive)
+        if corpo is None:
+            mensagem = {"error": f"O pedido excede o tamanho máximo de {MAX_CONTENT_LENGTH // (1024 * 1024)} MB."}
+            await _enviar(send, 413, [('Content-Type', 'application/json')], json.dumps(mensagem).encode('utf-8'))
+            return
+        environ = _environ(scope, corpo)
+        vista = self.rotas.get((scope['method'], scope['path']))
+        if vista is None:
+            loop = asyncio.get_running_loop()
+            estado, cabecalhos, corpo = await loop.run_in_executor(_wsgi_executor, _wsgi, self.flask_app, environ)
+            await _enviar(send, estado, cabecalhos, corpo)
+            return
+
+        tarefa = asyncio.ensure_future(self._servir(vista, environ))
+        vigia = asyncio.ensure_future(self._vigiar_desligar(receive, tarefa))
+        try:
+            resposta = await tarefa
+        except asyncio.CancelledError:
+            if asyncio.current_task().cancelling():
+                # O próprio servidor cancelou este pedido (ex.: a encerrar)
+                tarefa.cancel()
+                raise
+            return
+        finally:
+            vigia.cancel()
+        try:
+            await _enviar(send, resposta.status_code, resposta.headers.items(), resposta.get_data())
+        finally:
+            resposta.close()
+
+    async def _vigiar_desligar(self, receive, tarefa):
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'http.disconnect':
+                tarefa.cancel()
+                return
+
+    async def _servir(self, vista, environ):
+        """Corre a vista no contexto de pedido do Flask, como Flask.wsgi_app/full_dispatch_request."""
+        app = self.flask_app
+        contexto = app.request_context(environ)
+        erro = None
+        contexto.push()
+        try:
+            try:
+                try:
+                    rv = app.preprocess_request()
+                    if rv is None:
+                        async with asyncio.timeout(ASGI_PRAZO_PEDIDO or None):
+                            rv = await vista()
+                except TimeoutError:
+                    log.warning("Pedido %s excedeu o prazo de %ss", request.path, ASGI_PRAZO_PEDIDO)
+                    rv = jsonify({"error": "O pedido demorou demasiado. Tente novamente."}), 504
+                except Exception as e:
+                    rv = app.handle_user_exception(e)
+                return app.finalize_request(rv)
+            except asyncio.CancelledError:
+                # Cliente desligou: nada é enviado, mas as métricas e o trace registam o pedido
+                log.info("Cliente desligou durante %s; pedido cancelado", request.path)
+                app.finalize_request(('', ESTADO_CLIENTE_DESLIGOU))
+                raise
+            except Exception as e:
+                erro = e
+                return app.handle_exception(e)
+        finally:
+            contexto.pop(erro)
+
+
+app = AplicacaoAsgi(server.app)
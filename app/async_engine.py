@@ -0,0 +1,388 @@
+# Nome do ficheiro: app/async_engine.py
+"""
+Motor de recomendação assíncrono, usado pelas rotas servidas em modo ASGI (app/asgi.py).
+
+No modo WSGI cada recomendação ocupa uma thread durante a Vision, as várias
+chamadas ao Gemini e as buscas, por isso a concorrência é igual ao número de
+threads. Aqui as mesmas etapas são corrotinas:
+
+- Gemini e Spotify: cliente HTTP assíncrono (httpx) partilhado, com pool de
+  ligações; os pedidos ao Gemini são os mesmos PassoGemini do motor síncrono e
+  o Spotify passa pelo mesmo rate limiter, tratamento de 429, estatísticas e
+  cassete do RateLimitedSpotify;
+- SDKs bloqueantes (Vision, yt-dlp) e SQLite: `bloqueante()`, um pool de
+  threads dedicado (ASYNC_BLOQUEANTES_THREADS) que continua o trace atual;
+- etapas independentes correm com `em_paralelo()` (asyncio.TaskGroup): se uma
+  falhar ou o pedido for cancelado (o cliente desligou), as outras são
+  canceladas. Uma chamada bloqueante já em curso numa thread não pode ser
+  interrompida: termina e o resultado é descartado.
+
+A lógica (prompts, interpretação das respostas, deduplicação, re-ranking) é a
+do RecommendationEngine; este módulo só muda a forma de esperar pelo I/O.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import cassette
+from . import logs
+from . import metrics
+from . import spotify_client
+from .errors import SpotifyRateLimitError
+from .lazy import importar
+from .recommendation_engine import ProcessadorFaixas
+from .services.spotify_service import SpotifyService, SEARCH_PAGE_MAX, AUDIO_FEATURES_BATCH
+from .services.youtube_service import YouTubeMusicService
+
+log = logs.obter('async_engine')
+
+ASYNC_HTTP_CONEXOES = int(os.environ.get('ASYNC_HTTP_CONEXOES', '200'))
+ASYNC_BLOQUEANTES_THREADS = int(os.environ.get('ASYNC_BLOQUEANTES_THREADS', '32'))
+SPOTIFY_API = 'https://api.spotify.com/v1/'
+# Como o Retry da sessão síncrona (spotify_client.get_http_session): 5xx repetidos com backoff
+SPOTIFY_STATUS_REPETIR = (500, 502, 503, 504)
+SPOTIFY_REPETICOES = 2
+SPOTIFY_BACKOFF = 0.3
+
+_bloqueantes = ThreadPoolExecutor(max_workers=ASYNC_BLOQUEANTES_THREADS, thread_name_prefix='async-bloqueante')
+_cliente = None
+
+
+def cliente_http():
+    """Cliente httpx partilhado (criado no primeiro uso, dentro do event loop do servidor)."""
+    global _cliente
+    if _cliente is None:
+        httpx = importar('httpx')
+        _cliente = httpx.AsyncClient(
+            timeout=15, limits=httpx.Limits(max_connections=ASYNC_HTTP_CONEXOES, max_keepalive_connections=ASYNC_HTTP_CONEXOES))
+    return _cliente
+
+
+async def fechar():
+    """Fecha o cliente HTTP (fim do ciclo de vida do servidor ASGI)."""
+    global _cliente
+    cliente, _cliente = _cliente, None
+    if cliente is not None:
+        await cliente.aclose()
+
+
+async def bloqueante(func, *args, **kwargs):
+    """Corre uma chamada bloqueante no pool dedicado, continuando o trace/span atual."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_bloqueantes, functools.partial(contextvars.copy_context().run, func, *args, **kwargs))
+
+
+async def em_paralelo(*corrotinas):
+    """
+    Corre as corrotinas em paralelo e devolve os resultados pela ordem dada. Se uma falhar,
+    as restantes são canceladas e a exceção é relançada tal como é (sem ExceptionGroup).
+    """
+    try:
+        async with asyncio.TaskGroup() as grupo:
+            tarefas = [grupo.create_task(c) for c in corrotinas]
+    except BaseExceptionGroup as erros:
+        raise erros.exceptions[0] from None
+    return [t.result() for t in tarefas]
+
+
+async def _post_gemini(tipo, api_url, payload, timeout):
+    """POST ao Gemini medido por tipo de chamada, como recommendation_engine._post_gemini."""
+    httpx = importar('httpx')
+    with metrics.medir_estagio(f'gemini_{tipo}'):
+        try:
+            response = await cassette.chamar_async(
+                'gemini', {'url': api_url, 'json': payload},
+                lambda: cliente_http().post(api_url, json=payload, timeout=timeout),
+                cassette.codificar_httpx, cassette.descodificar_httpx)
+        except httpx.HTTPError:
+            metrics.registar_pedido_externo('gemini')
+            raise
+    metrics.registar_pedido_externo('gemini', response.status_code)
+    return response
+
+
+async def executar_passo(motor, passo):
+    """Executa um PassoGemini do motor síncrono com o cliente assíncrono."""
+    if passo.payload is None:
+        return passo.omissao
+    chave = motor.chave_cache('gemini', passo.tipo, passo.payload) if passo.cacheavel else None
+    response = None
+    try:
+        result = await bloqueante(motor.result_cache.obter, 'gemini', chave) if chave else None
+        if result is None:
+            response = await _post_gemini(passo.tipo, motor.url_gemini, passo.payload, passo.timeout)
+            log.debug("Gemini (%s): HTTP %s", passo.tipo, response.status_code)
+            response.raise_for_status()
+            result = response.json()
+            if chave:
+                await bloqueante(motor.result_cache.guardar, 'gemini', chave, result)
+        return passo.interpretar(result)
+    except Exception as e:
+        return passo.falhou(e, response.text if response is not None else None)
+
+
+class SpotifyAssincrono:
+    """
+    Os endpoints do Spotify usados nas recomendações (busca, recomendações, audio features),
+    pedidos com httpx em nome do cliente spotipy do SpotifyService: o mesmo token, rate limiter,
+    tratamento de 429 e estatísticas. As gravações da cassete têm as mesmas chaves do modo síncrono.
+    """
+
+    def __init__(self, servico):
+        self.servico = servico
+        self.sp = servico.sp_app
+
+    async def _token(self):
+        auth = self.sp.auth_manager
+        if auth is None:
+            return self.sp._auth
+        # Normalmente o token já foi renovado em segundo plano (ProactiveClientCredentials)
+        info = auth.cache_handler.get_cached_token()
+        if info and not auth.is_token_expired(info):
+            return info['access_token']
+        return await bloqueante(auth.get_access_token, as_dict=False)
+
+    async def _get(self, url, params):
+        """Um GET à Web API; as respostas de erro dão SpotifyException, como no spotipy."""
+        cabecalhos = {'Authorization': f'Bearer {await self._token()}', 'Content-Type': 'application/json'}
+        # O requests omite parâmetros None; o httpx enviaria "market="
+        enviados = {k: v for k, v in params.items() if v is not None}
+        for tentativa in range(SPOTIFY_REPETICOES + 1):
+            resposta = await cliente_http().get(SPOTIFY_API + url, params=enviados, headers=cabecalhos,
+                                                timeout=spotify_client.REQUESTS_TIMEOUT)
+            if resposta.status_code not in SPOTIFY_STATUS_REPETIR or tentativa == SPOTIFY_REPETICOES:
+                break
+            await asyncio.sleep(SPOTIFY_BACKOFF * 2 ** tentativa)
+        if resposta.status_code >= 400:
+            try:
+                erro = resposta.json().get('error', {})
+                msg, motivo = erro.get('message'), erro.get('reason')
+            except ValueError:
+                msg, motivo = resposta.text or None, None
+            raise spotify_client.SpotifyException(resposta.status_code, -1, f"{resposta.url}:\n {msg}",
+                                                  reason=motivo, headers=resposta.headers)
+        try:
+            return resposta.json()
+        except ValueError:
+            return None
+
+    async def _chamar(self, url, params):
+        """Como RateLimitedSpotify._internal_call: rate limiter, 429 com espera limitada e estatísticas."""
+        endpoint = spotify_client._normalizar_endpoint(url)
+        tentativa = 0
+        while True:
+            if not await self.sp.limiter.acquire_async(timeout=self.sp.max_retry_after):
+                raise SpotifyRateLimitError(max(1.0, self.sp.limiter.paused_for()), endpoint)
+            inicio = time.perf_counter()
+            status = 200
+            try:
+                return await cassette.chamar_async(
+                    'spotify', {'method': 'GET', 'url': url, 'payload': None, 'params': params},
+                    functools.partial(self._get, url, params))
+            except spotify_client.SpotifyException as e:
+                status = e.http_status or 500
+                if status != 429:
+                    raise
+                retry_after = self.sp._retry_after(e)
+                self.sp.limiter.pause(retry_after)
+                if retry_after > self.sp.max_retry_after or tentativa >= spotify_client.MAX_429_RETRIES:
+                    log.warning("429 em '%s', Retry-After=%ss. A desistir.", endpoint, retry_after)
+                    raise SpotifyRateLimitError(retry_after, endpoint) from e
+                tentativa += 1
+                log.warning("429 em '%s', a aguardar %ss (tentativa %s).", endpoint, retry_after, tentativa)
+            finally:
+                self.sp.stats.record(endpoint, (time.perf_counter() - inicio) * 1000.0, status)
+
+    async def _pagina(self, query, page_size, offset, market):
+        cache = self.servico.result_cache
+        chave = self.servico.chave_pagina(query, page_size, offset, market)
+        items = await bloqueante(cache.obter, 'busca_spotify', chave) if chave else None
+        if items is None:
+            results = await self._chamar('search', {'q': query, 'limit': page_size, 'offset': offset, 'type': 'track', 'market': market})
+            items = (results or {}).get('tracks', {}).get('items', [])
+            if chave:
+                await bloqueante(cache.guardar, 'busca_spotify', chave, items)
+        return items
+
+    async def buscar_paginado(self, query, limit=25, market='BR', aceitar=None, max_pages=3):
+        """Como SpotifyService.search_tracks_paginated: páginas em paralelo, filtradas pela ordem de relevância."""
+        with metrics.medir_estagio('search_spotify'):
+            page_size = min(SEARCH_PAGE_MAX, max(limit, 10))
+            tarefas = [asyncio.ensure_future(self._pagina(query, page_size, page * page_size, market))
+                       for page in range(max(1, max_pages))]
+            aceites = []
+            try:
+                for tarefa in tarefas:
+                    try:
+                        items = await tarefa
+                    except SpotifyRateLimitError:
+                        # Só propaga se nada foi obtido; caso contrário usa o que já chegou
+                        if aceites:
+                            break
+                        raise
+                    except Exception as e:
+                        log.error("Erro numa página da busca: %s", e)
+                        continue
+                    for item in items:
+                        if aceitar is None or aceitar(item):
+                            aceites.append(item)
+                            if len(aceites) >= limit:
+                                return aceites
+                    if len(items) < page_size:
+                        # Não há mais resultados para esta query
+                        break
+                return aceites
+            finally:
+                for tarefa in tarefas:
+                    tarefa.cancel()
+                await asyncio.gather(*tarefas, return_exceptions=True)
+
+    async def recomendacoes(self, seed_genres, targets=None, limit=50, market='BR'):
+        """Como SpotifyService.get_recommendations (os parâmetros são os que o spotipy envia)."""
+        if not seed_genres:
+            return []
+        params = {'limit': min(limit, 100), 'seed_genres': ','.join(seed_genres[:5])}
+        if market:
+            params['market'] = market
+        params.update({f"target_{k}": v for k, v in (targets or {}).items()})
+        with metrics.medir_estagio('recommendations_spotify'):
+            try:
+                results = await self._chamar('recommendations', params)
+                return (results or {}).get('tracks', [])
+            except SpotifyRateLimitError:
+                raise
+            except Exception as e:
+                log.error("Erro nas recomendações por sementes: %s", e); return []
+
+    async def _lote_features(self, lote):
+        try:
+            resultados = await self._chamar('audio-features/?ids=' + ','.join(lote), {})
+        except SpotifyRateLimitError:
+            raise
+        except Exception as e:
+            log.error("Erro ao obter audio features: %s", e)
+            return {}
+        if isinstance(resultados, dict) and 'audio_features' in resultados:
+            resultados = resultados['audio_features']
+        return dict(zip(lote, resultados or []))
+
+    async def audio_features(self, track_ids):
+        """Como SpotifyService.get_audio_features: cache local primeiro, lotes em falta em paralelo."""
+        with metrics.medir_estagio('audio_features_spotify'):
+            track_ids = [t for t in dict.fromkeys(track_ids) if t]
+            cache = self.servico.features_cache
+            features = await bloqueante(cache.get_many, track_ids) if cache else {}
+            em_falta = [t for t in track_ids if t not in features]
+            novos = {}
+            lotes = [em_falta[i:i + AUDIO_FEATURES_BATCH] for i in range(0, len(em_falta), AUDIO_FEATURES_BATCH)]
+            for parcial in await em_paralelo(*(self._lote_features(lote) for lote in lotes)):
+                novos.update(parcial)
+            if novos and cache:
+                await bloqueante(cache.put_many, novos)
+            features.update(novos)
+            return features
+
+
+class MotorAssincrono:
+    """Orquestra as recomendações como o RecommendationEngine, com o I/O em corrotinas."""
+
+    def __init__(self, motor):
+        self.motor = motor
+
+    async def analisar_imagem_bytes(self, content, mime_type='image/jpeg'):
+        """Vision (no pool de threads) e Gemini (emoção/título) em paralelo."""
+        log.debug("Análise de imagem: %d bytes (%s)", len(content), mime_type)
+        # O hash de uma imagem grande demora: corre fora do event loop
+        chave = await bloqueante(self.motor.chave_imagem, content, mime_type)
+        guardado = await bloqueante(self.motor.result_cache.obter, 'imagem', chave) if chave else None
+        if guardado is not None:
+            log.debug("Análise de imagem reutilizada da cache")
+            return tuple(guardado)
+        tags, playlist_title = await self._analisar_imagem(content, mime_type)
+        if chave and tags:
+            await bloqueante(self.motor.result_cache.guardar, 'imagem', chave, [tags, playlist_title])
+        return tags, playlist_title
+
+    async def _analisar_imagem(self, content, mime_type):
+        # O primeiro acesso cria o cliente Vision (bloqueante). Como no motor síncrono, sem Vision não pede o Gemini
+        if not await bloqueante(getattr, self.motor, 'vision_client'):
+            log.error("Cliente Google Vision não inicializado.")
+            return None, None
+        with metrics.medir_estagio('analise_imagem'):
+            try:
+                tags_vision, (emocao, titulo) = await em_paralelo(
+                    bloqueante(self.motor.tags_vision, content),
+                    executar_passo(self.motor, self.motor.passo_emocao_e_titulo(content, mime_type)))
+            except Exception as e:
+                log.error("Erro ao analisar imagem: %s", e, exc_info=True)
+                return None, None
+            if tags_vision is None:
+                return None, None
+            return self.motor.juntar_tags(tags_vision, emocao, titulo)
+
+    async def recomendar_musicas_por_tags(self, tags, servico, market='BR', limit=25, is_redo=False):
+        """Como RecommendationEngine.recomendar_musicas_por_tags, com o serviço passado explicitamente."""
+        log.debug("Recomendação: tags=%s limite=%s market=%s is_redo=%s", tags, limit, market, is_redo)
+        if servico is None:
+            log.error("Serviço de música não inicializado")
+            return None
+        if not tags:
+            log.error("Nenhuma tag fornecida")
+            return []
+        if isinstance(servico, SpotifyService):
+            resultado = await self._recomendar_spotify(tags, SpotifyAssincrono(servico), market, limit, is_redo)
+            log.info("Recomendação (Spotify): %d faixas", len(resultado))
+            return resultado
+        if not isinstance(servico, YouTubeMusicService):
+            log.error("Tipo de serviço desconhecido: %s", type(servico).__name__)
+            return None
+
+        query_musical = await executar_passo(self.motor, self.motor.passo_prompt_youtube(tags, is_redo))
+        log.debug("Prompt gerado para YouTube: %s", query_musical)
+        if not query_musical:
+            log.error("Prompt vazio para YouTube")
+            return []
+        # O yt-dlp é bloqueante: corre no pool de threads
+        tracks = await bloqueante(servico.search_tracks, query=query_musical, limit=limit, market=market)
+        if not tracks:
+            log.warning("Nenhuma faixa devolvida pelo YouTube; a tentar busca alternativa com as tags")
+            tracks = await bloqueante(servico.search_tracks, query=" ".join(tags[:3]) + " music", limit=limit, market=market)
+        if tracks is None:
+            log.error("tracks é None")
+            return None
+        resultado = self.motor._processar_faixas_api(tracks, limit)
+        log.info("Recomendação (YouTube): %d faixas", len(resultado) if resultado else 0)
+        return resultado
+
+    async def _recomendar_spotify(self, tags, spotify, market, limit, is_redo):
+        """Como RecommendationEngine._recomendar_spotify."""
+        seeds, query_musical = await em_paralelo(
+            executar_passo(self.motor, self.motor.passo_sementes_spotify(tags)),
+            executar_passo(self.motor, self.motor.passo_prompt_spotify(tags, is_redo)))
+        seeds = seeds or {}
+        log.debug("Prompt gerado: %s", query_musical)
+        alvos = self.motor.alvos_de_sementes(seeds)
+        seed_genres = seeds.get('seed_genres') or []
+        alvo_candidatos = limit * self.motor._FATOR_AMOSTRAGEM if alvos else limit
+
+        async def das_sementes():
+            try:
+                return await spotify.recomendacoes(seed_genres, alvos, alvo_candidatos, market) or []
+            except Exception as e:
+                log.error("Erro nas recomendações por sementes: %s", e)
+                return []
+
+        filtro_busca = ProcessadorFaixas(self.motor._chave_dedup, alvo_candidatos)
+        da_busca, recomendadas = await em_paralelo(
+            spotify.buscar_paginado(query_musical, alvo_candidatos, market, aceitar=filtro_busca.adicionar),
+            das_sementes())
+        log.debug("Recomendações por sementes %s: %d faixas", seed_genres, len(recomendadas))
+
+        candidatos = self.motor.intercalar(da_busca, recomendadas, alvo_candidatos)
+        if alvos and candidatos:
+            features = await spotify.audio_features([m['spotify_id'] for m in candidatos])
+            candidatos = self.motor.ordenar_por_features(candidatos, alvos, features)
+        return candidatos[:limit]
@@ -0,0 +1,81 @@
+# Nome do ficheiro: app/audio_features_cache.py
+"""
+Cache local de audio features do Spotify.
+
+As audio features de uma faixa nunca mudam para o mesmo ID, por isso são
+guardadas indefinidamente numa tabela SQLite, com uma camada em memória à frente.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from . import logs
+from . import metrics
+
+log = logs.obter('audio_features')
+
+
+class AudioFeaturesCache:
+    """Cache persistente (SQLite) + LRU em memória de audio features por ID de faixa.
+
+    A tabela audio_features_cache é criada pelas migrações (app/migrations.py).
+    """
+
+    def __init__(self, db, memory_size=5000):
+        self.db = db
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lembrar(self, track_id, features):
+        self._memory[track_id] = features
+        self._memory.move_to_end(track_id)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, track_ids):
+        """Retorna {track_id: features} para os IDs em cache (features pode ser None)."""
+        encontrados = {}
+        em_falta = []
+        with self._lock:
+            for track_id in track_ids:
+                if track_id in self._memory:
+                    self._memory.move_to_end(track_id)
+                    encontrados[track_id] = self._memory[track_id]
+                else:
+                    em_falta.append(track_id)
+        acertos_memoria = len(encontrados)
+        if not em_falta:
+            metrics.registar_cache('audio_features', acertos=acertos_memoria)
+            return encontrados
+        try:
+            with self.db.conexao() as conn:
+                for i in range(0, len(em_falta), 500):
+                    lote = em_falta[i:i + 500]
+                    placeholders = ','.join('?' * len(lote))
+                    rows = conn.execute(
+                        f"SELECT track_id, features FROM audio_features_cache WHERE track_id IN ({placeholders})", lote).fetchall()
+                    with self._lock:
+                        for track_id, features_json in rows:
+                            features = json.loads(features_json) if features_json else None
+                            encontrados[track_id] = features
+                            self._lembrar(track_id, features)
+        except Exception as e:
+            log.error("Erro ao ler a cache: %s", e)
+        metrics.registar_cache('audio_features', acertos=len(encontrados), falhas=acertos_memoria + len(em_falta) - len(encontrados))
+        return encontrados
+
+    def put_many(self, features_by_id):
+        """Guarda {track_id: features}. Features None também é guardado (faixa sem análise)."""
+        if not features_by_id:
+            return
+        with self._lock:
+            for track_id, features in features_by_id.items():
+                self._lembrar(track_id, features)
+        try:
+            with self.db.transacao() as cursor:
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO audio_features_cache (track_id, features) VALUES (?, ?)",
+                    [(track_id, json.dumps(features) if features else None) for track_id, features in features_by_id.items()])
+        except Exception as e:
+            log.error("Erro ao gravar na cache: %s", e)
@@ -0,0 +1,363 @@
+# Nome do ficheiro: app/cassette.py
+"""
+Gravação e reprodução ("cassete") das chamadas aos fornecedores externos.
+
+Reproduzir uma recomendação lenta ou errada obrigava a chamar outra vez as APIs
+reais, que gastam quota e respondem de outra forma. Com a cassete as chamadas
+ao Gemini, à Vision API, ao Spotify (spotipy) e ao yt-dlp passam por `chamar()`:
+
+- CASSETTE_MODE=record: chama o fornecedor e grava o par pedido/resposta (ou a
+  exceção), com a duração, em CASSETTE_PATH;
+- CASSETTE_MODE=replay: não há rede; cada chamada é servida a partir da
+  gravação. As gravações com a mesma chave são servidas pela ordem em que
+  foram feitas (um 429 seguido do sucesso repete-se igual) e recomeçam do
+  início quando se esgotam. Uma chamada sem gravação lança SemGravacao;
+- CASSETTE_LATENCY: fator aplicado à duração original em replay
+  (0 = instantâneo, 1 = latência original);
+- CASSETTE_MODE=off (omissão): `chamar()` limita-se a chamar a função.
+
+Formato: JSON Lines comprimido com gzip, uma linha por chamada:
+{"f": fornecedor, "k": chave, "d": descrição, "ms": duração, "r": resposta | "e": exceção}.
+A chave é o SHA-256 do pedido normalizado, depois de redigidos os segredos
+(a chave de API do Gemini na URL não entra na chave nem na descrição).
+"""
+import asyncio
+import atexit
+import gzip
+import hashlib
+import importlib
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+
+from . import logs
+
+log = logs.obter('cassette')
+
+MODO = os.environ.get('CASSETTE_MODE', 'off').strip().lower()
+CAMINHO = os.environ.get('CASSETTE_PATH', os.path.join('cassettes', 'cassette.jsonl.gz'))
+LATENCIA = float(os.environ.get('CASSETTE_LATENCY', '0'))
+MODOS = ('off', 'record', 'replay')
+
+# Campos das entradas do yt-dlp que o serviço não usa e que fariam a gravação crescer dezenas de vezes
+_PESADOS_YT_DLP = ('formats', 'requested_formats', 'automatic_captions', 'subtitles', 'requested_subtitles',
+                   'heatmap', 'http_headers', 'storyboards', 'fragments')
+_PRIMITIVOS = (str, int, float, bool, type(None))
+
+
+class SemGravacao(LookupError):
+    """Em replay, a cassete não tem nenhuma gravação para este pedido."""
+
+    def __init__(self, fornecedor, descricao):
+        self.fornecedor = fornecedor
+        super().__init__(f"Cassete sem gravação para {fornecedor}: {descricao}")
+
+
+def _serializavel(valor):
+    if isinstance(valor, _PRIMITIVOS):
+        return True
+    if isinstance(valor, (list, tuple)):
+        return all(_serializavel(v) for v in valor)
+    if isinstance(valor, dict):
+        return all(isinstance(k, str) and _serializavel(v) for k, v in valor.items())
+    return False
+
+
+def _codificar_erro(erro):
+    tipo = type(erro)
+    atributos = {k: (dict(v) if isinstance(v, Mapping) else v) for k, v in vars(erro).items() if not k.startswith('_')}
+    return {
+        't': f'{tipo.__module__}:{tipo.__qualname__}',
+        'a': [a if _serializavel(a) else str(a) for a in erro.args],
+        # Atributos como http_status/headers (SpotifyException) ou code (google.api_core)
+        'v': {k: (v if _serializavel(v) else None) for k, v in atributos.items()},
+    }
+
+
+def _descodificar_erro(dados):
+    """Recria a exceção com o tipo e os atributos originais (RuntimeError se o tipo não existir)."""
+    modulo, _, nome = dados['t'].partition(':')
+    try:
+        tipo = importlib.import_module(modulo)
+        for parte in nome.split('.'):
+            tipo = getattr(tipo, parte)
+        erro = tipo.__new__(tipo)
+        erro.args = tuple(dados['a'])
+        erro.__dict__.update(dados['v'])
+        return erro
+    except Exception:
+        return RuntimeError(f"{dados['t']}: {', '.join(map(str, dados['a']))}")
+
+
+class Cassette:
+    """Uma gravação em disco, em modo 'record' ou 'replay'. Thread-safe."""
+
+    def __init__(self, caminho, modo, latencia=0.0):
+        if modo not in ('record', 'replay'):
+            raise ValueError(f"Modo de cassete inválido: {modo!r} (use 'record' ou 'replay')")
+        self.caminho = caminho
+        self.modo = modo
+        self.latencia = latencia
+        self._lock = threading.Lock()
+        self._ficheiro = None
+        self._gravacoes = {}
+        self._posicoes = {}
+        self.servidas = 0
+        self.falhas = 0
+        if modo == 'replay':
+            self._carregar()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+            # Acrescenta (membro gzip novo): várias sessões de gravação podem ir para o mesmo ficheiro
+            self._ficheiro = gzip.open(caminho, 'at', encoding='utf-8')
+
+    def _carregar(self):
+        total = 0
+        with gzip.open(self.caminho, 'rt', encoding='utf-8') as f:
+            for linha in f:
+                if linha.strip():
+                    registo = json.loads(linha)
+                    self._gravacoes.setdefault(registo['k'], []).append(registo)
+                    total += 1
+        log.info("Cassete %s: %d gravações (%d pedidos distintos)", self.caminho, total, len(self._gravacoes))
+
+    @staticmethod
+    def chave(fornecedor, pedido):
+        normalizado = logs.redigir(json.dumps(pedido, sort_keys=True, ensure_ascii=False, default=str))
+        return hashlib.sha256(f'{fornecedor}\n{normalizado}'.encode('utf-8')).hexdigest()[:32], normalizado
+
+    def chamar(self, fornecedor, pedido, func, codificar=None, descodificar=None):
+        """
+        Executa `func()` (record) ou devolve a resposta gravada para `pedido` (replay).
+        `codificar`/`descodificar` convertem a resposta de/para JSON quando não é JSON nativo.
+        """
+        chave, normalizado = self.chave(fornecedor, pedido)
+        if self.modo == 'replay':
+            registo = self._gravacao(fornecedor, chave, normalizado)
+            if self.latencia > 0 and registo.get('ms'):
+                time.sleep(registo['ms'] / 1000.0 * self.latencia)
+            return self._resultado(registo, descodificar)
+        inicio = time.perf_counter()
+        registo = {'f': fornecedor, 'k': chave, 'd': normalizado[:200]}
+        try:
+            resposta = func()
+        except Exception as e:
+            self._gravar_erro(registo, inicio, e)
+            raise
+        self._gravar_resposta(registo, inicio, resposta, codificar)
+        return resposta
+
+    async def chamar_async(self, fornecedor, pedido, corrotina, codificar=None, descodificar=None):
+        """Como `chamar`, para `corrotina()` (modo ASGI); em replay a latência é simulada sem bloquear."""
+        chave, normalizado = self.chave(fornecedor, pedido)
+        if self.modo == 'replay':
+            registo = self._gravacao(fornecedor, chave, normalizado)
+            if self.latencia > 0 and registo.get('ms'):
+                await asyncio.sleep(registo['ms'] / 1000.0 * self.latencia)
+            return self._resultado(registo, descodificar)
+        inicio = time.perf_counter()
+        registo = {'f': fornecedor, 'k': chave, 'd': normalizado[:200]}
+        try:
+            resposta = await corrotina()
+        except Exception as e:
+            self._gravar_erro(registo, inicio, e)
+            raise
+        self._gravar_resposta(registo, inicio, resposta, codificar)
+        return resposta
+
+    def _gravar_erro(self, registo, inicio, erro):
+        registo['ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        registo['e'] = _codificar_erro(erro)
+        self._gravar(registo)
+
+    def _gravar_resposta(self, registo, inicio, resposta, codificar):
+        registo['ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+        try:
+            registo['r'] = codificar(resposta) if codificar else resposta
+        except Exception as e:
+            # Uma resposta que não se consegue gravar não pode estragar o pedido
+            log.warning("Cassete: resposta de %s não gravada (%s)", registo['f'], e)
+            return
+        self._gravar(registo)
+
+    def _gravar(self, registo):
+        linha = json.dumps(registo, ensure_ascii=False, separators=(',', ':'), default=str)
+        with self._lock:
+            if self._ficheiro is None:
+                return
+            self._ficheiro.write(linha + '\n')
+            # Sync flush: o que já foi gravado sobrevive a um crash do processo
+            self._ficheiro.flush()
+
+    def _gravacao(self, fornecedor, chave, normalizado):
+        """Próxima gravação para a chave (pela ordem de gravação, em ciclo)."""
+        with self._lock:
+            gravacoes = self._gravacoes.get(chave)
+            if not gravacoes:
+                self.falhas += 1
+            else:
+                posicao = self._posicoes.get(chave, 0)
+                self._posicoes[chave] = posicao + 1
+                self.servidas += 1
+        if not gravacoes:
+            log.warning("Cassete sem gravação para %s: %s", fornecedor, normalizado[:200])
+            raise SemGravacao(fornecedor, normalizado[:200])
+        return gravacoes[posicao % len(gravacoes)]
+
+    @staticmethod
+    def _resultado(registo, descodificar):
+        if 'e' in registo:
+            raise _descodificar_erro(registo['e'])
+        return descodificar(registo['r']) if descodificar else registo['r']
+
+    def fechar(self):
+        with self._lock:
+            ficheiro, self._ficheiro = self._ficheiro, None
+        if ficheiro is not None:
+            ficheiro.close()
+
+
+_lock = threading.Lock()
+_atual = None
+_inicializado = False
+
+
+def atual():
+    """Cassete ativa (configurada por CASSETTE_MODE na primeira chamada) ou None."""
+    global _atual, _inicializado
+    if _inicializado:
+        return _atual
+    with _lock:
+        if not _inicializado:
+            if MODO not in MODOS:
+                log.error("CASSETTE_MODE inválido: %r (use %s); cassete desligada", MODO, '/'.join(MODOS))
+            elif MODO != 'off':
+                _atual = Cassette(CAMINHO, MODO, LATENCIA)
+                atexit.register(desativar)
+                log.warning("Cassete em modo %s: %s", MODO, CAMINHO)
+            _inicializado = True
+    return _atual
+
+
+def ativar(caminho, modo, latencia=0.0):
+    """Substitui a cassete ativa (incidentes, benchmarks, scripts); devolve-a."""
+    global _atual, _inicializado
+    nova = Cassette(caminho, modo, latencia)
+    with _lock:
+        anterior, _atual, _inicializado = _atual, nova, True
+    if anterior is not None:
+        anterior.fechar()
+    return nova
+
+
+def desativar():
+    global _atual, _inicializado
+    with _lock:
+        anterior, _atual, _inicializado = _atual, None, True
+    if anterior is not None:
+        anterior.fechar()
+
+
+async def chamar_async(fornecedor, pedido, corrotina, codificar=None, descodificar=None):
+    """Passa `await corrotina()` pela cassete ativa; sem cassete é só `await corrotina()`."""
+    cassete = atual()
+    if cassete is None:
+        return await corrotina()
+    return await cassete.chamar_async(fornecedor, pedido, corrotina, codificar, descodificar)
+
+
+def reproduzindo():
+    cassete = atual()
+    return cassete is not None and cassete.modo == 'replay'
+
+
+def chamar(fornecedor, pedido, func, codificar=None, descodificar=None):
+    """Passa `func()` pela cassete ativa; sem cassete é só `func()`."""
+    cassete = atual()
+    if cassete is None:
+        return func()
+    return cassete.chamar(fornecedor, pedido, func, codificar, descodificar)
+
+
+# --- Codificação das respostas que não são JSON nativo ---
+
+def codificar_http(resposta):
+    """requests.Response -> dict (estado, cabeçalhos relevantes, corpo em texto)."""
+    cabecalhos = {k: v for k, v in resposta.headers.items() if k.lower() in ('content-type', 'retry-after')}
+    return {'s': resposta.status_code, 'h': cabecalhos, 'b': resposta.text, 'u': logs.redigir(resposta.url or ''),
+            'm': resposta.reason}
+
+
+def descodificar_http(dados):
+    requests = importlib.import_module('requests')
+    estruturas = importlib.import_module('requests.structures')
+    resposta = requests.Response()
+    resposta.status_code = dados['s']
+    resposta.headers = estruturas.CaseInsensitiveDict(dados['h'])
+    resposta._content = dados['b'].encode('utf-8')
+    resposta.encoding = 'utf-8'
+    resposta.url = dados['u']
+    resposta.reason = dados.get('m')
+    return resposta
+
+
+def codificar_httpx(resposta):
+    """httpx.Response -> o mesmo formato de `codificar_http` (as gravações servem aos dois modos)."""
+    cabecalhos = {k: v for k, v in resposta.headers.items() if k.lower() in ('content-type', 'retry-after')}
+    return {'s': resposta.status_code, 'h': cabecalhos, 'b': resposta.text, 'u': logs.redigir(str(resposta.url)),
+            'm': resposta.reason_phrase}
+
+
+def descodificar_httpx(dados):
+    httpx = importlib.import_module('httpx')
+    return httpx.Response(dados['s'], headers=dados['h'], content=dados['b'].encode('utf-8'),
+                          request=httpx.Request('POST', dados['u']))
+
+
+def codificar_yt_dlp(resultado):
+    """Info do yt-dlp sem formatos, legendas e afins (o serviço só usa os metadados)."""
+    def limpar(entrada):
+        if not isinstance(entrada, dict):
+            return entrada
+        limpa = {k: v for k, v in entrada.items() if k not in _PESADOS_YT_DLP}
+        if isinstance(limpa.get('entries'), list):
+            limpa['entries'] = [limpar(e) for e in limpa['entries']]
+        return limpa
+    if isinstance(resultado, list):
+        return [limpar(e) for e in resultado]
+    return limpar(resultado)
+
+
+class ClienteVision:
+    """
+    Envolve o ImageAnnotatorClient para que web_detection passe pela cassete.
+    Em replay o cliente real pode ser None (não são precisas credenciais da Google).
+    """
+
+    def __init__(self, cliente):
+        self._cliente = cliente
+
+    def __getattr__(self, nome):
+        if self._cliente is None:
+            raise AttributeError(nome)
+        return getattr(self._cliente, nome)
+
+    def web_detection(self, image, **kwargs):
+        def chamar_real():
+            if self._cliente is None:
+                raise SemGravacao('vision', 'cliente Vision indisponível')
+            return self._cliente.web_detection(image=image, **kwargs)
+        vision = importlib.import_module('google.cloud.vision')
+        pedido = {'m': 'web_detection', 'img': hashlib.sha256(image.content).hexdigest()}
+        return chamar('vision', pedido, chamar_real,
+                      codificar=lambda r: json.loads(type(r).to_json(r)),
+                      descodificar=lambda d: vision.AnnotateImageResponse.from_json(json.dumps(d), ignore_unknown_fields=True))
+
+
+def envolver_vision(cliente):
+    """O próprio cliente sem cassete (ou a gravar sem cliente); caso contrário, um ClienteVision."""
+    if atual() is None or (cliente is None and not reproduzindo()):
+        return cliente
+    return ClienteVision(cliente)
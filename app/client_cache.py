@@ -0,0 +1,195 @@
+# Nome do ficheiro: app/client_cache.py
+"""
+Cache LRU de clientes autenticados por utilizador (Spotify e YouTube).
+
+Evita reconstruir o SpotifyOAuth / spotipy.Spotify ou o cliente de discovery
+do YouTube em cada pedido. Os tokens perto de expirar são renovados em
+segundo plano, para que o caminho do pedido não fique bloqueado numa renovação.
+O documento de discovery do YouTube é carregado uma única vez e partilhado.
+"""
+import datetime
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build, build_from_document
+
+from . import logs
+from . import metrics
+from .spotify_client import RateLimitedSpotify
+
+log = logs.obter('client_cache')
+
+_discovery_lock = threading.Lock()
+_youtube_discovery_doc = None
+
+
+def _get_youtube_discovery_doc():
+    """Documento de discovery do YouTube v3, carregado e interpretado uma única vez por processo."""
+    global _youtube_discovery_doc
+    with _discovery_lock:
+        if _youtube_discovery_doc is None:
+            doc = None
+            try:
+                from googleapiclient.discovery_cache import get_static_doc
+                doc = get_static_doc('youtube', 'v3')
+            except ImportError:
+                pass
+            if doc:
+                _youtube_discovery_doc = json.loads(doc)
+            else:
+                # Versões antigas do cliente: obtém o documento através de um build normal
+                _youtube_discovery_doc = build('youtube', 'v3', developerKey='-')._rootDesc
+        return _youtube_discovery_doc
+
+
+def build_youtube(credentials=None, developer_key=None):
+    """Equivalente a build('youtube', 'v3', ...) reutilizando o documento de discovery em cache."""
+    return build_from_document(_get_youtube_discovery_doc(), credentials=credentials, developerKey=developer_key)
+
+
+class _Entrada:
+    __slots__ = ('client', 'token_info', 'credentials', 'last_used', 'refreshing')
+
+    def __init__(self, client, token_info, credentials=None):
+        self.client = client
+        self.token_info = token_info
+        self.credentials = credentials
+        self.last_used = time.monotonic()
+        self.refreshing = False
+
+
+class ClienteIndisponivelError(LookupError):
+    """Não há cliente em cache para o utilizador e não foi dado token_info para o criar."""
+
+
+class UserClientCache:
+    """LRU de clientes por (serviço, ID interno do utilizador), com expiração por inatividade."""
+
+    def __init__(self, spotify_auth, max_size=256, idle_ttl=1800, refresh_margin=300):
+        self.spotify_auth = spotify_auth
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.refresh_margin = refresh_margin
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='token-refresh')
+
+    # --- Gestão da LRU ---
+    def _get_entry(self, key):
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.last_used = time.monotonic()
+                self._entries.move_to_end(key)
+        if entry is not None:
+            metrics.registar_cache('user_clients', acertos=1)
+        else:
+            metrics.registar_cache('user_clients', falhas=1)
+        return entry
+
+    def _put_entry(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _evict_idle(self):
+        limite = time.monotonic() - self.idle_ttl
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_used >= limite:
+                break
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """Remove os clientes de um utilizador (ex.: logout)."""
+        with self._lock:
+            for key in [k for k in self._entries if k[1] == user_id]:
+                del self._entries[key]
+
+    def _schedule_refresh(self, entry, refresh_fn):
+        with self._lock:
+            if entry.refreshing:
+                return
+            entry.refreshing = True
+
+        def run():
+            try:
+                refresh_fn(entry)
+            except Exception as e:
+                log.error("Falha na renovação do token em segundo plano: %s", e)
+            finally:
+                entry.refreshing = False
+
+        self._refresh_executor.submit(run)
+
+    # --- Spotify ---
+    def _spotify_oauth(self, user_id):
+        return self.spotify_auth.get_oauth_manager({'internal_user_id': user_id})
+
+    def _refresh_spotify(self, user_id, entry):
+        token_info = self._spotify_oauth(user_id).refresh_access_token(entry.token_info['refresh_token'])
+        if not token_info.get('refresh_token'):
+            token_info['refresh_token'] = entry.token_info['refresh_token']
+        entry.client = RateLimitedSpotify(auth=token_info['access_token'])
+        entry.token_info = token_info
+
+    def get_spotify_client(self, user_id, token_info):
+        """
+        Retorna (cliente, token_info atual). O token_info devolvido pode ser mais
+        recente do que o da sessão, se tiver sido renovado em segundo plano.
+        Sem token_info (ex.: tarefas em segundo plano) só serve o cliente já em cache.
+        """
+        key = ('spotify', user_id)
+        entry = self._get_entry(key)
+        if entry is None and not token_info:
+            raise ClienteIndisponivelError(key)
+        if entry is None or (token_info and token_info.get('refresh_token') != entry.token_info.get('refresh_token')):
+            entry = _Entrada(RateLimitedSpotify(auth=token_info['access_token']), dict(token_info))
+            self._put_entry(key, entry)
+
+        restante = entry.token_info.get('expires_at', 0) - time.time()
+        if restante <= 10:
+            # Já expirou: a renovação síncrona é inevitável
+            self._refresh_spotify(user_id, entry)
+        elif restante <= self.refresh_margin:
+            self._schedule_refresh(entry, lambda e: self._refresh_spotify(user_id, e))
+        return entry.client, entry.token_info
+
+    # --- YouTube ---
+    def _refresh_youtube(self, entry):
+        entry.credentials.refresh(GoogleAuthRequest())
+        token_info = dict(entry.token_info)
+        token_info['token'] = entry.credentials.token
+        entry.token_info = token_info
+
+    def get_youtube_client(self, user_id, token_info):
+        """Retorna (cliente da API do YouTube, token_info atual) para o utilizador."""
+        key = ('youtube', user_id)
+        entry = self._get_entry(key)
+        if entry is None and not token_info:
+            raise ClienteIndisponivelError(key)
+        if entry is None or (token_info and token_info.get('refresh_token') != entry.token_info.get('refresh_token')):
+            credentials = Credentials(**token_info)
+            entry = _Entrada(build_youtube(credentials=credentials), dict(token_info), credentials)
+            self._put_entry(key, entry)
+
+        expiry = entry.credentials.expiry
+        # Sem data de expiração conhecida (token vindo da sessão) renova em segundo plano;
+        # até lá, o transporte da Google renova sozinho se receber um 401.
+        if expiry is None or (expiry - _utcnow()).total_seconds() <= self.refresh_margin:
+            if entry.credentials.refresh_token:
+                self._schedule_refresh(entry, self._refresh_youtube)
+        return entry.client, entry.token_info
+
+
+def _utcnow():
+    # google-auth guarda a expiração como datetime UTC sem tzinfo
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
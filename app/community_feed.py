@@ -0,0 +1,95 @@
+# Nome do ficheiro: app/community_feed.py
+"""
+Feed da comunidade paginado por cursor (keyset) em (data_criacao, id).
+
+Cada página é obtida numa única query: as playlists da página, o total de
+likes (coluna like_count, mantida por triggers), se o utilizador atual já
+gostou e as primeiras capas de álbum (via ROW_NUMBER), em vez de 3 queries
+adicionais por playlist.
+"""
+import base64
+
+from .cover_store import CoverStore
+
+PAGE_SIZE_DEFAULT = 24
+PAGE_SIZE_MAX = 60
+MAX_COVERS = 4
+# Separador das capas agregadas (não aparece em URLs)
+_SEP = '\x1f'
+
+_FEED_QUERY = """
+    WITH pagina AS (
+        SELECT p.id, p.nome_playlist, u.display_name, p.playlist_url, p.service_name, p.cover_hash, p.data_criacao,
+               p.like_count
+        FROM playlists_salvas p
+        JOIN usuarios u ON p.usuario_id = u.id
+        WHERE (:cursor_data IS NULL
+               OR p.data_criacao < :cursor_data
+               OR (p.data_criacao = :cursor_data AND p.id < :cursor_id))
+        ORDER BY p.data_criacao DESC, p.id DESC
+        LIMIT :limite
+    ),
+    capas AS (
+        SELECT playlist_id, album_cover_url FROM (
+            SELECT pm.playlist_id, pm.album_cover_url,
+                   ROW_NUMBER() OVER (PARTITION BY pm.playlist_id ORDER BY pm.posicao, pm.id) AS ordem
+            FROM playlist_musicas pm
+            JOIN pagina ON pm.playlist_id = pagina.id
+            WHERE pm.album_cover_url IS NOT NULL
+        )
+        WHERE ordem <= :max_capas
+        ORDER BY playlist_id, ordem
+    ),
+    capas_agregadas AS (
+        SELECT playlist_id, GROUP_CONCAT(album_cover_url, :sep) AS urls FROM capas GROUP BY playlist_id
+    ),
+    gostadas AS (
+        SELECT pl.playlist_id
+        FROM playlist_likes pl
+        JOIN pagina ON pl.playlist_id = pagina.id
+        WHERE pl.usuario_id = :usuario
+    )
+    SELECT pagina.id, pagina.nome_playlist, pagina.display_name, pagina.playlist_url, pagina.service_name,
+           pagina.cover_hash, pagina.data_criacao,
+           pagina.like_count, gostadas.playlist_id IS NOT NULL, capas_agregadas.urls
+    FROM pagina
+    LEFT JOIN gostadas ON gostadas.playlist_id = pagina.id
+    LEFT JOIN capas_agregadas ON capas_agregadas.playlist_id = pagina.id
+    ORDER BY pagina.data_criacao DESC, pagina.id DESC
+"""
+
+
+def codificar_cursor(data_criacao, playlist_id):
+    return base64.urlsafe_b64encode(f"{data_criacao}|{playlist_id}".encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(cursor):
+    """Retorna (data_criacao, id) ou (None, None) se o cursor for inválido/ausente."""
+    if not cursor:
+        return None, None
+    try:
+        data_criacao, playlist_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').rsplit('|', 1)
+        return data_criacao, int(playlist_id)
+    except Exception:
+        return None, None
+
+
+def buscar_pagina(conn, usuario_id, cursor=None, limite=PAGE_SIZE_DEFAULT):
+    """Retorna (playlists, next_cursor) para a página seguinte ao cursor."""
+    limite = max(1, min(int(limite or PAGE_SIZE_DEFAULT), PAGE_SIZE_MAX))
+    cursor_data, cursor_id = decodificar_cursor(cursor)
+    rows = conn.execute(_FEED_QUERY, {
+        'cursor_data': cursor_data, 'cursor_id': cursor_id,
+        # Pede uma linha a mais para saber se existe página seguinte
+        'limite': limite + 1, 'max_capas': MAX_COVERS,
+        'usuario': usuario_id, 'sep': _SEP,
+    }).fetchall()
+    tem_mais = len(rows) > limite
+    rows = rows[:limite]
+    playlists = [{
+        "id": p_id, "name": p_name, "creator": p_creator, "playlist_url": p_url, "service_name": p_service,
+        "cover_image": CoverStore.url(p_cover_hash), "cover_urls": urls.split(_SEP) if urls else [],
+        "like_count": like_count, "user_has_liked": bool(liked),
+    } for p_id, p_name, p_creator, p_url, p_service, p_cover_hash, _, like_count, liked, urls in rows]
+    next_cursor = codificar_cursor(rows[-1][6], rows[-1][0]) if tem_mais and rows else None
+    return playlists, next_cursor
@@ -0,0 +1,138 @@
+# Nome do ficheiro: app/cover_store.py
+"""
+Armazenamento das capas de playlists fora da tabela playlists_salvas.
+
+As capas chegam do player.html como data URL (JPEG em base64). Aqui são
+guardadas num diretório endereçado por conteúdo (nome = SHA-256 dos bytes),
+com uma miniatura de tamanho fixo gerada no servidor com o Pillow. A base de
+dados guarda apenas o hash e o feed transporta apenas o URL da miniatura.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+
+from . import logs
+from .lazy import importar
+
+log = logs.obter('cover_store')
+
+THUMB_SIZE = 300
+THUMB_QUALITY = 80
+# Capas maiores do que isto (já descodificadas) são recusadas
+MAX_COVER_BYTES = 5 * 1024 * 1024
+# Um PNG de poucos KB pode declarar dimensões enormes: acima disto não é descodificado
+MAX_COVER_PIXELS = 4096 * 4096
+HASH_RE = re.compile(r'^[0-9a-f]{64}$')
+COVER_URL_PREFIX = '/covers/'
+
+
+class CoverStore:
+    """Blob store de capas endereçado por conteúdo, com miniaturas fixas."""
+
+    def __init__(self, base_dir, thumb_size=THUMB_SIZE):
+        self.base_dir = base_dir
+        self.thumb_size = thumb_size
+        os.makedirs(base_dir, exist_ok=True)
+
+    def _caminho(self, cover_hash, sufixo):
+        # Dois níveis de diretório para não acumular milhares de ficheiros numa só pasta
+        return os.path.join(self.base_dir, cover_hash[:2], f"{cover_hash}{sufixo}")
+
+    def caminho_miniatura(self, cover_hash):
+        if not HASH_RE.match(cover_hash or ''):
+            return None
+        caminho = self._caminho(cover_hash, f"_t{self.thumb_size}.jpg")
+        return caminho if os.path.exists(caminho) else None
+
+    @staticmethod
+    def url(cover_hash):
+        return f"{COVER_URL_PREFIX}{cover_hash}.jpg" if cover_hash else None
+
+    @staticmethod
+    def _escrever(caminho, dados):
+        # Escrita atómica: outro processo nunca vê um ficheiro a meio
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, 'wb') as f:
+            f.write(dados)
+        os.replace(temporario, caminho)
+
+    def _gerar_miniatura(self, dados):
+        # O Pillow só é carregado quando há uma capa nova para processar
+        Image = importar('PIL.Image')
+        try:
+            img = Image.open(io.BytesIO(dados))
+        except Image.DecompressionBombError as e:
+            # Acima de 2x Image.MAX_IMAGE_PIXELS o próprio Pillow recusa (não é OSError nem ValueError)
+            raise ValueError(str(e)) from e
+        with img:
+            # Só o cabeçalho foi lido: as dimensões são verificadas antes de descodificar
+            if img.width * img.height > MAX_COVER_PIXELS:
+                raise ValueError(f"capa com {img.width}x{img.height} píxeis")
+            img = img.convert('RGB')
+            # Recorte central quadrado, depois redimensiona para o tamanho fixo
+            lado = min(img.size)
+            esquerda, topo = (img.width - lado) // 2, (img.height - lado) // 2
+            img = img.crop((esquerda, topo, esquerda + lado, topo + lado))
+            img = img.resize((self.thumb_size, self.thumb_size), Image.LANCZOS)
+            saida = io.BytesIO()
+            img.save(saida, format='JPEG', quality=THUMB_QUALITY, optimize=True, progressive=True)
+            return saida.getvalue()
+
+    def guardar_bytes(self, dados):
+        """Guarda a imagem e a miniatura. Retorna o hash, ou None se não for uma imagem válida."""
+        if not dados or len(dados) > MAX_COVER_BYTES:
+            return None
+        cover_hash = hashlib.sha256(dados).hexdigest()
+        caminho_thumb = self._caminho(cover_hash, f"_t{self.thumb_size}.jpg")
+        if os.path.exists(caminho_thumb):
+            return cover_hash  # Mesmo conteúdo já guardado
+        try:
+            miniatura = self._gerar_miniatura(dados)
+        except (OSError, ValueError) as e:  # inclui PIL.UnidentifiedImageError (subclasse de OSError)
+            log.warning("Capa inválida ignorada: %s", e)
+            return None
+        self._escrever(self._caminho(cover_hash, '.orig'), dados)
+        self._escrever(caminho_thumb, miniatura)
+        return cover_hash
+
+    def guardar_data_url(self, data_url):
+        """Aceita um data URL ('data:image/jpeg;base64,...') e retorna o hash da capa, ou None."""
+        if not data_url or not isinstance(data_url, str) or not data_url.startswith('data:'):
+            return None
+        try:
+            _, conteudo = data_url.split(',', 1)
+            dados = base64.b64decode(conteudo, validate=False)
+        except (ValueError, binascii.Error):
+            return None
+        return self.guardar_bytes(dados)
+
+
+def migrar_capas_inline(db, store, lote=50):
+    """
+    Move as capas guardadas inline (data URL em playlists_salvas.cover_image)
+    para o blob store, preenchendo cover_hash. Retorna o número de capas migradas.
+    """
+    migradas = 0
+    while True:
+        with db.conexao() as conn:
+            rows = conn.execute(
+                "SELECT id, cover_image FROM playlists_salvas WHERE cover_image IS NOT NULL LIMIT ?", (lote,)).fetchall()
+        if not rows:
+            break
+        # Escreve os ficheiros fora da transação; só as atualizações ficam dentro dela
+        atualizacoes = []
+        for playlist_id, cover_image in rows:
+            cover_hash = store.guardar_data_url(cover_image)
+            atualizacoes.append((cover_hash, playlist_id))
+            migradas += 1 if cover_hash else 0
+        with db.transacao() as cursor:
+            cursor.executemany(
+                "UPDATE playlists_salvas SET cover_hash = COALESCE(?, cover_hash), cover_image = NULL WHERE id = ?",
+                atualizacoes)
+    if migradas:
+        log.info("Migração: %s capas movidas para o blob store.", migradas)
+    return migradas
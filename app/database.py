@@ -0,0 +1,122 @@
+# Nome do ficheiro: app/database.py
+"""
+Camada de persistência SQLite partilhada por todos os endpoints e pelo motor.
+
+- Pool de ligações (uma ligação nunca é usada por duas threads ao mesmo tempo);
+- journal em WAL: leitores não bloqueiam nos escritores (feedback, playlists);
+- pragmas afinados: synchronous=NORMAL, busy_timeout, cache e mmap;
+- `transacao()`: contexto que abre BEGIN IMMEDIATE e faz commit/rollback.
+
+Uso:
+    with db.conexao() as conn:          # leitura
+        conn.execute("SELECT ...")
+    with db.transacao() as cursor:      # escrita atómica
+        cursor.execute("INSERT ...")
+Chamadas aninhadas na mesma thread reutilizam a mesma ligação/transação.
+"""
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from . import logs
+from . import metrics
+
+log = logs.obter('database')
+
+BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '16384'))
+MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(64 * 1024 * 1024)))
+POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', '8'))
+
+
+class Database:
+    """Pool de ligações SQLite configuradas para acesso concorrente."""
+
+    def __init__(self, path, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._local = threading.local()
+        self._wal_lock = threading.Lock()
+        self._wal_ativo = False
+
+    def _nova_conexao(self):
+        # isolation_level=None: as transações são abertas explicitamente em transacao()
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000.0,
+                               check_same_thread=False, isolation_level=None)
+        with self._wal_lock:
+            if not self._wal_ativo:
+                modo = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+                if modo.lower() != 'wal':
+                    log.warning("WAL indisponível, journal_mode=%s", modo)
+                self._wal_ativo = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _obter(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            metrics.registar_cache('db_pool', falhas=1)
+            return self._nova_conexao()
+        metrics.registar_cache('db_pool', acertos=1)
+        return conn
+
+    def _devolver(self, conn):
+        if conn.in_transaction:
+            # Nunca devolve ao pool uma ligação com transação pendente
+            conn.rollback()
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    @contextmanager
+    def conexao(self):
+        """Empresta uma ligação do pool para a thread atual (reutilizada em chamadas aninhadas)."""
+        atual = getattr(self._local, 'conn', None)
+        if atual is not None:
+            yield atual
+            return
+        conn = self._obter()
+        self._local.conn = conn
+        try:
+            with metrics.medir_estagio('db'):
+                yield conn
+        finally:
+            self._local.conn = None
+            self._devolver(conn)
+
+    @contextmanager
+    def transacao(self):
+        """
+        Transação de escrita (BEGIN IMMEDIATE): commit no fim, rollback se houver exceção.
+        Dentro de outra transação da mesma thread, junta-se a ela.
+        """
+        with self.conexao() as conn:
+            if conn.in_transaction:
+                yield conn.cursor()
+                return
+            with metrics.medir_estagio('db_transacao'):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    yield conn.cursor()
+                except BaseException:
+                    conn.rollback()
+                    raise
+                else:
+                    conn.commit()
+
+    def close(self):
+        """Fecha as ligações livres do pool (ex.: no fim de um processo ou antes de um fork)."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,14 @@
+# Nome do ficheiro: app/errors.py
+"""
+Exceções partilhadas que o servidor precisa de conhecer no arranque (ex.: para
+registar handlers de erro) sem importar os clientes pesados que as lançam.
+"""
+
+
+class SpotifyRateLimitError(Exception):
+    """O Spotify pediu para esperar mais do que o limite aceitável para um pedido."""
+
+    def __init__(self, retry_after, endpoint=None):
+        self.retry_after = retry_after
+        self.endpoint = endpoint
+        super().__init__(f"Spotify limitou o pedido a '{endpoint}'. Tente novamente em {retry_after}s.")
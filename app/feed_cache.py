@@ -0,0 +1,86 @@
+# Nome do ficheiro: app/feed_cache.py
+"""
+Cache do feed da comunidade invalidada por contadores de geração.
+
+O feed só muda quando alguém guarda/apaga/renomeia uma playlist ou dá like.
+Esses endpoints incrementam um contador de geração (na própria base de dados,
+para ser coerente entre processos) e as páginas em cache são reutilizadas
+enquanto a geração não mudar.
+
+A parte partilhada de cada página fica pré-serializada em JSON; o campo
+por utilizador `user_has_liked` é sobreposto com uma query barata. O ETag
+deriva das gerações, do utilizador e do cursor, permitindo responder 304.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from . import community_feed
+from . import metrics
+
+GERACAO_CONTEUDO = 'conteudo'
+GERACAO_LIKES = 'likes'
+
+
+def incrementar_geracao(cursor, tipo=GERACAO_CONTEUDO):
+    """Invalida o feed. Deve ser chamado na mesma transação da escrita que o altera."""
+    coluna = 'likes' if tipo == GERACAO_LIKES else 'conteudo'
+    cursor.execute(f"UPDATE feed_geracao SET {coluna} = {coluna} + 1 WHERE id = 1")
+
+
+def ler_geracao(conn):
+    row = conn.execute("SELECT conteudo, likes FROM feed_geracao WHERE id = 1").fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+
+class FeedCache:
+    """Páginas partilhadas do feed, pré-serializadas, indexadas por (cursor, limite)."""
+
+    def __init__(self, max_pages=128):
+        self.max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(geracao, usuario_id, cursor, limite):
+        """Valor do ETag (sem aspas) da página para este utilizador nesta geração."""
+        chave = f"{geracao[0]}:{geracao[1]}:{usuario_id}:{cursor or ''}:{limite or ''}"
+        return 'feed-' + hashlib.sha1(chave.encode('utf-8')).hexdigest()[:20]
+
+    def _pagina_partilhada(self, conn, geracao, cursor, limite):
+        chave = (cursor or '', limite)
+        with self._lock:
+            entrada = self._pages.get(chave)
+            if entrada is not None and entrada[0] == geracao:
+                self._pages.move_to_end(chave)
+                metrics.registar_cache('feed', acertos=1)
+                return entrada[1], entrada[2], entrada[3]
+        metrics.registar_cache('feed', falhas=1)
+
+        playlists, next_cursor = community_feed.buscar_pagina(conn, None, cursor=cursor, limite=limite)
+        ids = [p['id'] for p in playlists]
+        # Cada playlist é serializada sem o '}' final, para acrescentar user_has_liked depois
+        fragmentos = []
+        for p in playlists:
+            p.pop('user_has_liked', None)
+            fragmentos.append(json.dumps(p, ensure_ascii=False, separators=(',', ':'))[:-1])
+        with self._lock:
+            self._pages[chave] = (geracao, ids, fragmentos, next_cursor)
+            self._pages.move_to_end(chave)
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return ids, fragmentos, next_cursor
+
+    def render(self, conn, geracao, usuario_id, cursor=None, limite=None):
+        """Retorna o corpo JSON da página para o utilizador (string)."""
+        ids, fragmentos, next_cursor = self._pagina_partilhada(conn, geracao, cursor, limite)
+        gostadas = set()
+        if ids:
+            placeholders = ','.join('?' * len(ids))
+            gostadas = {r[0] for r in conn.execute(
+                f"SELECT playlist_id FROM playlist_likes WHERE usuario_id = ? AND playlist_id IN ({placeholders})",
+                [usuario_id] + ids)}
+        itens = ','.join(f'{frag},"user_has_liked":{"true" if pid in gostadas else "false"}}}'
+                         for pid, frag in zip(ids, fragmentos))
+        return f'{{"playlists":[{itens}],"next_cursor":{json.dumps(next_cursor)}}}'
@@ -0,0 +1,222 @@
+# Nome do ficheiro: app/jobs.py
+"""
+Fila de tarefas em segundo plano guardada em SQLite (tabela `jobs`).
+
+Os endpoints enfileiram a tarefa e respondem logo com o ID; um pool de
+threads trabalhadoras executa-as fora do ciclo do pedido. O estado, o
+progresso e o resultado ficam na tabela e são consultados por
+/api/jobs/<id>.
+
+- Cada tarefa é reservada numa transação (estado 'em_curso' + prazo), por
+  isso só um trabalhador a executa; se o processo morrer, o prazo expira e
+  outro trabalhador retoma-a.
+- Falhas transitórias (`ErroTransitorio`) são repetidas com backoff
+  exponencial até `max_tentativas`; as restantes falham de imediato.
+- `chave` torna o enfileiramento idempotente: enquanto existir uma tarefa
+  ativa com a mesma chave, é devolvido o ID dessa tarefa.
+
+Com JOB_WORKERS=0 (por omissão na Vercel, onde não há threads depois da
+resposta) as tarefas são executadas no próprio pedido, no momento em que são
+enfileiradas.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+
+from . import logs
+from .lazy import importar
+from . import tracing
+
+log = logs.obter('jobs')
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '2'))
+# Tempo máximo de uma execução antes de a tarefa poder ser retomada por outro trabalhador
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '600'))
+JOB_BACKOFF_BASE = float(os.environ.get('JOB_BACKOFF_BASE', '2'))
+JOB_BACKOFF_MAX = float(os.environ.get('JOB_BACKOFF_MAX', '300'))
+
+ESTADO_PENDENTE = 'pendente'
+ESTADO_EM_CURSO = 'em_curso'
+ESTADO_CONCLUIDO = 'concluido'
+ESTADO_FALHADO = 'falhado'
+_ESTADOS_ATIVOS = (ESTADO_PENDENTE, ESTADO_EM_CURSO)
+
+
+class ErroTransitorio(Exception):
+    """Falha temporária (rede, 5xx, limite de pedidos): a tarefa volta a ser tentada."""
+
+    def __init__(self, mensagem, retry_after=None):
+        super().__init__(mensagem)
+        self.retry_after = retry_after
+
+
+def erro_http_transitorio(erro):
+    """True para falhas de rede e respostas 429/5xx dos clientes HTTP (spotipy, googleapiclient, requests)."""
+    requests = importar('requests')
+    if isinstance(erro, (ConnectionError, TimeoutError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    status = getattr(erro, 'http_status', None) or getattr(getattr(erro, 'resp', None), 'status', None)
+    try:
+        status = int(status)
+    except (TypeError, ValueError):
+        return False
+    return status == 429 or status >= 500
+
+
+class Job:
+    """Tarefa em execução, tal como o handler a vê."""
+
+    def __init__(self, fila, job_id, tipo, payload, usuario_id, tentativa):
+        self._fila = fila
+        self.id = job_id
+        self.tipo = tipo
+        self.payload = payload
+        self.usuario_id = usuario_id
+        self.tentativa = tentativa
+
+    def progresso(self, mensagem):
+        """Atualiza o texto de progresso mostrado em /api/jobs/<id>."""
+        with self._fila.db.transacao() as cursor:
+            cursor.execute("UPDATE jobs SET progresso = ?, data_atualizacao = ? WHERE id = ?",
+                           (mensagem, time.time(), self.id))
+
+
+class JobQueue:
+    """Fila persistente com um pool de threads trabalhadoras."""
+
+    def __init__(self, db, workers=JOB_WORKERS, poll_interval=JOB_POLL_SECONDS):
+        self.db = db
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._threads = []
+        self._parar = threading.Event()
+        self._acordar = threading.Condition()
+        self._lock = threading.Lock()
+
+    def registar(self, tipo, handler):
+        """handler(job) -> resultado serializável em JSON."""
+        self._handlers[tipo] = handler
+
+    def iniciar(self):
+        with self._lock:
+            if self._threads or self.workers <= 0:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._ciclo, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        log.info("%s trabalhadores iniciados.", self.workers)
+
+    def parar(self, timeout=5):
+        self._parar.set()
+        with self._acordar:
+            self._acordar.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def enfileirar(self, tipo, payload, usuario_id=None, chave=None, max_tentativas=5):
+        """Enfileira a tarefa e retorna o seu ID (ou o da tarefa ativa com a mesma chave)."""
+        if tipo not in self._handlers:
+            raise ValueError(f"Tipo de tarefa desconhecido: {tipo}")
+        agora = time.time()
+        with self.db.transacao() as cursor:
+            if chave:
+                existente = cursor.execute(
+                    "SELECT id FROM jobs WHERE chave = ? AND estado IN (?, ?) ORDER BY data_criacao DESC LIMIT 1",
+                    (chave,) + _ESTADOS_ATIVOS).fetchone()
+                if existente:
+                    return existente[0]
+            job_id = uuid.uuid4().hex
+            cursor.execute("""
+                INSERT INTO jobs (id, tipo, payload, usuario_id, chave, estado, max_tentativas, proxima_execucao, data_criacao, data_atualizacao)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (job_id, tipo, json.dumps(payload), usuario_id, chave, ESTADO_PENDENTE, max_tentativas, agora, agora, agora))
+        if self.workers <= 0:
+            self.executar_pendente(job_id)
+        else:
+            self.iniciar()
+            with self._acordar:
+                self._acordar.notify()
+        return job_id
+
+    def obter(self, job_id, usuario_id=None):
+        """Estado público da tarefa, ou None se não existir (ou for de outro utilizador)."""
+        with self.db.conexao() as conn:
+            row = conn.execute(
+                "SELECT id, tipo, estado, progresso, resultado, erro, tentativas, max_tentativas, proxima_execucao, usuario_id, data_criacao, data_atualizacao FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+        if not row or (usuario_id is not None and row[9] != usuario_id):
+            return None
+        return {
+            "id": row[0], "type": row[1], "status": row[2], "progress": row[3],
+            "result": json.loads(row[4]) if row[4] else None, "error": row[5],
+            "attempts": row[6], "max_attempts": row[7],
+            "next_attempt_in": max(0.0, round(row[8] - time.time(), 1)) if row[2] == ESTADO_PENDENTE else None,
+            "created_at": row[10], "updated_at": row[11],
+        }
+
+    def _reservar(self, job_id=None):
+        agora = time.time()
+        with self.db.transacao() as cursor:
+            filtro, params = ("AND id = ?", (job_id,)) if job_id else ("", ())
+            row = cursor.execute(f"""
+                SELECT id, tipo, payload, usuario_id, tentativas FROM jobs
+                WHERE ((estado = ? AND proxima_execucao <= ?) OR (estado = ? AND prazo < ?)) {filtro}
+                ORDER BY proxima_execucao LIMIT 1
+            """, (ESTADO_PENDENTE, agora, ESTADO_EM_CURSO, agora) + params).fetchone()
+            if not row:
+                return None
+            cursor.execute("UPDATE jobs SET estado = ?, tentativas = tentativas + 1, prazo = ?, data_atualizacao = ? WHERE id = ?",
+                           (ESTADO_EM_CURSO, agora + JOB_LEASE_SECONDS, agora, row[0]))
+        return Job(self, row[0], row[1], json.loads(row[2]), row[3], row[4] + 1)
+
+    def _concluir(self, job, resultado):
+        with self.db.transacao() as cursor:
+            cursor.execute("UPDATE jobs SET estado = ?, resultado = ?, erro = NULL, prazo = NULL, data_atualizacao = ? WHERE id = ?",
+                           (ESTADO_CONCLUIDO, json.dumps(resultado), time.time(), job.id))
+
+    def _falhar(self, job, erro):
+        agora = time.time()
+        with self.db.transacao() as cursor:
+            max_tentativas = cursor.execute("SELECT max_tentativas FROM jobs WHERE id = ?", (job.id,)).fetchone()[0]
+            if isinstance(erro, ErroTransitorio) and job.tentativa < max_tentativas:
+                espera = erro.retry_after if erro.retry_after else min(JOB_BACKOFF_MAX, JOB_BACKOFF_BASE ** job.tentativa)
+                cursor.execute("UPDATE jobs SET estado = ?, erro = ?, proxima_execucao = ?, prazo = NULL, data_atualizacao = ? WHERE id = ?",
+                               (ESTADO_PENDENTE, str(erro)[:500], agora + espera, agora, job.id))
+                log.warning("%s %s: falha transitória (tentativa %s), nova tentativa em %.0fs: %s", job.tipo, job.id, job.tentativa, espera, erro)
+                return
+            cursor.execute("UPDATE jobs SET estado = ?, erro = ?, prazo = NULL, data_atualizacao = ? WHERE id = ?",
+                           (ESTADO_FALHADO, str(erro)[:500], agora, job.id))
+        log.error("%s %s falhou: %s", job.tipo, job.id, erro)
+
+    def _executar(self, job):
+        try:
+            with tracing.rastrear(f'job {job.tipo}'):
+                resultado = self._handlers[job.tipo](job)
+        except Exception as e:
+            self._falhar(job, e)
+        else:
+            self._concluir(job, resultado)
+
+    def executar_pendente(self, job_id=None):
+        """Executa uma tarefa pronta (a indicada, ou a mais antiga). Retorna False se não havia nenhuma."""
+        job = self._reservar(job_id)
+        if job is None:
+            return False
+        self._executar(job)
+        return True
+
+    def _ciclo(self):
+        while not self._parar.is_set():
+            try:
+                if self.executar_pendente():
+                    continue
+            except Exception as e:
+                log.error("Erro no trabalhador: %s", e)
+            with self._acordar:
+                self._acordar.wait(self.poll_interval)
@@ -0,0 +1,109 @@
+# Nome do ficheiro: app/lazy.py
+"""
+Inicialização preguiçosa dos componentes da aplicação e relatório de arranque.
+
+Num arranque a frio (Vercel) importar google.cloud.vision, googleapiclient,
+yt_dlp e spotipy, e criar os respetivos clientes, custa segundos. Aqui cada
+componente fica atrás de um `Lazy`, criado (uma única vez, mesmo com pedidos
+concorrentes) no primeiro uso; as rotas que só devolvem templates não tocam
+em nenhum deles.
+
+`importar()` e `Lazy` registam quanto tempo demorou cada import e cada
+componente; `relatorio()` devolve esses tempos em milissegundos.
+"""
+import importlib
+import importlib.util
+import sys
+import threading
+import time
+from collections.abc import Mapping
+
+from . import logs
+
+log = logs.obter('startup')
+
+_INICIO = time.perf_counter()
+_lock_relatorio = threading.Lock()
+_tempos_imports = {}
+_tempos_componentes = {}
+_marcos = {}
+
+
+def _registar(destino, nome, inicio):
+    with _lock_relatorio:
+        destino.setdefault(nome, round((time.perf_counter() - inicio) * 1000, 1))
+
+
+def importar(nome_modulo, pacote=None):
+    """
+    Importa um módulo pesado no momento em que é preciso, medindo o tempo do primeiro import.
+    Aceita nomes relativos ('.client_cache') com `pacote`, como importlib.import_module.
+    """
+    if nome_modulo.startswith('.'):
+        nome_modulo = importlib.util.resolve_name(nome_modulo, pacote)
+    modulo = sys.modules.get(nome_modulo)
+    if modulo is not None:
+        return modulo
+    inicio = time.perf_counter()
+    modulo = importlib.import_module(nome_modulo)
+    _registar(_tempos_imports, nome_modulo, inicio)
+    return modulo
+
+
+def marcar(nome):
+    """Regista um marco do arranque (ms desde o import deste módulo), ex.: 'app_pronta'."""
+    with _lock_relatorio:
+        _marcos.setdefault(nome, round((time.perf_counter() - _INICIO) * 1000, 1))
+
+
+def relatorio():
+    with _lock_relatorio:
+        return {"imports_ms": dict(_tempos_imports), "components_ms": dict(_tempos_componentes),
+                "milestones_ms": dict(_marcos)}
+
+
+class Lazy:
+    """Valor criado por `fabrica()` no primeiro `get()`; thread-safe (double-checked locking)."""
+
+    _VAZIO = object()
+
+    def __init__(self, nome, fabrica):
+        self.nome = nome
+        self._fabrica = fabrica
+        self._valor = self._VAZIO
+        self._lock = threading.Lock()
+
+    @property
+    def inicializado(self):
+        return self._valor is not self._VAZIO
+
+    def get(self):
+        valor = self._valor
+        if valor is not self._VAZIO:
+            return valor
+        with self._lock:
+            if self._valor is self._VAZIO:
+                inicio = time.perf_counter()
+                self._valor = self._fabrica()
+                _registar(_tempos_componentes, self.nome, inicio)
+                log.info("Componente '%s' inicializado em %s ms", self.nome, _tempos_componentes[self.nome])
+            return self._valor
+
+
+class ContextoLazy(Mapping):
+    """Dicionário de componentes em que cada valor só é criado quando é lido."""
+
+    def __init__(self, fabricas, prefixo=''):
+        self._componentes = {nome: Lazy(prefixo + nome, fabrica) for nome, fabrica in fabricas.items()}
+
+    def __getitem__(self, nome):
+        return self._componentes[nome].get()
+
+    def __iter__(self):
+        return iter(self._componentes)
+
+    def __len__(self):
+        return len(self._componentes)
+
+    def inicializado(self, nome):
+        return nome in self._componentes and self._componentes[nome].inicializado
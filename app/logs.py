@@ -0,0 +1,167 @@
+# Nome do ficheiro: app/logs.py
+"""
+Registo (logging) da aplicação.
+
+Os módulos obtêm um logger com `obter('engine')` (fica 'playerv2.engine') e
+registam com formatação preguiçosa: `log.debug("Faixa %s", titulo)` só
+formata a mensagem se o nível estiver ativo.
+
+- LOG_LEVEL: nível por omissão (INFO). As linhas por faixa/por vídeo e as
+  amostras de resultados ficam em DEBUG, por isso em produção o caminho
+  crítico paga apenas a verificação do nível.
+- LOG_LEVELS: nível por módulo, ex.: "engine=DEBUG,youtube=WARNING".
+- LOG_SAMPLE_EVERY: as linhas marcadas com `extra=POR_ITEM` (uma por item de
+  um ciclo) só são escritas 1 vez em cada N, por linha de código.
+- O handler do pedido só resolve a mensagem e põe-na numa fila limitada
+  (nunca bloqueia; se a fila estiver cheia a linha é descartada). Uma thread
+  (QueueListener) formata, redige os segredos e escreve no stdout. Num processo
+  criado por fork (workers do gunicorn) a fila e a thread são recriadas.
+- Redação: chaves de API (key=..., AIza...), tokens Bearer, access/refresh
+  tokens e client secrets nunca chegam à saída.
+"""
+import atexit
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+
+RAIZ = 'playerv2'
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', '20'))
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+FORMATO = '%(asctime)s %(levelname)-7s [%(modulo)s] %(message)s'
+
+# extra= das linhas emitidas por item de um ciclo (amostradas)
+POR_ITEM = {'por_item': True}
+
+_SEGREDOS = [
+    (re.compile(r'([?&](?:key|api_key|access_token|client_secret)=)[^&\s"\']+', re.IGNORECASE), r'\1[REDACTED]'),
+    (re.compile(r'\bAIza[0-9A-Za-z_\-]{20,}'), '[REDACTED]'),
+    (re.compile(r'(Bearer\s+)[A-Za-z0-9._~+/=\-]+', re.IGNORECASE), r'\1[REDACTED]'),
+    (re.compile(r'''(['"]?(?:access_token|refresh_token|id_token|client_secret)['"]?\s*[:=]\s*['"]?)[^'",\s}]+''', re.IGNORECASE),
+     r'\1[REDACTED]'),
+]
+
+_lock = threading.Lock()
+_listener = None
+_handler_fila = None
+_configurado = False
+
+
+def redigir(texto):
+    """Substitui segredos conhecidos no texto por [REDACTED]."""
+    for padrao, substituto in _SEGREDOS:
+        texto = padrao.sub(substituto, texto)
+    return texto
+
+
+def obter(nome):
+    """Logger da aplicação para um módulo ('engine', 'youtube', 'server', ...)."""
+    return logging.getLogger(f'{RAIZ}.{nome}')
+
+
+class _Formatador(logging.Formatter):
+    """Formata (incluindo tracebacks) e redige segredos; corre na thread do listener."""
+
+    def format(self, record):
+        record.modulo = record.name[len(RAIZ) + 1:] if record.name.startswith(RAIZ + '.') else record.name
+        return redigir(super().format(record))
+
+
+class _FiltroAmostragem(logging.Filter):
+    """Deixa passar 1 em cada `n` registos marcados com POR_ITEM, por linha de código."""
+
+    def __init__(self, n):
+        super().__init__()
+        self.n = n
+        self._contadores = {}
+
+    def filter(self, record):
+        if self.n <= 1 or not getattr(record, 'por_item', False):
+            return True
+        chave = (record.name, record.lineno)
+        contador = self._contadores.get(chave)
+        if contador is None:
+            contador = self._contadores.setdefault(chave, itertools.count())
+        return next(contador) % self.n == 0
+
+
+class _HandlerFila(logging.handlers.QueueHandler):
+    """Só resolve a mensagem no pedido (os args podem mudar depois); nunca bloqueia."""
+
+    def __init__(self, fila):
+        super().__init__(fila)
+        self.descartados = 0
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+def _aplicar_niveis(raiz):
+    raiz.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    for item in filter(None, (p.strip() for p in LOG_LEVELS.split(','))):
+        modulo, _, nivel = item.partition('=')
+        obter(modulo.strip()).setLevel(getattr(logging, nivel.strip().upper(), logging.INFO))
+
+
+def configurar(assincrono=True):
+    """
+    Configura os loggers 'playerv2.*' (idempotente). Com `assincrono=False` (ex.: Vercel, onde
+    o processo congela depois da resposta) escreve diretamente no stdout.
+    """
+    global _listener, _handler_fila, _configurado
+    with _lock:
+        if _configurado:
+            return
+        raiz = logging.getLogger(RAIZ)
+        _aplicar_niveis(raiz)
+        raiz.propagate = False
+        saida = logging.StreamHandler(sys.stdout)
+        saida.setFormatter(_Formatador(FORMATO))
+        if assincrono:
+            handler = _handler_fila = _HandlerFila(queue.Queue(LOG_QUEUE_SIZE))
+            _listener = logging.handlers.QueueListener(handler.queue, saida, respect_handler_level=False)
+            _listener.start()
+            atexit.register(parar)
+        else:
+            handler = saida
+        handler.addFilter(_FiltroAmostragem(LOG_SAMPLE_EVERY))
+        raiz.addHandler(handler)
+        _configurado = True
+
+
+def parar():
+    """Escreve o que ainda estiver na fila e para a thread do listener."""
+    global _listener
+    with _lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def _apos_fork():
+    """No processo filho a thread do listener não existe: nova fila e nova thread."""
+    global _listener, _lock
+    _lock = threading.Lock()
+    if _listener is None:
+        return
+    _handler_fila.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(_handler_fila.queue, *_listener.handlers, respect_handler_level=False)
+    _listener.start()
+
+
+if hasattr(os, 'register_at_fork'):  # não existe no Windows
+    os.register_at_fork(after_in_child=_apos_fork)
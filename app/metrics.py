@@ -0,0 +1,314 @@
+# Nome do ficheiro: app/metrics.py
+"""
+Métricas da aplicação no formato de texto do Prometheus (/metrics).
+
+Implementação mínima, sem dependências: contadores, gauges e histogramas
+com etiquetas. Cada série tem o seu próprio lock, mantido apenas durante a
+soma (o bucket do histograma é calculado fora dele), por isso o registo no
+caminho crítico custa um lock sem contenção e algumas operações aritméticas.
+A série de um conjunto de etiquetas é criada uma vez e depois lida de um
+dicionário sem lock.
+
+Helpers para o código da aplicação:
+- `medir_estagio(nome)` / `@medido(nome)`: duração e pedidos em curso de
+  uma etapa (Vision, chamadas ao Gemini, buscas, base de dados, playlists),
+  registada também como span do trace do pedido (ver app/tracing.py);
+- `registar_cache(cache, acertos, falhas)`: acertos/falhas das caches;
+- `registar_pedido_externo(servico, status)`: chamadas a APIs externas por
+  resultado (ok, error, rate_limited).
+
+Valores calculados só na recolha (rácio de acertos das caches, contadores
+do Spotify em spotify_client.call_stats, ...) vêm de coletores registados
+com `registar_coletor`.
+"""
+import bisect
+import functools
+import math
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from . import logs
+from . import tracing
+
+log = logs.obter('metrics')
+
+PREFIXO = 'playerv2_'
+# Limites dos buckets de duração, em segundos (de uma query SQLite a uma chamada ao Gemini)
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_metricas = []
+_coletores = []
+_lock_registo = threading.Lock()
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _etiquetas(nomes, valores, extra=''):
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nomes, valores)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if isinstance(valor, float):
+        if math.isinf(valor):
+            return '+Inf' if valor > 0 else '-Inf'
+        return repr(round(valor, 6))
+    return str(valor)
+
+
+class _SerieContador:
+    __slots__ = ('_lock', 'valor')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.valor = 0
+
+    def inc(self, quantidade=1):
+        with self._lock:
+            self.valor += quantidade
+
+
+class _SerieGauge(_SerieContador):
+    __slots__ = ()
+
+    def dec(self, quantidade=1):
+        with self._lock:
+            self.valor -= quantidade
+
+    def set(self, valor):
+        self.valor = valor
+
+
+class _SerieHistograma:
+    __slots__ = ('_lock', '_limites', '_contagens', '_soma')
+
+    def __init__(self, limites):
+        self._lock = threading.Lock()
+        self._limites = limites
+        self._contagens = [0] * (len(limites) + 1)
+        self._soma = 0.0
+
+    def observe(self, valor):
+        indice = bisect.bisect_left(self._limites, valor)
+        with self._lock:
+            self._contagens[indice] += 1
+            self._soma += valor
+
+    def amostra(self):
+        with self._lock:
+            return list(self._contagens), self._soma
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, nome, ajuda, etiquetas=()):
+        self.nome = PREFIXO + nome
+        self.ajuda = ajuda
+        self.etiquetas = tuple(etiquetas)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _nova_serie(self):
+        raise NotImplementedError
+
+    def labels(self, *valores):
+        serie = self._series.get(valores)
+        if serie is None:
+            if len(valores) != len(self.etiquetas):
+                raise ValueError(f"{self.nome} espera as etiquetas {self.etiquetas}")
+            with self._lock:
+                serie = self._series.setdefault(valores, self._nova_serie())
+        return serie
+
+    def series(self):
+        with self._lock:
+            return list(self._series.items())
+
+    def linhas(self):
+        yield f'# HELP {self.nome} {self.ajuda}'
+        yield f'# TYPE {self.nome} {self.tipo}'
+        for valores, serie in self.series():
+            yield f'{self.nome}{_etiquetas(self.etiquetas, valores)} {_numero(serie.valor)}'
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def _nova_serie(self):
+        return _SerieContador()
+
+    def inc(self, quantidade=1):
+        self.labels().inc(quantidade)
+
+
+class Gauge(_Metrica):
+    tipo = 'gauge'
+
+    def _nova_serie(self):
+        return _SerieGauge()
+
+    def inc(self, quantidade=1):
+        self.labels().inc(quantidade)
+
+    def dec(self, quantidade=1):
+        self.labels().dec(quantidade)
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, nome, ajuda, etiquetas=(), limites=BUCKETS_SEGUNDOS):
+        super().__init__(nome, ajuda, etiquetas)
+        self.limites = tuple(sorted(limites))
+
+    def _nova_serie(self):
+        return _SerieHistograma(self.limites)
+
+    def observe(self, valor):
+        self.labels().observe(valor)
+
+    def linhas(self):
+        yield f'# HELP {self.nome} {self.ajuda}'
+        yield f'# TYPE {self.nome} {self.tipo}'
+        for valores, serie in self.series():
+            contagens, soma = serie.amostra()
+            acumulado = 0
+            for limite, contagem in zip(self.limites + (math.inf,), contagens):
+                acumulado += contagem
+                le = 'le="' + _numero(float(limite)) + '"'
+                yield f'{self.nome}_bucket{_etiquetas(self.etiquetas, valores, le)} {acumulado}'
+            yield f'{self.nome}_sum{_etiquetas(self.etiquetas, valores)} {_numero(soma)}'
+            yield f'{self.nome}_count{_etiquetas(self.etiquetas, valores)} {acumulado}'
+
+
+def _registar(metrica):
+    with _lock_registo:
+        _metricas.append(metrica)
+    return metrica
+
+
+def contador(nome, ajuda, etiquetas=()):
+    return _registar(Contador(nome, ajuda, etiquetas))
+
+
+def gauge(nome, ajuda, etiquetas=()):
+    return _registar(Gauge(nome, ajuda, etiquetas))
+
+
+def histograma(nome, ajuda, etiquetas=(), limites=BUCKETS_SEGUNDOS):
+    return _registar(Histograma(nome, ajuda, etiquetas, limites))
+
+
+def registar_coletor(coletor):
+    """
+    coletor() -> iterável de (nome, tipo, ajuda, etiquetas, [(valores das etiquetas, valor)]),
+    chamado em cada recolha. Serve para valores que já existem noutro sítio (ex.: call_stats).
+    """
+    with _lock_registo:
+        _coletores.append(coletor)
+    return coletor
+
+
+# --- Métricas da aplicação ---
+ESTAGIO_SEGUNDOS = histograma('stage_duration_seconds', 'Duração de cada etapa do pipeline.', ('stage',))
+ESTAGIO_EM_CURSO = gauge('stage_in_flight', 'Execuções em curso de cada etapa do pipeline.', ('stage',))
+HTTP_SEGUNDOS = histograma('http_request_duration_seconds', 'Duração dos pedidos HTTP servidos.', ('endpoint', 'method', 'status'))
+HTTP_EM_CURSO = gauge('http_requests_in_flight', 'Pedidos HTTP em curso.')
+CACHE_PEDIDOS = contador('cache_requests_total', 'Consultas às caches, por resultado (hit/miss).', ('cache', 'result'))
+PEDIDOS_EXTERNOS = contador('outbound_requests_total', 'Chamadas a APIs externas, por resultado (ok/error/rate_limited).', ('service', 'outcome'))
+
+
+@contextmanager
+def medir_estagio(estagio):
+    """Mede a duração do bloco e conta-o como em curso enquanto executa; também é um span do trace atual."""
+    em_curso = ESTAGIO_EM_CURSO.labels(estagio)
+    em_curso.inc()
+    inicio = time.perf_counter()
+    try:
+        with tracing.span(estagio):
+            yield
+    finally:
+        ESTAGIO_SEGUNDOS.labels(estagio).observe(time.perf_counter() - inicio)
+        em_curso.dec()
+
+
+def medido(estagio):
+    """Decorador equivalente a `with medir_estagio(estagio)` à volta da função."""
+    def decorador(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with medir_estagio(estagio):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorador
+
+
+def registar_cache(cache, acertos=0, falhas=0):
+    if acertos:
+        CACHE_PEDIDOS.labels(cache, 'hit').inc(acertos)
+    if falhas:
+        CACHE_PEDIDOS.labels(cache, 'miss').inc(falhas)
+
+
+def registar_pedido_externo(servico, status=None):
+    """status: código HTTP da resposta, ou None se a chamada falhou sem resposta."""
+    if status == 429:
+        resultado = 'rate_limited'
+    elif status is None or status >= 400:
+        resultado = 'error'
+    else:
+        resultado = 'ok'
+    PEDIDOS_EXTERNOS.labels(servico, resultado).inc()
+
+
+@registar_coletor
+def _racio_caches():
+    totais = {}
+    for (cache, resultado), serie in CACHE_PEDIDOS.series():
+        totais.setdefault(cache, {'hit': 0, 'miss': 0})[resultado] = serie.valor
+    amostras = [((cache,), t['hit'] / (t['hit'] + t['miss'])) for cache, t in totais.items() if t['hit'] + t['miss']]
+    yield ('cache_hit_ratio', 'gauge', 'Rácio de acertos de cada cache desde o arranque.', ('cache',), amostras)
+
+
+@registar_coletor
+def _spotify_api():
+    # Só se o cliente do Spotify já foi carregado (não força o import do spotipy)
+    spotify_client = sys.modules.get(f'{__package__}.spotify_client')
+    if spotify_client is None:
+        return
+    stats = spotify_client.call_stats.snapshot()
+    etiquetas = ('endpoint',)
+    yield ('spotify_api_calls_total', 'counter', 'Chamadas à Web API do Spotify.', etiquetas,
+           [((e,), s['calls']) for e, s in stats.items()])
+    yield ('spotify_api_errors_total', 'counter', 'Respostas de erro (exceto 429) da Web API do Spotify.', etiquetas,
+           [((e,), s['errors']) for e, s in stats.items()])
+    yield ('spotify_api_rate_limited_total', 'counter', 'Respostas 429 da Web API do Spotify.', etiquetas,
+           [((e,), s['rate_limited']) for e, s in stats.items()])
+    yield ('spotify_api_duration_seconds_total', 'counter', 'Tempo total gasto em chamadas à Web API do Spotify.', etiquetas,
+           [((e,), s['total_ms'] / 1000.0) for e, s in stats.items()])
+
+
+def exportar():
+    """Todas as métricas no formato de texto do Prometheus (versão 0.0.4)."""
+    with _lock_registo:
+        metricas, coletores = list(_metricas), list(_coletores)
+    linhas = []
+    for metrica in metricas:
+        linhas.extend(metrica.linhas())
+    for coletor in coletores:
+        try:
+            for nome, tipo, ajuda, etiquetas, amostras in coletor():
+                linhas.append(f'# HELP {PREFIXO}{nome} {ajuda}')
+                linhas.append(f'# TYPE {PREFIXO}{nome} {tipo}')
+                for valores, valor in amostras:
+                    linhas.append(f'{PREFIXO}{nome}{_etiquetas(etiquetas, valores)} {_numero(valor)}')
+        except Exception as e:
+            log.error("Erro no coletor %s: %s", getattr(coletor, '__name__', coletor), e)
+    return '\n'.join(linhas) + '\n'
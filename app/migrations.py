@@ -0,0 +1,277 @@
+# Nome do ficheiro: app/migrations.py
+"""
+Esquema da base de dados e migrações versionadas.
+
+A versão aplicada fica em `PRAGMA user_version`. Cada migração corre uma
+única vez, dentro da sua própria transação, e sobe a versão no fim. Bases de
+dados antigas (versão 0, criadas antes deste módulo) também são suportadas:
+as migrações iniciais são idempotentes (IF NOT EXISTS / coluna só se faltar).
+
+Esta é a única definição do esquema: é usada pelo servidor no arranque e
+pelo scripts/setup_database.py.
+"""
+from . import logs
+
+log = logs.obter('migrations')
+
+
+def _colunas(cursor, tabela):
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({tabela})")}
+
+
+def _adicionar_coluna(cursor, tabela, coluna, tipo):
+    if coluna not in _colunas(cursor, tabela):
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {tipo}")
+
+
+def _v1_esquema_base(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usuarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            service_user_id TEXT NOT NULL,
+            service_name TEXT NOT NULL,
+            display_name TEXT,
+            data_primeiro_login DATETIME DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(service_user_id, service_name)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS playlists_salvas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            nome_playlist TEXT NOT NULL,
+            playlist_url TEXT, -- URL genérico para a playlist (Spotify ou YouTube)
+            service_name TEXT NOT NULL,
+            data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS playlist_musicas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            playlist_id INTEGER NOT NULL,
+            musica_id TEXT NOT NULL,
+            titulo_musica TEXT,
+            artista_musica TEXT,
+            preview_url_musica TEXT,
+            artista_id TEXT,
+            album_cover_url TEXT,
+            service_name TEXT NOT NULL,
+            FOREIGN KEY (playlist_id) REFERENCES playlists_salvas (id) ON DELETE CASCADE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS playlist_likes (
+            playlist_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            data_like DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (playlist_id, usuario_id),
+            FOREIGN KEY (playlist_id) REFERENCES playlists_salvas (id) ON DELETE CASCADE,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS historico_reproducao (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL,
+            musica_id TEXT,
+            artista_id TEXT,
+            rating INTEGER,
+            data_hora DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    """)
+
+    # --- Tabelas para gestão de músicas locais (opcional) ---
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS musicas (
+            id INTEGER PRIMARY KEY, titulo TEXT, artista TEXT, album TEXT,
+            caminho_arquivo TEXT UNIQUE NOT NULL
+        )""")
+    cursor.execute("CREATE TABLE IF NOT EXISTS generos (id INTEGER PRIMARY KEY, nome TEXT UNIQUE NOT NULL)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS musica_generos (
+            musica_id INTEGER,
+            genero_id INTEGER,
+            FOREIGN KEY (musica_id) REFERENCES musicas (id),
+            FOREIGN KEY (genero_id) REFERENCES generos (id),
+            PRIMARY KEY (musica_id, genero_id)
+        )""")
+    cursor.execute("CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, nome TEXT UNIQUE NOT NULL)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS musica_tags (
+            musica_id INTEGER,
+            tag_id INTEGER,
+            FOREIGN KEY (musica_id) REFERENCES musicas (id),
+            FOREIGN KEY (tag_id) REFERENCES tags (id),
+            PRIMARY KEY (musica_id, tag_id)
+        )""")
+
+
+def _v2_capas_e_posicoes(cursor):
+    # cover_image: capa inline antiga (só é lida pela migração para o blob store)
+    _adicionar_coluna(cursor, 'playlists_salvas', 'cover_image', 'TEXT')
+    _adicionar_coluna(cursor, 'playlists_salvas', 'cover_hash', 'TEXT')
+    # Posição esparsa das faixas para a sincronização incremental
+    _adicionar_coluna(cursor, 'playlist_musicas', 'posicao', 'REAL')
+
+
+def _v3_caches(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS feed_geracao (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            conteudo INTEGER NOT NULL DEFAULT 0,
+            likes INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO feed_geracao (id, conteudo, likes) VALUES (1, 0, 0)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS audio_features_cache (
+            track_id TEXT PRIMARY KEY,
+            features TEXT,
+            data_cache DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _v4_indices(cursor):
+    # Faixas de uma playlist, já pela ordem em que são listadas
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlist_musicas_playlist ON playlist_musicas (playlist_id, posicao)")
+    # Playlist existente com o mesmo nome (guardar/sincronizar) e listagem do utilizador
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlists_usuario_nome ON playlists_salvas (usuario_id, nome_playlist, service_name)")
+    # Feed da comunidade: paginação por (data_criacao, id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlists_feed ON playlists_salvas (data_criacao, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlist_likes_usuario ON playlist_likes (usuario_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_historico_usuario_data ON historico_reproducao (usuario_id, data_hora)")
+
+
+def _v5_contador_likes(cursor):
+    # Contador desnormalizado: o feed e o toggle leem-no sem COUNT(*) sobre playlist_likes
+    _adicionar_coluna(cursor, 'playlists_salvas', 'like_count', 'INTEGER NOT NULL DEFAULT 0')
+    cursor.execute("""
+        UPDATE playlists_salvas SET like_count = (
+            SELECT COUNT(*) FROM playlist_likes WHERE playlist_likes.playlist_id = playlists_salvas.id)
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_playlist_likes_insert AFTER INSERT ON playlist_likes
+        BEGIN
+            UPDATE playlists_salvas SET like_count = like_count + 1 WHERE id = NEW.playlist_id;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_playlist_likes_delete AFTER DELETE ON playlist_likes
+        BEGIN
+            UPDATE playlists_salvas SET like_count = MAX(like_count - 1, 0) WHERE id = OLD.playlist_id;
+        END
+    """)
+
+
+def _v6_outbox_playlists(cursor):
+    # Operações remotas (criar/sincronizar no Spotify/YouTube) por reconciliar, ver app/playlist_persistence.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS playlist_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            playlist_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            service_name TEXT NOT NULL,
+            operacao TEXT NOT NULL,
+            estado TEXT NOT NULL,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            ultimo_erro TEXT,
+            data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data_atualizacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (playlist_id) REFERENCES playlists_salvas (id) ON DELETE CASCADE,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlist_outbox_playlist ON playlist_outbox (playlist_id, estado)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_playlist_outbox_usuario ON playlist_outbox (usuario_id, estado)")
+
+
+def _v7_jobs(cursor):
+    # Fila de tarefas em segundo plano, ver app/jobs.py (tempos em segundos desde a época)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            usuario_id INTEGER,
+            chave TEXT,
+            estado TEXT NOT NULL,
+            progresso TEXT,
+            resultado TEXT,
+            erro TEXT,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            max_tentativas INTEGER NOT NULL DEFAULT 5,
+            proxima_execucao REAL NOT NULL,
+            prazo REAL,
+            data_criacao REAL NOT NULL,
+            data_atualizacao REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_estado ON jobs (estado, proxima_execucao)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_chave ON jobs (chave, estado)")
+
+
+def _v8_cache_resultados(cursor):
+    # Cache partilhada entre workers (prompts do Gemini, buscas, análises de imagem), ver app/result_cache.py
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cache_resultados (
+            espaco TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            valor TEXT NOT NULL,
+            expira REAL NOT NULL,
+            PRIMARY KEY (espaco, chave)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_resultados_expira ON cache_resultados (expira)")
+
+
+
+def _v9_sessoes(cursor):
+    # Sessões do Flask no servidor (ver app/session_store.py). Tabela com rowid: os dados
+    # cifrados ocupam vários KB e ficariam mal numa árvore WITHOUT ROWID.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sessoes (
+            id TEXT PRIMARY KEY,
+            dados BLOB NOT NULL,
+            versao INTEGER NOT NULL,
+            expira REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_expira ON sessoes (expira)")
+
+
+# (versão, descrição, função). Nunca alterar uma migração já publicada: acrescentar uma nova.
+MIGRACOES = [
+    (1, "esquema base", _v1_esquema_base),
+    (2, "colunas cover_image, cover_hash e posicao", _v2_capas_e_posicoes),
+    (3, "tabelas feed_geracao e audio_features_cache", _v3_caches),
+    (4, "índices das consultas frequentes", _v4_indices),
+    (5, "contador like_count mantido por triggers", _v5_contador_likes),
+    (6, "outbox das operações remotas de playlists", _v6_outbox_playlists),
+    (7, "fila de tarefas em segundo plano", _v7_jobs),
+    (8, "cache de resultados partilhada entre processos", _v8_cache_resultados),
+    (9, "sessões do Flask guardadas no servidor", _v9_sessoes),
+]
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def versao_atual(db):
+    with db.conexao() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def aplicar_migracoes(db):
+    """Aplica as migrações em falta. Retorna a versão final do esquema."""
+    if versao_atual(db) >= VERSAO_ATUAL:
+        return VERSAO_ATUAL
+    for versao, descricao, migracao in MIGRACOES:
+        with db.transacao() as cursor:
+            # Relido dentro da transação: outro processo pode ter migrado entretanto
+            if cursor.execute("PRAGMA user_version").fetchone()[0] >= versao:
+                continue
+            migracao(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(versao)}")
+        log.info("Migração v%s aplicada: %s", versao, descricao)
+    return VERSAO_ATUAL
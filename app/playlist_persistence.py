@@ -0,0 +1,216 @@
+# Nome do ficheiro: app/playlist_persistence.py
+"""
+Persistência de playlists guardadas (local e remota).
+
+A lista de faixas é validada e normalizada uma vez e escrita numa única
+transação (executemany, ver playlist_sync.sincronizar_local).
+
+Para playlists no Spotify/YouTube usa-se uma outbox: a escrita local e o
+registo da operação remota pendente (`playlist_outbox`) são feitos na mesma
+transação; a chamada à API acontece depois, fora da transação, e o resultado
+é reconciliado (URL guardado, entrada concluída). Se a chamada falhar, a
+entrada fica em 'erro' e pode ser repetida sem duplicar a playlist local nem
+a remota: mal a playlist remota é criada (antes de adicionar as faixas), o seu
+URL é guardado e a entrada passa a 'sincronizar', por isso a repetição
+completa a playlist existente em vez de criar outra.
+"""
+from . import feed_cache
+from . import metrics
+from .playlist_sync import sincronizar_local, extrair_id_remoto
+
+OPERACAO_CRIAR = 'criar'
+OPERACAO_SINCRONIZAR = 'sincronizar'
+
+ESTADO_PENDENTE = 'pendente'
+ESTADO_EM_CURSO = 'em_curso'
+ESTADO_CONCLUIDA = 'concluida'
+ESTADO_ERRO = 'erro'
+
+# Limite de faixas por playlist no Spotify
+MAX_FAIXAS = 10000
+MAX_TENTATIVAS = 5
+# Uma entrada 'em_curso' mais antiga do que isto é considerada abandonada (ex.: processo morto)
+EM_CURSO_EXPIRA_SEGUNDOS = 300
+
+_CAMPOS_TEXTO = ('titulo', 'artista', 'preview_url', 'artista_id', 'album_cover_url')
+
+
+class PlaylistInvalidaError(ValueError):
+    """Dados da playlist recebidos do cliente são inválidos."""
+
+
+class OutboxIndisponivelError(Exception):
+    """A entrada da outbox não existe, já foi concluída ou está a ser processada."""
+
+
+def normalizar_faixas(tracks):
+    """Valida a lista de faixas do cliente e devolve-a só com os campos que são guardados."""
+    if not isinstance(tracks, list) or not tracks:
+        raise PlaylistInvalidaError("A lista de músicas não pode estar vazia.")
+    if len(tracks) > MAX_FAIXAS:
+        raise PlaylistInvalidaError(f"Uma playlist não pode ter mais de {MAX_FAIXAS} músicas.")
+    faixas = []
+    for track in tracks:
+        musica_id = track.get('spotify_id') if isinstance(track, dict) else None
+        if not isinstance(musica_id, str) or not musica_id.strip():
+            raise PlaylistInvalidaError("Todas as músicas precisam de um identificador.")
+        faixa = {'spotify_id': musica_id.strip()}
+        for campo in _CAMPOS_TEXTO:
+            valor = track.get(campo)
+            faixa[campo] = str(valor).strip() if valor not in (None, '') else None
+        faixas.append(faixa)
+    return faixas
+
+
+def _url_remota(nova_playlist, service_name):
+    externos = nova_playlist.get('external_urls', {}) or {}
+    if service_name == 'spotify':
+        return externos.get('spotify', '')
+    playlist_url = externos.get('youtube') or externos.get('spotify', '')
+    return playlist_url or f"https://www.youtube.com/playlist?list={nova_playlist.get('id', '')}"
+
+
+class PlaylistPersistence:
+    """Escrita das playlists guardadas e reconciliação com o serviço remoto."""
+
+    def __init__(self, db):
+        self.db = db
+
+    @staticmethod
+    def _guardar(cursor, usuario_id, nome, service_name, faixas, cover_hash, playlist_id=None):
+        if playlist_id is None:
+            cursor.execute("INSERT INTO playlists_salvas (usuario_id, nome_playlist, service_name, cover_hash) VALUES (?, ?, ?, ?)",
+                           (usuario_id, nome, service_name, cover_hash))
+            playlist_id = cursor.lastrowid
+        elif cover_hash:
+            cursor.execute("UPDATE playlists_salvas SET cover_hash = ? WHERE id = ?", (cover_hash, playlist_id))
+        alteracoes = sincronizar_local(cursor, playlist_id, faixas, service_name)
+        feed_cache.incrementar_geracao(cursor)
+        return playlist_id, alteracoes
+
+    @metrics.medido('playlist_guardar_local')
+    def guardar_local(self, usuario_id, nome, service_name, tracks, cover_hash=None):
+        """Cria ou atualiza (pelo nome) uma playlist só local. Retorna (playlist_id, alterações)."""
+        faixas = normalizar_faixas(tracks)
+        with self.db.transacao() as cursor:
+            existente = cursor.execute(
+                "SELECT id FROM playlists_salvas WHERE usuario_id = ? AND nome_playlist = ? AND service_name = ?",
+                (usuario_id, nome, service_name)).fetchone()
+            return self._guardar(cursor, usuario_id, nome, service_name, faixas, cover_hash,
+                                 existente[0] if existente else None)
+
+    @metrics.medido('playlist_preparar_remota')
+    def preparar_remota(self, usuario_id, nome, service_name, tracks, cover_hash=None, sincronizar=False):
+        """
+        Grava a playlist localmente e regista a operação remota pendente, na mesma transação.
+        Com `sincronizar`, reutiliza a última playlist com este nome (já criada no serviço ou
+        cuja criação ficou pendente). Retorna o ID da entrada da outbox.
+        """
+        faixas = normalizar_faixas(tracks)
+        with self.db.transacao() as cursor:
+            existente = None
+            if sincronizar:
+                existente = cursor.execute(
+                    "SELECT id, playlist_url FROM playlists_salvas WHERE usuario_id = ? AND nome_playlist = ? AND service_name = ? ORDER BY id DESC LIMIT 1",
+                    (usuario_id, nome, service_name)).fetchone()
+            playlist_id, _ = self._guardar(cursor, usuario_id, nome, service_name, faixas, cover_hash,
+                                           existente[0] if existente else None)
+            operacao = OPERACAO_SINCRONIZAR if existente and extrair_id_remoto(existente[1], service_name) else OPERACAO_CRIAR
+            # Uma só entrada por playlist ainda por reconciliar: a mais recente substitui a anterior
+            pendente = cursor.execute(
+                "SELECT id FROM playlist_outbox WHERE playlist_id = ? AND estado IN (?, ?) ORDER BY id DESC LIMIT 1",
+                (playlist_id, ESTADO_PENDENTE, ESTADO_ERRO)).fetchone()
+            if pendente:
+                cursor.execute("UPDATE playlist_outbox SET operacao = ?, estado = ?, tentativas = 0, ultimo_erro = NULL, data_atualizacao = CURRENT_TIMESTAMP WHERE id = ?",
+                               (operacao, ESTADO_PENDENTE, pendente[0]))
+                return pendente[0]
+            cursor.execute("INSERT INTO playlist_outbox (playlist_id, usuario_id, service_name, operacao, estado) VALUES (?, ?, ?, ?, ?)",
+                           (playlist_id, usuario_id, service_name, operacao, ESTADO_PENDENTE))
+            return cursor.lastrowid
+
+    def faixas(self, playlist_id):
+        """Faixas guardadas, pela ordem da playlist, no formato usado pelos serviços."""
+        with self.db.conexao() as conn:
+            rows = conn.execute(
+                "SELECT musica_id, titulo_musica, artista_musica, preview_url_musica, artista_id, album_cover_url FROM playlist_musicas WHERE playlist_id = ? ORDER BY posicao, id",
+                (playlist_id,)).fetchall()
+        return [{'spotify_id': r[0], 'titulo': r[1], 'artista': r[2], 'preview_url': r[3], 'artista_id': r[4], 'album_cover_url': r[5]}
+                for r in rows]
+
+    def _reservar(self, outbox_id, usuario_id):
+        """Marca a entrada como 'em_curso' (só um pedido a processa). Retorna os dados da entrada."""
+        with self.db.transacao() as cursor:
+            row = cursor.execute("""
+                SELECT o.playlist_id, o.operacao, o.estado, o.tentativas, p.nome_playlist, p.playlist_url, o.service_name
+                FROM playlist_outbox o JOIN playlists_salvas p ON p.id = o.playlist_id
+                WHERE o.id = ? AND o.usuario_id = ?
+                  AND (o.estado IN (?, ?)
+                       OR (o.estado = ? AND o.data_atualizacao < datetime('now', ?)))
+            """, (outbox_id, usuario_id, ESTADO_PENDENTE, ESTADO_ERRO, ESTADO_EM_CURSO,
+                  f'-{EM_CURSO_EXPIRA_SEGUNDOS} seconds')).fetchone()
+            if not row or row[3] >= MAX_TENTATIVAS:
+                raise OutboxIndisponivelError(outbox_id)
+            cursor.execute("UPDATE playlist_outbox SET estado = ?, data_atualizacao = CURRENT_TIMESTAMP WHERE id = ?",
+                           (ESTADO_EM_CURSO, outbox_id))
+        playlist_id, operacao, _, _, nome, playlist_url, service_name = row
+        return playlist_id, operacao, nome, playlist_url, service_name
+
+    def _registar_criada(self, outbox_id, playlist_id, playlist_url):
+        """A playlist remota já existe: guarda o URL e converte a entrada numa sincronização."""
+        with self.db.transacao() as cursor:
+            cursor.execute("UPDATE playlists_salvas SET playlist_url = ? WHERE id = ?", (playlist_url, playlist_id))
+            cursor.execute("UPDATE playlist_outbox SET operacao = ?, data_atualizacao = CURRENT_TIMESTAMP WHERE id = ?",
+                           (OPERACAO_SINCRONIZAR, outbox_id))
+            feed_cache.incrementar_geracao(cursor)
+
+    @metrics.medido('playlist_remota')
+    def executar(self, outbox_id, usuario_id, service, user_client):
+        """
+        Executa a operação remota pendente e reconcilia o resultado.
+        Retorna (URL da playlist remota, operação); em caso de erro a entrada fica em 'erro' e a exceção propaga.
+        """
+        playlist_id, operacao, nome, playlist_url, service_name = self._reservar(outbox_id, usuario_id)
+        try:
+            faixas = self.faixas(playlist_id)
+            id_remoto = extrair_id_remoto(playlist_url, service_name)
+            if operacao == OPERACAO_SINCRONIZAR and id_remoto:
+                service.sync_playlist(user_client=user_client, playlist_id=id_remoto, tracks=faixas)
+            else:
+                def criada(nova_playlist):
+                    self._registar_criada(outbox_id, playlist_id, _url_remota(nova_playlist, service_name))
+                nova_playlist = service.create_playlist(user_client=user_client, playlist_name=nome, tracks=faixas,
+                                                        ao_criar=criada)
+                playlist_url = _url_remota(nova_playlist, service_name)
+        except Exception as e:
+            with self.db.transacao() as cursor:
+                cursor.execute("UPDATE playlist_outbox SET estado = ?, tentativas = tentativas + 1, ultimo_erro = ?, data_atualizacao = CURRENT_TIMESTAMP WHERE id = ?",
+                               (ESTADO_ERRO, str(e)[:500], outbox_id))
+            raise
+        with self.db.transacao() as cursor:
+            cursor.execute("UPDATE playlists_salvas SET playlist_url = ? WHERE id = ?", (playlist_url, playlist_id))
+            cursor.execute("UPDATE playlist_outbox SET estado = ?, tentativas = tentativas + 1, ultimo_erro = NULL, data_atualizacao = CURRENT_TIMESTAMP WHERE id = ?",
+                           (ESTADO_CONCLUIDA, outbox_id))
+            feed_cache.incrementar_geracao(cursor)
+        return playlist_url, operacao
+
+    def resultado(self, outbox_id):
+        """(URL da playlist remota, operação) se a entrada já foi concluída, senão None."""
+        with self.db.conexao() as conn:
+            row = conn.execute("""
+                SELECT p.playlist_url, o.operacao FROM playlist_outbox o JOIN playlists_salvas p ON p.id = o.playlist_id
+                WHERE o.id = ? AND o.estado = ?
+            """, (outbox_id, ESTADO_CONCLUIDA)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def pendentes(self, usuario_id):
+        """Operações remotas por reconciliar do utilizador (para o cliente poder repeti-las)."""
+        with self.db.conexao() as conn:
+            rows = conn.execute("""
+                SELECT o.id, o.playlist_id, p.nome_playlist, o.operacao, o.estado, o.tentativas, o.ultimo_erro
+                FROM playlist_outbox o JOIN playlists_salvas p ON p.id = o.playlist_id
+                WHERE o.usuario_id = ? AND o.estado != ?
+                ORDER BY o.id DESC
+            """, (usuario_id, ESTADO_CONCLUIDA)).fetchall()
+        return [{"id": r[0], "playlist_id": r[1], "name": r[2], "operation": r[3], "state": r[4],
+                 "attempts": r[5], "last_error": r[6], "can_retry": r[5] < MAX_TENTATIVAS and r[4] != ESTADO_EM_CURSO}
+                for r in rows]
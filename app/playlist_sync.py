@@ -0,0 +1,186 @@
+# Nome do ficheiro: app/playlist_sync.py
+"""
+Sincronização incremental de playlists.
+
+Compara a lista de faixas guardada com a nova (por musica_id e posição) e
+calcula apenas as inserções, remoções e movimentos necessários, para que
+guardar uma playlist editada custe proporcionalmente à edição e não ao tamanho.
+
+As posições locais (playlist_musicas.posicao) são números reais esparsos: uma
+inserção ou movimento só altera a linha afetada, sem renumerar as restantes.
+"""
+from bisect import bisect_left
+from collections import defaultdict, deque
+
+# Abaixo deste intervalo entre vizinhos deixa de ser seguro subdividir posições
+_INTERVALO_MINIMO = 1e-6
+
+
+def _emparelhar(antigos, novos):
+    """
+    Emparelha ocorrências iguais (a k-ésima ocorrência de um ID antigo com a
+    k-ésima do novo). Retorna lista com, para cada índice novo, o índice antigo
+    correspondente ou None (inserção), e o conjunto de índices antigos removidos.
+    """
+    ocorrencias = defaultdict(deque)
+    for i, musica_id in enumerate(antigos):
+        ocorrencias[musica_id].append(i)
+    origem = []
+    for musica_id in novos:
+        fila = ocorrencias.get(musica_id)
+        origem.append(fila.popleft() if fila else None)
+    removidos = {i for fila in ocorrencias.values() for i in fila}
+    return origem, removidos
+
+
+def _estaveis(origem):
+    """Índices novos que formam a maior subsequência crescente de índices antigos (não precisam de mover)."""
+    caudas, caudas_idx, anterior = [], [], {}
+    for j, i_antigo in enumerate(origem):
+        if i_antigo is None:
+            continue
+        k = bisect_left(caudas, i_antigo)
+        anterior[j] = caudas_idx[k - 1] if k > 0 else None
+        if k == len(caudas):
+            caudas.append(i_antigo); caudas_idx.append(j)
+        else:
+            caudas[k] = i_antigo; caudas_idx[k] = j
+    estaveis = set()
+    j = caudas_idx[-1] if caudas_idx else None
+    while j is not None:
+        estaveis.add(j)
+        j = anterior[j]
+    return estaveis
+
+
+def calcular_diff(antigos, novos):
+    """
+    Calcula o diff entre duas listas de IDs.
+    Retorna dict com:
+      - 'origem': para cada índice novo, o índice antigo (ou None se for inserção);
+      - 'removidos': índices antigos a remover;
+      - 'estaveis': índices novos que ficam no lugar;
+      - 'inseridos' / 'movidos': índices novos a inserir / mover.
+    """
+    origem, removidos = _emparelhar(antigos, novos)
+    estaveis = _estaveis(origem)
+    inseridos = [j for j, i in enumerate(origem) if i is None]
+    movidos = [j for j, i in enumerate(origem) if i is not None and j not in estaveis]
+    return {'origem': origem, 'removidos': sorted(removidos), 'estaveis': estaveis,
+            'inseridos': inseridos, 'movidos': movidos}
+
+
+def planear_operacoes(antigos, novos):
+    """
+    Traduz o diff numa sequência de operações sobre uma lista remota:
+      ('remover', [posições atuais, por ordem decrescente])
+      ('inserir', posição, [ids])
+      ('mover', posição_atual, inserir_antes_de)   (semântica do reorder do Spotify)
+    Cada elemento não estável é colocado logo a seguir ao seu antecessor na nova
+    ordem, o que garante o resultado final com um número de operações igual
+    ao número de inserções + movimentos.
+    """
+    diff = calcular_diff(antigos, novos)
+    origem, estaveis = diff['origem'], diff['estaveis']
+    operacoes = []
+    if diff['removidos']:
+        operacoes.append(('remover', sorted(diff['removidos'], reverse=True)))
+
+    # Simulação da lista remota com marcadores únicos (índice antigo ou ('novo', j))
+    removidos = set(diff['removidos'])
+    atual = [i for i in range(len(antigos)) if i not in removidos]
+    marcador_de = lambda j: origem[j] if origem[j] is not None else ('novo', j)
+
+    j = 0
+    while j < len(novos):
+        if j in estaveis:
+            j += 1
+            continue
+        pos_destino = atual.index(marcador_de(j - 1)) + 1 if j > 0 else 0
+        if origem[j] is None:
+            # Agrupa inserções consecutivas numa só operação
+            bloco = [j]
+            while bloco[-1] + 1 < len(novos) and origem[bloco[-1] + 1] is None:
+                bloco.append(bloco[-1] + 1)
+            operacoes.append(('inserir', pos_destino, [novos[k] for k in bloco]))
+            atual[pos_destino:pos_destino] = [marcador_de(k) for k in bloco]
+            j = bloco[-1] + 1
+            continue
+        pos_atual = atual.index(origem[j])
+        if pos_atual != pos_destino:
+            operacoes.append(('mover', pos_atual, pos_destino))
+            marcador = atual.pop(pos_atual)
+            atual.insert(pos_destino - 1 if pos_atual < pos_destino else pos_destino, marcador)
+        j += 1
+    return operacoes
+
+
+def sincronizar_local(cursor, playlist_id, tracks, service_name):
+    """
+    Aplica a nova lista de faixas a playlist_musicas tocando apenas nas linhas
+    alteradas. Retorna dict com o número de inserções, remoções e movimentos.
+    """
+    linhas = cursor.execute(
+        "SELECT id, musica_id, posicao FROM playlist_musicas WHERE playlist_id = ? ORDER BY posicao, id",
+        (playlist_id,)).fetchall()
+    antigos = [r[1] for r in linhas]
+    novos = [t.get('spotify_id') for t in tracks]
+    diff = calcular_diff(antigos, novos)
+    origem, estaveis = diff['origem'], diff['estaveis']
+
+    if diff['removidos']:
+        cursor.executemany("DELETE FROM playlist_musicas WHERE id = ?", [(linhas[i][0],) for i in diff['removidos']])
+
+    # Posições: as estáveis mantêm-se; as restantes ficam entre os vizinhos estáveis
+    posicoes = [None] * len(novos)
+    for j in estaveis:
+        posicoes[j] = linhas[origem[j]][2]
+    if any(posicoes[j] is None for j in estaveis):
+        posicoes = None  # playlist antiga sem posições: renumera tudo
+    else:
+        j = 0
+        anterior = 0.0
+        while j < len(novos):
+            if posicoes[j] is not None:
+                anterior = posicoes[j]; j += 1
+                continue
+            fim = j
+            while fim < len(novos) and posicoes[fim] is None:
+                fim += 1
+            seguinte = posicoes[fim] if fim < len(novos) else anterior + (fim - j + 1)
+            passo = (seguinte - anterior) / (fim - j + 1)
+            if passo < _INTERVALO_MINIMO:
+                posicoes = None
+                break
+            for k in range(j, fim):
+                posicoes[k] = anterior + passo * (k - j + 1)
+            j = fim
+
+    if posicoes is None:
+        posicoes = [float(k + 1) for k in range(len(novos))]
+        alterar = [j for j in range(len(novos)) if origem[j] is not None]
+    else:
+        alterar = diff['movidos']
+
+    if alterar:
+        cursor.executemany("UPDATE playlist_musicas SET posicao = ? WHERE id = ?",
+                           [(posicoes[j], linhas[origem[j]][0]) for j in alterar])
+    if diff['inseridos']:
+        cursor.executemany(
+            "INSERT INTO playlist_musicas (playlist_id, musica_id, titulo_musica, artista_musica, preview_url_musica, artista_id, album_cover_url, service_name, posicao) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(playlist_id, tracks[j].get('spotify_id'), tracks[j].get('titulo'), tracks[j].get('artista'), tracks[j].get('preview_url'),
+              tracks[j].get('artista_id'), tracks[j].get('album_cover_url'), service_name, posicoes[j]) for j in diff['inseridos']])
+    return {'inseridas': len(diff['inseridos']), 'removidas': len(diff['removidos']), 'movidas': len(diff['movidos'])}
+
+
+def extrair_id_remoto(playlist_url, service_name):
+    """Obtém o ID da playlist remota a partir do URL guardado."""
+    if not playlist_url:
+        return None
+    if service_name == 'youtube':
+        if 'list=' not in playlist_url:
+            return None
+        return playlist_url.split('list=', 1)[1].split('&', 1)[0] or None
+    if '/playlist/' not in playlist_url:
+        return None
+    return playlist_url.split('/playlist/', 1)[1].split('?', 1)[0].strip('/') or None
@@ -4,169 +4,383 @@ import re
 import random
 import sqlite3
 import base64
+import hashlib
 import json
+import logging
 import requests
 import time
-from google.cloud import vision
+from concurrent.futures import ThreadPoolExecutor
+from .lazy import Lazy, importar
+from . import cassette
+from . import logs
+from . import metrics
+from . import tracing
+from .result_cache import chave_de
 from .services.spotify_service import SpotifyService
 from .services.youtube_service import YouTubeMusicService
 from . import config_credentials as creds
 
+log = logs.obter('engine')
+
+# Pool para chamadas externas independentes dentro do mesmo pedido (Gemini, Spotify)
+_io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='engine-io')
+
+def _post_gemini(tipo, api_url, payload, timeout):
+    """POST ao Gemini medido por tipo de chamada (duração, em curso, 429/erros)."""
+    with metrics.medir_estagio(f'gemini_{tipo}'):
+        try:
+            response = cassette.chamar(
+                'gemini', {'url': api_url, 'json': payload},
+                lambda: requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=timeout),
+                cassette.codificar_http, cassette.descodificar_http)
+        except requests.exceptions.RequestException:
+            metrics.registar_pedido_externo('gemini')
+            raise
+    metrics.registar_pedido_externo('gemini', response.status_code)
+    return response
+
 def chamar_gemini(payload, api_url, max_retries=3):
     for attempt in range(max_retries):
         try:
-            response = requests.post(api_url, json=payload, timeout=15)
+            response = _post_gemini('generico', api_url, payload, timeout=15)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
             if response.status_code == 429 and attempt < max_retries - 1:
                 wait = 2 ** attempt
-                print(f"[Engine] Limite atingido, tentando novamente em {wait}s...")
+                log.warning("Gemini: limite atingido, nova tentativa em %ss", wait)
                 time.sleep(wait)
                 continue
-            print(f"[Engine] Erro ao chamar Gemini: {e}")
+            log.error("Erro ao chamar Gemini: %s", e)
             return None
         except Exception as e:
-            print(f"[Engine] Erro inesperado: {e}")
+            log.error("Erro inesperado ao chamar Gemini: %s", e)
             return None
 
 
+class PassoGemini:
+    """
+    Uma chamada ao Gemini descrita como dados, para o motor síncrono e o assíncrono
+    (app/async_engine.py) a executarem da mesma forma: `interpretar(json)` converte a
+    resposta e `omissao` é o resultado quando a chamada falha. Com `payload=None` não
+    há chamada (ex.: query de anime, sem chave de API) e o resultado é `omissao`.
+    Com `cacheavel` a resposta pode ser reutilizada para o mesmo payload (cache de resultados).
+    """
+    __slots__ = ('tipo', 'payload', 'timeout', 'interpretar', 'omissao', 'cacheavel')
+
+    def __init__(self, tipo, payload, timeout=15, interpretar=None, omissao=None, cacheavel=False):
+        self.tipo = tipo
+        self.payload = payload
+        self.timeout = timeout
+        self.interpretar = interpretar
+        self.omissao = omissao
+        self.cacheavel = cacheavel
+
+    def falhou(self, erro, texto_resposta=None):
+        """Regista a falha e devolve o resultado por omissão."""
+        log.error("Gemini (%s): %s", self.tipo, erro)
+        if texto_resposta:
+            log.debug("Gemini (%s): resposta: %.500s", self.tipo, texto_resposta)
+        return self.omissao
+
+
+def _texto_candidato(result):
+    """Texto do primeiro candidato de uma resposta do Gemini, ou None se não houver candidatos."""
+    if not result.get('candidates'):
+        return None
+    return result['candidates'][0]['content']['parts'][0]['text']
+
+
+def _json_candidato(texto):
+    return json.loads(texto.replace('```json', '').replace('```', '').strip())
+
+
+class ProcessadorFaixas:
+    """
+    Filtro incremental de faixas: normaliza o formato, descarta instrumentais e
+    duplicados (por ID e por chave semântica) até atingir o limite.
+    Permite consumir resultados à medida que chegam (ex.: páginas de uma busca).
+    """
+    PALAVRAS_INSTRUMENTAIS = ['instrumental', 'karaoke', 'backing track', 'versão instrumental', 'versao instrumental']
+
+    def __init__(self, chave_dedup, limit=25):
+        self.chave_dedup = chave_dedup
+        self.limit = limit
+        self.musicas = []
+        self.ids_vistos = set()
+        self.chaves_vistas = set()
+
+    @property
+    def completo(self):
+        return len(self.musicas) >= self.limit
+
+    def _is_instrumental(self, nome, artista):
+        texto = f"{nome} {artista}".lower()
+        return any(p in texto for p in self.PALAVRAS_INSTRUMENTAIS)
+
+    def adicionar(self, item):
+        """Tenta adicionar uma faixa bruta. Retorna True se foi aceite."""
+        if self.completo or not item:
+            return False
+
+        is_youtube_format = 'titulo' in item and 'artista' in item
+
+        if is_youtube_format:
+            track_id = item.get('spotify_id') or item.get('id')
+            if not track_id:
+                return False
+            titulo = item.get('titulo', 'Sem título')
+            artista = item.get('artista', 'Desconhecido')
+
+            if self._is_instrumental(titulo, artista):
+                return False
+            if track_id in self.ids_vistos:
+                return False
+            chave = self.chave_dedup(titulo, artista)
+            if chave in self.chaves_vistas:
+                log.debug("Duplicata semântica ignorada: %s - %s", titulo, artista, extra=logs.POR_ITEM)
+                return False
+
+            yt_duration = item.get('duration', '')
+            if not yt_duration:
+                yt_dur_secs = item.get('duration_seconds') or item.get('duration_ms', 0) // 1000
+                if yt_dur_secs:
+                    yt_duration = f"{yt_dur_secs // 60}:{yt_dur_secs % 60:02d}"
+                else:
+                    yt_duration = "3:45"
+            track_final = {
+                'titulo': titulo,
+                'artista': artista,
+                'artista_id': item.get('artista_id', ''),
+                'preview_url': item.get('preview_url', f"https://www.youtube.com/watch?v={track_id}"),
+                'spotify_id': track_id,
+                'album_cover_url': item.get('album_cover_url', ''),
+                'service_name': 'youtube',
+                'id': track_id,
+                'duration': yt_duration
+            }
+            self.musicas.append(track_final)
+            self.ids_vistos.add(track_id)
+            self.chaves_vistas.add(chave)
+            return True
+
+        # Unwrap playlist-style items: {added_at, track: {...}}
+        track_data = item.get('track') if isinstance(item.get('track'), dict) else item
+        if not track_data.get('artists') or not track_data.get('id'):
+            return False
+        spotify_id = track_data.get('id')
+        artists_data = track_data.get('artists', [])
+        titulo = track_data.get('name', '')
+        artista = artists_data[0].get('name', 'N/A') if artists_data else 'N/A'
+
+        if self._is_instrumental(titulo, artista):
+            return False
+        if spotify_id in self.ids_vistos:
+            return False
+        chave = self.chave_dedup(titulo, artista)
+        if chave in self.chaves_vistas:
+            log.debug("Duplicata semântica ignorada: %s - %s", titulo, artista, extra=logs.POR_ITEM)
+            return False
+
+        album_images = track_data.get('album', {}).get('images', [])
+        duration_ms = track_data.get('duration_ms', 0)
+        if duration_ms:
+            minutos = duration_ms // 60000
+            segundos = (duration_ms % 60000) // 1000
+            duration_str = f"{minutos}:{segundos:02d}"
+        else:
+            duration_str = "00:00"
+        musica = {
+            'titulo': titulo,
+            'artista': artista,
+            'artista_id': artists_data[0].get('id') if artists_data else None,
+            'preview_url': track_data.get('preview_url'),
+            'spotify_id': spotify_id,
+            'album_cover_url': album_images[0]['url'] if album_images else None,
+            'service_name': 'spotify',
+            'duration': duration_str
+        }
+        self.musicas.append(musica)
+        self.ids_vistos.add(spotify_id)
+        self.chaves_vistas.add(chave)
+        return True
+
+
 class RecommendationEngine:
-    def __init__(self, vision_client, db_connection):
+    def __init__(self, vision_client, db, result_cache=None):
         """
         Inicializa o motor, definindo o serviço de música dinamicamente por pedido.
         Também carrega a lista de géneros disponíveis do Spotify a partir de um ficheiro.
+        `result_cache` (app/result_cache.py) guarda respostas do Gemini e análises de imagem.
         """
-        self.vision_client = vision_client
-        self.conn = db_connection
+        # Pode ser o cliente ou um Lazy: o cliente Vision só é criado na primeira análise de imagem
+        self._vision_client = vision_client
+        self.db = db
+        self.result_cache = result_cache
         self.gemini_api_key = creds.GEMINI_API_KEY
         self.music_service = None
         
         # Carrega a lista de géneros válidos do Spotify para validação
         self.available_spotify_genres = set()
         try:
-            print("[Engine] A carregar a lista de géneros do Spotify a partir do ficheiro local...")
+            log.debug("A carregar a lista de géneros do Spotify a partir do ficheiro local...")
             current_dir = os.path.dirname(os.path.abspath(__file__))
             genres_file_path = os.path.join(current_dir, '..', 'data', 'spotify_genres.txt')
             with open(genres_file_path, 'r') as f:
                 self.available_spotify_genres = set(f.read().strip().split(','))
-            print(f"[Engine] Carregados {len(self.available_spotify_genres)} géneros do Spotify.")
+            log.info("Carregados %d géneros do Spotify.", len(self.available_spotify_genres))
+        except Exception as e:
+            log.warning("Não foi possível carregar o ficheiro de géneros do Spotify: %s", e)
+
+    @property
+    def vision_client(self):
+        if isinstance(self._vision_client, Lazy):
+            return self._vision_client.get()
+        return self._vision_client
+
+    @property
+    def url_gemini(self):
+        return f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={self.gemini_api_key}"
+
+    def executar_passo(self, passo):
+        """Executa um PassoGemini (síncrono)."""
+        if passo.payload is None:
+            return passo.omissao
+        chave = self.chave_cache('gemini', passo.tipo, passo.payload) if passo.cacheavel else None
+        response = None
+        try:
+            result = self.result_cache.obter('gemini', chave) if chave else None
+            if result is None:
+                response = _post_gemini(passo.tipo, self.url_gemini, passo.payload, timeout=passo.timeout)
+                log.debug("Gemini (%s): HTTP %s", passo.tipo, response.status_code)
+                response.raise_for_status()
+                result = response.json()
+                if chave:
+                    self.result_cache.guardar('gemini', chave, result)
+            return passo.interpretar(result)
         except Exception as e:
-            print(f"[Engine] AVISO: Não foi possível carregar o ficheiro de géneros do Spotify. Erro: {e}")
+            return passo.falhou(e, response.text if response is not None else None)
+
+    def chave_cache(self, espaco, *partes):
+        """Chave na cache de resultados, ou None se não houver cache (ou estiver desativada)."""
+        if self.result_cache is None or not self.result_cache.ativa:
+            return None
+        return chave_de(espaco, *partes)
 
     def analisar_imagem_e_obter_tags(self, filepath):
-        """Usa a Vision API para contexto e o Gemini para emoção/título."""
-        print(f"[Engine] ===== INÍCIO DA ANÁLISE DE IMAGEM =====")
-        print(f"[Engine] Caminho do arquivo: {filepath}")
-        print(f"[Engine] Arquivo existe: {os.path.exists(filepath) if filepath else False}")
-        
-        if not self.vision_client:
-            print("[Engine] ❌ ERRO: Cliente Google Vision não inicializado.")
-            return None, None
-        
+        """Versão a partir de um ficheiro em disco (scripts); o servidor usa analisar_imagem_bytes."""
+        log.debug("Caminho do arquivo: %s", filepath)
         try:
-            print("[Engine] Abrindo arquivo de imagem...")
             with open(filepath, 'rb') as f:
                 content = f.read()
-            print(f"[Engine] ✓ Arquivo lido com sucesso. Tamanho: {len(content)} bytes")
-            
-            tags_coletadas = set()
-            
-            print("[Engine] --- ETAPA 1: Análise com Vision API ---")
-            try:
-                response_web = self.vision_client.web_detection(image=vision.Image(content=content))
-                if response_web.web_detection.web_entities:
-                    print(f"[Engine] ✓ Vision API encontrou {len(response_web.web_detection.web_entities)} entidades")
-                    for entity in response_web.web_detection.web_entities[:5]:
-                        tags_coletadas.add(entity.description.lower())
-                        print(f"[Engine]   - Tag Vision: {entity.description}")
-                else:
-                    print("[Engine] ⚠ Vision API não retornou entidades")
-            except Exception as e:
-                print(f"[Engine] ❌ ERRO na Vision API: {e}")
-                import traceback
-                traceback.print_exc()
-            
-            print("[Engine] --- ETAPA 2: Análise de emoção com Gemini ---")
-            emotional_tags, playlist_title = self._analisar_emocao_e_titulo_com_ia(content)
-            if emotional_tags:
-                print(f"[Engine] ✓ Gemini retornou {len(emotional_tags)} tags de emoção")
-                tags_coletadas.update(emotional_tags)
-            else:
-                print("[Engine] ⚠ Gemini não retornou tags de emoção")
-
-            if not tags_coletadas:
-                print("[Engine] ❌ ERRO: Nenhuma tag coletada de nenhuma fonte!")
+        except OSError as e:
+            log.error("Não foi possível ler o arquivo: %s", e)
+            return None, None
+        return self.analisar_imagem_bytes(content)
+
+    @metrics.medido('analise_imagem')
+    def analisar_imagem_bytes(self, content, mime_type='image/jpeg'):
+        """Usa a Vision API para contexto e o Gemini para emoção/título, a partir dos bytes da imagem."""
+        log.debug("Análise de imagem: %d bytes (%s)", len(content), mime_type)
+        chave = self.chave_imagem(content, mime_type)
+        guardado = self.result_cache.obter('imagem', chave) if chave else None
+        if guardado is not None:
+            log.debug("Análise de imagem reutilizada da cache")
+            return tuple(guardado)
+        tags, playlist_title = self._analisar_imagem(content, mime_type)
+        if chave and tags:
+            self.result_cache.guardar('imagem', chave, [tags, playlist_title])
+        return tags, playlist_title
+
+    def chave_imagem(self, content, mime_type):
+        # A mesma imagem (por conteúdo) dá a mesma análise
+        return self.chave_cache('imagem', hashlib.sha256(content).hexdigest(), mime_type)
+
+    def _analisar_imagem(self, content, mime_type):
+        try:
+            tags_vision = self.tags_vision(content)
+            if tags_vision is None:
                 return None, None
-                
-            final_tags = list(tags_coletadas)
-            print(f"[Engine] ✓ Tags Finais Combinadas ({len(final_tags)} tags): {final_tags}")
-            print(f"[Engine] ✓ Título da playlist: {playlist_title}")
-            print(f"[Engine] ===== FIM DA ANÁLISE DE IMAGEM =====")
-            return final_tags, playlist_title
-
-        except FileNotFoundError as e:
-            print(f"[Engine] ❌ ERRO: Arquivo não encontrado: {e}")
+            emotional_tags, playlist_title = self._analisar_emocao_e_titulo_com_ia(content, mime_type)
+            return self.juntar_tags(tags_vision, emotional_tags, playlist_title)
+        except Exception as e:
+            log.error("Erro ao analisar imagem: %s", e, exc_info=True)
             return None, None
+
+    def tags_vision(self, content):
+        """Tags das entidades da Vision API (conjunto vazio se a chamada falhar; None sem cliente Vision)."""
+        if not self.vision_client:
+            log.error("Cliente Google Vision não inicializado.")
+            return None
+        tags_coletadas = set()
+        try:
+            vision = importar('google.cloud.vision')
+            with metrics.medir_estagio('vision'):
+                response_web = self.vision_client.web_detection(image=vision.Image(content=content))
+            metrics.registar_pedido_externo('vision', 200)
+            if response_web.web_detection.web_entities:
+                log.debug("Vision API encontrou %d entidades", len(response_web.web_detection.web_entities))
+                for entity in response_web.web_detection.web_entities[:5]:
+                    tags_coletadas.add(entity.description.lower())
+                    log.debug("Tag Vision: %s", entity.description)
+            else:
+                log.warning("Vision API não retornou entidades")
         except Exception as e:
-            print(f"[Engine] ❌ ERRO ao analisar imagem: {e}")
-            import traceback
-            traceback.print_exc()
+            # Exceções da google.api_core trazem o código HTTP em `code` (429 = quota)
+            codigo = getattr(e, 'code', None)
+            metrics.registar_pedido_externo('vision', codigo if isinstance(codigo, int) else None)
+            log.error("Erro na Vision API: %s", e, exc_info=True)
+        return tags_coletadas
+
+    def juntar_tags(self, tags_vision, emotional_tags, playlist_title):
+        """Junta as tags da Vision e do Gemini; (None, None) se nenhuma fonte deu tags."""
+        tags_coletadas = set(tags_vision)
+        if emotional_tags:
+            log.debug("Gemini retornou %d tags de emoção", len(emotional_tags))
+            tags_coletadas.update(emotional_tags)
+        else:
+            log.warning("Gemini não retornou tags de emoção")
+
+        if not tags_coletadas:
+            log.error("Nenhuma tag recolhida de nenhuma fonte")
             return None, None
 
-    def _analisar_emocao_e_titulo_com_ia(self, image_content):
+        final_tags = list(tags_coletadas)
+        log.info("Análise de imagem: %d tags %s, título %r", len(final_tags), final_tags, playlist_title)
+        return final_tags, playlist_title
+
+    def _analisar_emocao_e_titulo_com_ia(self, image_content, mime_type='image/jpeg'):
         """Usa o Gemini (multimodal) para obter tags de emoção e um título para a playlist."""
-        print(f"[Engine] [Gemini] Verificando chave API...")
+        return self.executar_passo(self.passo_emocao_e_titulo(image_content, mime_type))
+
+    def passo_emocao_e_titulo(self, image_content, mime_type='image/jpeg'):
+        omissao = ([], "Playlist Sugerida")
         if not self.gemini_api_key:
-            print("[Engine] [Gemini] ❌ ERRO: GEMINI_API_KEY não configurada!")
-            return [], "Playlist Sugerida"
-        print(f"[Engine] [Gemini] ✓ Chave API presente (primeiros 10 chars: {self.gemini_api_key[:10]}...)")
-        
-        print(f"[Engine] [Gemini] Codificando imagem em base64...")
+            log.error("GEMINI_API_KEY não configurada")
+            return PassoGemini('emocao_titulo', None, omissao=omissao)
+
         image_base64 = base64.b64encode(image_content).decode('utf-8')
-        print(f"[Engine] [Gemini] ✓ Imagem codificada. Tamanho base64: {len(image_base64)} chars")
-        
+        log.debug("Imagem codificada em base64: %d caracteres", len(image_base64))
+
         prompt = ("Analyze this image and return JSON: "
                   "{\"playlist_title\": \"Creative Title (3-5 words)\", "
                   "\"mood_tags\": [\"tag1\", \"tag2\", \"tag3\", \"tag4\", \"tag5\"]} "
                   "Focus on atmosphere and emotion.")
-        
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={self.gemini_api_key}"
-        payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": "image/jpeg", "data": image_base64}}]}]}
-        
-        print(f"[Engine] [Gemini] Enviando requisição para API...")
-        try:
-            response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=20)
-            print(f"[Engine] [Gemini] Status HTTP: {response.status_code}")
-            response.raise_for_status()
-            result = response.json()
-            
-            if result.get('candidates'):
-                print(f"[Engine] [Gemini] ✓ Resposta recebida com {len(result.get('candidates', []))} candidatos")
-                json_string = result['candidates'][0]['content']['parts'][0]['text'].replace('```json', '').replace('```', '').strip()
-                print(f"[Engine] [Gemini] JSON extraído: {json_string[:200]}...")
-                data = json.loads(json_string)
-                emotional_tags = data.get("mood_tags", [])
-                playlist_title = data.get("playlist_title", "Playlist Sugerida")
-                print(f"[Engine] [Gemini] ✓ Título: {playlist_title}")
-                print(f"[Engine] [Gemini] ✓ Tags: {emotional_tags}")
-                return emotional_tags, playlist_title
-            else:
-                print(f"[Engine] [Gemini] ⚠ Resposta sem candidatos. Resultado: {result}")
-                return [], "Playlist Sugerida"
-        except requests.exceptions.HTTPError as e:
-            print(f"[Engine] [Gemini] ❌ ERRO HTTP: {e}")
-            print(f"[Engine] [Gemini] Resposta: {response.text if 'response' in locals() else 'N/A'}")
-            return [], "Playlist Sugerida"
-        except json.JSONDecodeError as e:
-            print(f"[Engine] [Gemini] ❌ ERRO ao decodificar JSON: {e}")
-            print(f"[Engine] [Gemini] Texto recebido: {result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', 'N/A')[:500]}")
-            return [], "Playlist Sugerida"
-        except Exception as e:
-            print(f"[Engine] [Gemini] ❌ ERRO inesperado: {e}")
-            import traceback
-            traceback.print_exc()
-            return [], "Playlist Sugerida"
+        payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": mime_type, "data": image_base64}}]}]}
+
+        def interpretar(result):
+            texto = _texto_candidato(result)
+            if texto is None:
+                log.warning("Gemini: resposta sem candidatos: %.500s", result)
+                return omissao
+            log.debug("Gemini: JSON extraído: %.200s", texto)
+            data = _json_candidato(texto)
+            emotional_tags = data.get("mood_tags", [])
+            playlist_title = data.get("playlist_title", "Playlist Sugerida")
+            log.debug("Gemini: título %r, tags %s", playlist_title, emotional_tags)
+            return emotional_tags, playlist_title
+
+        return PassoGemini('emocao_titulo', payload, 20, interpretar, omissao)
 
    
     def _gerar_consultas_youtube_com_gemini(self, tags, limit=7):
@@ -179,50 +393,47 @@ class RecommendationEngine:
         api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={self.gemini_api_key}"
         payload = {"contents": [{"parts": [{"text": prompt}]}]}
         try:
-            response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=15)
+            response = _post_gemini('consultas_youtube', api_url, payload, timeout=15)
             response.raise_for_status()
             result = response.json()
             if result.get('candidates'):
                 text_response = result['candidates'][0]['content']['parts'][0]['text']
                 queries = [q.strip() for q in text_response.split(',') if q.strip()]
-                print(f"[Engine] Consultas de música geradas para o YouTube: {queries}")
+                log.debug("Consultas de música geradas para o YouTube: %s", queries)
                 return queries
             return []
         except Exception as e:
-            print(f"[Engine] Erro ao gerar consultas para o YouTube: {e}"); return []
+            log.error("Erro ao gerar consultas para o YouTube: %s", e); return []
 
     
     
 
     def _gerar_sementes_spotify_com_gemini(self, tags):
         """Usa o Gemini para gerar sementes ricas (géneros, características) para o Spotify."""
-        if not self.gemini_api_key: return {}
+        return self.executar_passo(self.passo_sementes_spotify(tags))
+
+    def passo_sementes_spotify(self, tags):
+        if not self.gemini_api_key: return PassoGemini('sementes_spotify', None, omissao={})
         prompt = (f"You are a Spotify playlist expert. Based on these tags: {tags}, create a JSON object with seeds for Spotify's recommendation API. "
                   "Include 'seed_genres' (a list of 1-2 valid genres from Spotify's official list) "
                   "and optional target audio features like 'target_energy' (0.0-1.0), 'target_danceability' (0.0-1.0), or 'target_valence' (a measure of positivity, 0.0-1.0). "
                   "Example for tags ['party', 'night', 'happy']: {\"seed_genres\": [\"dance\", \"pop\"], \"target_energy\": 0.8, \"target_danceability\": 0.9}\n"
                   "Example for tags ['rain', 'sad', 'lo-fi']: {\"seed_genres\": [\"ambient\", \"sad\"], \"target_energy\": 0.2, \"target_acousticness\": 0.8}")
-        
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={self.gemini_api_key}"
         payload = {"contents": [{"parts": [{"text": prompt}]}]}
-        try:
-            response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=15)
-            response.raise_for_status()
-            result = response.json()
-            if result.get('candidates'):
-                json_string = result['candidates'][0]['content']['parts'][0]['text'].replace('```json', '').replace('```', '').strip()
-                seeds = json.loads(json_string)
-                
-                # Validação dos géneros retornados pela IA
-                if 'seed_genres' in seeds and self.available_spotify_genres:
-                    seeds['seed_genres'] = [g for g in seeds['seed_genres'] if g in self.available_spotify_genres]
-                    if not seeds['seed_genres']: del seeds['seed_genres']
-                
-                print(f"[Engine] Sementes geradas para o Spotify: {seeds}")
-                return seeds
-            return {}
-        except Exception as e:
-            print(f"[Engine] Erro ao gerar sementes para o Spotify: {e}"); return {}
+
+        def interpretar(result):
+            texto = _texto_candidato(result)
+            if texto is None:
+                return {}
+            seeds = _json_candidato(texto)
+            # Validação dos géneros retornados pela IA
+            if 'seed_genres' in seeds and self.available_spotify_genres:
+                seeds['seed_genres'] = [g for g in seeds['seed_genres'] if g in self.available_spotify_genres]
+                if not seeds['seed_genres']: del seeds['seed_genres']
+            log.debug("Sementes geradas para o Spotify: %s", seeds)
+            return seeds
+
+        return PassoGemini('sementes_spotify', payload, 15, interpretar, {}, cacheavel=True)
 
     def _construir_query_anime(self, tags):
         if not tags:
@@ -272,132 +483,209 @@ class RecommendationEngine:
 
     def recomendar_musicas_por_tags(self, tags, market='BR', limit=25, is_redo=False):
         """Orquestra a recomendação com base no serviço de música ativo."""
-        print(f"[Engine] ===== INÍCIO DA RECOMENDAÇÃO DE MÚSICAS =====")
-        print(f"[Engine] Tags recebidas: {tags}")
-        print(f"[Engine] Limite: {limit}, Market: {market}, is_redo: {is_redo}")
+        log.debug("Recomendação: tags=%s limite=%s market=%s is_redo=%s", tags, limit, market, is_redo)
         
         if not self.music_service:
-            print("[Engine] ❌ ERRO: Serviço de música não inicializado!")
+            log.error("Serviço de música não inicializado")
             return None
         
         service_type = type(self.music_service).__name__
-        print(f"[Engine] Tipo de serviço: {service_type}")
+        log.debug("Tipo de serviço: %s", service_type)
         
         if not tags:
-            print("[Engine] ❌ ERRO: Nenhuma tag fornecida!")
+            log.error("Nenhuma tag fornecida")
             return []
 
         tracks = []
         # LÓGICA PARA O SPOTIFY
         if isinstance(self.music_service, SpotifyService):
-            print("[Engine] --- Usando estratégia do Spotify ---")
-            query_musical = self._gerar_prompt_musical_spotify(tags, is_redo)
-            print(f"[Engine] Prompt gerado: {query_musical}")
-            tracks = self.music_service.search_tracks(query=query_musical, limit=limit, market=market)
+            resultado = self._recomendar_spotify(tags, market, limit, is_redo)
+            log.info("Recomendação (Spotify): %d faixas", len(resultado))
+            return resultado
         
         # LÓGICA PARA O YOUTUBE - Agora funciona igual ao Spotify
         elif isinstance(self.music_service, YouTubeMusicService):
-            print("[Engine] --- Usando estratégia do YouTube ---")
             query_musical = self._gerar_prompt_musical_youtube(tags, is_redo)
-            print(f"[Engine] Prompt gerado para YouTube: {query_musical}")
+            log.debug("Prompt gerado para YouTube: %s", query_musical)
             if not query_musical:
-                print("[Engine] ❌ ERRO: Prompt vazio para YouTube!")
+                log.error("Prompt vazio para YouTube")
                 return []
             
-            print(f"[Engine] Chamando search_tracks do YouTube...")
             tracks = self.music_service.search_tracks(query=query_musical, limit=limit, market=market)
-            print(f"[Engine] ✓ search_tracks retornou: {len(tracks) if tracks else 0} faixas (tipo: {type(tracks)})")
+            log.debug("search_tracks do YouTube devolveu %d faixas", len(tracks) if tracks else 0)
             
             if not tracks or len(tracks) == 0:
-                print("[Engine] ⚠ AVISO: Nenhuma faixa retornada do YouTube!")
-                print("[Engine] Tentando busca alternativa com tags diretas...")
+                log.warning("Nenhuma faixa devolvida pelo YouTube; a tentar busca alternativa com as tags")
                 fallback_query = " ".join(tags[:3]) + " music"
-                print(f"[Engine] Busca alternativa: {fallback_query}")
+                log.debug("Busca alternativa: %s", fallback_query)
                 tracks = self.music_service.search_tracks(query=fallback_query, limit=limit, market=market)
-                print(f"[Engine] Resultado da busca alternativa: {len(tracks) if tracks else 0} faixas")
+                log.debug("Resultado da busca alternativa: %d faixas", len(tracks) if tracks else 0)
             
             if tracks:
-                print(f"[Engine] Primeira faixa exemplo: {tracks[0] if tracks else 'N/A'}")
+                log.debug("Primeira faixa: %s", tracks[0])
         else:
-            print(f"[Engine] ❌ ERRO: Tipo de serviço desconhecido: {service_type}")
+            log.error("Tipo de serviço desconhecido: %s", service_type)
 
         if tracks is None:
-            print("[Engine] ❌ ERRO: tracks é None!")
+            log.error("tracks é None")
             return None
         
-        print(f"[Engine] Processando {len(tracks)} faixas...")
+        log.debug("A processar %d faixas...", len(tracks))
         resultado = self._processar_faixas_api(tracks, limit)
-        print(f"[Engine] ✓ Processamento concluído. Resultado final: {len(resultado) if resultado else 0} faixas")
-        if resultado:
-            print(f"[Engine] ===== AMOSTRA DO RESULTADO (primeiras 2 faixas) =====")
-            print(json.dumps(resultado[:2], indent=2, ensure_ascii=False))
-            print(f"[Engine] =======================================================")
-        print(f"[Engine] ===== FIM DA RECOMENDAÇÃO DE MÚSICAS =====")
+        log.info("Recomendação (YouTube): %d faixas", len(resultado) if resultado else 0)
+        if resultado and log.isEnabledFor(logging.DEBUG):
+            log.debug("Amostra do resultado: %s", json.dumps(resultado[:2], ensure_ascii=False))
         return resultado
     
 
+    # Audio features usadas no re-ranking (todas no intervalo 0.0-1.0)
+    _FEATURES_ALVO = ('energy', 'valence', 'danceability', 'acousticness', 'instrumentalness', 'speechiness', 'liveness')
+    # Quantos candidatos recolher por faixa final antes do re-ranking
+    _FATOR_AMOSTRAGEM = 2
+
+    def _recomendar_spotify(self, tags, market, limit, is_redo):
+        """
+        Combina a busca textual (prompt do Gemini) com recomendações por sementes
+        (géneros + alvos de energy/valence/danceability) e re-ordena os candidatos
+        pela distância das suas audio features aos alvos.
+        """
+        # As duas chamadas ao Gemini são independentes: correm em paralelo
+        futuro_sementes = tracing.submeter(_io_executor, self._gerar_sementes_spotify_com_gemini, tags)
+        query_musical = self._gerar_prompt_musical_spotify(tags, is_redo)
+        log.debug("Prompt gerado: %s", query_musical)
+        try:
+            seeds = futuro_sementes.result() or {}
+        except Exception as e:
+            log.error("Erro ao obter sementes para o Spotify: %s", e); seeds = {}
+
+        alvos = self.alvos_de_sementes(seeds)
+
+        # Recomendações por sementes correm em paralelo com a busca textual
+        seed_genres = seeds.get('seed_genres') or []
+        alvo_candidatos = limit * self._FATOR_AMOSTRAGEM if alvos else limit
+        futuro_recs = None
+        if seed_genres:
+            futuro_recs = tracing.submeter(
+                _io_executor, self.music_service.get_recommendations, seed_genres, alvos, alvo_candidatos, market)
+
+        # Páginas de busca pedidas em paralelo e filtradas à medida que chegam,
+        # para encher o limite mesmo depois de remover instrumentais/duplicados.
+        filtro_busca = ProcessadorFaixas(self._chave_dedup, alvo_candidatos)
+        da_busca = self.music_service.search_tracks_paginated(
+            query=query_musical, limit=alvo_candidatos, market=market, aceitar=filtro_busca.adicionar)
+
+        das_sementes = []
+        if futuro_recs is not None:
+            try:
+                das_sementes = futuro_recs.result() or []
+            except Exception as e:
+                log.error("Erro nas recomendações por sementes: %s", e)
+            log.debug("Recomendações por sementes %s: %d faixas", seed_genres, len(das_sementes))
+
+        candidatos = self.intercalar(da_busca, das_sementes, alvo_candidatos)
+        if alvos and candidatos:
+            candidatos = self._reordenar_por_features(candidatos, alvos)
+        return candidatos[:limit]
+
+    def alvos_de_sementes(self, seeds):
+        """Alvos de audio features (0.0-1.0) pedidos nas sementes do Gemini, ex.: {'energy': 0.8}."""
+        alvos = {}
+        for feature in self._FEATURES_ALVO:
+            valor = seeds.get(f"target_{feature}")
+            try:
+                if valor is not None:
+                    alvos[feature] = min(1.0, max(0.0, float(valor)))
+            except (TypeError, ValueError):
+                continue
+        return alvos
+
+    def intercalar(self, da_busca, das_sementes, limite):
+        """Intercala as faixas da busca e das recomendações por sementes, com deduplicação entre elas."""
+        processador = ProcessadorFaixas(self._chave_dedup, limite)
+        for i in range(max(len(da_busca), len(das_sementes))):
+            if processador.completo:
+                break
+            if i < len(da_busca):
+                processador.adicionar(da_busca[i])
+            if i < len(das_sementes):
+                processador.adicionar(das_sementes[i])
+        return processador.musicas
+
+    def _reordenar_por_features(self, musicas, alvos):
+        """Ordena as músicas pela distância euclidiana das audio features aos alvos (estável)."""
+        features = self.music_service.get_audio_features([m['spotify_id'] for m in musicas])
+        return self.ordenar_por_features(musicas, alvos, features)
+
+    @staticmethod
+    def ordenar_por_features(musicas, alvos, features):
+        def distancia(musica):
+            f = features.get(musica['spotify_id'])
+            if not f:
+                # Sem análise: fica depois das faixas com features, mantendo a ordem original
+                return float('inf')
+            return sum((float(f.get(k) or 0.0) - v) ** 2 for k, v in alvos.items()) ** 0.5
+
+        return sorted(musicas, key=distancia)
+
     def _gerar_prompt_musical_spotify(self, tags, is_redo=False):
         """Gera um prompt de busca criativo para o Spotify."""
+        return self.executar_passo(self.passo_prompt_spotify(tags, is_redo))
+
+    def passo_prompt_spotify(self, tags, is_redo=False):
         anime_query = self._construir_query_anime(tags)
         if anime_query and not is_redo:
-            print(f"[Engine] [Prompt Spotify] Contexto de anime detectado, usando query direta: {anime_query}")
-            return anime_query
-        if not self.gemini_api_key: return " ".join(tags[:3])
+            log.debug("Contexto de anime detectado, query direta para o Spotify: %s", anime_query)
+            return PassoGemini('prompt_spotify', None, omissao=anime_query)
+        omissao = " ".join(tags[:3])
+        if not self.gemini_api_key: return PassoGemini('prompt_spotify', None, omissao=omissao)
         redo_instruction = "Give me a COMPLETELY DIFFERENT and UNEXPECTED music prompt for these tags. Think outside the box." if is_redo else ""
         prompt = (f"Given these tags describing an image: {tags}. "
                 f"{redo_instruction} "
                 "Generate a short, creative prompt for a music playlist. "
                 "Examples: 'upbeat indie pop for a sunny beach day', 'lo-fi chill beats for a rainy city night'")
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={self.gemini_api_key}"
         payload = {"contents": [{"parts": [{"text": prompt}]}]}
-        try:
-            response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=15)
-            response.raise_for_status()
-            result = response.json()
-            if result.get('candidates'): return result['candidates'][0]['content']['parts'][0]['text'].strip()
-            return " ".join(tags[:3])
-        except Exception as e:
-            print(f"[Engine] Erro ao gerar prompt para o Spotify: {e}"); return " ".join(tags[:3])
-    
+
+        def interpretar(result):
+            texto = _texto_candidato(result)
+            return texto.strip() if texto is not None else omissao
+
+        # Um redo pede de propósito uma sugestão diferente: não é reutilizado
+        return PassoGemini('prompt_spotify', payload, 15, interpretar, omissao, cacheavel=not is_redo)
+
     def _gerar_prompt_musical_youtube(self, tags, is_redo=False):
         """Gera um prompt de busca criativo para o YouTube (igual ao Spotify)."""
-        print(f"[Engine] [Prompt YouTube] Gerando prompt para tags: {tags}")
+        return self.executar_passo(self.passo_prompt_youtube(tags, is_redo))
+
+    def passo_prompt_youtube(self, tags, is_redo=False):
+        log.debug("A gerar prompt do YouTube para as tags: %s", tags)
         anime_query = self._construir_query_anime(tags)
         if anime_query and not is_redo:
-            print(f"[Engine] [Prompt YouTube] Contexto de anime detectado, usando query direta: {anime_query}")
-            return anime_query
+            log.debug("Contexto de anime detectado, query direta para o YouTube: %s", anime_query)
+            return PassoGemini('prompt_youtube', None, omissao=anime_query)
+        omissao = " ".join(tags[:3]) + " music"
         if not self.gemini_api_key:
-            print("[Engine] [Prompt YouTube] ⚠ GEMINI_API_KEY não disponível, usando tags diretas")
-            return " ".join(tags[:3]) + " music"
-        
+            log.warning("GEMINI_API_KEY não disponível, a usar as tags diretamente")
+            return PassoGemini('prompt_youtube', None, omissao=omissao)
+
         redo_instruction = "Give me a COMPLETELY DIFFERENT and UNEXPECTED music prompt for these tags. Think outside the box." if is_redo else ""
         prompt = (f"Given these tags describing an image: {tags}. "
                 f"{redo_instruction} "
                 "Generate a short, creative prompt for a music playlist search on YouTube. "
                 "Examples: 'upbeat indie pop for a sunny beach day', 'lo-fi chill beats for a rainy city night', 'tropical house music beach vibes'")
-        api_url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={self.gemini_api_key}"
         payload = {"contents": [{"parts": [{"text": prompt}]}]}
-        
-        print(f"[Engine] [Prompt YouTube] Enviando requisição ao Gemini...")
-        try:
-            response = requests.post(api_url, json=payload, headers={'Content-Type': 'application/json'}, timeout=15)
-            print(f"[Engine] [Prompt YouTube] Status HTTP: {response.status_code}")
-            response.raise_for_status()
-            result = response.json()
-            if result.get('candidates'): 
-                prompt_text = result['candidates'][0]['content']['parts'][0]['text'].strip()
-                print(f"[Engine] [Prompt YouTube] ✓ Prompt recebido: {prompt_text}")
-                if "music" not in prompt_text.lower():
-                    prompt_text += " music"
-                    print(f"[Engine] [Prompt YouTube] Adicionado 'music' ao prompt")
-                return prompt_text
-            print("[Engine] [Prompt YouTube] ⚠ Sem candidatos, usando fallback")
-            return " ".join(tags[:3]) + " music"
-        except Exception as e:
-            print(f"[Engine] [Prompt YouTube] ❌ ERRO: {e}")
-            import traceback
-            traceback.print_exc()
-            return " ".join(tags[:3]) + " music"
+
+        def interpretar(result):
+            prompt_text = _texto_candidato(result)
+            if prompt_text is None:
+                log.warning("Gemini sem candidatos para o prompt do YouTube, a usar as tags")
+                return omissao
+            prompt_text = prompt_text.strip()
+            log.debug("Prompt do YouTube recebido: %s", prompt_text)
+            if "music" not in prompt_text.lower():
+                prompt_text += " music"
+            return prompt_text
+
+        return PassoGemini('prompt_youtube', payload, 15, interpretar, omissao, cacheavel=not is_redo)
 
     # Palavras que indicam que um segmento após " - " é uma versão/variação da música
     _PALAVRAS_VERSAO = {
@@ -435,126 +723,40 @@ class RecommendationEngine:
         a = self._FEAT_SPLIT.split((artista or '').lower().strip())[0].strip()
         return (t, a)
 
+    @metrics.medido('processar_faixas_api')
     def _processar_faixas_api(self, tracks, limit=25):
         """Processa faixas garantindo unicidade por ID e por (título base, artista principal)."""
-        musicas_processadas = []
-        ids_vistos = set()
-        chaves_vistas = set()
-        palavras_instrumentais = ['instrumental', 'karaoke', 'backing track', 'versão instrumental', 'versao instrumental']
-
-        def is_instrumental(nome, artista):
-            texto = f"{nome} {artista}".lower()
-            return any(p in texto for p in palavras_instrumentais)
-
+        processador = ProcessadorFaixas(self._chave_dedup, limit)
         for item in tracks:
-            if len(musicas_processadas) >= limit:
+            if processador.completo:
                 break
-            if not item:
-                continue
-
-            is_youtube_format = 'titulo' in item and 'artista' in item
-
-            if is_youtube_format:
-                track_id = item.get('spotify_id') or item.get('id')
-                if not track_id:
-                    continue
-                titulo = item.get('titulo', 'Sem título')
-                artista = item.get('artista', 'Desconhecido')
-
-                if is_instrumental(titulo, artista):
-                    continue
-                if track_id in ids_vistos:
-                    continue
-                chave = self._chave_dedup(titulo, artista)
-                if chave in chaves_vistas:
-                    print(f"[Engine] Duplicata semantica ignorada: {titulo} - {artista}")
-                    continue
-
-                yt_duration = item.get('duration', '')
-                if not yt_duration:
-                    yt_dur_secs = item.get('duration_seconds') or item.get('duration_ms', 0) // 1000
-                    if yt_dur_secs:
-                        yt_duration = f"{yt_dur_secs // 60}:{yt_dur_secs % 60:02d}"
-                    else:
-                        yt_duration = "3:45"
-                track_final = {
-                    'titulo': titulo,
-                    'artista': artista,
-                    'artista_id': item.get('artista_id', ''),
-                    'preview_url': item.get('preview_url', f"https://www.youtube.com/watch?v={track_id}"),
-                    'spotify_id': track_id,
-                    'album_cover_url': item.get('album_cover_url', ''),
-                    'service_name': 'youtube',
-                    'id': track_id,
-                    'duration': yt_duration
-                }
-                musicas_processadas.append(track_final)
-                ids_vistos.add(track_id)
-                chaves_vistas.add(chave)
-
-            else:
-                # Unwrap playlist-style items: {added_at, track: {...}}
-                track_data = item.get('track') if isinstance(item.get('track'), dict) else item
-                if not track_data.get('artists') or not track_data.get('id'):
-                    continue
-                spotify_id = track_data.get('id')
-                artists_data = track_data.get('artists', [])
-                titulo = track_data.get('name', '')
-                artista = artists_data[0].get('name', 'N/A') if artists_data else 'N/A'
-
-                if is_instrumental(titulo, artista):
-                    continue
-                if spotify_id in ids_vistos:
-                    continue
-                chave = self._chave_dedup(titulo, artista)
-                if chave in chaves_vistas:
-                    print(f"[Engine] Duplicata semantica ignorada: {titulo} - {artista}")
-                    continue
-
-                album_images = track_data.get('album', {}).get('images', [])
-                duration_ms = track_data.get('duration_ms', 0)
-                if duration_ms:
-                    minutos = duration_ms // 60000
-                    segundos = (duration_ms % 60000) // 1000
-                    duration_str = f"{minutos}:{segundos:02d}"
-                else:
-                    duration_str = "00:00"
-                musica = {
-                    'titulo': titulo,
-                    'artista': artista,
-                    'artista_id': artists_data[0].get('id') if artists_data else None,
-                    'preview_url': track_data.get('preview_url'),
-                    'spotify_id': spotify_id,
-                    'album_cover_url': album_images[0]['url'] if album_images else None,
-                    'service_name': 'spotify',
-                    'duration': duration_str
-                }
-                musicas_processadas.append(musica)
-                ids_vistos.add(spotify_id)
-                chaves_vistas.add(chave)
-
-        return musicas_processadas
+            processador.adicionar(item)
+        return processador.musicas
 
 
 
     def registrar_feedback_engine(self, musica_info, rating_value, internal_user_id):
         if not internal_user_id: return False
-        cursor = self.conn.cursor()
         try:
             # A query já usa 'usuario_id', que é o nosso ID interno
-            cursor.execute("INSERT INTO historico_reproducao (usuario_id, musica_id, artista_id, rating) VALUES (?, ?, ?, ?)",
-                           (internal_user_id, musica_info.get('spotify_id'), musica_info.get('artista_id'), rating_value))
-            self.conn.commit(); return True
+            with self.db.transacao() as cursor:
+                cursor.execute("INSERT INTO historico_reproducao (usuario_id, musica_id, artista_id, rating) VALUES (?, ?, ?, ?)",
+                               (internal_user_id, musica_info.get('spotify_id'), musica_info.get('artista_id'), rating_value))
+            return True
         except Exception as e:
-            print(f"[Engine] Erro ao registar feedback no BD: {e}"); return False
+            log.error("Erro ao registar feedback no BD: %s", e); return False
 
     # --- CORREÇÃO AQUI: Renomeado o parâmetro para clareza ---
     def registrar_feedback_playlist_engine(self, lista_de_musicas, rating_value, internal_user_id):
         if not internal_user_id: return False
-        sucessos = 0
-        for musica in lista_de_musicas:
-            if self.registrar_feedback_engine(musica, rating_value, internal_user_id):
-                sucessos += 1
-        print(f"[Engine] Feedback em lote registado para {sucessos} de {len(lista_de_musicas)} músicas.")
-        return sucessos > 0
-
+        # Uma única transação para a playlist inteira (em vez de um commit por música)
+        linhas = [(internal_user_id, musica.get('spotify_id'), musica.get('artista_id'), rating_value)
+                  for musica in lista_de_musicas]
+        try:
+            with self.db.transacao() as cursor:
+                cursor.executemany("INSERT INTO historico_reproducao (usuario_id, musica_id, artista_id, rating) VALUES (?, ?, ?, ?)",
+                                   linhas)
+        except Exception as e:
+            log.error("Erro ao registar feedback em lote no BD: %s", e); return False
+        log.debug("Feedback em lote registado para %d de %d músicas.", len(linhas), len(lista_de_musicas))
+        return len(linhas) > 0
@@ -0,0 +1,107 @@
+# Nome do ficheiro: app/result_cache.py
+"""
+Cache de resultados partilhada entre processos (workers do gunicorn, instâncias ASGI).
+
+Guarda, com prazo de validade, resultados caros de obter e que se repetem entre
+utilizadores: respostas do Gemini aos prompts (sementes, query de busca), páginas
+de busca do Spotify/YouTube e análises de imagem (por hash do conteúdo).
+
+- camada partilhada: tabela cache_resultados na base de dados SQLite da aplicação
+  (WAL), criada pelas migrações; o que um worker calcula serve a todos;
+- à frente, um LRU em memória por processo, com o mesmo prazo;
+- os valores são JSON: cada leitura devolve uma cópia que o chamador pode alterar.
+
+CACHE_RESULTADOS_TTL (s) define o prazo; 0 desativa a cache.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import logs
+from . import metrics
+
+log = logs.obter('result_cache')
+
+CACHE_RESULTADOS_TTL = float(os.environ.get('CACHE_RESULTADOS_TTL', '3600'))
+CACHE_RESULTADOS_MEMORIA = int(os.environ.get('CACHE_RESULTADOS_MEMORIA', '2000'))
+# Remove as entradas expiradas da tabela a cada N gravações deste processo
+LIMPEZA_CADA = 500
+
+
+def chave_de(*partes):
+    """Chave estável (sha256) de valores serializáveis em JSON, ex.: chave_de(tipo, payload)."""
+    serializado = json.dumps(partes, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Cache persistente (SQLite, partilhada) + LRU em memória, com prazo por entrada."""
+
+    def __init__(self, db, ttl=None, memory_size=None):
+        self.db = db
+        self.ttl = CACHE_RESULTADOS_TTL if ttl is None else ttl
+        self.memory_size = CACHE_RESULTADOS_MEMORIA if memory_size is None else memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._gravacoes = 0
+
+    @property
+    def ativa(self):
+        return self.ttl > 0
+
+    def _lembrar(self, chave, texto, expira):
+        self._memory[chave] = (texto, expira)
+        self._memory.move_to_end(chave)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def obter(self, espaco, chave):
+        """Valor guardado para (espaco, chave), ou None se não existir ou tiver expirado."""
+        if not self.ativa:
+            return None
+        agora = time.time()
+        with self._lock:
+            entrada = self._memory.get((espaco, chave))
+            if entrada is not None:
+                if entrada[1] > agora:
+                    self._memory.move_to_end((espaco, chave))
+                    metrics.registar_cache(f'resultados_{espaco}', acertos=1)
+                    return json.loads(entrada[0])
+                del self._memory[(espaco, chave)]
+        try:
+            with self.db.conexao() as conn:
+                row = conn.execute("SELECT valor, expira FROM cache_resultados WHERE espaco = ? AND chave = ? AND expira > ?",
+                                   (espaco, chave, agora)).fetchone()
+        except Exception as e:
+            log.error("Erro ao ler a cache (%s): %s", espaco, e)
+            row = None
+        if row is None:
+            metrics.registar_cache(f'resultados_{espaco}', falhas=1)
+            return None
+        with self._lock:
+            self._lembrar((espaco, chave), row[0], row[1])
+        metrics.registar_cache(f'resultados_{espaco}', acertos=1)
+        return json.loads(row[0])
+
+    def guardar(self, espaco, chave, valor, ttl=None):
+        """Guarda `valor` (serializável em JSON; None não é guardado) durante `ttl` segundos."""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or valor is None:
+            return
+        texto = json.dumps(valor, ensure_ascii=False)
+        expira = time.time() + ttl
+        with self._lock:
+            self._lembrar((espaco, chave), texto, expira)
+            self._gravacoes += 1
+            limpar = self._gravacoes % LIMPEZA_CADA == 0
+        try:
+            with self.db.transacao() as cursor:
+                cursor.execute("INSERT OR REPLACE INTO cache_resultados (espaco, chave, valor, expira) VALUES (?, ?, ?, ?)",
+                               (espaco, chave, texto, expira))
+                if limpar:
+                    cursor.execute("DELETE FROM cache_resultados WHERE expira <= ?", (time.time(),))
+        except Exception as e:
+            log.error("Erro ao gravar na cache (%s): %s", espaco, e)
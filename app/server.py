@@ -1,28 +1,40 @@
 # Nome do ficheiro: app/server.py
+import gc
 import os
 import sqlite3
-import uuid
 import sys
+import threading
+import time
 
 # Garante UTF-8 no stdout/stderr para suportar emojis nos logs (Windows usa cp1252 por padrão)
 if hasattr(sys.stdout, 'reconfigure'):
     sys.stdout.reconfigure(encoding='utf-8', errors='replace')
 if hasattr(sys.stderr, 'reconfigure'):
     sys.stderr.reconfigure(encoding='utf-8', errors='replace')
-from flask import Flask, request, jsonify, render_template, redirect, session, url_for
-from google.cloud import vision
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+from flask import Flask, request, jsonify, render_template, redirect, session, url_for, send_file, abort, g
 
 # Permite o uso de HTTP para o fluxo OAuth em ambiente local
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
-# Importações refatoradas
-from .spotify_auth_manager import SpotifyAuthManager
-from .youtube_auth_manager import YouTubeAuthManager
-from .recommendation_engine import RecommendationEngine
-from .services.spotify_service import SpotifyService
-from .services.youtube_service import YouTubeMusicService
+# Importações refatoradas. Só módulos leves aqui: Google, yt-dlp, spotipy e Pillow
+# são importados no primeiro uso do componente que precisa deles (ver app/lazy.py).
+from .lazy import ContextoLazy, Lazy, importar, marcar, relatorio as relatorio_arranque
+from .errors import SpotifyRateLimitError
+from .playlist_persistence import PlaylistPersistence, PlaylistInvalidaError, OutboxIndisponivelError
+from .jobs import JobQueue, ErroTransitorio, erro_http_transitorio, JOB_WORKERS
+from . import feed_cache
+from .cover_store import CoverStore, migrar_capas_inline
+from .uploads import UploadRequest, UploadRejeitadoError, ler_imagem, MAX_CONTENT_LENGTH
+from . import admission
+from . import cassette
+from . import logs
+from . import metrics
+from . import tracing
+from .admission import AdmissaoRecusadaError, admitir
+from .database import Database
+from .migrations import aplicar_migracoes
+from .result_cache import ResultCache
+from .session_store import ServerSessionInterface, SessionStore, criar_fernet, referencia as referencia_sessao
 from . import config_credentials as creds 
 
 # --- Configurações de Caminhos ---
@@ -36,11 +48,15 @@ IS_VERCEL = (
     os.path.exists('/var/task')
 )
 
+# Logs em fila (thread própria) exceto na Vercel, onde o processo congela depois de cada resposta
+logs.configurar(assincrono=not IS_VERCEL)
+log = logs.obter('server')
+
 # Na Vercel, usa /tmp para banco de dados (única área writeable)
 # Em ambiente local, usa o diretório data/
 if IS_VERCEL:
     DB_DIR = '/tmp'
-    print(f"Ambiente Vercel detectado. Usando /tmp para banco de dados.")
+    log.info("Ambiente Vercel detectado. Usando /tmp para banco de dados.")
 else:
     DB_DIR = os.path.join(ROOT_DIR, 'data')
     os.makedirs(DB_DIR, exist_ok=True)
@@ -54,248 +70,342 @@ template_dir = os.path.join(os.path.dirname(__file__), 'templates')
 static_dir = os.path.join(os.path.dirname(__file__), 'static')
 app = Flask(__name__, template_folder=template_dir, static_folder=static_dir)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY', os.urandom(24).hex())
-
-# Variável global para armazenar o contexto da aplicação (lazy loading)
-app_context = None
-conn = None
-
-def setup_application():
-    """Inicializa todos os serviços e gestores e retorna-os num único dicionário de contexto."""
-    global app_context, conn
-    
-    if app_context is not None:
-        return app_context
+# Uploads ficam em memória (ver app/uploads.py); pedidos maiores do que isto são recusados com 413
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+# Sessão no servidor (ver app/session_store.py): o cookie leva só um identificador opaco.
+# Desligada na Vercel, onde cada instância tem a sua base de dados em /tmp.
+SESSOES_SERVIDOR = os.environ.get('SESSOES_SERVIDOR', '0' if IS_VERCEL else '1') == '1'
+if SESSOES_SERVIDOR:
+    app.session_interface = ServerSessionInterface(lambda: app_context['sessions'])
+
+def _configurar_credenciais_google():
+    """Configura credenciais do Google (suporta múltiplas formas)."""
+    google_creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+    google_creds_json = os.environ.get('GOOGLE_CREDENTIALS_JSON')
     
-    print("A inicializar os gestores e o motor de recomendação...")
-    print(f"Ambiente Vercel detectado: {IS_VERCEL}")
-    print(f"DB_DIR configurado: {DB_DIR}")
-    print(f"DB_FILE configurado: {DB_FILE}")
+    log.debug("GOOGLE_APPLICATION_CREDENTIALS: %s", 'Definido' if google_creds_path else 'Não definido')
+    log.debug("GOOGLE_CREDENTIALS_JSON: %s", 'Definido' if google_creds_json else 'Não definido')
     
-    try:
-        # Configura credenciais do Google (suporta múltiplas formas)
-        google_creds_path = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
-        google_creds_json = os.environ.get('GOOGLE_CREDENTIALS_JSON')
-        
-        print(f"GOOGLE_APPLICATION_CREDENTIALS: {'Definido' if google_creds_path else 'Não definido'}")
-        print(f"GOOGLE_CREDENTIALS_JSON: {'Definido' if google_creds_json else 'Não definido'}")
-        
-        if google_creds_json:
-            # Se as credenciais estão em formato JSON na variável de ambiente
-            # Cria um arquivo temporário com as credenciais
-            import json
-            try:
-                # Valida se é JSON válido
-                creds_data = json.loads(google_creds_json)
-                # Cria arquivo temporário com as credenciais
-                if IS_VERCEL:
-                    temp_creds_path = '/tmp/google-credentials.json'
-                else:
-                    temp_creds_path = os.path.join(ROOT_DIR, 'google-credentials-temp.json')
-                
-                with open(temp_creds_path, 'w') as f:
-                    json.dump(creds_data, f)
-                
-                os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_creds_path
-                print("Credenciais do Google carregadas a partir da variável de ambiente GOOGLE_CREDENTIALS_JSON")
-            except json.JSONDecodeError as e:
-                print(f"ERRO: GOOGLE_CREDENTIALS_JSON contém JSON inválido: {e}")
-            except Exception as e:
-                print(f"ERRO ao processar GOOGLE_CREDENTIALS_JSON: {e}")
-        elif google_creds_path:
-            # Já está configurado via variável de ambiente (caminho do arquivo)
-            print(f"Usando credenciais do Google do caminho: {google_creds_path}")
-        elif os.path.exists(CAMINHO_CREDENCIAL_GOOGLE):
-            # Usa arquivo local se existir
-            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CAMINHO_CREDENCIAL_GOOGLE
-            print(f"Usando credenciais do Google do arquivo local: {CAMINHO_CREDENCIAL_GOOGLE}")
-        else:
-            print("AVISO: Credenciais do Google não encontradas. Algumas funcionalidades podem não funcionar.")
-            print("Para configurar, adicione uma das seguintes variáveis de ambiente na Vercel:")
-            print("  - GOOGLE_APPLICATION_CREDENTIALS: caminho para o arquivo JSON")
-            print("  - GOOGLE_CREDENTIALS_JSON: conteúdo completo do arquivo JSON como string")
-        
-        # Inicializa cliente Vision (pode falhar se credenciais não estiverem configuradas)
-        vision_client = None
+    if google_creds_json:
+        # Se as credenciais estão em formato JSON na variável de ambiente
+        # Cria um arquivo temporário com as credenciais
+        import json
         try:
-            vision_client = vision.ImageAnnotatorClient()
+            # Valida se é JSON válido
+            creds_data = json.loads(google_creds_json)
+            # Cria arquivo temporário com as credenciais
+            if IS_VERCEL:
+                temp_creds_path = '/tmp/google-credentials.json'
+            else:
+                temp_creds_path = os.path.join(ROOT_DIR, 'google-credentials-temp.json')
+            
+            with open(temp_creds_path, 'w') as f:
+                json.dump(creds_data, f)
+            
+            os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = temp_creds_path
+            log.info("Credenciais do Google carregadas a partir da variável de ambiente GOOGLE_CREDENTIALS_JSON")
+        except json.JSONDecodeError as e:
+            log.warning("GOOGLE_CREDENTIALS_JSON contém JSON inválido: %s", e)
         except Exception as e:
-            print(f"AVISO: Não foi possível inicializar o cliente Vision: {e}")
-        
-        # Determina o caminho do banco de dados (sempre usa /tmp na Vercel)
-        if IS_VERCEL:
-            db_file_path = '/tmp/banco_musicas.db'
-            db_dir = '/tmp'
-            print(f"[DEBUG] Ambiente Vercel: usando {db_file_path}")
-        else:
-            db_file_path = DB_FILE
-            db_dir = os.path.dirname(DB_FILE)
-            print(f"[DEBUG] Ambiente local: usando {db_file_path}")
+            log.error("Erro ao processar GOOGLE_CREDENTIALS_JSON: %s", e)
+    elif google_creds_path:
+        # Já está configurado via variável de ambiente (caminho do arquivo)
+        log.info("Usando credenciais do Google do caminho: %s", google_creds_path)
+    elif os.path.exists(CAMINHO_CREDENCIAL_GOOGLE):
+        # Usa arquivo local se existir
+        os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CAMINHO_CREDENCIAL_GOOGLE
+        log.info("Usando credenciais do Google do arquivo local: %s", CAMINHO_CREDENCIAL_GOOGLE)
+    else:
+        log.warning("Credenciais do Google não encontradas; algumas funcionalidades podem não funcionar. "
+                    "Defina GOOGLE_APPLICATION_CREDENTIALS (caminho do JSON) ou GOOGLE_CREDENTIALS_JSON (conteúdo do JSON).")
+
+def _criar_vision_client():
+    """Cliente Vision (pode falhar se credenciais não estiverem configuradas)."""
+    if cassette.reproduzindo():
+        # As respostas vêm da cassete: não são precisas credenciais da Google
+        return cassette.envolver_vision(None)
+    _configurar_credenciais_google()
+    try:
+        return cassette.envolver_vision(importar('google.cloud.vision').ImageAnnotatorClient())
+    except Exception as e:
+        log.warning("Não foi possível inicializar o cliente Vision: %s", e)
+        return None
+
+def _caminho_base_dados():
+    """Determina o caminho do banco de dados (sempre usa /tmp na Vercel)."""
+    log.debug("Ambiente Vercel detectado: %s", IS_VERCEL)
+    log.debug("DB_DIR configurado: %s", DB_DIR)
+    log.debug("DB_FILE configurado: %s", DB_FILE)
+    if IS_VERCEL:
+        db_file_path = '/tmp/banco_musicas.db'
+        db_dir = '/tmp'
+        log.debug("Ambiente Vercel: usando %s", db_file_path)
+    else:
+        db_file_path = DB_FILE
+        db_dir = os.path.dirname(DB_FILE)
+        log.debug("Ambiente local: usando %s", db_file_path)
+    
+    # Garante que o diretório do banco existe
+    try:
+        os.makedirs(db_dir, exist_ok=True)
+        log.debug("Diretório do banco verificado: %s", db_dir)
         
-        # Garante que o diretório do banco existe
+        # Verifica se o diretório é writeable
+        test_file = os.path.join(db_dir, '.test_write')
         try:
-            os.makedirs(db_dir, exist_ok=True)
-            print(f"Diretório do banco verificado: {db_dir}")
-            
-            # Verifica se o diretório é writeable
-            test_file = os.path.join(db_dir, '.test_write')
-            try:
-                with open(test_file, 'w') as f:
-                    f.write('test')
-                os.remove(test_file)
-                print(f"Diretório {db_dir} é writeable")
-            except Exception as e:
-                print(f"AVISO: Diretório {db_dir} não é writeable: {e}")
-                # Se não for writeable e não estiver na Vercel, tenta /tmp
-                if not IS_VERCEL:
-                    db_file_path = '/tmp/banco_musicas.db'
-                    db_dir = '/tmp'
-                    os.makedirs(db_dir, exist_ok=True)
-                    print(f"Usando /tmp como fallback: {db_file_path}")
+            with open(test_file, 'w') as f:
+                f.write('test')
+            os.remove(test_file)
+            log.debug("Diretório %s é writeable", db_dir)
         except Exception as e:
-            print(f"AVISO: Não foi possível criar diretório {db_dir}: {e}")
-            # Se falhar e não estiver na Vercel, tenta /tmp
+            log.warning("Diretório %s não é writeable: %s", db_dir, e)
+            # Se não for writeable e não estiver na Vercel, tenta /tmp
             if not IS_VERCEL:
                 db_file_path = '/tmp/banco_musicas.db'
                 db_dir = '/tmp'
-                try:
-                    os.makedirs(db_dir, exist_ok=True)
-                    print(f"Usando /tmp como fallback: {db_file_path}")
-                except Exception as e2:
-                    print(f"ERRO CRÍTICO: Não foi possível criar diretório em /tmp: {e2}")
-                    raise
-        
-        # Conecta ao banco de dados
-        try:
-            db_connection = sqlite3.connect(db_file_path, check_same_thread=False)
-            print(f"Banco de dados conectado: {db_file_path}")
-            
-            # Inicializa as tabelas se o banco estiver vazio
-            cursor = db_connection.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='usuarios'")
-            if not cursor.fetchone():
-                print("Inicializando estrutura do banco de dados...")
-                _criar_tabelas(db_connection)
-            else:
-                # Migração: adiciona cover_image se não existir
-                try:
-                    db_connection.execute("ALTER TABLE playlists_salvas ADD COLUMN cover_image TEXT")
-                    db_connection.commit()
-                    print("Migração: coluna cover_image adicionada.")
-                except sqlite3.OperationalError:
-                    pass  # Coluna já existe
-        except Exception as e:
-            print(f"ERRO: Não foi possível conectar ao banco de dados em {DB_FILE}: {e}")
-            import traceback
-            traceback.print_exc()
-            raise
+                os.makedirs(db_dir, exist_ok=True)
+                log.info("Usando /tmp como fallback: %s", db_file_path)
+    except Exception as e:
+        log.warning("Não foi possível criar diretório %s: %s", db_dir, e)
+        # Se falhar e não estiver na Vercel, tenta /tmp
+        if not IS_VERCEL:
+            db_file_path = '/tmp/banco_musicas.db'
+            db_dir = '/tmp'
+            try:
+                os.makedirs(db_dir, exist_ok=True)
+                log.info("Usando /tmp como fallback: %s", db_file_path)
+            except Exception as e2:
+                log.critical("Não foi possível criar diretório em /tmp: %s", e2)
+                raise
+    return db_file_path
+
+def _criar_db():
+    """Pool de ligações em WAL (ver app/database.py) com o esquema atualizado."""
+    db_file_path = _caminho_base_dados()
+    try:
+        db = Database(db_file_path)
+        log.info("Banco de dados conectado: %s", db_file_path)
+        # Cria/atualiza o esquema (migrações versionadas em PRAGMA user_version)
+        aplicar_migracoes(db)
+        return db
+    except Exception as e:
+        log.error("Não foi possível conectar ao banco de dados em %s: %s", db_file_path, e, exc_info=True)
+        raise
 
-        auth_spotify = SpotifyAuthManager()
-        auth_youtube = YouTubeAuthManager()
-        
-        sp_app_client = auth_spotify.get_app_client()
-        service_spotify = SpotifyService(spotify_client=sp_app_client)
-        # yt-dlp não requer chave de API para buscas, mas ainda é útil para criar playlists
-        youtube_api_key = getattr(creds, 'YOUTUBE_API_KEY', None)
-        service_youtube = YouTubeMusicService(developer_key=youtube_api_key)
-
-        rec_engine = RecommendationEngine(
-            vision_client=vision_client, 
-            db_connection=db_connection
-        )
-        
-        print("Servidor pronto para receber pedidos.")
-        
-        app_context = {
-            "engine": rec_engine,
-            "auth": {"spotify": auth_spotify, "youtube": auth_youtube},
-            "services": {"spotify": service_spotify, "youtube": service_youtube},
-            "db_connection": db_connection
-        }
-        conn = db_connection
+def _criar_cover_store():
+    db = app_context['db']
+    cover_store = CoverStore(os.path.join(os.path.dirname(db.path), 'covers'))
+    migrar_capas_inline(db, cover_store)
+    return cover_store
+
+def _criar_engine():
+    RecommendationEngine = importar('.recommendation_engine', __package__).RecommendationEngine
+    return RecommendationEngine(
+        vision_client=_vision_client, 
+        db=app_context['db'],
+        result_cache=app_context['result_cache']
+    )
+
+def _criar_spotify_service():
+    SpotifyService = importar('.services.spotify_service', __package__).SpotifyService
+    AudioFeaturesCache = importar('.audio_features_cache', __package__).AudioFeaturesCache
+    sp_app_client = app_context['auth']['spotify'].get_app_client()
+    return SpotifyService(spotify_client=sp_app_client, features_cache=AudioFeaturesCache(app_context['db']),
+                          result_cache=app_context['result_cache'])
+
+def _criar_youtube_service():
+    YouTubeMusicService = importar('.services.youtube_service', __package__).YouTubeMusicService
+    # yt-dlp não requer chave de API para buscas, mas ainda é útil para criar playlists
+    youtube_api_key = getattr(creds, 'YOUTUBE_API_KEY', None)
+    return YouTubeMusicService(developer_key=youtube_api_key, result_cache=app_context['result_cache'])
+
+def _criar_user_clients():
+    UserClientCache = importar('.client_cache', __package__).UserClientCache
+    return UserClientCache(app_context['auth']['spotify'])
+
+def _criar_job_queue():
+    # Na Vercel não há threads depois da resposta: as tarefas correm no próprio pedido
+    job_queue = JobQueue(app_context['db'], workers=0 if IS_VERCEL else JOB_WORKERS)
+    job_queue.registar(JOB_PLAYLIST_REMOTA, _job_playlist_remota)
+    # Os trabalhadores podem retomar tarefas pendentes de arranques anteriores
+    job_queue.iniciar()
+    return job_queue
+
+# O cliente Vision só é preciso na análise de imagem (não no feedback nem nas playlists)
+_vision_client = Lazy('vision', _criar_vision_client)
+
+# Contexto da aplicação: cada componente é criado no primeiro acesso (thread-safe),
+# por isso as rotas que só devolvem templates não carregam Google, yt-dlp nem spotipy.
+app_context = ContextoLazy({
+    "db": _criar_db,
+    "result_cache": lambda: ResultCache(app_context['db']),
+    "sessions": lambda: SessionStore(app_context['db'], criar_fernet(app.secret_key)),
+    "engine": _criar_engine,
+    "auth": lambda: ContextoLazy({
+        "spotify": lambda: importar('.spotify_auth_manager', __package__).SpotifyAuthManager(),
+        "youtube": lambda: importar('.youtube_auth_manager', __package__).YouTubeAuthManager(),
+    }, prefixo='auth.'),
+    "services": lambda: ContextoLazy({
+        "spotify": _criar_spotify_service,
+        "youtube": _criar_youtube_service,
+    }, prefixo='services.'),
+    "user_clients": _criar_user_clients,
+    "feed_cache": feed_cache.FeedCache,
+    "cover_store": _criar_cover_store,
+    "playlists": lambda: PlaylistPersistence(app_context['db']),
+    "jobs": _criar_job_queue,
+})
+
+def setup_application():
+    """Inicializa todos os serviços e gestores de uma vez (ex.: aquecimento antes de servir pedidos)."""
+    log.info("A inicializar os gestores e o motor de recomendação...")
+    try:
+        for nome in app_context:
+            app_context[nome]
+        for servicos in (app_context['auth'], app_context['services']):
+            for nome in servicos:
+                servicos[nome]
+        _vision_client.get()
+        log.info("Servidor pronto para receber pedidos.")
         return app_context
-        
     except Exception as e:
-        print(f"ERRO CRÍTICO AO INICIAR SERVIDOR: {e}")
-        import traceback
-        traceback.print_exc()
+        log.critical("Erro crítico ao iniciar o servidor: %s", e, exc_info=True)
         # Não faz sys.exit() para permitir que a Vercel trate o erro
         raise
 
-def _criar_tabelas(conn):
-    """Cria todas as tabelas necessárias se não existirem."""
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS usuarios (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            service_user_id TEXT NOT NULL,
-            service_name TEXT NOT NULL,
-            display_name TEXT,
-            data_primeiro_login DATETIME DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(service_user_id, service_name)
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS playlists_salvas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER NOT NULL,
-            nome_playlist TEXT NOT NULL,
-            playlist_url TEXT,
-            service_name TEXT NOT NULL,
-            cover_image TEXT,
-            data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios(id)
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS playlist_musicas (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            playlist_id INTEGER NOT NULL,
-            musica_id TEXT NOT NULL,
-            titulo_musica TEXT,
-            artista_musica TEXT,
-            preview_url_musica TEXT,
-            artista_id TEXT,
-            album_cover_url TEXT,
-            service_name TEXT NOT NULL,
-            FOREIGN KEY (playlist_id) REFERENCES playlists_salvas (id) ON DELETE CASCADE
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS playlist_likes (
-            playlist_id INTEGER NOT NULL,
-            usuario_id INTEGER NOT NULL,
-            data_like DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (playlist_id, usuario_id),
-            FOREIGN KEY (playlist_id) REFERENCES playlists_salvas (id) ON DELETE CASCADE,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    """)
-    
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS historico_reproducao (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            usuario_id INTEGER NOT NULL,
-            musica_id TEXT, 
-            artista_id TEXT,
-            rating INTEGER, 
-            data_hora DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (usuario_id) REFERENCES usuarios (id)
-        )
-    """)
-    
-    conn.commit()
-    print("Tabelas criadas/verificadas com sucesso.")
-
 def get_app_context():
-    """Obtém o contexto da aplicação, inicializando se necessário."""
-    if app_context is None:
-        return setup_application()
+    """Obtém o contexto da aplicação (os componentes são inicializados no primeiro uso)."""
     return app_context
 
+# --- Arranque em produção: aquecimento antes do fork e prontidão (ver gunicorn.conf.py) ---
+# Imports pesados feitos uma vez no processo mestre; os workers partilham-nos (copy-on-write)
+MODULOS_PRE_FORK = ('google.cloud.vision', 'googleapiclient.discovery', 'yt_dlp', 'yt_dlp.utils', 'spotipy', 'PIL.Image',
+                    'cryptography.fernet')
+# Componentes sem threads, sockets nem ligações abertas depois de criados: podem atravessar o fork
+COMPONENTES_PRE_FORK = ('db', 'result_cache', 'sessions', 'engine', 'feed_cache', 'cover_store', 'playlists', 'user_clients')
+_pronto = threading.Event()
+_aquecimento_lock = threading.Lock()
+_aquecimento = None
+
+def preparar_pre_fork():
+    """
+    No processo mestre (gunicorn com preload_app), antes de criar os workers: imports pesados,
+    migrações, motor (géneros do Spotify) e componentes só de leitura. O que tem threads,
+    sockets ou gRPC (Vision, cliente Spotify, fila de tarefas) é criado em cada worker por `aquecer`.
+    """
+    for nome in MODULOS_PRE_FORK:
+        try:
+            importar(nome)
+        except ImportError as e:
+            log.warning("Módulo %s indisponível: %s", nome, e)
+    for contexto, nomes in ((app_context, COMPONENTES_PRE_FORK), (app_context['auth'], ('spotify', 'youtube')),
+                            (app_context['services'], ('youtube',))):
+        for nome in nomes:
+            try:
+                contexto[nome]
+            except Exception as e:
+                # Fica por criar: o worker volta a tentar no aquecimento
+                log.warning("Componente '%s' não criado antes do fork: %s", nome, e)
+    if app_context.inicializado('db'):
+        # Ligações SQLite não podem ser usadas por outro processo: cada worker abre as suas
+        app_context['db'].close()
+    # O que já existe deixa de ser percorrido pelo GC, para as páginas ficarem partilhadas com os workers
+    gc.freeze()
+    marcar('pre_fork')
+    log.info("Aquecimento antes do fork concluído.")
+
+def aquecer():
+    """Cria todos os componentes neste processo e marca-o como pronto (/readyz)."""
+    setup_application()
+    _pronto.set()
+    marcar('pronto')
+
+def _aquecer_em_fundo():
+    global _aquecimento
+    try:
+        aquecer()
+    except Exception:
+        # Já registado por setup_application; o próximo /readyz tenta de novo
+        with _aquecimento_lock:
+            _aquecimento = None
+
+def aquecer_em_segundo_plano():
+    """Inicia `aquecer` numa thread, uma só vez (ex.: num worker acabado de criar)."""
+    global _aquecimento
+    with _aquecimento_lock:
+        if _aquecimento is None and not _pronto.is_set():
+            _aquecimento = threading.Thread(target=_aquecer_em_fundo, name='aquecimento', daemon=True)
+            _aquecimento.start()
+
+# --- Métricas HTTP e rastreio por pedido (ver app/metrics.py e app/tracing.py) ---
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+def _acesso_diagnostico():
+    """Endpoints de diagnóstico: abertos com TRACE_DEBUG=1, senão exigem o token das métricas."""
+    if tracing.TRACE_DEBUG:
+        return True
+    return bool(METRICS_TOKEN) and request.headers.get('Authorization') == f'Bearer {METRICS_TOKEN}'
+
+@app.before_request
+def _inicio_pedido():
+    g.metricas_inicio = time.perf_counter()
+    metrics.HTTP_EM_CURSO.inc()
+    if request.endpoint != 'static':
+        depurar = tracing.TRACE_DEBUG and request.headers.get('X-Debug-Trace') == '1'
+        rota = request.url_rule.rule if request.url_rule else request.path
+        g.trace, g.trace_token = tracing.iniciar(f'{request.method} {rota}', depurar)
+
+@app.after_request
+def _fim_pedido(response):
+    inicio = g.get('metricas_inicio')
+    if inicio is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'desconhecido'
+        metrics.HTTP_SEGUNDOS.labels(endpoint, request.method, str(response.status_code)).observe(time.perf_counter() - inicio)
+    trace = g.get('trace')
+    if trace is not None:
+        g.trace_estado = response.status_code
+        response.headers['Server-Timing'] = trace.server_timing()
+        response.headers['X-Trace-Id'] = trace.id
+        if trace.depurar and response.is_json:
+            corpo = response.get_json(silent=True)
+            if isinstance(corpo, dict):
+                corpo['_trace'] = trace.para_dict()
+                response.set_data(app.json.dumps(corpo))
+    return response
+
+@app.teardown_request
+def _teardown_pedido(_erro=None):
+    if g.pop('metricas_inicio', None) is not None:
+        metrics.HTTP_EM_CURSO.dec()
+    trace = g.pop('trace', None)
+    if trace is not None:
+        tracing.terminar(trace, g.pop('trace_token'), g.pop('trace_estado', 500))
+
+@app.route('/api/traces')
+def traces_api():
+    """Traces guardados no buffer circular (?id=, ?limit=); ?dump=1 grava-os em data/traces-<data>.jsonl."""
+    if not _acesso_diagnostico(): abort(401)
+    if request.args.get('dump') == '1':
+        caminho = os.path.join(DB_DIR, f"traces-{time.strftime('%Y%m%d-%H%M%S')}.jsonl")
+        return jsonify({"path": caminho, "count": tracing.despejar(caminho)})
+    limite = request.args.get('limit', type=int)
+    return jsonify({"traces": tracing.recentes(limite, request.args.get('id'))})
+
+@app.route('/readyz')
+def readyz():
+    """Prontidão para o balanceador: 503 até os componentes deste processo estarem criados (inicia o aquecimento)."""
+    if _pronto.is_set(): return jsonify({"ready": True, "pid": os.getpid()})
+    aquecer_em_segundo_plano()
+    return jsonify({"ready": False, "pid": os.getpid()}), 503, {'Retry-After': '1'}
+
+@app.route('/metrics')
+def metrics_api():
+    """Métricas no formato do Prometheus. Com METRICS_TOKEN definido exige 'Authorization: Bearer <token>'."""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return metrics.exportar(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 # ===================================================
 # Endpoints da Interface e Autenticação
 # ===================================================
@@ -340,6 +450,17 @@ def login_youtube():
     session['oauth_code_verifier'] = code_verifier
     return redirect(auth_url)
 
+def _obter_ou_criar_usuario(db, service_user_id, service_name, display_name):
+    """Retorna o ID interno do utilizador, criando-o na primeira autenticação."""
+    with db.transacao() as cursor:
+        cursor.execute("SELECT id FROM usuarios WHERE service_user_id = ? AND service_name = ?", (service_user_id, service_name))
+        user_row = cursor.fetchone()
+        if user_row:
+            return user_row[0]
+        cursor.execute("INSERT INTO usuarios (service_user_id, service_name, display_name) VALUES (?, ?, ?)",
+                       (service_user_id, service_name, display_name))
+        return cursor.lastrowid
+
 @app.route('/callback/spotify')
 def callback_spotify():
     ctx = get_app_context()
@@ -352,16 +473,7 @@ def callback_spotify():
             sp_user = spotify_auth_manager.get_user_client(token_info)
             user_info = sp_user.me()
             
-            db_conn = ctx['db_connection']
-            cursor = db_conn.cursor()
-            cursor.execute("SELECT id FROM usuarios WHERE service_user_id = ? AND service_name = 'spotify'", (user_info['id'],))
-            user_row = cursor.fetchone()
-            if not user_row:
-                cursor.execute("INSERT INTO usuarios (service_user_id, service_name, display_name) VALUES (?, 'spotify', ?)",
-                               (user_info['id'], user_info['display_name']))
-                db_conn.commit(); db_user_id = cursor.lastrowid
-            else:
-                db_user_id = user_row[0]
+            db_user_id = _obter_ou_criar_usuario(ctx['db'], user_info['id'], 'spotify', user_info['display_name'])
             
             session.update({
                 'service': 'spotify', 'internal_user_id': db_user_id,
@@ -370,7 +482,7 @@ def callback_spotify():
             })
             return redirect('/player')
         except Exception as e:
-            print(f"Erro no callback do Spotify: {e}"); return "Erro ao obter o token de acesso.", 400
+            log.error("Erro no callback do Spotify: %s", e); return "Erro ao obter o token de acesso.", 400
     return "Erro: Nenhum código de autorização fornecido.", 400
 
 @app.route('/callback/youtube')
@@ -382,22 +494,13 @@ def callback_youtube():
     if state is None or state != request.args.get('state'): return 'Invalid state parameter.', 400
     try:
         token_info = youtube_auth_manager.get_token_from_code(request.url, state, code_verifier)
-        credentials = Credentials(**token_info)
-        youtube_user_client = build('youtube', 'v3', credentials=credentials)
+        credentials = importar('google.oauth2.credentials').Credentials(**token_info)
+        youtube_user_client = importar('.client_cache', __package__).build_youtube(credentials=credentials)
         response = youtube_user_client.channels().list(part='snippet', mine=True).execute()
         if not response.get('items'): return "A sua conta Google não tem um canal do YouTube.", 400
         user_channel = response['items'][0]
         user_id_yt, display_name = user_channel['id'], user_channel['snippet']['title']
-        db_conn = ctx['db_connection']
-        cursor = db_conn.cursor()
-        cursor.execute("SELECT id FROM usuarios WHERE service_user_id = ? AND service_name = 'youtube'", (user_id_yt,))
-        user_row = cursor.fetchone()
-        if not user_row:
-            cursor.execute("INSERT INTO usuarios (service_user_id, service_name, display_name) VALUES (?, 'youtube', ?)",
-                           (user_id_yt, display_name))
-            db_conn.commit(); db_user_id = cursor.lastrowid
-        else:
-            db_user_id = user_row[0]
+        db_user_id = _obter_ou_criar_usuario(ctx['db'], user_id_yt, 'youtube', display_name)
         session.update({
             'service': 'youtube', 'internal_user_id': db_user_id,
             'service_user_id': user_id_yt,
@@ -405,11 +508,12 @@ def callback_youtube():
         })
         return redirect('/player')
     except Exception as e:
-        import traceback; traceback.print_exc()
-        print(f"Erro no callback do YouTube: {type(e).__name__}: {e}"); return f"Erro ao obter o token de acesso do YouTube: {e}", 400
+        log.error("Erro no callback do YouTube: %s: %s", type(e).__name__, e, exc_info=True); return f"Erro ao obter o token de acesso do YouTube: {e}", 400
 
 @app.route('/logout')
 def logout():
+    if app_context.inicializado('user_clients') and 'internal_user_id' in session:
+        app_context['user_clients'].invalidate(session['internal_user_id'])
     session.clear(); return redirect('/')
 
 @app.route('/api/user_status')
@@ -418,44 +522,112 @@ def user_status():
         return jsonify({"logged_in": True, "display_name": session.get('display_name'), "service": session.get('service')})
     return jsonify({"logged_in": False})
 
+@app.errorhandler(SpotifyRateLimitError)
+def spotify_rate_limited(e):
+    """O Spotify está a limitar a aplicação: responde 503 com Retry-After em vez de uma lista vazia."""
+    retry_after = max(1, int(round(e.retry_after)))
+    response = jsonify({"error": "O Spotify está temporariamente a limitar pedidos. Tente novamente em breve.", "retry_after": retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.errorhandler(AdmissaoRecusadaError)
+def admissao_recusada(e):
+    """Limite por utilizador (429) ou endpoint saturado (503): recusa rápida com Retry-After."""
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.status_code = e.status
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.errorhandler(UploadRejeitadoError)
+def upload_rejeitado(e):
+    return jsonify({"error": str(e)}), e.status
+
+@app.errorhandler(413)
+def pedido_grande_demais(e):
+    return jsonify({"error": f"O pedido excede o tamanho máximo de {MAX_CONTENT_LENGTH // (1024 * 1024)} MB."}), 413
+
+@app.route('/api/spotify_stats')
+def spotify_stats_api():
+    """Contadores de chamadas/latência por endpoint da Web API do Spotify."""
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    return jsonify(importar('.spotify_client', __package__).call_stats.snapshot())
+
+@app.route('/api/admission_stats')
+def admission_stats_api():
+    """Pedidos admitidos/recusados e tempo em fila de cada endpoint com controlo de admissão."""
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    return jsonify({"endpoints": {nome: b.snapshot() for nome, b in _bulkheads.items()},
+                    "per_user_rejected": _limite_recomendacoes.recusados})
+
+@app.route('/api/startup_report')
+def startup_report_api():
+    """Tempos (ms) de cada import pesado e de cada componente inicializado neste processo."""
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    return jsonify(relatorio_arranque())
+
+# --- Controlo de admissão dos endpoints que chamam Vision/Gemini/yt-dlp (ver app/admission.py) ---
+_bulkheads = {
+    nome: admission.Bulkhead(nome, admission.RECOMENDACAO_CONCORRENCIA, admission.RECOMENDACAO_FILA_MAX,
+                             admission.RECOMENDACAO_ESPERA_MAX)
+    for nome in ('recommend_by_image', 'recommend_from_tags')
+}
+# Um só orçamento por utilizador para os dois endpoints
+_limite_recomendacoes = admission.LimiteUtilizador(admission.UTILIZADOR_PEDIDOS_POR_MINUTO, admission.UTILIZADOR_RAJADA)
+
+@metrics.registar_coletor
+def _metricas_admissao():
+    stats = {nome: b.snapshot() for nome, b in _bulkheads.items()}
+    yield ('admission_in_flight', 'gauge', 'Pedidos admitidos em execução por endpoint.', ('endpoint',),
+           [((nome,), s['in_flight']) for nome, s in stats.items()])
+    yield ('admission_waiting', 'gauge', 'Pedidos à espera de admissão por endpoint.', ('endpoint',),
+           [((nome,), s['waiting']) for nome, s in stats.items()])
+    yield ('admission_rejected_total', 'counter', 'Pedidos recusados pelo controlo de admissão.', ('endpoint', 'reason'),
+           [((nome, motivo), s[f'rejected_{motivo}']) for nome, s in stats.items() for motivo in ('queue_full', 'timeout')])
+    yield ('admission_queue_seconds_total', 'counter', 'Tempo total passado na fila de admissão.', ('endpoint',),
+           [((nome,), s['total_queue_ms'] / 1000.0) for nome, s in stats.items()])
+    yield ('user_rate_limited_total', 'counter', 'Pedidos recusados pelo limite por utilizador.', (),
+           [((), _limite_recomendacoes.recusados)])
+
+def _admitir_recomendacao(nome):
+    return admitir(_bulkheads[nome], _limite_recomendacoes, lambda: session.get('internal_user_id'))
+
 def _get_active_service():
     ctx = get_app_context()
     active_service_name = session.get('service')
     return ctx['services'].get(active_service_name) if active_service_name else None
 
 @app.route('/api/recommend_by_image', methods=['POST'])
+@_admitir_recomendacao('recommend_by_image')
 def recommend_by_image_api():
     if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
-    ctx = get_app_context()
-    engine = ctx['engine']; engine.music_service = _get_active_service()
-    if not engine.music_service: return jsonify({"error": "Serviço de música não encontrado."}), 500
+    # O upload é validado (tamanho/tipo) antes de inicializar o motor de análise
     if 'image' not in request.files: return jsonify({"error": "Nenhum ficheiro de imagem."}), 400
     file = request.files['image']
     if not file or file.filename == '': return jsonify({"error": "Ficheiro inválido."}), 400
-    temp_dir = os.path.join(ROOT_DIR, "temp_uploads")
-    os.makedirs(temp_dir, exist_ok=True)
-    filename = str(uuid.uuid4()) + os.path.splitext(file.filename)[1]
-    temp_path = os.path.join(temp_dir, filename)
+    imagem = ler_imagem(file)
+    log.debug("Imagem recebida: %s bytes, %s, sha256 %s", imagem.tamanho, imagem.mime_type, imagem.sha256[:12])
+    ctx = get_app_context()
+    engine = ctx['engine']; engine.music_service = _get_active_service()
+    if not engine.music_service: return jsonify({"error": "Serviço de música não encontrado."}), 500
     try:
-        file.save(temp_path)
-        tags, playlist_title = engine.analisar_imagem_e_obter_tags(temp_path)
+        tags, playlist_title = engine.analisar_imagem_bytes(imagem.conteudo, imagem.mime_type)
     except Exception as e:
-        print(f"Erro ao processar imagem: {e}")
-        import traceback; traceback.print_exc()
+        log.error("Erro ao processar imagem: %s", e, exc_info=True)
         return jsonify({"error": f"Erro ao processar imagem: {str(e)}"}), 500
-    finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
     if not tags: return jsonify({"error": "Não foi possível analisar a imagem."}), 500
     try:
         recomendacoes = engine.recomendar_musicas_por_tags(tags, is_redo=False)
+    except SpotifyRateLimitError:
+        raise
     except Exception as e:
-        print(f"Erro ao obter recomendações: {e}")
+        log.error("Erro ao obter recomendações: %s", e)
         return jsonify({"error": f"Erro ao obter recomendações: {str(e)}"}), 500
     if recomendacoes is None: return jsonify({"error": "Erro ao obter recomendações."}), 500
     return jsonify({"ambiente_detetado": tags, "recomendacoes": recomendacoes, "playlist_title": playlist_title})
 
 @app.route('/api/recommend_from_tags', methods=['POST'])
+@_admitir_recomendacao('recommend_from_tags')
 def recommend_from_tags_api():
     if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
     ctx = get_app_context()
@@ -467,6 +639,86 @@ def recommend_from_tags_api():
     if recomendacoes is None: return jsonify({"error": "Erro ao obter recomendações."}), 500
     return jsonify({"ambiente_detetado": tags, "recomendacoes": recomendacoes, "playlist_title": f"Novas recomendações para: {', '.join(map(str, tags))}"})
 
+def _obter_user_client(ctx, service_name):
+    """Cliente autenticado do utilizador atual (cache por utilizador); atualiza o token na sessão."""
+    user_client = None
+    user_clients = ctx['user_clients']
+    token_info = session.get('token_info')
+    if service_name == 'spotify':
+        user_client, token_info = user_clients.get_spotify_client(session['internal_user_id'], token_info)
+    elif service_name == 'youtube':
+        user_client, token_info = user_clients.get_youtube_client(session['internal_user_id'], token_info)
+    if token_info != session.get('token_info'):
+        session['token_info'] = token_info
+    return user_client
+
+JOB_PLAYLIST_REMOTA = 'playlist_remota'
+
+def _job_playlist_remota(job):
+    """Tarefa em segundo plano: executa a operação remota de uma entrada da outbox."""
+    ctx = get_app_context()
+    outbox_id, service_name = job.payload['outbox_id'], job.payload['service_name']
+    playlists = ctx['playlists']
+    # Repetição idempotente: se a operação já foi concluída, devolve o mesmo resultado
+    resultado = playlists.resultado(outbox_id)
+    if resultado is None:
+        ClienteIndisponivelError = importar('.client_cache', __package__).ClienteIndisponivelError
+        # O cliente está em cache no processo que enfileirou a tarefa; noutro worker, depois de
+        # um reinício ou de muito tempo na fila, é recriado com o token da sessão do utilizador
+        token_info = _token_info_da_tarefa(ctx, job, service_name)
+        try:
+            if service_name == 'spotify':
+                user_client, _ = ctx['user_clients'].get_spotify_client(job.usuario_id, token_info)
+            else:
+                user_client, _ = ctx['user_clients'].get_youtube_client(job.usuario_id, token_info)
+        except ClienteIndisponivelError:
+            if not job.payload.get('sessao'):
+                # Sessão em cookie: só o processo que a enfileirou tem o cliente; outro pode retomá-la
+                raise ErroTransitorio("Cliente do utilizador indisponível neste processo.")
+            raise RuntimeError("Sessão expirada: volte a guardar a playlist para a sincronizar.")
+        job.progresso(f"A guardar no {'Spotify' if service_name == 'spotify' else 'YouTube'}...")
+        try:
+            resultado = playlists.executar(outbox_id, job.usuario_id, ctx['services'][service_name], user_client)
+        except SpotifyRateLimitError as e:
+            raise ErroTransitorio(str(e), retry_after=e.retry_after)
+        except OutboxIndisponivelError:
+            # Outro trabalhador concluiu-a entretanto, ou já não pode ser repetida
+            resultado = playlists.resultado(outbox_id)
+            if resultado is None:
+                raise
+        except Exception as e:
+            if erro_http_transitorio(e):
+                raise ErroTransitorio(str(e))
+            raise
+    playlist_url, operacao = resultado
+    return {"playlist_url": playlist_url, "operation": operacao, "outbox_id": outbox_id}
+
+def _token_info_da_tarefa(ctx, job, service_name):
+    """token_info atual da sessão que enfileirou a tarefa, ou None (sessão terminada ou em cookie)."""
+    chave = job.payload.get('sessao')
+    if not chave or not SESSOES_SERVIDOR:
+        return None
+    carregada = ctx['sessions'].carregar_referencia(chave)
+    if carregada is None:
+        return None
+    dados = app.session_interface.serializer.loads(carregada[0])
+    if dados.get('internal_user_id') != job.usuario_id or dados.get('service') != service_name:
+        return None
+    return dados.get('token_info')
+
+def _enfileirar_playlist_remota(ctx, outbox_id, service_name, mensagem):
+    # Garante que o cliente autenticado está em cache para o trabalhador o usar
+    if not _obter_user_client(ctx, service_name):
+        return jsonify({"error": "Não foi possível autenticar o cliente.", "outbox_id": outbox_id}), 500
+    payload = {"outbox_id": outbox_id, "service_name": service_name}
+    if getattr(session, 'sid', None):
+        # Referência (não o cookie) à sessão no servidor, de onde a tarefa obtém o token
+        payload["sessao"] = referencia_sessao(session.sid)
+    job_id = ctx['jobs'].enfileirar(JOB_PLAYLIST_REMOTA, payload,
+                                    usuario_id=session['internal_user_id'], chave=f"outbox:{outbox_id}")
+    return jsonify({"success": True, "message": mensagem, "job_id": job_id, "outbox_id": outbox_id,
+                    "status_url": url_for('job_status', job_id=job_id)}), 202
+
 @app.route('/api/create_playlist', methods=['POST'])
 def create_playlist_api():
     if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
@@ -475,67 +727,70 @@ def create_playlist_api():
     if not playlist_name or not tracks: return jsonify({"error": "Dados em falta."}), 400
     ctx = get_app_context()
     active_service_name = session['service']
-    active_service = ctx['services'][active_service_name]
-    auth_manager = ctx['auth'][active_service_name]
     try:
-        user_client = None
-        if active_service_name == 'spotify':
-            oauth_manager = auth_manager.get_oauth_manager(session)
-            token_info = session.get('token_info')
-            if oauth_manager.is_token_expired(token_info):
-                token_info = oauth_manager.refresh_access_token(token_info['refresh_token'])
-                session['token_info'] = token_info
-            user_client = auth_manager.get_user_client(token_info)
-        elif active_service_name == 'youtube':
-            credentials = Credentials(**session['token_info'])
-            user_client = build('youtube', 'v3', credentials=credentials)
-        if not user_client: return jsonify({"error": "Não foi possível autenticar o cliente."}), 500
-        nova_playlist = active_service.create_playlist(user_client=user_client, playlist_name=playlist_name, tracks=tracks)
-        # Corrigido: suporta tanto Spotify quanto YouTube
-        if active_service_name == 'spotify':
-            playlist_url = nova_playlist.get('external_urls', {}).get('spotify', '')
-        else:  # YouTube
-            playlist_url = nova_playlist.get('external_urls', {}).get('youtube') or nova_playlist.get('external_urls', {}).get('spotify', '')
-        if not playlist_url:
-            playlist_url = f"https://www.youtube.com/playlist?list={nova_playlist.get('id', '')}" if active_service_name == 'youtube' else ''
-        db_conn = ctx['db_connection']
-        cursor = db_conn.cursor()
-        cursor.execute("INSERT INTO playlists_salvas (usuario_id, nome_playlist, playlist_url, service_name, cover_image) VALUES (?, ?, ?, ?, ?)",
-                       (session['internal_user_id'], playlist_name, playlist_url, active_service_name, cover_image))
-        saved_playlist_id = cursor.lastrowid
-        for track in tracks:
-            cursor.execute("INSERT INTO playlist_musicas (playlist_id, musica_id, titulo_musica, artista_musica, preview_url_musica, artista_id, album_cover_url, service_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                           (saved_playlist_id, track.get('spotify_id'), track.get('titulo'), track.get('artista'), track.get('preview_url'), track.get('artista_id'), track.get('album_cover_url'), active_service_name))
-        db_conn.commit()
-        return jsonify({"success": True, "message": f"Playlist '{playlist_name}' criada com sucesso!", "playlist_url": playlist_url})
+        cover_hash = ctx['cover_store'].guardar_data_url(cover_image)
+        # Escrita local e registo da operação remota numa só transação (outbox)
+        outbox_id = ctx['playlists'].preparar_remota(session['internal_user_id'], playlist_name, active_service_name,
+                                                     tracks, cover_hash=cover_hash, sincronizar=bool(data.get('sync')))
+        # A chamada à API remota corre em segundo plano: o pedido responde já com o ID da tarefa
+        return _enfileirar_playlist_remota(ctx, outbox_id, active_service_name, f"A guardar a playlist '{playlist_name}'...")
+    except PlaylistInvalidaError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
-        ctx = get_app_context()
-        ctx['db_connection'].rollback(); print(f"Erro ao criar playlist: {e}"); return jsonify({"error": f"Erro ao criar a sua playlist: {e}"}), 500
+        log.error("Erro ao criar playlist: %s", e); return jsonify({"error": f"Erro ao criar a sua playlist: {e}"}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Estado/progresso de uma tarefa em segundo plano do utilizador."""
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    fila = get_app_context()['jobs']
+    if fila.workers <= 0:
+        # Sem trabalhadores (Vercel): a nova tentativa, se já for devida, corre no pedido de consulta
+        fila.executar_pendente(job_id)
+    estado = fila.obter(job_id, usuario_id=session['internal_user_id'])
+    if not estado: return jsonify({"error": "Não encontrado."}), 404
+    return jsonify(estado)
+
+@app.route('/api/playlist_outbox', methods=['GET'])
+def list_playlist_outbox():
+    """Playlists guardadas cuja criação/sincronização no serviço ainda não foi concluída."""
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    return jsonify(get_app_context()['playlists'].pendentes(session['internal_user_id']))
+
+@app.route('/api/playlist_outbox/<int:outbox_id>/retry', methods=['POST'])
+def retry_playlist_outbox(outbox_id):
+    if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
+    ctx = get_app_context()
+    pendente = next((p for p in ctx['playlists'].pendentes(session['internal_user_id']) if p['id'] == outbox_id), None)
+    if not pendente: return jsonify({"error": "Não encontrado."}), 404
+    if not pendente['can_retry']: return jsonify({"error": "Esta operação está em curso ou excedeu as tentativas."}), 409
+    return _enfileirar_playlist_remota(ctx, outbox_id, session['service'], f"A sincronizar a playlist '{pendente['name']}'...")
 
 @app.route('/api/local_playlists', methods=['GET'])
 def get_local_playlists():
     if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
     try:
         ctx = get_app_context()
-        cursor = ctx['db_connection'].cursor()
-        playlists = [{"id": row[0], "name": row[1]} for row in cursor.execute("SELECT id, nome_playlist FROM playlists_salvas WHERE usuario_id = ? ORDER BY nome_playlist", (session['internal_user_id'],))]
+        with ctx['db'].conexao() as conn:
+            playlists = [{"id": row[0], "name": row[1]} for row in conn.execute("SELECT id, nome_playlist FROM playlists_salvas WHERE usuario_id = ? ORDER BY nome_playlist", (session['internal_user_id'],))]
         return jsonify(playlists)
     except Exception as e:
-        print(f"Erro ao buscar playlists: {e}"); return jsonify({"error": "Erro interno."}), 500
+        log.error("Erro ao buscar playlists: %s", e); return jsonify({"error": "Erro interno."}), 500
 
 @app.route('/api/local_playlists/<int:playlist_id>', methods=['GET'])
 def get_local_playlist_tracks(playlist_id):
     if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
     try:
         ctx = get_app_context()
-        cursor = ctx['db_connection'].cursor()
-        cursor.execute("SELECT id FROM playlists_salvas WHERE id = ? AND usuario_id = ?", (playlist_id, session['internal_user_id']))
-        if not cursor.fetchone(): return jsonify({"error": "Não encontrado."}), 404
-        cursor.execute("SELECT musica_id, titulo_musica, artista_musica, preview_url_musica, artista_id, service_name FROM playlist_musicas WHERE playlist_id = ?", (playlist_id,))
-        musicas = [{'spotify_id': r[0], 'titulo': r[1], 'artista': r[2], 'preview_url': r[3], 'artista_id': r[4], 'service_name': r[5]} for r in cursor.fetchall()]
+        with ctx['db'].conexao() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM playlists_salvas WHERE id = ? AND usuario_id = ?", (playlist_id, session['internal_user_id']))
+            if not cursor.fetchone(): return jsonify({"error": "Não encontrado."}), 404
+            cursor.execute("SELECT musica_id, titulo_musica, artista_musica, preview_url_musica, artista_id, service_name FROM playlist_musicas WHERE playlist_id = ? ORDER BY posicao, id", (playlist_id,))
+            musicas = [{'spotify_id': r[0], 'titulo': r[1], 'artista': r[2], 'preview_url': r[3], 'artista_id': r[4], 'service_name': r[5]} for r in cursor.fetchall()]
         return jsonify(musicas)
     except Exception as e:
-        print(f"Erro ao buscar faixas: {e}"); return jsonify({"error": "Erro interno."}), 500
+        log.error("Erro ao buscar faixas: %s", e); return jsonify({"error": "Erro interno."}), 500
 
 @app.route('/api/local_playlists', methods=['POST'])
 def create_local_playlist():
@@ -546,26 +801,15 @@ def create_local_playlist():
     active_service_name = session['service']
     try:
         ctx = get_app_context()
-        cursor = ctx['db_connection'].cursor()
-        # Verifica se a playlist já existe
-        cursor.execute("SELECT id FROM playlists_salvas WHERE usuario_id = ? AND nome_playlist = ? AND service_name = ?", (session['internal_user_id'], playlist_name, active_service_name))
-        existing = cursor.fetchone()
-        if existing:
-            playlist_id = existing[0]
-            # Remove músicas existentes para substituir e atualiza a capa
-            cursor.execute("DELETE FROM playlist_musicas WHERE playlist_id = ?", (playlist_id,))
-            if cover_image:
-                cursor.execute("UPDATE playlists_salvas SET cover_image = ? WHERE id = ?", (cover_image, playlist_id))
-        else:
-            cursor.execute("INSERT INTO playlists_salvas (usuario_id, nome_playlist, service_name, cover_image) VALUES (?, ?, ?, ?)", (session['internal_user_id'], playlist_name, active_service_name, cover_image))
-            playlist_id = cursor.lastrowid
-        for track in tracks:
-            cursor.execute("INSERT INTO playlist_musicas (playlist_id, musica_id, titulo_musica, artista_musica, preview_url_musica, artista_id, album_cover_url, service_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                           (playlist_id, track.get('spotify_id'), track.get('titulo'), track.get('artista'), track.get('preview_url'), track.get('artista_id'), track.get('album_cover_url'), active_service_name))
-        ctx['db_connection'].commit(); return jsonify({"success": True, "message": "Playlist guardada!"})
+        cover_hash = ctx['cover_store'].guardar_data_url(cover_image)
+        # Cria ou aplica só as diferenças face às músicas guardadas, numa transação
+        _, alteracoes = ctx['playlists'].guardar_local(session['internal_user_id'], playlist_name, active_service_name,
+                                                       tracks, cover_hash=cover_hash)
+        return jsonify({"success": True, "message": "Playlist guardada!", "changes": alteracoes})
+    except PlaylistInvalidaError as e: return jsonify({"error": str(e)}), 400
     except sqlite3.IntegrityError: return jsonify({"error": f"Já existe uma playlist com o nome '{playlist_name}'."}), 409
     except Exception as e:
-        print(f"Erro ao guardar playlist: {e}"); return jsonify({"error": "Erro interno."}), 500
+        log.error("Erro ao guardar playlist: %s", e); return jsonify({"error": "Erro interno."}), 500
 
 @app.route('/api/rename_local_playlist/<int:playlist_id>', methods=['POST'])
 def rename_playlist_api(playlist_id):
@@ -575,26 +819,30 @@ def rename_playlist_api(playlist_id):
     if not new_name: return jsonify({"error": "Nome inválido."}), 400
     try:
         ctx = get_app_context()
-        cursor = ctx['db_connection'].cursor()
-        cursor.execute("SELECT id FROM playlists_salvas WHERE nome_playlist = ? AND usuario_id = ?", (new_name, session['internal_user_id']))
-        if cursor.fetchone(): return jsonify({"error": "Nome já existe."}), 409
-        cursor.execute("UPDATE playlists_salvas SET nome_playlist = ? WHERE id = ? AND usuario_id = ?", (new_name, playlist_id, session['internal_user_id']))
-        ctx['db_connection'].commit()
-        return jsonify({"success": cursor.rowcount > 0})
+        with ctx['db'].transacao() as cursor:
+            cursor.execute("SELECT id FROM playlists_salvas WHERE nome_playlist = ? AND usuario_id = ?", (new_name, session['internal_user_id']))
+            if cursor.fetchone(): return jsonify({"error": "Nome já existe."}), 409
+            cursor.execute("UPDATE playlists_salvas SET nome_playlist = ? WHERE id = ? AND usuario_id = ?", (new_name, playlist_id, session['internal_user_id']))
+            renomeada = cursor.rowcount > 0
+            if renomeada:
+                feed_cache.incrementar_geracao(cursor)
+        return jsonify({"success": renomeada})
     except Exception as e:
-        print(f"Erro ao renomear: {e}"); return jsonify({"error": "Erro interno."}), 500
+        log.error("Erro ao renomear: %s", e); return jsonify({"error": "Erro interno."}), 500
 
 @app.route('/api/delete_local_playlist/<int:playlist_id>', methods=['DELETE'])
 def delete_playlist_api(playlist_id):
     if 'internal_user_id' not in session: return jsonify({"error": "Utilizador não autenticado."}), 401
     try:
         ctx = get_app_context()
-        cursor = ctx['db_connection'].cursor()
-        cursor.execute("DELETE FROM playlists_salvas WHERE id = ? AND usuario_id = ?", (playlist_id, session['internal_user_id']))
-        ctx['db_connection'].commit()
-        return jsonify({"success": cursor.rowcount > 0})
+        with ctx['db'].transacao() as cursor:
+            cursor.execute("DELETE FROM playlists_salvas WHERE id = ? AND usuario_id = ?", (playlist_id, session['internal_user_id']))
+            apagada = cursor.rowcount > 0
+            if apagada:
+                feed_cache.incrementar_geracao(cursor)
+        return jsonify({"success": apagada})
     except Exception as e:
-        print(f"Erro ao apagar: {e}"); return jsonify({"error": "Erro interno."}), 500
+        log.error("Erro ao apagar: %s", e); return jsonify({"error": "Erro interno."}), 500
 
 @app.route('/api/community_playlists', methods=['GET'])
 def get_community_playlists():
@@ -602,17 +850,35 @@ def get_community_playlists():
     current_user_id = session['internal_user_id']
     try:
         ctx = get_app_context()
-        cursor = ctx['db_connection'].cursor()
-        query = "SELECT p.id, p.nome_playlist, u.display_name, p.playlist_url, p.service_name, p.cover_image FROM playlists_salvas p JOIN usuarios u ON p.usuario_id = u.id ORDER BY p.data_criacao DESC"
-        playlists = []
-        for p_id, p_name, p_creator, p_url, p_service, p_cover_image in cursor.execute(query).fetchall():
-            covers = [r[0] for r in cursor.execute("SELECT album_cover_url FROM playlist_musicas WHERE playlist_id = ? AND album_cover_url IS NOT NULL LIMIT 4", (p_id,))]
-            like_count = cursor.execute("SELECT COUNT(*) FROM playlist_likes WHERE playlist_id = ?", (p_id,)).fetchone()[0]
-            user_has_liked = cursor.execute("SELECT 1 FROM playlist_likes WHERE playlist_id = ? AND usuario_id = ?", (p_id, current_user_id)).fetchone() is not None
-            playlists.append({"id": p_id, "name": p_name, "creator": p_creator, "playlist_url": p_url, "service_name": p_service, "cover_image": p_cover_image, "cover_urls": covers, "like_count": like_count, "user_has_liked": user_has_liked})
-        return jsonify(playlists)
+        cursor_feed, limite = request.args.get('cursor'), request.args.get('limit', type=int)
+        with ctx['db'].conexao() as db_conn:
+            # O feed só muda quando a geração muda: se o cliente já tem esta versão, 304 sem corpo
+            geracao = feed_cache.ler_geracao(db_conn)
+            etag = feed_cache.FeedCache.etag(geracao, current_user_id, cursor_feed, limite)
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                corpo = ctx['feed_cache'].render(db_conn, geracao, current_user_id, cursor=cursor_feed, limite=limite)
+                response = app.response_class(corpo, mimetype='application/json')
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
     except Exception as e:
-        print(f"Erro ao buscar comunidade: {e}"); return jsonify({"error": "Erro interno."}), 500
+        log.error("Erro ao buscar comunidade: %s", e); return jsonify({"error": "Erro interno."}), 500
+
+@app.route('/covers/<cover_hash>.jpg')
+def cover_thumbnail(cover_hash):
+    """Miniatura da capa. O nome é o hash do conteúdo, por isso a resposta nunca muda."""
+    if request.if_none_match.contains_weak(cover_hash):
+        response = app.response_class(status=304)
+    else:
+        caminho = get_app_context()['cover_store'].caminho_miniatura(cover_hash)
+        if not caminho: abort(404)
+        response = send_file(caminho, mimetype='image/jpeg', conditional=False, etag=False)
+    response.set_etag(cover_hash)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/api/playlist/<int:playlist_id>/toggle_like', methods=['POST'])
 def toggle_playlist_like(playlist_id):
@@ -620,16 +886,19 @@ def toggle_playlist_like(playlist_id):
     user_id = session['internal_user_id']
     try:
         ctx = get_app_context()
-        cursor = ctx['db_connection'].cursor()
-        if cursor.execute("SELECT 1 FROM playlist_likes WHERE playlist_id = ? AND usuario_id = ?", (playlist_id, user_id)).fetchone():
-            cursor.execute("DELETE FROM playlist_likes WHERE playlist_id = ? AND usuario_id = ?", (playlist_id, user_id)); liked = False
-        else:
-            cursor.execute("INSERT INTO playlist_likes (playlist_id, usuario_id) VALUES (?, ?)", (playlist_id, user_id)); liked = True
-        ctx['db_connection'].commit()
-        like_count = cursor.execute("SELECT COUNT(*) FROM playlist_likes WHERE playlist_id = ?", (playlist_id,)).fetchone()[0]
+        # BEGIN IMMEDIATE serializa os toggles concorrentes (duplo clique) e os triggers mantêm like_count
+        with ctx['db'].transacao() as cursor:
+            if not cursor.execute("SELECT 1 FROM playlists_salvas WHERE id = ?", (playlist_id,)).fetchone():
+                return jsonify({"error": "Não encontrado."}), 404
+            cursor.execute("DELETE FROM playlist_likes WHERE playlist_id = ? AND usuario_id = ?", (playlist_id, user_id))
+            liked = cursor.rowcount == 0
+            if liked:
+                cursor.execute("INSERT OR IGNORE INTO playlist_likes (playlist_id, usuario_id) VALUES (?, ?)", (playlist_id, user_id))
+            feed_cache.incrementar_geracao(cursor, feed_cache.GERACAO_LIKES)
+            like_count = cursor.execute("SELECT like_count FROM playlists_salvas WHERE id = ?", (playlist_id,)).fetchone()[0]
         return jsonify({"success": True, "liked": liked, "new_like_count": like_count})
     except Exception as e:
-        print(f"Erro ao dar like: {e}"); return jsonify({"error": "Erro interno."}), 500
+        log.error("Erro ao dar like: %s", e); return jsonify({"error": "Erro interno."}), 500
     
 
 @app.route('/api/feedback', methods=['POST'])
@@ -664,5 +933,7 @@ def playlist_feedback_api():
     
     return jsonify({"success": sucesso})
 
+marcar('app_pronta')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -12,6 +12,11 @@ class MusicService:
     def search_artists(self, query, limit):
         raise NotImplementedError("Este método deve ser implementado pela subclasse.")
 
-    def create_playlist(self, user_client, playlist_name, tracks, description):
+    def create_playlist(self, user_client, playlist_name, tracks, description, ao_criar=None):
         # O user_id foi removido, pois cada serviço irá obtê-lo do cliente.
+        # ao_criar(playlist) é chamado logo que a playlist remota existe, antes de adicionar as faixas.
+        raise NotImplementedError("Este método deve ser implementado pela subclasse.")
+
+    def sync_playlist(self, user_client, playlist_id, tracks):
+        # Atualiza uma playlist remota existente aplicando apenas as diferenças.
         raise NotImplementedError("Este método deve ser implementado pela subclasse.")
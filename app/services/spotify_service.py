@@ -1,19 +1,97 @@
 # Nome do ficheiro: app/services/spotify_service.py
+from concurrent.futures import ThreadPoolExecutor
 from .base_service import MusicService
+from ..spotify_client import SpotifyRateLimitError
+from ..playlist_sync import planear_operacoes
+from .. import logs
+from .. import metrics
+from .. import tracing
+from ..result_cache import chave_de
+
+log = logs.obter('spotify')
+
+# Limite da API de busca do Spotify por página
+SEARCH_PAGE_MAX = 50
+# Limite de IDs por chamada a /audio-features
+AUDIO_FEATURES_BATCH = 100
+
+# Pool partilhado para pedir várias páginas de busca em paralelo
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='spotify-search')
+
 
 class SpotifyService(MusicService):
     """A implementação do MusicService para a plataforma Spotify."""
 
-    def __init__(self, spotify_client):
+    def __init__(self, spotify_client, features_cache=None, result_cache=None):
         self.sp_app = spotify_client
+        self.features_cache = features_cache
+        # Páginas de busca partilhadas entre workers (app/result_cache.py)
+        self.result_cache = result_cache
 
+    @metrics.medido('search_spotify')
     def search_tracks(self, query, limit=25, market='BR'):
         """Busca faixas no Spotify."""
         try:
             results = self.sp_app.search(q=query, limit=limit, type='track', market=market)
             return results.get('tracks', {}).get('items', [])
+        except SpotifyRateLimitError:
+            # Não é um resultado vazio: o chamador deve responder com Retry-After
+            raise
         except Exception as e:
-            print(f"[SpotifyService] Erro na busca: {e}"); return []
+            log.error("Erro na busca: %s", e); return []
+
+    def _search_page(self, query, page_size, offset, market):
+        chave = self.chave_pagina(query, page_size, offset, market)
+        items = self.result_cache.obter('busca_spotify', chave) if chave else None
+        if items is None:
+            results = self.sp_app.search(q=query, limit=page_size, offset=offset, type='track', market=market)
+            items = results.get('tracks', {}).get('items', [])
+            if chave:
+                self.result_cache.guardar('busca_spotify', chave, items)
+        return items
+
+    def chave_pagina(self, query, page_size, offset, market):
+        """Chave de uma página de busca na cache de resultados (None sem cache)."""
+        if self.result_cache is None or not self.result_cache.ativa:
+            return None
+        return chave_de('busca_spotify', query, page_size, offset, market)
+
+    @metrics.medido('search_spotify')
+    def search_tracks_paginated(self, query, limit=25, market='BR', aceitar=None, max_pages=3):
+        """
+        Busca várias páginas (offsets) em paralelo, numa única ronda de pedidos,
+        e passa as faixas por `aceitar` pela ordem de relevância até atingir `limit`.
+        `aceitar(item)` deve retornar True quando a faixa é aproveitada (ex.: ProcessadorFaixas.adicionar).
+        Retorna as faixas brutas aceites.
+        """
+        page_size = min(SEARCH_PAGE_MAX, max(limit, 10))
+        futures = [tracing.submeter(_search_executor, self._search_page, query, page_size, page * page_size, market)
+                   for page in range(max(1, max_pages))]
+        aceites = []
+        try:
+            for future in futures:
+                try:
+                    items = future.result()
+                except SpotifyRateLimitError:
+                    # Só propaga se nada foi obtido; caso contrário usa o que já chegou
+                    if aceites:
+                        break
+                    raise
+                except Exception as e:
+                    log.error("Erro numa página da busca: %s", e)
+                    continue
+                for item in items:
+                    if aceitar is None or aceitar(item):
+                        aceites.append(item)
+                        if len(aceites) >= limit:
+                            return aceites
+                if len(items) < page_size:
+                    # Não há mais resultados para esta query
+                    break
+            return aceites
+        finally:
+            for future in futures:
+                future.cancel()
 
     def get_recommendations_by_artists(self, artist_ids, limit=25, market='BR'):
         """Obtém recomendações do Spotify com base em artistas."""
@@ -21,21 +99,69 @@ class SpotifyService(MusicService):
             # A biblioteca spotipy lida com a formatação da lista de IDs.
             results = self.sp_app.recommendations(seed_artists=artist_ids, limit=limit, market=market)
             return results.get('tracks', [])
+        except SpotifyRateLimitError:
+            raise
         except Exception as e:
-            print(f"[SpotifyService] Erro nas recomendações por artista: {e}"); return None
+            log.error("Erro nas recomendações por artista: %s", e); return None
     
+    @metrics.medido('recommendations_spotify')
+    def get_recommendations(self, seed_genres, targets=None, limit=50, market='BR'):
+        """Obtém recomendações a partir de géneros semente e de alvos de audio features (ex.: {'energy': 0.8})."""
+        if not seed_genres:
+            return []
+        kwargs = {f"target_{k}": v for k, v in (targets or {}).items()}
+        try:
+            results = self.sp_app.recommendations(seed_genres=seed_genres[:5], limit=min(limit, 100), country=market, **kwargs)
+            return results.get('tracks', [])
+        except SpotifyRateLimitError:
+            raise
+        except Exception as e:
+            log.error("Erro nas recomendações por sementes: %s", e); return []
+
+    @metrics.medido('audio_features_spotify')
+    def get_audio_features(self, track_ids):
+        """
+        Retorna {track_id: features} (features pode ser None), consultando a cache local
+        primeiro e pedindo os restantes em lotes de até 100 IDs.
+        """
+        track_ids = [t for t in dict.fromkeys(track_ids) if t]
+        features = self.features_cache.get_many(track_ids) if self.features_cache else {}
+        em_falta = [t for t in track_ids if t not in features]
+        novos = {}
+        for i in range(0, len(em_falta), AUDIO_FEATURES_BATCH):
+            lote = em_falta[i:i + AUDIO_FEATURES_BATCH]
+            try:
+                resultados = self.sp_app.audio_features(lote) or []
+            except SpotifyRateLimitError:
+                raise
+            except Exception as e:
+                log.error("Erro ao obter audio features: %s", e)
+                continue
+            for track_id, item in zip(lote, resultados):
+                novos[track_id] = item
+        if novos and self.features_cache:
+            self.features_cache.put_many(novos)
+        features.update(novos)
+        return features
+
+    @metrics.medido('search_artists_spotify')
     def search_artists(self, query, limit=1):
         """Busca por artistas no Spotify."""
         try:
             results = self.sp_app.search(q=query, type='artist', limit=limit)
             return results.get('artists', {}).get('items', [])
+        except SpotifyRateLimitError:
+            raise
         except Exception as e:
-            print(f"[SpotifyService] Erro na busca de artistas: {e}"); return []
+            log.error("Erro na busca de artistas: %s", e); return []
 
-    def create_playlist(self, user_client, playlist_name, tracks, description="Playlist criada por PlayerV2 IA"):
+    @metrics.medido('playlist_create_spotify')
+    def create_playlist(self, user_client, playlist_name, tracks, description="Playlist criada por PlayerV2 IA", ao_criar=None):
         """
         Cria uma playlist na conta do utilizador do Spotify.
         O ID do utilizador é obtido diretamente do cliente autenticado para maior fiabilidade.
+        :param ao_criar: chamado com a playlist criada antes de adicionar as faixas (se estas
+            falharem, quem chamou já sabe que a playlist existe e não a volta a criar).
         """
         if not tracks:
             raise ValueError("A lista de músicas não pode estar vazia.")
@@ -51,6 +177,8 @@ class SpotifyService(MusicService):
                 description=description
             )
             playlist_id = nova_playlist['id']
+            if ao_criar:
+                ao_criar(nova_playlist)
             
             track_uris = [f"spotify:track:{track['spotify_id']}" for track in tracks]
             if track_uris:
@@ -60,5 +188,45 @@ class SpotifyService(MusicService):
             return nova_playlist
 
         except Exception as e:
-            print(f"[SpotifyService] Erro ao criar playlist: {e}")
+            log.error("Erro ao criar playlist: %s", e)
             raise
+
+    def _listar_faixas_playlist(self, user_client, playlist_id):
+        """Retorna os IDs das faixas da playlist remota, pela ordem atual."""
+        ids = []
+        page = user_client.playlist_items(playlist_id, fields='items(track(id)),next', limit=100, additional_types=('track',))
+        while page:
+            ids.extend((item.get('track') or {}).get('id') for item in page.get('items', []))
+            page = user_client.next(page) if page.get('next') else None
+        return ids
+
+    @metrics.medido('playlist_sync_spotify')
+    def sync_playlist(self, user_client, playlist_id, tracks):
+        """
+        Atualiza a playlist remota para ficar igual a `tracks`, aplicando só as
+        remoções, inserções e reordenações necessárias (e não recriando a playlist).
+        """
+        atuais = self._listar_faixas_playlist(user_client, playlist_id)
+        novos = [track['spotify_id'] for track in tracks]
+        operacoes = planear_operacoes(atuais, novos)
+        snapshot_id = None
+        for op in operacoes:
+            if op[0] == 'remover':
+                # Posições decrescentes: cada lote não desloca os seguintes
+                posicoes = op[1]
+                for i in range(0, len(posicoes), 100):
+                    itens = [{"uri": f"spotify:track:{atuais[p]}", "positions": [p]} for p in posicoes[i:i + 100]]
+                    snapshot_id = user_client.playlist_remove_specific_occurrences_of_items(
+                        playlist_id, itens, snapshot_id=snapshot_id).get('snapshot_id')
+            elif op[0] == 'inserir':
+                _, posicao, ids = op
+                for i in range(0, len(ids), 100):
+                    uris = [f"spotify:track:{t}" for t in ids[i:i + 100]]
+                    snapshot_id = user_client.playlist_add_items(playlist_id, uris, position=posicao + i).get('snapshot_id')
+            else:
+                _, de, antes_de = op
+                snapshot_id = user_client.playlist_reorder_items(
+                    playlist_id, range_start=de, insert_before=antes_de, snapshot_id=snapshot_id).get('snapshot_id')
+        log.info("Playlist %s sincronizada com %s operações.", playlist_id, len(operacoes))
+        return {'id': playlist_id, 'operacoes': len(operacoes),
+                'external_urls': {'spotify': f"https://open.spotify.com/playlist/{playlist_id}"}}
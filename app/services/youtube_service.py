@@ -1,26 +1,44 @@
 # Nome do ficheiro: app/services/youtube_service.py
-import yt_dlp
-import yt_dlp.utils
-from googleapiclient.discovery import build
-from googleapiclient.http import BatchHttpRequest
 from .base_service import MusicService
+from ..lazy import importar
+from ..playlist_sync import planear_operacoes
+from .. import cassette
+from .. import logs
+from .. import metrics
+from ..result_cache import chave_de
+
+log = logs.obter('youtube')
+
+
+def _yt_dlp():
+    # O yt-dlp demora a importar: só é carregado na primeira busca
+    importar('yt_dlp.utils')
+    return importar('yt_dlp')
+
+
+def build_youtube(**kwargs):
+    # googleapiclient só é carregado quando a API oficial é mesmo usada
+    return importar('..client_cache', __package__).build_youtube(**kwargs)
+
 
 class YouTubeMusicService(MusicService):
     """A implementação do MusicService para a plataforma YouTube Music."""
 
-    def __init__(self, developer_key=None):
+    def __init__(self, developer_key=None, result_cache=None):
         """
         Inicializa o serviço. Agora usa yt-dlp para buscas, que não requer chave de API.
         A chave de API ainda é usada para criar playlists (requer autenticação OAuth).
         :param developer_key: Opcional - chave de API da Google Cloud Console (para criar playlists).
         """
         self.developer_key = developer_key
+        # Resultados das buscas partilhados entre workers (app/result_cache.py)
+        self.result_cache = result_cache
         # yt-dlp não requer inicialização especial
 
     def _map_youtube_to_standard_format(self, entry):
         """Converte um item de vídeo do YouTube (yt-dlp ou API) para o nosso formato padrão."""
         if not isinstance(entry, dict):
-            print(f"[YouTubeService] [Map] ⚠ Entrada não é dict: {type(entry)}")
+            log.debug("Entrada não é dict: %s", type(entry), extra=logs.POR_ITEM)
             return None
             
         # Formato yt-dlp (com extract_flat=False ou True)
@@ -34,13 +52,13 @@ class YouTubeMusicService(MusicService):
                 video_id = url.split('watch?v=')[-1].split('&')[0].split('/')[0]
         
         if not video_id:
-            print(f"[YouTubeService] [Map] ⚠ Não foi possível extrair video_id. Chaves disponíveis: {list(entry.keys())[:10]}")
+            log.debug("Não foi possível extrair video_id; chaves: %s", list(entry.keys())[:10], extra=logs.POR_ITEM)
             return None
         
         # Obtém título
         title = entry.get('title', entry.get('fulltitle', entry.get('name', 'Sem título')))
         if not title or title == 'Sem título':
-            print(f"[YouTubeService] [Map] AVISO: Título não encontrado na entrada")
+            log.debug("Título não encontrado na entrada", extra=logs.POR_ITEM)
         
         # Obtém artista/canal - yt-dlp usa 'channel' quando extract_flat=False
         artist = (entry.get('channel') or entry.get('uploader') or 
@@ -76,23 +94,34 @@ class YouTubeMusicService(MusicService):
             'duration': duration_str,
         }
         
-        print(f"[YouTubeService] [Map] Mapeado: {title[:50]} - {artist[:30]} (ID: {video_id})")
+        log.debug("Mapeado: %.50s - %.30s (ID: %s)", title, artist, video_id, extra=logs.POR_ITEM)
         return track
 
+    @metrics.medido('search_youtube')
     def search_tracks(self, query, limit=25, market='BR'):
-        """Busca vídeos de música no YouTube usando yt-dlp."""
-        print(f"[YouTubeService] ===== INÍCIO DA BUSCA =====")
-        print(f"[YouTubeService] Query recebida: '{query}'")
-        print(f"[YouTubeService] Limite: {limit}, Market: {market}")
+        """Busca vídeos de música no YouTube usando yt-dlp (ou na cache de resultados)."""
+        chave = None
+        if self.result_cache is not None and self.result_cache.ativa:
+            chave = chave_de('busca_youtube', query, limit, market)
+            tracks = self.result_cache.obter('busca_youtube', chave)
+            if tracks is not None:
+                return tracks
+        tracks = self._buscar_yt_dlp(query, limit, market)
+        if chave and tracks:
+            # Buscas sem resultados (ex.: falha do yt-dlp) não são guardadas
+            self.result_cache.guardar('busca_youtube', chave, tracks)
+        return tracks
+
+    def _buscar_yt_dlp(self, query, limit, market):
+        yt_dlp = _yt_dlp()
+        log.debug("Busca: %r (limite=%s, market=%s)", query, limit, market)
         
         try:
             # Prepara a query de busca - se já contém "music", não adiciona novamente
             search_query = query
             if "music" not in query.lower() and " - " not in query:
                 search_query = f"{query} music"
-                print(f"[YouTubeService] Query ajustada: '{search_query}'")
-            else:
-                print(f"[YouTubeService] Query mantida como está: '{search_query}'")
+                log.debug("Query ajustada: %r", search_query)
             
             # Configurações do yt-dlp para busca
             # IMPORTANTE: extract_flat=True não funciona corretamente, precisa ser False
@@ -104,42 +133,38 @@ class YouTubeMusicService(MusicService):
                 'noplaylist': True,
                 'extractor_args': {'youtube': {'player_client': ['android', 'web']}},  # Evita problemas de JS
             }
-            print(f"[YouTubeService] Configurações yt-dlp: extract_flat=False, default_search=ytsearch{limit}")
             
             tracks = []
-            print(f"[YouTubeService] Inicializando yt-dlp...")
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                print(f"[YouTubeService] Chamando extract_info com: '{search_query}'")
-                result = ydl.extract_info(search_query, download=False)
-                print(f"[YouTubeService] ✓ extract_info concluído. Tipo do resultado: {type(result)}")
+                result = cassette.chamar('yt_dlp', {'query': search_query, 'opts': ydl_opts},
+                                         lambda: ydl.extract_info(search_query, download=False), cassette.codificar_yt_dlp)
+                metrics.registar_pedido_externo('yt_dlp', 200)
                 
                 # Com extract_flat=False, o resultado é um dict com 'entries' contendo os vídeos
                 if isinstance(result, dict):
                     entries = result.get('entries', [])
                     # Se entries está vazio mas result tem '_type': 'playlist', pode ser que não processou
                     if not entries and result.get('_type') == 'playlist':
-                        print(f"[YouTubeService] AVISO: Playlist vazia ou não processada")
+                        log.debug("Playlist vazia ou não processada")
                 elif isinstance(result, list):
                     entries = result
                 else:
                     entries = []
                 
                 if not entries:
-                    print(f"[YouTubeService] ❌ Nenhum resultado encontrado para: {search_query}")
-                    print(f"[YouTubeService] Tipo do resultado: {type(result)}")
+                    log.warning("Nenhum resultado encontrado para: %s", search_query)
+                    log.debug("Tipo do resultado: %s", type(result))
                     if isinstance(result, dict):
-                        print(f"[YouTubeService] Chaves do resultado: {list(result.keys())[:10]}")
-                        print(f"[YouTubeService] Conteúdo completo (primeiros 500 chars): {str(result)[:500]}")
-                    elif isinstance(result, list):
-                        print(f"[YouTubeService] Resultado é uma lista com {len(result)} itens")
+                        log.debug("Chaves do resultado: %s", list(result.keys())[:10])
+                        log.debug("Resultado (primeiros 500 caracteres): %.500s", result)
                     return []
                 
-                print(f"[YouTubeService] ✓ Encontradas {len(entries)} entradas brutas")
+                log.debug("Encontradas %d entradas brutas", len(entries))
                 
                 # Processa cada entrada
                 for idx, entry in enumerate(entries[:limit]):
                     if not entry:
-                        print(f"[YouTubeService] Entrada {idx} está vazia")
+                        log.debug("Entrada %d está vazia", idx, extra=logs.POR_ITEM)
                         continue
                     
                     try:
@@ -154,19 +179,17 @@ class YouTubeMusicService(MusicService):
                                     video_id = url.split('watch?v=')[-1].split('&')[0].split('/')[0]
                             
                             if video_id and len(video_id) >= 10:  # IDs válidos têm pelo menos 10-11 caracteres
-                                print(f"[YouTubeService] Processando entrada {idx}: ID={video_id}")
                                 track = self._map_youtube_to_standard_format(entry)
                                 if track:
-                                    print(f"[YouTubeService] Track mapeado: titulo={track.get('titulo')}, artista={track.get('artista')}, spotify_id={track.get('spotify_id')}")
+                                    log.debug("Track mapeado: %s - %s (%s)", track.get('titulo'), track.get('artista'), track.get('spotify_id'), extra=logs.POR_ITEM)
                                     if track.get('spotify_id'):
                                         tracks.append(track)
-                                        print(f"[YouTubeService] ✓ Adicionado: {track.get('titulo', 'N/A')} - {track.get('artista', 'N/A')}")
                                     else:
-                                        print(f"[YouTubeService] ⚠ Track sem spotify_id: {track}")
+                                        log.debug("Track sem spotify_id: %s", track, extra=logs.POR_ITEM)
                                 else:
-                                    print(f"[YouTubeService] ⚠ _map_youtube_to_standard_format retornou None para entrada {idx}")
+                                    log.debug("Entrada %d não pôde ser mapeada", idx, extra=logs.POR_ITEM)
                             else:
-                                print(f"[YouTubeService] ⚠ Entrada {idx} não tem ID válido. video_id={video_id}, entry keys: {list(entry.keys())[:10] if isinstance(entry, dict) else 'N/A'}")
+                                log.debug("Entrada %d não tem ID válido (video_id=%s)", idx, video_id, extra=logs.POR_ITEM)
                         elif isinstance(entry, str):
                             # Se for uma URL string
                             if 'watch?v=' in entry:
@@ -183,59 +206,53 @@ class YouTubeMusicService(MusicService):
                                         'id': video_id
                                     })
                     except Exception as e:
-                        print(f"[YouTubeService] Erro ao processar entrada {idx}: {e}")
-                        import traceback
-                        traceback.print_exc()
+                        log.warning("Erro ao processar entrada %d: %s", idx, e, exc_info=True)
                         continue
             
-            print(f"[YouTubeService] ===== RESULTADO FINAL =====")
-            print(f"[YouTubeService] Total de faixas processadas: {len(tracks)}")
-            if len(tracks) == 0:
-                print(f"[YouTubeService] ❌ AVISO CRÍTICO: Nenhum resultado encontrado!")
-                print(f"[YouTubeService] Query usada: {search_query}")
-                print(f"[YouTubeService] Entradas brutas encontradas: {len(entries) if 'entries' in locals() else 0}")
-            else:
-                print(f"[YouTubeService] ✓ Sucesso! Primeiras 3 faixas:")
-                for i, track in enumerate(tracks[:3], 1):
-                    print(f"[YouTubeService]   {i}. {track.get('titulo', 'N/A')} - {track.get('artista', 'N/A')}")
-            print(f"[YouTubeService] ===== FIM DA BUSCA =====")
+            log.info("Busca %r: %d faixas (%d entradas brutas)", search_query, len(tracks), len(entries))
+            if not tracks:
+                log.warning("Nenhuma faixa válida para a query: %s", search_query)
             return tracks if tracks else []
             
         except yt_dlp.utils.DownloadError as e:
-            print(f"[YouTubeService] Erro de download do yt-dlp: {e}")
-            print(f"[YouTubeService] Detalhes: {str(e)}")
+            metrics.registar_pedido_externo('yt_dlp')
+            log.error("Erro de download do yt-dlp: %s", e)
             # Fallback para API antiga se yt-dlp falhar
             if self.developer_key:
                 try:
-                    print("[YouTubeService] Tentando fallback com API oficial...")
+                    log.info("A tentar fallback com a API oficial...")
                     return self._search_with_api(query, limit)
                 except Exception as e2:
-                    print(f"[YouTubeService] Fallback também falhou: {e2}")
+                    log.error("Fallback também falhou: %s", e2)
             return []
         except Exception as e:
-            print(f"[YouTubeService] Erro inesperado na busca com yt-dlp: {e}")
-            import traceback
-            traceback.print_exc()
+            log.error("Erro inesperado na busca com yt-dlp: %s", e, exc_info=True)
             # Fallback para API antiga se yt-dlp falhar
             if self.developer_key:
                 try:
-                    print("[YouTubeService] Tentando fallback com API oficial...")
+                    log.info("A tentar fallback com a API oficial...")
                     return self._search_with_api(query, limit)
                 except Exception as e2:
-                    print(f"[YouTubeService] Fallback também falhou: {e2}")
+                    log.error("Fallback também falhou: %s", e2)
             return []
     
     def _search_with_api(self, query, limit):
         """Método de fallback usando a API oficial (se disponível)."""
-        youtube_client = build('youtube', 'v3', developerKey=self.developer_key)
+        youtube_client = build_youtube(developer_key=self.developer_key)
         search_query = query if " - " in query else query + " music"
-        search_response = youtube_client.search().list(
-            q=search_query,
-            part='snippet',
-            maxResults=limit,
-            type='video',
-            videoCategoryId='10'
-        ).execute()
+        try:
+            search_response = youtube_client.search().list(
+                q=search_query,
+                part='snippet',
+                maxResults=limit,
+                type='video',
+                videoCategoryId='10'
+            ).execute()
+        except Exception as e:
+            # HttpError do googleapiclient: o código HTTP está em e.resp.status
+            metrics.registar_pedido_externo('youtube_api', getattr(getattr(e, 'resp', None), 'status', None))
+            raise
+        metrics.registar_pedido_externo('youtube_api', 200)
         items = search_response.get('items', [])
         return [self._map_youtube_to_standard_format(item) for item in items]
 
@@ -248,11 +265,13 @@ class YouTubeMusicService(MusicService):
             artist_query = artist_ids[0] if isinstance(artist_ids[0], str) and not artist_ids[0].startswith('UC') else f"channel:{artist_ids[0]}"
             return self.search_tracks(artist_query, limit=limit, market=market)
         except Exception as e:
-            print(f"[YouTubeService] Erro nas recomendações: {e}")
+            log.error("Erro nas recomendações: %s", e)
             return []
     
+    @metrics.medido('search_artists_youtube')
     def search_artists(self, query, limit=1):
         """Busca por canais (artistas) no YouTube usando yt-dlp."""
+        yt_dlp = _yt_dlp()
         try:
             ydl_opts = {
                 'quiet': True,
@@ -263,7 +282,8 @@ class YouTubeMusicService(MusicService):
             
             artists = []
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                result = ydl.extract_info(f"{query} artist", download=False)
+                result = cassette.chamar('yt_dlp', {'query': f"{query} artist", 'opts': ydl_opts},
+                                         lambda: ydl.extract_info(f"{query} artist", download=False), cassette.codificar_yt_dlp)
                 entries = result.get('entries', [])
                 
                 for entry in entries[:limit]:
@@ -275,14 +295,16 @@ class YouTubeMusicService(MusicService):
             
             return artists
         except Exception as e:
-            print(f"[YouTubeService] Erro na busca de artistas: {e}")
+            log.error("Erro na busca de artistas: %s", e)
             return []
 
     # --- MÉTODO ATUALIZADO: O parâmetro 'user_id' foi removido ---
-    def create_playlist(self, user_client, playlist_name, tracks, description="Playlist criada por PlayerV2 IA"):
+    @metrics.medido('playlist_create_youtube')
+    def create_playlist(self, user_client, playlist_name, tracks, description="Playlist criada por PlayerV2 IA", ao_criar=None):
         """
         Cria uma playlist no YouTube e adiciona os vídeos (músicas) em lote.
         :param user_client: Um cliente da API do YouTube autenticado para o utilizador.
+        :param ao_criar: chamado com a playlist criada antes de adicionar os vídeos.
         """
         if not tracks: raise ValueError("A lista de músicas não pode estar vazia.")
         
@@ -295,11 +317,13 @@ class YouTubeMusicService(MusicService):
             playlist_response = user_client.playlists().insert(part='snippet,status', body=playlist_body).execute()
             playlist_id = playlist_response['id']
             playlist_url = f"https://www.youtube.com/playlist?list={playlist_id}"
+            if ao_criar:
+                ao_criar({'external_urls': {'youtube': playlist_url}, 'id': playlist_id})
 
             # 2. Adiciona vídeos em lote (batch) para ser mais eficiente
             def batch_callback(request_id, response, exception):
                 if exception:
-                    print(f"Erro ao adicionar item à playlist do YouTube no pedido {request_id}: {exception}")
+                    log.error("Erro ao adicionar item à playlist do YouTube no pedido %s: %s", request_id, exception)
 
             batch = user_client.new_batch_http_request(callback=batch_callback)
 
@@ -320,5 +344,70 @@ class YouTubeMusicService(MusicService):
             return {'external_urls': {'youtube': playlist_url}, 'id': playlist_id}
 
         except Exception as e:
-            print(f"[YouTubeService] Erro ao criar playlist no YouTube: {e}")
+            log.error("Erro ao criar playlist no YouTube: %s", e)
             raise
+
+    def _listar_itens_playlist(self, user_client, playlist_id):
+        """Retorna [(playlistItemId, videoId)] da playlist remota, pela ordem atual."""
+        itens = []
+        pedido = user_client.playlistItems().list(part='snippet', playlistId=playlist_id, maxResults=50)
+        while pedido is not None:
+            resposta = pedido.execute()
+            for item in resposta.get('items', []):
+                itens.append((item['id'], item['snippet']['resourceId'].get('videoId')))
+            pedido = user_client.playlistItems().list_next(pedido, resposta)
+        return itens
+
+    @metrics.medido('playlist_sync_youtube')
+    def sync_playlist(self, user_client, playlist_id, tracks):
+        """
+        Atualiza a playlist do YouTube para ficar igual a `tracks`, apagando,
+        inserindo e reposicionando apenas os itens necessários.
+        """
+        itens = self._listar_itens_playlist(user_client, playlist_id)
+        item_ids = [item_id for item_id, _ in itens]
+        video_do_item = dict(itens)
+        novos = [track.get('spotify_id') for track in tracks]
+        operacoes = planear_operacoes([video_id for _, video_id in itens], novos)
+
+        def snippet(video_id, posicao):
+            return {'snippet': {'playlistId': playlist_id, 'position': posicao,
+                                'resourceId': {'kind': 'youtube#video', 'videoId': video_id}}}
+
+        for op in operacoes:
+            if op[0] == 'remover':
+                # As remoções são independentes da ordem: vão num único lote
+                falhas = []
+
+                def batch_callback(request_id, response, exception):
+                    # 404: o item já não existe, que é o que se pretendia
+                    if exception and getattr(getattr(exception, 'resp', None), 'status', None) != 404:
+                        falhas.append(exception)
+
+                batch = user_client.new_batch_http_request(callback=batch_callback)
+                for posicao in op[1]:
+                    batch.add(user_client.playlistItems().delete(id=item_ids[posicao]))
+                batch.execute()
+                if falhas:
+                    # As posições locais já não correspondem à playlist remota: aborta. A nova
+                    # tentativa da tarefa volta a listar a playlist e a planear as operações.
+                    log.error("Falharam %d remoções na playlist %s do YouTube: %s", len(falhas), playlist_id, falhas[0])
+                    raise falhas[0]
+                for posicao in op[1]:
+                    del item_ids[posicao]
+            elif op[0] == 'inserir':
+                _, posicao, ids = op
+                for k, video_id in enumerate(ids):
+                    resposta = user_client.playlistItems().insert(part='snippet', body=snippet(video_id, posicao + k)).execute()
+                    item_ids.insert(posicao + k, resposta['id'])
+            else:
+                _, de, antes_de = op
+                destino = antes_de - 1 if de < antes_de else antes_de
+                item_id = item_ids.pop(de)
+                body = snippet(video_do_item[item_id], destino)
+                body['id'] = item_id
+                user_client.playlistItems().update(part='snippet', body=body).execute()
+                item_ids.insert(destino, item_id)
+        log.info("Playlist %s sincronizada com %d operações.", playlist_id, len(operacoes))
+        return {'external_urls': {'youtube': f"https://www.youtube.com/playlist?list={playlist_id}"},
+                'id': playlist_id, 'operacoes': len(operacoes)}
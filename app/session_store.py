@@ -0,0 +1,249 @@
+# Nome do ficheiro: app/session_store.py
+"""
+Sessões do Flask guardadas no servidor: o cookie leva só um identificador opaco.
+
+Com a sessão por omissão do Flask, o token_info (access/refresh token e, no
+YouTube, client_id e client_secret) viajava num cookie assinado de vários KB,
+enviado e verificado (HMAC) em todos os pedidos, incluindo páginas estáticas e
+/api/user_status.
+
+- os dados ficam na tabela `sessoes` (migração v9), cifrados com Fernet; a
+  chave vem de SESSAO_CHAVES ou é derivada de app.secret_key;
+- na tabela a sessão é identificada pelo sha256 do identificador do cookie:
+  quem ler a base de dados não obtém cookies válidos;
+- um LRU por processo guarda as sessões já decifradas; a coluna `versao` é
+  comparada em cada leitura, por isso uma alteração (ou logout) noutro worker
+  é vista de imediato;
+- as sessões expiram ao fim de PERMANENT_SESSION_LIFETIME sem uso; o prazo é
+  renovado no máximo uma vez por RENOVAR_APOS e as expiradas são removidas
+  periodicamente (LIMPEZA_INTERVALO);
+- o identificador muda quando o utilizador autenticado muda (login, troca de
+  conta), para um identificador obtido antes do login não dar acesso à conta.
+"""
+import base64
+import hashlib
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSession, SessionInterface
+from flask.json.tag import TaggedJSONSerializer
+
+from . import logs
+from . import metrics
+from .lazy import importar
+
+log = logs.obter('session_store')
+
+SESSAO_MEMORIA = int(os.environ.get('SESSAO_MEMORIA', '5000'))
+# Chaves Fernet separadas por vírgulas; a primeira cifra, todas decifram (rotação de chaves)
+SESSAO_CHAVES = os.environ.get('SESSAO_CHAVES', '')
+# Evita uma escrita por pedido só para prolongar o prazo
+RENOVAR_APOS = 3600
+LIMPEZA_INTERVALO = 600
+# Chave da sessão com o utilizador autenticado (ver server.callback_spotify/callback_youtube)
+CHAVE_UTILIZADOR = 'internal_user_id'
+
+
+def criar_fernet(secret_key):
+    """MultiFernet com as chaves de SESSAO_CHAVES ou, sem elas, uma chave derivada de `secret_key`."""
+    fernet = importar('cryptography.fernet')
+    chaves = [c.strip() for c in SESSAO_CHAVES.split(',') if c.strip()]
+    if not chaves:
+        segredo = secret_key.encode('utf-8') if isinstance(secret_key, str) else secret_key
+        chaves = [base64.urlsafe_b64encode(hashlib.sha256(b'sessoes:' + segredo).digest())]
+    return fernet.MultiFernet([fernet.Fernet(c) for c in chaves])
+
+
+def referencia(sid):
+    """Chave da sessão na tabela: identifica-a sem ser um cookie válido (ex.: em tarefas em segundo plano)."""
+    return hashlib.sha256(sid.encode('ascii', 'replace')).hexdigest()
+
+
+class SessionStore:
+    """Sessões cifradas em SQLite (partilhadas entre workers) + LRU em memória por processo."""
+
+    def __init__(self, db, fernet, memory_size=None):
+        self.db = db
+        self.fernet = fernet
+        self.memory_size = SESSAO_MEMORIA if memory_size is None else memory_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._ultima_limpeza = time.time()
+        self._cifra_invalida = importar('cryptography.fernet').InvalidToken
+
+    def _lembrar(self, chave, versao, texto, expira):
+        self._memory[chave] = (versao, texto, expira)
+        self._memory.move_to_end(chave)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _esquecer(self, chave):
+        with self._lock:
+            self._memory.pop(chave, None)
+
+    def carregar(self, sid):
+        """(texto, versao, expira) da sessão `sid`, ou None se não existir ou tiver expirado."""
+        return self.carregar_referencia(referencia(sid))
+
+    def carregar_referencia(self, chave):
+        """Como `carregar`, a partir de `referencia(sid)`."""
+        agora = time.time()
+        with self._lock:
+            memoria = self._memory.get(chave)
+        # Os dados só são lidos (e decifrados) se a versão em memória estiver desatualizada
+        with self.db.conexao() as conn:
+            row = conn.execute("SELECT versao, expira, CASE WHEN versao = ? THEN NULL ELSE dados END "
+                               "FROM sessoes WHERE id = ? AND expira > ?",
+                               (memoria[0] if memoria else -1, chave, agora)).fetchone()
+        if row is None:
+            if memoria:
+                self._esquecer(chave)
+            metrics.registar_cache('sessoes', falhas=1)
+            return None
+        versao, expira, cifrado = row
+        if cifrado is None:
+            metrics.registar_cache('sessoes', acertos=1)
+            texto = memoria[1]
+        else:
+            metrics.registar_cache('sessoes', falhas=1)
+            try:
+                texto = self.fernet.decrypt(cifrado).decode('utf-8')
+            except self._cifra_invalida:
+                # Chave mudou (ex.: FLASK_SECRET_KEY aleatória num novo arranque): começa uma sessão nova
+                log.warning("Sessão com cifra inválida; ignorada")
+                return None
+        with self._lock:
+            self._lembrar(chave, versao, texto, expira)
+        return texto, versao, expira
+
+    def guardar(self, sid, texto, expira):
+        """Grava a sessão e devolve a nova versão."""
+        chave = referencia(sid)
+        with self.db.transacao() as cursor:
+            # A versão é incrementada na própria base de dados (transação de escrita): dois workers
+            # que gravem a mesma sessão ao mesmo tempo ficam com versões diferentes, e quem tiver
+            # em memória a versão que perdeu volta a ler os dados
+            cursor.execute("""
+                INSERT INTO sessoes (id, dados, versao, expira) VALUES (?, ?, 1, ?)
+                ON CONFLICT(id) DO UPDATE SET dados = excluded.dados, versao = sessoes.versao + 1, expira = excluded.expira
+            """, (chave, self.fernet.encrypt(texto.encode('utf-8')), expira))
+            versao = cursor.execute("SELECT versao FROM sessoes WHERE id = ?", (chave,)).fetchone()[0]
+        with self._lock:
+            self._lembrar(chave, versao, texto, expira)
+        self._talvez_limpar()
+        return versao
+
+    def renovar(self, sid, expira):
+        """Prolonga o prazo sem reescrever os dados."""
+        chave = referencia(sid)
+        with self.db.transacao() as cursor:
+            cursor.execute("UPDATE sessoes SET expira = ? WHERE id = ?", (expira, chave))
+        with self._lock:
+            memoria = self._memory.get(chave)
+            if memoria:
+                self._memory[chave] = (memoria[0], memoria[1], expira)
+        self._talvez_limpar()
+
+    def apagar(self, sid):
+        chave = referencia(sid)
+        self._esquecer(chave)
+        with self.db.transacao() as cursor:
+            cursor.execute("DELETE FROM sessoes WHERE id = ?", (chave,))
+
+    def limpar_expiradas(self):
+        """Remove as sessões expiradas. Retorna quantas foram removidas."""
+        agora = time.time()
+        with self._lock:
+            self._ultima_limpeza = agora
+            for chave in [c for c, (_, _, expira) in self._memory.items() if expira <= agora]:
+                del self._memory[chave]
+        with self.db.transacao() as cursor:
+            cursor.execute("DELETE FROM sessoes WHERE expira <= ?", (agora,))
+            removidas = cursor.rowcount
+        if removidas:
+            log.debug("%s sessões expiradas removidas", removidas)
+        return removidas
+
+    def _talvez_limpar(self):
+        if time.time() - self._ultima_limpeza < LIMPEZA_INTERVALO:
+            return
+        try:
+            self.limpar_expiradas()
+        except Exception as e:
+            log.error("Erro ao remover sessões expiradas: %s", e)
+
+
+class ServerSession(SecureCookieSession):
+    """Sessão do Flask com o identificador e a versão da linha em `sessoes`."""
+
+    def __init__(self, initial=None, sid=None, versao=0, expira=0.0):
+        super().__init__(initial)
+        self.sid = sid
+        self.versao = versao
+        self.expira = expira
+        # Utilizador no início do pedido: se mudar, o identificador é renovado
+        # (dict.get: SecureCookieSession.get marcaria a sessão como acedida)
+        self.utilizador = dict.get(self, CHAVE_UTILIZADOR)
+
+
+class ServerSessionInterface(SessionInterface):
+    """SessionInterface com os dados no SessionStore; `obter_store` cria-o no primeiro uso."""
+
+    session_class = ServerSession
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, obter_store):
+        self.obter_store = obter_store
+
+    def open_session(self, app, request):
+        # Ficheiros estáticos não usam a sessão: nem a base de dados é consultada
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            return self.session_class()
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return self.session_class()
+        try:
+            carregada = self.obter_store().carregar(sid)
+        except Exception as e:
+            log.error("Erro ao ler a sessão: %s", e)
+            carregada = None
+        if carregada is None:
+            return self.session_class()
+        texto, versao, expira = carregada
+        try:
+            return self.session_class(self.serializer.loads(texto), sid=sid, versao=versao, expira=expira)
+        except ValueError:
+            return self.session_class()
+
+    def save_session(self, app, session, response):
+        nome = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        caminho = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session:
+            if session.modified and session.sid:
+                self.obter_store().apagar(session.sid)
+                response.delete_cookie(nome, domain=dominio, path=caminho, secure=self.get_cookie_secure(app),
+                                       partitioned=self.get_cookie_partitioned(app),
+                                       samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+        store = self.obter_store()
+        expira = time.time() + app.permanent_session_lifetime.total_seconds()
+        novo_sid = not session.sid or dict.get(session, CHAVE_UTILIZADOR) != session.utilizador
+        if novo_sid:
+            if session.sid:
+                store.apagar(session.sid)
+            session.sid, session.versao = secrets.token_urlsafe(32), 0
+        if novo_sid or session.modified:
+            session.versao = store.guardar(session.sid, self.serializer.dumps(dict(session)), expira)
+        elif expira - session.expira > RENOVAR_APOS:
+            store.renovar(session.sid, expira)
+        if novo_sid or self.should_set_cookie(app, session):
+            response.set_cookie(nome, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=dominio, path=caminho,
+                                secure=self.get_cookie_secure(app), partitioned=self.get_cookie_partitioned(app),
+                                samesite=self.get_cookie_samesite(app))
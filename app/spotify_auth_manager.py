@@ -1,10 +1,14 @@
 import os
 import webbrowser
-import spotipy
-from spotipy.oauth2 import SpotifyOAuth, SpotifyClientCredentials
+from spotipy.oauth2 import SpotifyOAuth
 
 
 from . import config_credentials as creds
+from . import logs
+from .spotify_client import RateLimitedSpotify, get_shared_app_client
+
+log = logs.obter('spotify_auth')
+
 
 class SpotifyAuthManager:
     SCOPES = "playlist-modify-public playlist-modify-private"
@@ -25,14 +29,13 @@ class SpotifyAuthManager:
         self.client_secret = client_secret
     
     def get_app_client(self):
-        """Retorna um cliente Spotipy para buscas públicas (Client Credentials)."""
+        """Retorna o cliente Spotipy partilhado para buscas públicas (Client Credentials)."""
         try:
-            auth_manager = SpotifyClientCredentials(client_id=self.client_id, client_secret=self.client_secret)
-            sp = spotipy.Spotify(auth_manager=auth_manager)
-            print("[Auth Manager] Autenticação da aplicação Spotify bem-sucedida.")
+            sp = get_shared_app_client(self.client_id, self.client_secret)
+            log.info("Autenticação da aplicação Spotify bem-sucedida.")
             return sp
         except Exception as e: 
-            print(f"[Auth Manager] Falha na autenticação da aplicação: {e}")
+            log.error("Falha na autenticação da aplicação: %s", e)
             return None
 
     def get_oauth_manager(self, session):
@@ -47,7 +50,7 @@ class SpotifyAuthManager:
     def get_user_client(self, token_info):
         """Cria um cliente Spotipy a partir das informações do token."""
         if not token_info: return None
-        return spotipy.Spotify(auth=token_info['access_token'])
+        return RateLimitedSpotify(auth=token_info['access_token'])
 
     def logout(self, user_id):
         """Faz logout do utilizador, apagando o seu ficheiro de cache."""
@@ -55,6 +58,6 @@ class SpotifyAuthManager:
             cache_file = f"{self.CACHE_FILE_PREFIX}{user_id}"
             if os.path.exists(cache_file): 
                 os.remove(cache_file)
-                print(f"[Auth Manager] Cache removido para {user_id}.")
+                log.debug("Cache removido para %s.", user_id)
                 return True
         return False
@@ -0,0 +1,276 @@
+# Nome do ficheiro: app/spotify_client.py
+"""
+Camada partilhada de acesso à Web API do Spotify.
+
+Todos os clientes Spotipy do processo (aplicação e utilizadores) passam por aqui:
+- um pool de ligações HTTP afinado, partilhado entre clientes;
+- um rate limiter (token bucket) global ao processo;
+- tratamento de 429 com respeito pelo cabeçalho Retry-After, com espera limitada;
+- renovação antecipada, em segundo plano, do token de client credentials;
+- contadores de chamadas/latência por endpoint.
+"""
+import asyncio
+import os
+import functools
+import re
+import threading
+import time
+
+import requests
+import spotipy
+from requests.adapters import HTTPAdapter
+from spotipy.exceptions import SpotifyException
+from spotipy.oauth2 import SpotifyClientCredentials
+from urllib3.util.retry import Retry
+
+from . import cassette
+from . import logs
+from .errors import SpotifyRateLimitError
+
+log = logs.obter('spotify_client')
+
+# --- Configuração (pode ser ajustada por variáveis de ambiente) ---
+RATE_PER_SECOND = float(os.environ.get('SPOTIFY_RATE_PER_SECOND', '8'))
+RATE_BURST = int(os.environ.get('SPOTIFY_RATE_BURST', '16'))
+POOL_SIZE = int(os.environ.get('SPOTIFY_POOL_SIZE', '16'))
+MAX_RETRY_AFTER = float(os.environ.get('SPOTIFY_MAX_RETRY_AFTER', '5'))
+MAX_429_RETRIES = int(os.environ.get('SPOTIFY_MAX_429_RETRIES', '2'))
+REQUESTS_TIMEOUT = float(os.environ.get('SPOTIFY_REQUESTS_TIMEOUT', '8'))
+TOKEN_REFRESH_MARGIN = int(os.environ.get('SPOTIFY_TOKEN_REFRESH_MARGIN', '300'))
+
+
+class TokenBucket:
+    """Token bucket thread-safe. `rate` fichas por segundo, até `capacity` acumuladas."""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Suspende a emissão de fichas (usado quando o Spotify devolve 429)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+    def paused_for(self):
+        """Segundos que ainda faltam da pausa imposta por um 429 (0 se não estiver em pausa)."""
+        with self._lock:
+            return max(0.0, self._paused_until - time.monotonic())
+
+    def _try_acquire(self):
+        """Tenta obter uma ficha sem esperar. Retorna 0 se obteve, senão os segundos até haver uma."""
+        with self._lock:
+            now = time.monotonic()
+            if now >= self._paused_until:
+                self._tokens = min(self.capacity, self._tokens + (now - max(self._last, self._paused_until)) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return 0.0
+                return (1.0 - self._tokens) / self.rate
+            self._last = self._paused_until
+            return self._paused_until - now
+
+    def acquire(self, timeout=None):
+        """
+        Bloqueia até obter uma ficha. Retorna False, sem esperar em vão, se a
+        próxima ficha só estiver disponível depois do timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    async def acquire_async(self, timeout=None):
+        """Como `acquire()`, mas espera sem ocupar a thread (modo ASGI)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self._try_acquire()
+            if not wait:
+                return True
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            await asyncio.sleep(wait)
+
+
+class SpotifyCallStats:
+    """Contadores de chamadas e latência agregados por endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, endpoint, elapsed_ms, status):
+        with self._lock:
+            s = self._stats.get(endpoint)
+            if s is None:
+                s = self._stats[endpoint] = {'calls': 0, 'errors': 0, 'rate_limited': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+            s['calls'] += 1
+            s['total_ms'] += elapsed_ms
+            if elapsed_ms > s['max_ms']:
+                s['max_ms'] = elapsed_ms
+            if status == 429:
+                s['rate_limited'] += 1
+            elif status >= 400:
+                s['errors'] += 1
+
+    def snapshot(self):
+        """Retorna uma cópia dos contadores, com a latência média calculada."""
+        with self._lock:
+            result = {}
+            for endpoint, s in self._stats.items():
+                item = dict(s)
+                item['avg_ms'] = round(s['total_ms'] / s['calls'], 2) if s['calls'] else 0.0
+                result[endpoint] = item
+            return result
+
+
+# Segmentos que precedem um identificador no caminho do endpoint
+_ID_PARENTS = {'users', 'playlists', 'tracks', 'albums', 'artists', 'audio-features', 'audio-analysis', 'shows', 'episodes'}
+_PREFIX_RE = re.compile(r'^https?://[^/]+/v1/')
+
+
+def _normalizar_endpoint(url):
+    """Reduz um URL da API a um nome de endpoint estável (ex.: 'playlists/{id}/tracks')."""
+    path = _PREFIX_RE.sub('', url).split('?', 1)[0].strip('/')
+    partes = path.split('/')
+    for i in range(1, len(partes)):
+        if partes[i - 1] in _ID_PARENTS:
+            partes[i] = '{id}'
+    return '/'.join(partes) or 'root'
+
+
+# --- Estado partilhado pelo processo ---
+rate_limiter = TokenBucket(RATE_PER_SECOND, RATE_BURST)
+call_stats = SpotifyCallStats()
+_session_lock = threading.Lock()
+_shared_session = None
+
+
+def get_http_session():
+    """Sessão HTTP partilhada, com pool de ligações dimensionado para acessos concorrentes."""
+    global _shared_session
+    with _session_lock:
+        if _shared_session is None:
+            session = requests.Session()
+            # 429 fica de fora: é tratado em RateLimitedSpotify com espera limitada
+            retry = Retry(
+                total=3, connect=3, read=False, status=2,
+                backoff_factor=0.3,
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+                respect_retry_after_header=False,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=retry)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _shared_session = session
+        return _shared_session
+
+
+class RateLimitedSpotify(spotipy.Spotify):
+    """Cliente Spotipy que passa pelo rate limiter do processo e trata 429 de forma limitada."""
+
+    def __init__(self, *args, limiter=None, stats=None, max_retry_after=MAX_RETRY_AFTER, **kwargs):
+        kwargs.setdefault('requests_session', get_http_session())
+        kwargs.setdefault('requests_timeout', REQUESTS_TIMEOUT)
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter or rate_limiter
+        self.stats = stats or call_stats
+        self.max_retry_after = max_retry_after
+
+    def _internal_call(self, method, url, payload, params):
+        endpoint = _normalizar_endpoint(url)
+        attempt = 0
+        while True:
+            # Durante uma pausa longa (Retry-After acima do limite) falha logo em vez de
+            # bloquear a thread do pedido até a pausa acabar
+            if not self.limiter.acquire(timeout=self.max_retry_after):
+                raise SpotifyRateLimitError(max(1.0, self.limiter.paused_for()), endpoint)
+            start = time.perf_counter()
+            status = 200
+            try:
+                return cassette.chamar(
+                    'spotify', {'method': method, 'url': url, 'payload': payload, 'params': params},
+                    functools.partial(super()._internal_call, method, url, payload, params))
+            except SpotifyException as e:
+                status = e.http_status or 500
+                if status != 429:
+                    raise
+                retry_after = self._retry_after(e)
+                # Todo o processo abranda: o limite do Spotify é por aplicação
+                self.limiter.pause(retry_after)
+                if retry_after > self.max_retry_after or attempt >= MAX_429_RETRIES:
+                    log.warning("429 em '%s', Retry-After=%ss. A desistir.", endpoint, retry_after)
+                    raise SpotifyRateLimitError(retry_after, endpoint) from e
+                attempt += 1
+                log.warning("429 em '%s', a aguardar %ss (tentativa %s).", endpoint, retry_after, attempt)
+            finally:
+                self.stats.record(endpoint, (time.perf_counter() - start) * 1000.0, status)
+
+    @staticmethod
+    def _retry_after(exc):
+        headers = getattr(exc, 'headers', None) or {}
+        try:
+            return max(0.0, float(headers.get('Retry-After', 1)))
+        except (TypeError, ValueError):
+            return 1.0
+
+
+class ProactiveClientCredentials(SpotifyClientCredentials):
+    """Client credentials que renova o token em segundo plano antes de expirar."""
+
+    def __init__(self, *args, refresh_margin=TOKEN_REFRESH_MARGIN, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_margin = refresh_margin
+        self._refresh_thread = None
+        self._stop = threading.Event()
+
+    def start_background_refresh(self):
+        if self._refresh_thread is not None:
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='spotify-token-refresh', daemon=True)
+        self._refresh_thread.start()
+
+    def stop_background_refresh(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            try:
+                token_info = self.cache_handler.get_cached_token()
+                if not token_info or token_info.get('expires_at', 0) - time.time() <= self.refresh_margin:
+                    self.get_access_token(as_dict=False, check_cache=False)
+                    token_info = self.cache_handler.get_cached_token()
+                wait = token_info.get('expires_at', 0) - time.time() - self.refresh_margin
+            except Exception as e:
+                log.error("Falha ao renovar o token da aplicação: %s", e)
+                wait = 30
+            self._stop.wait(max(wait, 5))
+
+
+_app_client_lock = threading.Lock()
+_app_clients = {}
+
+
+def get_shared_app_client(client_id, client_secret):
+    """Retorna o cliente da aplicação (client credentials) partilhado pelo processo."""
+    with _app_client_lock:
+        client = _app_clients.get(client_id)
+        if client is None:
+            auth_manager = ProactiveClientCredentials(client_id=client_id, client_secret=client_secret)
+            # Em replay o token nunca é usado: não há pedidos ao Spotify
+            if not cassette.reproduzindo():
+                auth_manager.start_background_refresh()
+            client = RateLimitedSpotify(auth_manager=auth_manager)
+            _app_clients[client_id] = client
+        return client
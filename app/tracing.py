@@ -0,0 +1,204 @@
+# Nome do ficheiro: app/tracing.py
+"""
+Rastreio por pedido (spans) para saber onde foi gasto o tempo de um pedido.
+
+Cada pedido HTTP (e cada execução de uma tarefa em segundo plano) abre um
+`Trace`; as etapas medidas com metrics.medir_estagio (Vision, Gemini,
+buscas, deduplicação, base de dados, playlists) abrem automaticamente um
+span dentro dele. O trace e o span atuais vivem em contextvars, por isso:
+
+- fora de um trace, `span()` não faz nada (custo de uma leitura de contextvar);
+- para continuar o trace numa thread de um pool usa-se `submeter(executor, ...)`,
+  que copia o contexto atual para a tarefa.
+
+No fim do pedido o servidor:
+- envia o cabeçalho `Server-Timing` com o tempo total por etapa;
+- guarda o trace num buffer circular em memória se foi amostrado
+  (TRACE_SAMPLE_RATE), se foi lento (TRACE_SLOW_MS) ou se o cliente pediu
+  o trace em modo de depuração (TRACE_DEBUG=1 e cabeçalho X-Debug-Trace).
+O buffer pode ser consultado/despejado em /api/traces.
+"""
+import contextvars
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', '0.05'))
+# Traces mais lentos do que isto são sempre guardados, independentemente da amostragem
+TRACE_SLOW_MS = float(os.environ.get('TRACE_SLOW_MS', '5000'))
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', '200'))
+# Permite que o cliente peça o trace completo na resposta (X-Debug-Trace: 1)
+TRACE_DEBUG = os.environ.get('TRACE_DEBUG', '0') == '1'
+# Limite de spans por trace (um pedido com centenas de consultas não cresce sem limite)
+MAX_SPANS = 500
+
+_trace_atual = contextvars.ContextVar('trace_atual', default=None)
+_span_atual = contextvars.ContextVar('span_atual', default=None)
+
+_buffer = deque(maxlen=TRACE_BUFFER_SIZE)
+_lock_buffer = threading.Lock()
+_NOME_INVALIDO = re.compile(r'[^A-Za-z0-9_.-]')
+
+
+class Span:
+    __slots__ = ('id', 'pai', 'nome', 'thread', 'inicio', 'fim', 'erro')
+
+    def __init__(self, nome, pai):
+        self.id = uuid.uuid4().hex[:8]
+        self.pai = pai
+        self.nome = nome
+        self.thread = threading.current_thread().name
+        self.inicio = time.perf_counter()
+        self.fim = None
+        self.erro = None
+
+    @property
+    def duracao_ms(self):
+        return ((self.fim or time.perf_counter()) - self.inicio) * 1000
+
+
+class Trace:
+    """Spans de um pedido. Pode receber spans de várias threads em simultâneo."""
+
+    def __init__(self, nome, depurar=False):
+        self.id = uuid.uuid4().hex[:16]
+        self.nome = nome
+        self.depurar = depurar
+        self.amostrado = depurar or random.random() < TRACE_SAMPLE_RATE
+        self.data = time.time()
+        self.inicio = time.perf_counter()
+        self.fim = None
+        self.estado = None
+        self.spans = []
+        self.descartados = 0
+        self._lock = threading.Lock()
+
+    @property
+    def duracao_ms(self):
+        return ((self.fim or time.perf_counter()) - self.inicio) * 1000
+
+    def _adicionar(self, span):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.descartados += 1
+
+    def totais_por_etapa(self):
+        """{nome: (duração total em ms, número de spans)}, pela ordem em que as etapas começaram."""
+        totais = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.inicio)
+        for s in spans:
+            total, n = totais.get(s.nome, (0.0, 0))
+            totais[s.nome] = (total + s.duracao_ms, n + 1)
+        return totais
+
+    def server_timing(self):
+        """Valor do cabeçalho Server-Timing: uma entrada por etapa e o total do pedido."""
+        partes = []
+        for nome, (total, n) in self.totais_por_etapa().items():
+            desc = f';desc="x{n}"' if n > 1 else ''
+            partes.append(f'{_NOME_INVALIDO.sub("_", nome)};dur={total:.1f}{desc}')
+        partes.append(f'total;dur={self.duracao_ms:.1f}')
+        return ', '.join(partes)
+
+    def para_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.inicio)
+        return {
+            "trace_id": self.id, "name": self.nome, "timestamp": self.data, "status": self.estado,
+            "duration_ms": round(self.duracao_ms, 2), "dropped_spans": self.descartados,
+            "spans": [{"id": s.id, "parent": s.pai, "name": s.nome, "thread": s.thread,
+                       "start_ms": round((s.inicio - self.inicio) * 1000, 2), "duration_ms": round(s.duracao_ms, 2),
+                       "error": s.erro} for s in spans],
+        }
+
+
+def atual():
+    """Trace ativo no contexto atual, ou None."""
+    return _trace_atual.get()
+
+
+def iniciar(nome, depurar=False):
+    """Abre um trace no contexto atual. Retorna (trace, token) para `terminar`."""
+    trace = Trace(nome, depurar)
+    return trace, _trace_atual.set(trace)
+
+
+def terminar(trace, token, estado=None):
+    """Fecha o trace e guarda-o no buffer se foi amostrado, lento ou pedido em depuração."""
+    trace.fim = time.perf_counter()
+    trace.estado = estado
+    try:
+        _trace_atual.reset(token)
+    except ValueError:
+        # Token de outro contexto (o servidor WSGI não correu o pedido num só contexto)
+        _trace_atual.set(None)
+    if trace.amostrado or trace.duracao_ms >= TRACE_SLOW_MS:
+        with _lock_buffer:
+            _buffer.append(trace)
+
+
+@contextmanager
+def rastrear(nome, depurar=False):
+    """Trace à volta de um bloco (ex.: uma tarefa em segundo plano)."""
+    trace, token = iniciar(nome, depurar)
+    estado = 'ok'
+    try:
+        yield trace
+    except BaseException:
+        estado = 'erro'
+        raise
+    finally:
+        terminar(trace, token, estado)
+
+
+@contextmanager
+def span(nome):
+    """Span dentro do trace atual (não faz nada se não houver trace)."""
+    trace = _trace_atual.get()
+    if trace is None:
+        yield None
+        return
+    s = Span(nome, _span_atual.get())
+    token = _span_atual.set(s.id)
+    try:
+        yield s
+    except BaseException as e:
+        s.erro = type(e).__name__
+        raise
+    finally:
+        s.fim = time.perf_counter()
+        _span_atual.reset(token)
+        trace._adicionar(s)
+
+
+def submeter(executor, func, *args, **kwargs):
+    """executor.submit que continua o trace/span atual na thread do pool."""
+    return executor.submit(contextvars.copy_context().run, func, *args, **kwargs)
+
+
+def recentes(limite=None, trace_id=None):
+    """Traces guardados no buffer (mais recentes primeiro), como dicionários."""
+    with _lock_buffer:
+        traces = list(_buffer)
+    traces.reverse()
+    if trace_id is not None:
+        traces = [t for t in traces if t.id == trace_id]
+    return [t.para_dict() for t in traces[:limite]]
+
+
+def despejar(caminho):
+    """Escreve o buffer num ficheiro JSON Lines (um trace por linha). Retorna quantos foram escritos."""
+    traces = recentes()
+    with open(caminho, 'w', encoding='utf-8') as f:
+        for t in reversed(traces):
+            f.write(json.dumps(t, ensure_ascii=False) + '\n')
+    return len(traces)
@@ -0,0 +1,117 @@
+# Nome do ficheiro: app/uploads.py
+"""
+Receção de imagens enviadas pelo cliente, sem ficheiros temporários.
+
+O parser multipart do Werkzeug escreve cada ficheiro no contentor devolvido
+por `UploadRequest._get_file_stream`. Aqui esse contentor é um `BufferImagem`
+em memória que, à medida que os blocos chegam:
+
+- recusa o upload assim que passa de UPLOAD_MAX_BYTES (413);
+- identifica o tipo real pelos primeiros bytes (assinatura do formato) e
+  recusa logo o que não for imagem (415), sem ler o resto do corpo;
+- calcula o SHA-256 do conteúdo.
+
+O pedido inteiro também fica limitado por MAX_CONTENT_LENGTH (ver
+`MAX_CONTENT_LENGTH` abaixo), por isso o buffer nunca cresce sem limite. Os
+bytes seguem diretamente para a análise (RecommendationEngine.analisar_imagem_bytes).
+"""
+import hashlib
+import io
+import os
+from collections import namedtuple
+
+from flask import Request
+
+UPLOAD_MAX_BYTES = int(os.environ.get('UPLOAD_MAX_BYTES', str(10 * 1024 * 1024)))
+# Margem para os cabeçalhos e limites do multipart, além do próprio ficheiro
+MULTIPART_MARGEM_BYTES = 64 * 1024
+MAX_CONTENT_LENGTH = UPLOAD_MAX_BYTES + MULTIPART_MARGEM_BYTES
+_CHUNK_BYTES = 64 * 1024
+# Bytes necessários para reconhecer todas as assinaturas abaixo
+_CABECALHO_BYTES = 16
+
+ImagemRecebida = namedtuple('ImagemRecebida', 'conteudo sha256 mime_type tamanho')
+
+
+class UploadRejeitadoError(Exception):
+    """
+    O upload não é uma imagem aceite; `status` é o código HTTP a devolver.
+    Não deriva de ValueError de propósito: o parser de formulários do Werkzeug engole ValueError.
+    """
+
+    def __init__(self, mensagem, status=400):
+        super().__init__(mensagem)
+        self.status = status
+
+
+def detetar_tipo_imagem(cabecalho):
+    """MIME type da imagem pelos primeiros bytes, ou None se não for um formato suportado."""
+    if cabecalho.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if cabecalho.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if cabecalho[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return 'image/webp'
+    if cabecalho[4:8] == b'ftyp' and cabecalho[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return 'image/heic'
+    if cabecalho[:2] == b'BM':
+        return 'image/bmp'
+    return None
+
+
+class BufferImagem(io.BytesIO):
+    """Contentor em memória para um ficheiro do multipart: limita o tamanho, calcula o hash e valida o tipo."""
+
+    def __init__(self, limite=UPLOAD_MAX_BYTES):
+        super().__init__()
+        self.limite = limite
+        self.mime_type = None
+        self._sha256 = hashlib.sha256()
+
+    def write(self, dados):
+        if self.tell() + len(dados) > self.limite:
+            raise UploadRejeitadoError(f"A imagem excede o tamanho máximo de {self.limite // (1024 * 1024)} MB.", 413)
+        escritos = super().write(dados)
+        self._sha256.update(dados)
+        if self.mime_type is None and self.tell() >= _CABECALHO_BYTES:
+            self._validar_tipo()
+        return escritos
+
+    def _validar_tipo(self):
+        with self.getbuffer() as vista:
+            cabecalho = bytes(vista[:_CABECALHO_BYTES])
+        self.mime_type = detetar_tipo_imagem(cabecalho)
+        if self.mime_type is None:
+            raise UploadRejeitadoError("O ficheiro enviado não é uma imagem suportada (JPEG, PNG, GIF, WEBP, HEIC ou BMP).", 415)
+
+    def imagem(self):
+        """Conteúdo completo, já validado, pronto para a análise."""
+        tamanho = self.getbuffer().nbytes
+        if tamanho == 0:
+            raise UploadRejeitadoError("O ficheiro de imagem está vazio.")
+        if self.mime_type is None:
+            self._validar_tipo()
+        return ImagemRecebida(self.getvalue(), self._sha256.hexdigest(), self.mime_type, tamanho)
+
+
+def ler_imagem(ficheiro, limite=UPLOAD_MAX_BYTES):
+    """
+    Imagem de um FileStorage do pedido. Se o parser já escreveu para um BufferImagem
+    (pedidos de UploadRequest) não há nova cópia; caso contrário o stream é lido por blocos.
+    """
+    stream = ficheiro.stream
+    if isinstance(stream, BufferImagem):
+        return stream.imagem()
+    buffer = BufferImagem(limite)
+    for bloco in iter(lambda: stream.read(_CHUNK_BYTES), b''):
+        buffer.write(bloco)
+    return buffer.imagem()
+
+
+class UploadRequest(Request):
+    """Request do Flask cujos ficheiros multipart vão para um BufferImagem em vez de um ficheiro temporário."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return BufferImagem()
@@ -0,0 +1,11 @@
+# Nome do ficheiro: benchmarks/__init__.py
+"""
+Benchmarks offline da aplicação (não fazem parte do servidor).
+
+- e2e: pedidos aos endpoints de recomendação com Vision, Gemini, Spotify e
+  yt-dlp substituídos por falsos determinísticos (stubs), com latência e
+  erros configuráveis, e comparação com uma baseline guardada.
+- corpus: geradores de faixas sintéticas no formato do Spotify e do YouTube.
+
+Correm a partir da raiz do repositório, ex.: `python -m benchmarks.e2e --help`.
+"""
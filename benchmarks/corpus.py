@@ -0,0 +1,150 @@
+# Nome do ficheiro: benchmarks/corpus.py
+"""
+Corpora sintéticos e determinísticos de faixas para os benchmarks.
+
+O mesmo `seed` gera sempre as mesmas faixas (também entre processos: o
+`random.Random` de uma string não depende do PYTHONHASHSEED). Para exercitar a
+deduplicação como no tráfego real, uma parte das faixas repete uma música já
+gerada com outro ID e com o ruído habitual das buscas:
+
+- versões: "- Remastered 2011", "(Radio Edit)", "- Extended Mix", "[Official Video]",
+  "- X Remix", "(Live)", "- Slowed + Reverb", ...;
+- artistas convidados: "Artista feat. X", "Artista & X", "Artista, X";
+- instrumentais/karaoke (que o ProcessadorFaixas descarta).
+
+Formatos:
+- `corpus_spotify`: objetos de faixa da Web API do Spotify (opcionalmente
+  embrulhados como itens de playlist {added_at, track});
+- `corpus_youtube`: faixas no formato normalizado do YouTubeMusicService;
+- `entradas_yt_dlp`: entradas como as devolvidas por YoutubeDL.extract_info.
+"""
+import random
+import string
+
+ARTISTAS = [
+    'Bon Iver', 'The xx', 'Cigarettes After Sex', 'Daft Punk', 'Tame Impala', 'Frank Ocean',
+    'Beach House', 'Radiohead', 'Arctic Monkeys', 'Lorde', 'Caetano Veloso', 'Marisa Monte',
+    'Tom Jobim', 'Nujabes', 'Joji', 'Billie Eilish', 'The Weeknd', 'Massive Attack',
+    'Portishead', 'Sade', 'Khruangbin', 'Mac DeMarco', 'Phoebe Bridgers', 'Fleetwood Mac',
+    'Kendrick Lamar', 'Rosalía', 'Björk', 'M83', 'Air', 'Zero 7', 'Bonobo', 'Four Tet',
+    'Jorge Ben Jor', 'Elis Regina', 'Yumi Zouma', 'Men I Trust', 'Washed Out', 'Tycho',
+    'Aurora', 'Sufjan Stevens',
+]
+PALAVRAS = [
+    'night', 'summer', 'rain', 'city', 'lights', 'ocean', 'dream', 'gold', 'midnight', 'blue',
+    'heart', 'fire', 'slow', 'dancing', 'home', 'away', 'echo', 'silver', 'road', 'sunset',
+    'garden', 'wild', 'velvet', 'holocene', 'saudade', 'chuva', 'mar', 'noite', 'teardrop', 'glass',
+]
+# Sufixos que identificam outra versão da mesma música ({c} é um artista convidado)
+VERSOES = [
+    ' - Remastered 2011', ' (Radio Edit)', ' - Extended Mix', ' [Official Video]', ' - {c} Remix',
+    ' (Live)', ' - Live at Montreux', ' - Slowed + Reverb', ' (Acoustic)', ' - Deluxe Edition',
+    ' (feat. {c})', ' [Remastered]', ' - Sped Up',
+]
+CONVIDADOS = [' feat. {c}', ' & {c}', ', {c}', ' ft. {c}']
+INSTRUMENTAIS = [' (Instrumental)', ' - Karaoke Version', ' (Backing Track)']
+
+_BASE62 = string.ascii_letters + string.digits
+_BASE64_URL = _BASE62 + '-_'
+
+
+def _faixas(n, seed, duplicados, instrumentais):
+    """Faixas neutras (título, artista, duração, ID, índice da música original)."""
+    rng = random.Random(f'corpus:{seed}')
+    originais = []
+    for i in range(n):
+        sorteio = rng.random()
+        if originais and sorteio < duplicados:
+            indice, titulo_base, artista_base, duracao = rng.choice(originais)
+            convidado = rng.choice(ARTISTAS)
+            if rng.random() < 0.6:
+                titulo = titulo_base + rng.choice(VERSOES).format(c=convidado)
+                artista = artista_base
+            else:
+                titulo = titulo_base
+                artista = artista_base + rng.choice(CONVIDADOS).format(c=convidado)
+            duracao += rng.randint(-20, 40)
+        else:
+            indice = i
+            palavras = rng.sample(PALAVRAS, rng.randint(1, 3))
+            titulo = ' '.join(palavras).title()
+            artista = rng.choice(ARTISTAS)
+            duracao = rng.randint(120, 420)
+            originais.append((indice, titulo, artista, duracao))
+            if sorteio > 1 - instrumentais:
+                titulo += rng.choice(INSTRUMENTAIS)
+        yield {
+            'indice': i,
+            'original': indice,
+            'titulo': titulo,
+            'artista': artista,
+            'duracao': max(30, duracao),
+            'rng': rng,
+        }
+
+
+def corpus_spotify(n, seed=0, duplicados=0.3, instrumentais=0.03, embrulhadas=0.0):
+    """`n` objetos de faixa da Web API do Spotify; `embrulhadas` é a fração como item de playlist."""
+    resultado = []
+    for f in _faixas(n, seed, duplicados, instrumentais):
+        rng = f['rng']
+        artistas = [{'id': ''.join(rng.choices(_BASE62, k=22)), 'name': nome.strip()}
+                    for nome in f['artista'].replace(' feat. ', ', ').replace(' ft. ', ', ').replace(' & ', ', ').split(', ')]
+        faixa = {
+            'id': ''.join(rng.choices(_BASE62, k=22)),
+            'name': f['titulo'],
+            'artists': artistas,
+            'album': {'images': [{'url': f"https://i.scdn.co/image/{f['original']:040x}", 'height': 640, 'width': 640}]},
+            'duration_ms': f['duracao'] * 1000 + rng.randint(0, 999),
+            'preview_url': None if rng.random() < 0.4 else f"https://p.scdn.co/mp3-preview/{f['indice']:040x}",
+            'popularity': rng.randint(0, 100),
+            'explicit': rng.random() < 0.1,
+        }
+        if embrulhadas and rng.random() < embrulhadas:
+            faixa = {'added_at': '2024-01-01T00:00:00Z', 'track': faixa}
+        resultado.append(faixa)
+    return resultado
+
+
+def entradas_yt_dlp(n, seed=0, duplicados=0.3, instrumentais=0.03):
+    """`n` entradas de vídeo como as devolvidas pelo yt-dlp (extract_flat=False)."""
+    resultado = []
+    for f in _faixas(n, seed, duplicados, instrumentais):
+        rng = f['rng']
+        video_id = ''.join(rng.choices(_BASE64_URL, k=11))
+        artista_principal = f['artista'].split(' feat. ')[0].split(' & ')[0].split(', ')[0]
+        canal = artista_principal if rng.random() < 0.7 else f'{artista_principal} - Topic'
+        titulo = f['titulo'] if rng.random() < 0.5 else f"{f['artista']} - {f['titulo']}"
+        resultado.append({
+            'id': video_id,
+            'title': titulo,
+            'fulltitle': titulo,
+            'channel': canal,
+            'channel_id': 'UC' + ''.join(rng.choices(_BASE64_URL, k=22)),
+            'uploader': canal,
+            'duration': f['duracao'],
+            'thumbnail': f'https://i.ytimg.com/vi/{video_id}/hqdefault.jpg',
+            'thumbnails': [{'url': f'https://i.ytimg.com/vi/{video_id}/default.jpg'}],
+            'webpage_url': f'https://www.youtube.com/watch?v={video_id}',
+            'view_count': rng.randint(1000, 10 ** 8),
+        })
+    return resultado
+
+
+def corpus_youtube(n, seed=0, duplicados=0.3, instrumentais=0.03):
+    """`n` faixas no formato normalizado do YouTubeMusicService (titulo/artista/spotify_id)."""
+    resultado = []
+    for entrada in entradas_yt_dlp(n, seed, duplicados, instrumentais):
+        minutos, segundos = divmod(entrada['duration'], 60)
+        resultado.append({
+            'titulo': entrada['title'],
+            'artista': entrada['channel'],
+            'artista_id': entrada['channel_id'],
+            'preview_url': entrada['webpage_url'],
+            'spotify_id': entrada['id'],
+            'album_cover_url': entrada['thumbnail'],
+            'service_name': 'youtube',
+            'id': entrada['id'],
+            'duration': f'{minutos}:{segundos:02d}',
+        })
+    return resultado
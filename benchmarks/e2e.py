@@ -0,0 +1,340 @@
+# Nome do ficheiro: benchmarks/e2e.py
+"""
+Benchmark ponta a ponta, offline, dos endpoints de recomendação.
+
+Conduz a aplicação Flask pelo test client (um cliente por thread) com os
+serviços externos substituídos pelos falsos de benchmarks/stubs.py, e mede:
+
+- pedidos/s e latência do cliente (p50/p95/p99);
+- p50/p95/p99 de cada etapa do pipeline, a partir do cabeçalho Server-Timing
+  (tempo total da etapa no pedido: Vision, chamadas ao Gemini, buscas, base de dados, ...);
+- picos de memória: RSS do processo e, com --tracemalloc, o pico das alocações Python.
+
+O resultado pode ser guardado como baseline (benchmarks/baselines/<cenário>.json) e
+as execuções seguintes são comparadas com ele: se os pedidos/s caírem ou algum p95
+(total ou de uma etapa) subir mais do que a tolerância, o processo termina com código 1.
+
+Exemplos (na raiz do repositório):
+    python -m benchmarks.e2e --cenario tags-spotify --pedidos 200 --concorrencia 4
+    python -m benchmarks.e2e --cenario imagem-youtube --latencia yt_dlp=300 --erros gemini=0.05
+    python -m benchmarks.e2e --cenario tags-spotify --guardar-baseline
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+
+from . import stubs
+
+CENARIOS = {
+    'imagem-spotify': ('/api/recommend_by_image', 'spotify'),
+    'imagem-youtube': ('/api/recommend_by_image', 'youtube'),
+    'tags-spotify': ('/api/recommend_from_tags', 'spotify'),
+    'tags-youtube': ('/api/recommend_from_tags', 'youtube'),
+}
+DIR_BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+PERCENTIS = (50, 95, 99)
+# Diferenças abaixo disto (ms) não contam como regressão de uma etapa (ruído de medição)
+PISO_REGRESSAO_MS = 2.0
+TAGS = [['beach', 'sunset', 'calm'], ['city', 'night', 'neon', 'dreamy'], ['rain', 'coffee', 'cozy'],
+        ['forest', 'mountain', 'hopeful'], ['party', 'euphoric', 'dance']]
+
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank (valores já ordenados)."""
+    if not valores:
+        return None
+    return valores[min(len(valores) - 1, max(0, math.ceil(p / 100 * len(valores)) - 1))]
+
+
+def resumo(valores):
+    valores = sorted(valores)
+    item = {f'p{p}': round(percentil(valores, p), 2) for p in PERCENTIS} if valores else {}
+    item['n'] = len(valores)
+    if valores:
+        item['max'] = round(valores[-1], 2)
+    return item
+
+
+def ler_server_timing(cabecalho):
+    """{etapa: duração em ms} a partir de 'vision;dur=12.3, search_spotify;dur=80.1;desc="x3", total;dur=...'."""
+    etapas = {}
+    for entrada in filter(None, (e.strip() for e in (cabecalho or '').split(','))):
+        nome, *parametros = entrada.split(';')
+        for parametro in parametros:
+            chave, _, valor = parametro.partition('=')
+            if chave.strip() == 'dur':
+                etapas[nome.strip()] = float(valor)
+    return etapas
+
+
+def imagem_sintetica(tamanho, indice):
+    """PNG sintético (apenas a assinatura é verificada pelo upload); o conteúdo varia com o índice."""
+    corpo = (f'benchmark-{indice}-'.encode() * (tamanho // 12 + 1))[:max(0, tamanho - 8)]
+    return b'\x89PNG\r\n\x1a\n' + corpo
+
+
+def rss_pico_mb():
+    """Pico de memória residente do processo (None em plataformas sem o módulo resource)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux devolve KiB, macOS devolve bytes
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Bancada:
+    """Clientes de teste (um por thread), autenticados com o serviço do cenário."""
+
+    def __init__(self, app, servico):
+        self.app = app
+        self.servico = servico
+        self._local = threading.local()
+        self._ids = iter(range(1, 1 << 30))
+        self._lock = threading.Lock()
+
+    def cliente(self):
+        cliente = getattr(self._local, 'cliente', None)
+        if cliente is None:
+            with self._lock:
+                user_id = next(self._ids)
+            cliente = self.app.test_client()
+            with cliente.session_transaction() as sessao:
+                sessao['internal_user_id'] = user_id
+                sessao['service'] = self.servico
+                sessao['display_name'] = f'benchmark-{user_id}'
+            self._local.cliente = cliente
+        return cliente
+
+
+def _pedido(bancada, rota, indice, tamanho_imagem):
+    cliente = bancada.cliente()
+    inicio = time.perf_counter()
+    if rota == '/api/recommend_by_image':
+        dados = {'image': (io.BytesIO(imagem_sintetica(tamanho_imagem, indice)), f'benchmark-{indice}.png')}
+        resposta = cliente.post(rota, data=dados, content_type='multipart/form-data')
+    else:
+        resposta = cliente.post(rota, json={'tags': TAGS[indice % len(TAGS)]})
+    duracao_ms = (time.perf_counter() - inicio) * 1000
+    faixas = len((resposta.get_json(silent=True) or {}).get('recomendacoes') or [])
+    return resposta.status_code, duracao_ms, ler_server_timing(resposta.headers.get('Server-Timing')), faixas
+
+
+def executar(cenario, pedidos=100, concorrencia=4, aquecimento=5, tamanho_imagem=256 * 1024,
+             latencias=None, erros=None, limites=None, jitter=0.2, seed=0,
+             spotify_rps=None, usar_tracemalloc=False, limite_utilizador=False):
+    """
+    Corre um cenário e devolve o relatório (dicionário serializável em JSON).
+    Os componentes da aplicação ficam criados com os falsos deste cenário: usar um processo por cenário
+    (ver `executar_isolado`).
+    """
+    rota, servico = CENARIOS[cenario]
+    perfis_servicos = stubs.perfis(latencias, erros, limites, jitter, seed)
+    # O spotipy regista cada resposta de erro; as falhas injetadas já são contadas nos perfis
+    logging.getLogger('spotipy').setLevel(logging.CRITICAL)
+    with tempfile.TemporaryDirectory(prefix='playerv2-bench-') as pasta, \
+            stubs.ambiente_offline(perfis_servicos, spotify_rps=spotify_rps):
+        from app import server
+        with ExitStack() as pilha:
+            pilha.enter_context(mock.patch.object(server, 'DB_FILE', os.path.join(pasta, 'banco_musicas.db')))
+            pilha.enter_context(mock.patch.object(server, 'DB_DIR', pasta))
+            if not limite_utilizador:
+                # Os clientes do benchmark excederiam o limite por utilizador: só o bulkhead fica ativo
+                pilha.enter_context(mock.patch.object(server._limite_recomendacoes, 'consumir', lambda chave: 0.0))
+            bancada = Bancada(server.app, servico)
+            try:
+                # Aquecimento: cria os componentes preguiçosos (motor, serviços, base de dados) fora da medição
+                for i in range(aquecimento):
+                    _pedido(bancada, rota, -1 - i, tamanho_imagem)
+                if usar_tracemalloc:
+                    tracemalloc.start()
+                inicio = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concorrencia, thread_name_prefix='bench') as executor:
+                    resultados = list(executor.map(lambda i: _pedido(bancada, rota, i, tamanho_imagem), range(pedidos)))
+                duracao = time.perf_counter() - inicio
+                pico_tracemalloc = tracemalloc.get_traced_memory()[1] if usar_tracemalloc else None
+            finally:
+                if usar_tracemalloc:
+                    tracemalloc.stop()
+                jobs = server.app_context['jobs'] if server.app_context.inicializado('jobs') else None
+                if jobs is not None:
+                    jobs.parar()
+
+    estados = Counter(str(status) for status, _, _, _ in resultados)
+    etapas = defaultdict(list)
+    for _, _, timing, _ in resultados:
+        for nome, dur in timing.items():
+            etapas[nome].append(dur)
+    return {
+        'scenario': cenario,
+        'requests': pedidos,
+        'concurrency': concorrencia,
+        'duration_s': round(duracao, 3),
+        'requests_per_s': round(pedidos / duracao, 2) if duracao else None,
+        'status': dict(sorted(estados.items())),
+        'tracks_per_response': resumo([f for s, _, _, f in resultados if s == 200]),
+        'latency_ms': resumo([d for _, d, _, _ in resultados]),
+        'stages_ms': {nome: resumo(v) for nome, v in sorted(etapas.items())},
+        'memory_mb': {
+            'rss_peak': rss_pico_mb(),
+            'tracemalloc_peak': round(pico_tracemalloc / (1024 * 1024), 2) if pico_tracemalloc is not None else None,
+        },
+        'services': {nome: p.para_dict() for nome, p in perfis_servicos.items()},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')},
+    }
+
+
+def executar_isolado(cenario, **opcoes):
+    """`executar` num processo novo: componentes, caches e pico de RSS não passam de um cenário para outro."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(executar, cenario, **opcoes).result()
+
+
+def caminho_baseline(cenario):
+    return os.path.join(DIR_BASELINES, f'{cenario}.json')
+
+
+def comparar(atual, baseline, tolerancia):
+    """Lista de regressões (texto) de `atual` face a `baseline`, com a tolerância relativa dada."""
+    regressoes = []
+    rps, rps_base = atual.get('requests_per_s'), baseline.get('requests_per_s')
+    if rps and rps_base and rps < rps_base * (1 - tolerancia):
+        regressoes.append(f'pedidos/s: {rps} < {rps_base} (-{(1 - rps / rps_base) * 100:.1f}%)')
+
+    def p95(nome, valor, base):
+        if valor is None or base is None:
+            return
+        if valor > base * (1 + tolerancia) and valor - base > PISO_REGRESSAO_MS:
+            regressoes.append(f'{nome} p95: {valor} ms > {base} ms (+{(valor / base - 1) * 100 if base else math.inf:.1f}%)')
+
+    p95('latência', atual['latency_ms'].get('p95'), baseline['latency_ms'].get('p95'))
+    for etapa, item in atual['stages_ms'].items():
+        base = baseline.get('stages_ms', {}).get(etapa)
+        if base:
+            p95(f'etapa {etapa}', item.get('p95'), base.get('p95'))
+    rss, rss_base = atual['memory_mb'].get('rss_peak'), baseline.get('memory_mb', {}).get('rss_peak')
+    if rss and rss_base and rss > rss_base * (1 + tolerancia):
+        regressoes.append(f'RSS de pico: {rss} MB > {rss_base} MB')
+    return regressoes
+
+
+def configuracao(relatorio):
+    """Parâmetros que têm de coincidir para a comparação com a baseline fazer sentido."""
+    servicos = {nome: {k: v for k, v in item.items() if k != 'calls'} for nome, item in relatorio['services'].items()}
+    return {'requests': relatorio['requests'], 'concurrency': relatorio['concurrency'], 'services': servicos}
+
+
+def imprimir(relatorio):
+    print(f"\n== {relatorio['scenario']}: {relatorio['requests']} pedidos, concorrência {relatorio['concurrency']} ==")
+    print(f"duração {relatorio['duration_s']} s, {relatorio['requests_per_s']} pedidos/s, estados {relatorio['status']}")
+    lat = relatorio['latency_ms']
+    print(f"latência (ms): p50 {lat.get('p50')}  p95 {lat.get('p95')}  p99 {lat.get('p99')}  max {lat.get('max')}")
+    print(f"{'etapa':<32}{'n':>7}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for nome, item in relatorio['stages_ms'].items():
+        print(f"{nome:<32}{item['n']:>7}{item.get('p50', '-'):>10}{item.get('p95', '-'):>10}{item.get('p99', '-'):>10}")
+    mem = relatorio['memory_mb']
+    print(f"memória (MB): RSS de pico {mem['rss_peak']}, pico tracemalloc {mem['tracemalloc_peak']}")
+    print('chamadas aos serviços falsos: ' + ', '.join(f"{n}={s['calls']}" for n, s in relatorio['services'].items()))
+
+
+def _pares(texto, conversor=float):
+    """'gemini=300,spotify=50' -> {'gemini': 300.0, 'spotify': 50.0}."""
+    resultado = {}
+    for item in filter(None, (p.strip() for p in (texto or '').split(','))):
+        nome, _, valor = item.partition('=')
+        if nome.strip() not in stubs.SERVICOS:
+            raise argparse.ArgumentTypeError(f"serviço desconhecido '{nome}' (use {', '.join(stubs.SERVICOS)})")
+        resultado[nome.strip()] = conversor(valor)
+    return resultado
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark offline dos endpoints de recomendação.')
+    parser.add_argument('--cenario', choices=sorted(CENARIOS), action='append',
+                        help='Cenário a correr (pode repetir; por omissão todos).')
+    parser.add_argument('--pedidos', type=int, default=100)
+    parser.add_argument('--concorrencia', type=int, default=4)
+    parser.add_argument('--aquecimento', type=int, default=5)
+    parser.add_argument('--tamanho-imagem', type=int, default=256 * 1024, help='Bytes da imagem enviada.')
+    parser.add_argument('--latencia', type=_pares, default={}, help='Latência por serviço em ms, ex.: gemini=300,yt_dlp=500')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Variação relativa da latência (0.2 = ±20%%).')
+    parser.add_argument('--erros', type=_pares, default={}, help='Taxa de erros por serviço, ex.: gemini=0.05')
+    parser.add_argument('--limites', type=_pares, default={}, help='Taxa de respostas 429 por serviço, ex.: spotify=0.02')
+    parser.add_argument('--spotify-rps', type=float, default=None,
+                        help='Ritmo do rate limiter do Spotify (por omissão sem limite; 8 reproduz a produção).')
+    parser.add_argument('--limite-utilizador', action='store_true', help='Mantém o limite de pedidos por utilizador.')
+    parser.add_argument('--tracemalloc', action='store_true', help='Mede o pico de alocações Python (mais lento).')
+    parser.add_argument('--cache-resultados', action='store_true',
+                        help='Mantém a cache de resultados (app/result_cache.py); por omissão cada pedido percorre o pipeline.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--gravar-cassete', metavar='CAMINHO', help='Grava as chamadas aos fornecedores (app/cassette.py).')
+    parser.add_argument('--reproduzir-cassete', metavar='CAMINHO',
+                        help='Serve as chamadas aos fornecedores a partir de uma cassete gravada.')
+    parser.add_argument('--json', help='Grava os relatórios neste ficheiro.')
+    parser.add_argument('--guardar-baseline', action='store_true', help='Grava o resultado como nova baseline.')
+    parser.add_argument('--sem-comparar', action='store_true', help='Não compara com a baseline guardada.')
+    parser.add_argument('--tolerancia', type=float, default=0.15, help='Regressão relativa tolerada (0.15 = 15%%).')
+    args = parser.parse_args(argv)
+
+    # Os logs por pedido não interessam aqui (e custam tempo); LOG_LEVEL continua a poder ser definido
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Os processos de cada cenário herdam o ambiente: é lá que a cassete é ativada
+    if args.gravar_cassete or args.reproduzir_cassete:
+        os.environ['CASSETTE_MODE'] = 'record' if args.gravar_cassete else 'replay'
+        os.environ['CASSETTE_PATH'] = args.gravar_cassete or args.reproduzir_cassete
+    if not args.cache_resultados:
+        # As tags dos pedidos repetem-se: com a cache quase tudo seria servido sem chamar os fornecedores
+        os.environ['CACHE_RESULTADOS_TTL'] = '0'
+
+    relatorios, regressoes = [], []
+    for cenario in args.cenario or sorted(CENARIOS):
+        relatorio = executar_isolado(
+            cenario, pedidos=args.pedidos, concorrencia=args.concorrencia, aquecimento=args.aquecimento,
+            tamanho_imagem=args.tamanho_imagem, latencias=args.latencia, erros=args.erros, limites=args.limites,
+            jitter=args.jitter, seed=args.seed, spotify_rps=args.spotify_rps, usar_tracemalloc=args.tracemalloc,
+            limite_utilizador=args.limite_utilizador)
+        imprimir(relatorio)
+        relatorios.append(relatorio)
+
+        caminho = caminho_baseline(cenario)
+        if args.guardar_baseline:
+            os.makedirs(DIR_BASELINES, exist_ok=True)
+            with open(caminho, 'w', encoding='utf-8') as f:
+                json.dump(relatorio, f, indent=2, ensure_ascii=False)
+            print(f'baseline gravada em {caminho}')
+        elif not args.sem_comparar and os.path.exists(caminho):
+            with open(caminho, encoding='utf-8') as f:
+                baseline = json.load(f)
+            if configuracao(baseline) != configuracao(relatorio):
+                print(f'AVISO: a configuração difere da baseline {caminho} (pedidos, concorrência ou perfis dos serviços)')
+            encontradas = comparar(relatorio, baseline, args.tolerancia)
+            for r in encontradas:
+                print(f'REGRESSÃO [{cenario}] {r}')
+            if not encontradas:
+                print(f'sem regressões face a {caminho} (tolerância {args.tolerancia:.0%})')
+            regressoes.extend(encontradas)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(relatorios, f, indent=2, ensure_ascii=False)
+    return 1 if regressoes else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+# Nome do ficheiro: benchmarks/faixas.py
+"""
+Micro-benchmarks e testes de escala do pós-processamento de faixas.
+
+Mede RecommendationEngine._chave_dedup e RecommendationEngine._processar_faixas_api
+sobre corpora sintéticos (benchmarks/corpus.py) no formato do Spotify e do
+YouTube, de 10 a 100 000 itens:
+
+- tempo por item e itens/s (melhor de N repetições);
+- alocações com tracemalloc: pico de memória durante a chamada e blocos
+  que ficam alocados no fim (o resultado).
+
+E verifica, terminando com código 1 se algo falhar:
+
+- semântica atual da deduplicação (ficheiros em benchmarks/golden/): as chaves
+  de uma tabela de títulos/artistas com o ruído habitual e o resultado de
+  _processar_faixas_api para corpora fixos;
+- um piso de itens/s (PISO_ITENS_POR_S) nos tamanhos a partir de
+  TAMANHO_MINIMO_PISO, onde o custo fixo da chamada já não domina.
+
+Uma otimização que mude a semântica de propósito regenera os ficheiros com
+--atualizar-golden (e o diff mostra o que mudou).
+
+    python -m benchmarks.faixas
+    python -m benchmarks.faixas --tamanhos 1000,100000 --repeticoes 3
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from .corpus import corpus_spotify, corpus_youtube
+
+DIR_GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+TAMANHOS = (10, 100, 1000, 10000, 100000)
+# Itens/s mínimos (com folga larga face ao medido num portátil; a CI partilhada é mais lenta)
+PISO_ITENS_POR_S = {
+    'chave_dedup': 40000,
+    'processar_spotify': 25000,
+    'processar_youtube': 25000,
+}
+TAMANHO_MINIMO_PISO = 1000
+# Corpora cujo resultado é fixado nos ficheiros golden: (formato, itens, semente, limite)
+CASOS_GOLDEN = [
+    ('spotify', 500, 1, 25), ('spotify', 500, 2, 500), ('spotify', 2000, 3, 150),
+    ('youtube', 500, 1, 25), ('youtube', 500, 2, 500), ('youtube', 2000, 3, 150),
+]
+# Títulos/artistas com o ruído que a deduplicação tem de tratar
+AMOSTRAS_CHAVE = [
+    ('Holocene', 'Bon Iver'),
+    ('HOLOCENE ', 'bon iver'),
+    ('Holocene - Remastered 2011', 'Bon Iver'),
+    ('Holocene (Live at AIR Studios)', 'Bon Iver'),
+    ('Holocene [Official Video]', 'Bon Iver'),
+    ('Holocene - Live at Montreux', 'Bon Iver'),
+    ('Holocene - Empire Of The Sun Remix', 'Bon Iver'),
+    ('Holocene - Slowed + Reverb', 'Bon Iver'),
+    ('Holocene - Sped Up', 'Bon Iver'),
+    ('Holocene - Part II', 'Bon Iver'),
+    ('Holocene - Extended Mix - 2020', 'Bon Iver'),
+    ('Intro', 'The xx feat. Florence'),
+    ('Intro', 'The xx ft. Florence'),
+    ('Intro', 'The xx & Florence'),
+    ('Intro', 'The xx, Florence'),
+    ('Intro', 'The xx feat Florence'),
+    ('Intro', 'Simon & Garfunkel'),
+    ('Bon Iver - Holocene', 'Bon Iver - Topic'),
+    ('Águas de Março (Ao Vivo)', 'Elis Regina & Tom Jobim'),
+    ('Águas de Março - Ao Vivo', 'Elis Regina'),
+    ('Teardrop (feat. Elizabeth Fraser)', 'Massive Attack'),
+    ('Teardrop - Version 2', 'Massive Attack'),
+    ('Teardrop - Mad Professor Mix', 'Massive Attack'),
+    ('Night - Day', 'Zedd'),
+    ('Night (Instrumental)', 'Zedd'),
+    ('', ''),
+    (None, None),
+]
+
+
+def _motor():
+    # Só os métodos puros são usados: não é preciso base de dados, Vision nem serviços
+    from app.recommendation_engine import RecommendationEngine
+    return RecommendationEngine.__new__(RecommendationEngine)
+
+
+def gerar(formato, n, seed=0):
+    if formato == 'spotify':
+        return corpus_spotify(n, seed=seed, embrulhadas=0.1)
+    return corpus_youtube(n, seed=seed)
+
+
+def _cronometrar(func, repeticoes):
+    """Melhor tempo (s) de `repeticoes` chamadas."""
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        func()
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor
+
+
+def _alocacoes(func):
+    """(pico em bytes durante a chamada, blocos alocados que sobrevivem à chamada)."""
+    tracemalloc.start()
+    try:
+        antes = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        resultado = func()
+        pico = tracemalloc.get_traced_memory()[1] - base
+        depois = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocos = sum(s.count_diff for s in depois.compare_to(antes, 'filename'))
+    del resultado
+    return pico, blocos
+
+
+def medir(motor, tamanhos, repeticoes, com_tracemalloc):
+    """Linhas do relatório: uma por (operação, formato, tamanho)."""
+    linhas = []
+    for formato in ('spotify', 'youtube'):
+        for n in tamanhos:
+            corpus = gerar(formato, n)
+            pares = [(f.get('titulo') or (f.get('track') or f).get('name'),
+                      f.get('artista') or ((f.get('track') or f).get('artists') or [{}])[0].get('name'))
+                     for f in corpus]
+            casos = [
+                ('chave_dedup', lambda: [motor._chave_dedup(t, a) for t, a in pares]),
+                (f'processar_{formato}', lambda: motor._processar_faixas_api(corpus, limit=n)),
+                (f'processar_{formato}_limite25', lambda: motor._processar_faixas_api(corpus, limit=25)),
+            ]
+            for nome, func in casos:
+                # Mais repetições nos tamanhos pequenos, para o tempo não ficar abaixo da resolução do relógio
+                segundos = _cronometrar(func, repeticoes if n >= 10000 else repeticoes * 10)
+                linha = {'operacao': nome, 'formato': formato, 'itens': n, 'segundos': segundos,
+                         'us_por_item': segundos / n * 1e6, 'itens_por_s': n / segundos if segundos else float('inf')}
+                if nome == f'processar_{formato}':
+                    linha['aceites'] = len(func())
+                if com_tracemalloc:
+                    linha['pico_bytes'], linha['blocos'] = _alocacoes(func)
+                linhas.append(linha)
+    return linhas
+
+
+def verificar_pisos(linhas, fator):
+    falhas = []
+    for linha in linhas:
+        piso = PISO_ITENS_POR_S.get(linha['operacao'])
+        if piso and linha['itens'] >= TAMANHO_MINIMO_PISO and linha['itens_por_s'] < piso * fator:
+            falhas.append(f"{linha['operacao']} ({linha['formato']}, {linha['itens']} itens): "
+                          f"{linha['itens_por_s']:.0f} itens/s < piso {piso * fator:.0f}")
+    return falhas
+
+
+def _resumo_resultado(musicas):
+    serializado = json.dumps(musicas, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return {'aceites': len(musicas), 'sha256': hashlib.sha256(serializado).hexdigest(),
+            'primeiras': [[m['titulo'], m['artista']] for m in musicas[:5]]}
+
+
+def saidas_golden(motor):
+    """Resultados atuais para as amostras e corpora fixos, no formato dos ficheiros golden."""
+    chaves = [[t, a, list(motor._chave_dedup(t, a))] for t, a in AMOSTRAS_CHAVE]
+    corpora = {f'{formato}:{n}:{seed}:{limite}': _resumo_resultado(motor._processar_faixas_api(gerar(formato, n, seed), limite))
+               for formato, n, seed, limite in CASOS_GOLDEN}
+    return {'chave_dedup.json': chaves, 'processar_faixas_api.json': corpora}
+
+
+def verificar_golden(motor, atualizar=False):
+    falhas = []
+    for nome, atual in saidas_golden(motor).items():
+        caminho = os.path.join(DIR_GOLDEN, nome)
+        if atualizar or not os.path.exists(caminho):
+            os.makedirs(DIR_GOLDEN, exist_ok=True)
+            with open(caminho, 'w', encoding='utf-8') as f:
+                json.dump(atual, f, indent=1, ensure_ascii=False)
+                f.write('\n')
+            print(f'golden gravado em {caminho}')
+            continue
+        with open(caminho, encoding='utf-8') as f:
+            esperado = json.load(f)
+        if nome == 'chave_dedup.json':
+            for (t, a, chave), (_, _, chave_atual) in zip(esperado, atual):
+                if chave != chave_atual:
+                    falhas.append(f'_chave_dedup({t!r}, {a!r}) = {chave_atual} (esperado {chave})')
+            if len(esperado) != len(atual):
+                falhas.append(f'{nome}: {len(atual)} amostras, o ficheiro tem {len(esperado)} (use --atualizar-golden)')
+        else:
+            for caso, resumo in esperado.items():
+                if atual.get(caso) != resumo:
+                    falhas.append(f'_processar_faixas_api {caso}: {atual.get(caso, {}).get("aceites")} aceites, '
+                                  f'resultado diferente do golden ({resumo["aceites"]} aceites)')
+    return falhas
+
+
+def imprimir(linhas):
+    cabecalho = f"{'operação':<28}{'itens':>8}{'µs/item':>10}{'itens/s':>12}{'aceites':>9}"
+    com_memoria = any('pico_bytes' in linha for linha in linhas)
+    if com_memoria:
+        cabecalho += f"{'pico KiB':>11}{'blocos':>9}"
+    print(cabecalho)
+    for linha in linhas:
+        texto = (f"{linha['operacao']:<28}{linha['itens']:>8}{linha['us_por_item']:>10.2f}"
+                 f"{linha['itens_por_s']:>12.0f}{linha.get('aceites', ''):>9}")
+        if com_memoria:
+            texto += f"{linha['pico_bytes'] / 1024:>11.1f}{linha['blocos']:>9}"
+        print(texto)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Micro-benchmarks de _chave_dedup e _processar_faixas_api.')
+    parser.add_argument('--tamanhos', default=','.join(map(str, TAMANHOS)), help='Ex.: 10,1000,100000')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--sem-tracemalloc', action='store_true', help='Não mede as alocações.')
+    parser.add_argument('--fator-piso', type=float, default=1.0, help='Multiplica os pisos de itens/s (0 desativa).')
+    parser.add_argument('--atualizar-golden', action='store_true', help='Regrava os ficheiros golden com a semântica atual.')
+    parser.add_argument('--json', help='Grava as medições neste ficheiro.')
+    args = parser.parse_args(argv)
+
+    motor = _motor()
+    falhas = verificar_golden(motor, args.atualizar_golden)
+    linhas = medir(motor, [int(t) for t in args.tamanhos.split(',') if t.strip()], args.repeticoes, not args.sem_tracemalloc)
+    imprimir(linhas)
+    falhas += verificar_pisos(linhas, args.fator_piso)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(linhas, f, indent=2)
+    for falha in falhas:
+        print(f'FALHA {falha}')
+    return 1 if falhas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
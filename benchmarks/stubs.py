@@ -0,0 +1,274 @@
+# Nome do ficheiro: benchmarks/stubs.py
+"""
+Substitutos determinísticos dos serviços externos, para correr a aplicação
+sem credenciais nem rede:
+
+- Vision: módulo `google.cloud.vision` falso (ImageAnnotatorClient, Image);
+- Gemini: `requests.post` do motor devolve respostas no formato da API
+  generateContent, escolhidas pelo tipo de prompt;
+- Spotify: o cliente real (RateLimitedSpotify, com rate limiter, 429 e
+  estatísticas) com uma `requests.Session` que responde a /search,
+  /recommendations e /audio-features a partir dos corpora sintéticos;
+- yt-dlp: módulo `yt_dlp` falso (YoutubeDL, utils.DownloadError).
+
+Os módulos pesados são carregados com app.lazy.importar, que consulta
+primeiro sys.modules: é aí que os falsos são instalados.
+
+Cada serviço tem um `Perfil` com latência (média e jitter) e taxas de erro e
+de 429 injetados. Os sorteios usam geradores com semente, por isso duas
+execuções com a mesma configuração fazem as mesmas escolhas.
+"""
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+import types
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import lru_cache
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from .corpus import corpus_spotify, entradas_yt_dlp
+
+SERVICOS = ('vision', 'gemini', 'spotify', 'yt_dlp')
+# Latência por omissão de cada serviço (ms), na ordem de grandeza observada em produção
+LATENCIA_PADRAO_MS = {'vision': 150.0, 'gemini': 400.0, 'spotify': 80.0, 'yt_dlp': 900.0}
+
+TAGS_VISION = ['Beach', 'Sunset', 'Sky', 'Ocean', 'City', 'Night', 'Skyline', 'Forest', 'Mountain',
+               'Rain', 'Street', 'Neon', 'Anime', 'Concert', 'Coffee', 'Snow', 'Desert', 'Party']
+TAGS_EMOCAO = ['calm', 'nostalgic', 'dreamy', 'energetic', 'melancholic', 'romantic', 'euphoric',
+               'cozy', 'mysterious', 'hopeful', 'lonely', 'warm']
+ARTISTAS_CONSULTA = ['Bon Iver', 'The xx', 'Men I Trust', 'Khruangbin', 'Air', 'Tycho', 'Beach House', 'Bonobo']
+GENEROS = ['chill', 'indie', 'ambient', 'pop', 'electronic', 'jazz', 'mpb', 'trip-hop', 'synth-pop', 'acoustic']
+
+
+class Perfil:
+    """Latência e falhas injetadas num serviço. Thread-safe e determinístico para a mesma semente."""
+
+    def __init__(self, nome, latencia_ms=0.0, jitter=0.2, taxa_erro=0.0, taxa_429=0.0, seed=0):
+        self.nome = nome
+        self.latencia_ms = latencia_ms
+        self.jitter = jitter
+        self.taxa_erro = taxa_erro
+        self.taxa_429 = taxa_429
+        self._rng = random.Random(f'perfil:{nome}:{seed}')
+        self._lock = threading.Lock()
+        self.resultados = Counter()
+
+    def chamar(self):
+        """Espera a latência sorteada e retorna None, 'erro' ou '429'."""
+        with self._lock:
+            atraso = self.latencia_ms * (1 + self.jitter * (2 * self._rng.random() - 1))
+            sorteio = self._rng.random()
+        falha = '429' if sorteio < self.taxa_429 else 'erro' if sorteio < self.taxa_429 + self.taxa_erro else None
+        if atraso > 0:
+            time.sleep(atraso / 1000.0)
+        with self._lock:
+            self.resultados[falha or 'ok'] += 1
+        return falha
+
+    def para_dict(self):
+        return {'latency_ms': self.latencia_ms, 'jitter': self.jitter, 'error_rate': self.taxa_erro,
+                'rate_limit_rate': self.taxa_429, 'calls': dict(self.resultados)}
+
+
+def _escolher(semente, opcoes, k):
+    """k opções distintas escolhidas de forma determinística a partir de `semente`."""
+    return random.Random(semente).sample(opcoes, k)
+
+
+def _resposta(url, status, corpo, cabecalhos=None):
+    resposta = requests.Response()
+    resposta.status_code = status
+    resposta.url = url
+    resposta.reason = {200: 'OK', 404: 'Not Found', 429: 'Too Many Requests'}.get(status, 'Internal Server Error')
+    resposta.headers.update({'Content-Type': 'application/json'}, **(cabecalhos or {}))
+    resposta._content = json.dumps(corpo).encode('utf-8')
+    resposta.encoding = 'utf-8'
+    return resposta
+
+
+# --- Vision ---
+
+def modulo_vision(perfil):
+    """Módulo `google.cloud.vision` falso: as entidades dependem apenas do conteúdo da imagem."""
+    modulo = types.ModuleType('google.cloud.vision')
+
+    class Image:
+        def __init__(self, content=b''):
+            self.content = content
+
+    class ImageAnnotatorClient:
+        def web_detection(self, image, **kwargs):
+            if perfil.chamar():
+                raise RuntimeError('Vision: erro injetado pelo benchmark')
+            semente = hashlib.sha256(image.content).hexdigest()
+            entidades = [types.SimpleNamespace(description=d, score=1.0 - i * 0.1)
+                         for i, d in enumerate(_escolher(semente, TAGS_VISION, 5))]
+            return types.SimpleNamespace(web_detection=types.SimpleNamespace(web_entities=entidades))
+
+    modulo.Image = Image
+    modulo.ImageAnnotatorClient = ImageAnnotatorClient
+    return modulo
+
+
+# --- Gemini ---
+
+class GeminiFalso:
+    """Substituto de requests.post para o endpoint generateContent do Gemini."""
+
+    def __init__(self, perfil):
+        self.perfil = perfil
+
+    @staticmethod
+    def _texto(prompt, tem_imagem):
+        if tem_imagem:
+            return json.dumps({'playlist_title': 'Luzes de Fim de Tarde',
+                               'mood_tags': _escolher(prompt, TAGS_EMOCAO, 5)})
+        if 'Spotify playlist expert' in prompt:
+            rng = random.Random(prompt)
+            return '```json\n' + json.dumps({'seed_genres': rng.sample(GENEROS, 2),
+                                             'target_energy': round(rng.random(), 2),
+                                             'target_valence': round(rng.random(), 2)}) + '\n```'
+        if 'comma-separated list' in prompt:
+            return ', '.join(f'{a} - {p.title()}' for a, p in zip(_escolher(prompt, ARTISTAS_CONSULTA, 7),
+                                                                  _escolher(prompt + ':t', TAGS_EMOCAO, 7)))
+        palavras = _escolher(prompt, TAGS_EMOCAO, 2) + _escolher(prompt + ':g', GENEROS, 1)
+        return ' '.join(palavras) + ' for a quiet evening'
+
+    def post(self, url, json=None, headers=None, timeout=None, **kwargs):
+        falha = self.perfil.chamar()
+        if falha == '429':
+            return _resposta(url, 429, {'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED'}})
+        if falha:
+            return _resposta(url, 500, {'error': {'code': 500, 'status': 'INTERNAL'}})
+        partes = (json or {}).get('contents', [{}])[0].get('parts', [])
+        prompt = ' '.join(p.get('text', '') for p in partes)
+        tem_imagem = any('inline_data' in p for p in partes)
+        texto = self._texto(prompt, tem_imagem)
+        return _resposta(url, 200, {'candidates': [{'content': {'parts': [{'text': texto}], 'role': 'model'}}]})
+
+
+# --- Spotify ---
+
+@lru_cache(maxsize=256)
+def _resultados_busca(query, total):
+    return corpus_spotify(total, seed=f'busca:{query}')
+
+
+class SessaoSpotifyFalsa(requests.Session):
+    """Sessão HTTP do cliente Spotipy que responde localmente aos endpoints usados nas recomendações."""
+
+    def __init__(self, perfil, retry_after=1, resultados_por_query=150):
+        super().__init__()
+        self.perfil = perfil
+        self.retry_after = retry_after
+        self.resultados_por_query = resultados_por_query
+
+    def request(self, method, url, params=None, data=None, headers=None, **kwargs):
+        falha = self.perfil.chamar()
+        if falha == '429':
+            return _resposta(url, 429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}},
+                             {'Retry-After': str(self.retry_after)})
+        if falha:
+            return _resposta(url, 500, {'error': {'status': 500, 'message': 'Erro injetado pelo benchmark'}})
+        partes = urlsplit(url)
+        args = {k: v[0] for k, v in parse_qs(partes.query).items()}
+        args.update({k: str(v) for k, v in (params or {}).items() if v is not None})
+        endpoint = partes.path.split('/v1/', 1)[-1].strip('/')
+        if endpoint == 'search':
+            limite, offset = int(args.get('limit', 10)), int(args.get('offset', 0))
+            todos = _resultados_busca(args.get('q', ''), self.resultados_por_query)
+            corpo = {'tracks': {'items': todos[offset:offset + limite], 'total': len(todos),
+                                'limit': limite, 'offset': offset}}
+        elif endpoint == 'recommendations':
+            semente = json.dumps(sorted(args.items()))
+            corpo = {'tracks': corpus_spotify(int(args.get('limit', 20)), seed=f'recs:{semente}'), 'seeds': []}
+        elif endpoint == 'audio-features':
+            corpo = {'audio_features': [self._features(i) for i in args.get('ids', '').split(',') if i]}
+        else:
+            return _resposta(url, 404, {'error': {'status': 404, 'message': f'{endpoint} não simulado'}})
+        return _resposta(url, 200, corpo)
+
+    @staticmethod
+    def _features(track_id):
+        rng = random.Random(track_id)
+        if rng.random() < 0.05:
+            return None
+        return {'id': track_id, 'energy': rng.random(), 'valence': rng.random(), 'danceability': rng.random(),
+                'acousticness': rng.random(), 'instrumentalness': rng.random() * 0.3, 'tempo': rng.uniform(60, 180)}
+
+
+# --- yt-dlp ---
+
+def modulo_yt_dlp(perfil):
+    """Módulo `yt_dlp` falso: extract_info devolve entradas sintéticas para a query."""
+    modulo = types.ModuleType('yt_dlp')
+    utils = types.ModuleType('yt_dlp.utils')
+
+    class DownloadError(Exception):
+        pass
+
+    class YoutubeDL:
+        def __init__(self, params=None):
+            self.params = params or {}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download=True, **kwargs):
+            if perfil.chamar():
+                raise DownloadError('ERROR: erro injetado pelo benchmark')
+            pesquisa = self.params.get('default_search', 'ytsearch5')
+            n = int(pesquisa[len('ytsearch'):] or 1)
+            return {'_type': 'playlist', 'id': url, 'title': url, 'entries': entradas_yt_dlp(n, seed=f'yt:{url}')}
+
+    utils.DownloadError = DownloadError
+    modulo.utils = utils
+    modulo.YoutubeDL = YoutubeDL
+    return modulo
+
+
+def perfis(latencias=None, erros=None, limites=None, jitter=0.2, seed=0):
+    """Um Perfil por serviço; `latencias`, `erros` e `limites` (429) são dicionários {serviço: valor}."""
+    latencias = {**LATENCIA_PADRAO_MS, **(latencias or {})}
+    return {s: Perfil(s, latencias[s], jitter, (erros or {}).get(s, 0.0), (limites or {}).get(s, 0.0), seed)
+            for s in SERVICOS}
+
+
+@contextmanager
+def ambiente_offline(perfis_servicos, spotify_rps=None, retry_after=1):
+    """
+    Instala os substitutos enquanto o bloco corre. Deve envolver o import e o uso de
+    app.server (os componentes são criados no primeiro pedido, já com os falsos).
+    `spotify_rps`: ritmo do rate limiter do cliente Spotify (None = sem limite).
+    """
+    with ExitStack() as pilha:
+        yt_dlp = modulo_yt_dlp(perfis_servicos['yt_dlp'])
+        pilha.enter_context(mock.patch.dict(sys.modules, {
+            'google.cloud.vision': modulo_vision(perfis_servicos['vision']),
+            'yt_dlp': yt_dlp,
+            'yt_dlp.utils': yt_dlp.utils,
+        }))
+        pilha.enter_context(mock.patch.dict(os.environ, {'SPOTIPY_CLIENT_ID': 'benchmark', 'SPOTIPY_CLIENT_SECRET': 'benchmark'}))
+
+        from app import config_credentials as creds
+        from app import recommendation_engine, spotify_client
+        pilha.enter_context(mock.patch.multiple(creds, GEMINI_API_KEY='benchmark', YOUTUBE_API_KEY=None))
+        pilha.enter_context(mock.patch.object(recommendation_engine.requests, 'post',
+                                              GeminiFalso(perfis_servicos['gemini']).post))
+        limitador = spotify_client.TokenBucket(spotify_rps or 1e9, max(1, int(spotify_rps or 1e9)))
+        cliente = spotify_client.RateLimitedSpotify(
+            auth='benchmark', requests_session=SessaoSpotifyFalsa(perfis_servicos['spotify'], retry_after),
+            limiter=limitador)
+        pilha.enter_context(mock.patch.dict(spotify_client._app_clients, {'benchmark': cliente}))
+        yield
@@ -0,0 +1,49 @@
+# Nome do ficheiro: gunicorn.conf.py
+"""
+Configuração de produção (pre-fork): `gunicorn` na raiz do repositório lê este ficheiro.
+
+O processo mestre importa a aplicação (preload_app) e aquece o que pode ser partilhado
+pelos workers copy-on-write: módulos pesados (Vision, yt-dlp, spotipy), migrações,
+motor com os géneros do Spotify (server.preparar_pre_fork). Cada worker cria depois,
+em segundo plano, o que não sobrevive a um fork (clientes Vision e Spotify, fila de
+tarefas, ligações SQLite) e só então /readyz responde 200: com o balanceador a usar
+/readyz, o primeiro pedido de um utilizador nunca paga a inicialização.
+
+Entre workers, as respostas do Gemini, buscas e análises de imagem são partilhadas
+pela cache de resultados em SQLite (app/result_cache.py).
+
+    gunicorn                       # WEB_CONCURRENCY workers x GUNICORN_THREADS threads em $PORT
+"""
+import multiprocessing
+import os
+
+wsgi_app = 'app.server:app'
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+# Os pedidos esperam sobretudo por I/O (Vision, Gemini, Spotify, yt-dlp): threads por worker
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+preload_app = True
+# Recomendações com yt-dlp podem demorar; acima disto o worker é reiniciado
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+accesslog = '-'
+
+
+def when_ready(server):
+    # Chamado no mestre depois do preload e antes de criar os workers
+    from app import server as aplicacao
+    aplicacao.preparar_pre_fork()
+
+
+def post_fork(server, worker):
+    from app import server as aplicacao
+    aplicacao.aquecer_em_segundo_plano()
+
+
+def worker_exit(server, worker):
+    from app import server as aplicacao
+    contexto = aplicacao.get_app_context()
+    if contexto.inicializado('jobs'):
+        contexto['jobs'].parar()
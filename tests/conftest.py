@@ -0,0 +1,21 @@
+# Nome do ficheiro: tests/conftest.py
+"""Configuração do pytest: pacote `app` importável a partir da raiz do repositório e fixtures comuns."""
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Base de dados SQLite temporária com o esquema atual (todas as migrações)."""
+    from app.database import Database
+    from app.migrations import aplicar_migracoes
+    base = Database(str(tmp_path / 'banco_musicas.db'))
+    aplicar_migracoes(base)
+    yield base
+    base.close()
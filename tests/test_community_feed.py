@@ -0,0 +1,75 @@
+# Nome do ficheiro: tests/test_community_feed.py
+"""Paginação por cursor (keyset) do feed da comunidade."""
+from app import community_feed
+from app.community_feed import buscar_pagina, codificar_cursor, decodificar_cursor
+
+
+def _povoar(db, datas):
+    """Uma playlist por data (há datas repetidas, para exercitar o desempate pelo id)."""
+    with db.transacao() as cursor:
+        cursor.execute("INSERT INTO usuarios (service_user_id, service_name, display_name) VALUES ('u1', 'spotify', 'Ana')")
+        usuario_id = cursor.lastrowid
+        for i, data in enumerate(datas):
+            cursor.execute("INSERT INTO playlists_salvas (usuario_id, nome_playlist, service_name, data_criacao) VALUES (?, ?, 'spotify', ?)",
+                           (usuario_id, f"p{i}", data))
+            playlist_id = cursor.lastrowid
+            for k in range(6):
+                cursor.execute("INSERT INTO playlist_musicas (playlist_id, musica_id, service_name, album_cover_url, posicao) VALUES (?, ?, 'spotify', ?, ?)",
+                               (playlist_id, f"m{k}", f"https://capa/{playlist_id}/{k}", k))
+        cursor.execute("INSERT INTO playlist_likes (playlist_id, usuario_id) VALUES (?, ?)", (playlist_id, usuario_id))
+    return usuario_id
+
+
+def _todas_as_paginas(conn, usuario_id, limite):
+    paginas, cursor = [], None
+    while True:
+        playlists, cursor = buscar_pagina(conn, usuario_id, cursor=cursor, limite=limite)
+        paginas.append(playlists)
+        if cursor is None:
+            return paginas
+
+
+def test_cursor_ida_e_volta():
+    cursor = codificar_cursor('2024-01-02 10:00:00', 42)
+    assert decodificar_cursor(cursor) == ('2024-01-02 10:00:00', 42)
+
+
+def test_cursor_invalido_ou_ausente_volta_ao_inicio():
+    assert decodificar_cursor(None) == (None, None)
+    assert decodificar_cursor('isto-nao-e-base64!') == (None, None)
+    assert decodificar_cursor(codificar_cursor('2024-01-01', 'x')) == (None, None)
+
+
+def test_paginas_percorrem_o_feed_sem_repetir_nem_saltar(db):
+    datas = ['2024-01-01 10:00:00', '2024-01-03 10:00:00', '2024-01-02 10:00:00',
+             '2024-01-02 10:00:00', '2024-01-02 10:00:00', '2024-01-04 10:00:00', '2024-01-01 09:00:00']
+    usuario_id = _povoar(db, datas)
+    with db.conexao() as conn:
+        paginas = _todas_as_paginas(conn, usuario_id, limite=2)
+        completo, cursor = buscar_pagina(conn, usuario_id, limite=100)
+    assert cursor is None
+    assert [len(p) for p in paginas] == [2, 2, 2, 1]
+    ids = [p['id'] for pagina in paginas for p in pagina]
+    # Mesma ordem (data desc, id desc) que a consulta numa só página
+    assert ids == [p['id'] for p in completo]
+    assert ids == [6, 2, 5, 4, 3, 1, 7]
+
+
+def test_pagina_exata_nao_devolve_cursor(db):
+    usuario_id = _povoar(db, ['2024-01-01', '2024-01-02'])
+    with db.conexao() as conn:
+        playlists, cursor = buscar_pagina(conn, usuario_id, limite=2)
+    assert len(playlists) == 2 and cursor is None
+
+
+def test_capas_likes_e_limites(db):
+    usuario_id = _povoar(db, ['2024-01-01', '2024-01-02'])
+    with db.conexao() as conn:
+        playlists, _ = buscar_pagina(conn, usuario_id, limite=10)
+        por_omissao, _ = buscar_pagina(conn, usuario_id, limite=0)
+    ultima = playlists[0]
+    assert ultima['cover_urls'] == [f"https://capa/{ultima['id']}/{k}" for k in range(community_feed.MAX_COVERS)]
+    assert ultima['user_has_liked'] and ultima['like_count'] == 1
+    assert not playlists[1]['user_has_liked']
+    # limite 0/None usa o tamanho por omissão
+    assert len(por_omissao) == 2
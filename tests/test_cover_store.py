@@ -0,0 +1,59 @@
+# Nome do ficheiro: tests/test_cover_store.py
+"""Blob store de capas: miniaturas e recusa de imagens inválidas ou grandes demais."""
+import base64
+import io
+import os
+
+import pytest
+from PIL import Image
+
+from app import cover_store
+from app.cover_store import CoverStore
+
+
+def _png(largura, altura):
+    saida = io.BytesIO()
+    Image.new('RGB', (largura, altura), (200, 30, 30)).save(saida, format='PNG')
+    return saida.getvalue()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return CoverStore(str(tmp_path / 'covers'))
+
+
+def _ficheiros(store):
+    return [f for _, _, nomes in os.walk(store.base_dir) for f in nomes]
+
+
+def test_guarda_original_e_miniatura(store):
+    data_url = 'data:image/png;base64,' + base64.b64encode(_png(640, 480)).decode()
+    cover_hash = store.guardar_data_url(data_url)
+    with Image.open(store.caminho_miniatura(cover_hash)) as miniatura:
+        assert miniatura.size == (store.thumb_size, store.thumb_size)
+    # Mesmo conteúdo: mesmo hash, sem voltar a escrever
+    assert store.guardar_data_url(data_url) == cover_hash
+    assert len(_ficheiros(store)) == 2
+
+
+def test_bytes_que_nao_sao_imagem_sao_ignorados(store):
+    assert store.guardar_bytes(b'isto nao e uma imagem') is None
+    assert store.guardar_data_url('data:image/png;base64,@@@') is None
+    assert _ficheiros(store) == []
+
+
+def test_bomba_de_descompressao_e_recusada_sem_excecao(store, monkeypatch):
+    # Acima de 2x MAX_IMAGE_PIXELS o Pillow lança DecompressionBombError ao abrir
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 1000)
+    assert store.guardar_bytes(_png(100, 100)) is None
+    assert _ficheiros(store) == []
+
+
+def test_capa_com_pixeis_a_mais_nao_e_descodificada(store, monkeypatch):
+    monkeypatch.setattr(cover_store, 'MAX_COVER_PIXELS', 50 * 50)
+    converter = []
+    original = Image.Image.convert
+    monkeypatch.setattr(Image.Image, 'convert', lambda self, *a, **k: converter.append(1) or original(self, *a, **k))
+    assert store.guardar_bytes(_png(60, 60)) is None
+    assert converter == [] and _ficheiros(store) == []
+    assert store.guardar_bytes(_png(50, 50)) is not None
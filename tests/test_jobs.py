@@ -0,0 +1,138 @@
+# Nome do ficheiro: tests/test_jobs.py
+"""Fila de tarefas persistente: reserva, repetições com backoff e retoma depois do prazo."""
+import time
+
+import pytest
+
+from app import jobs
+from app.jobs import ErroTransitorio, JobQueue
+
+
+@pytest.fixture
+def fila(db, monkeypatch):
+    # Trabalhadores por iniciar: as tarefas são executadas à mão com executar_pendente()
+    fila = JobQueue(db, workers=1)
+    monkeypatch.setattr(fila, 'iniciar', lambda: None)
+    return fila
+
+
+def test_executa_e_guarda_o_resultado(fila):
+    fila.registar('soma', lambda job: {'total': sum(job.payload['valores'])})
+    job_id = fila.enfileirar('soma', {'valores': [1, 2, 3]}, usuario_id=7)
+    assert fila.obter(job_id)['status'] == jobs.ESTADO_PENDENTE
+    assert fila.executar_pendente()
+    estado = fila.obter(job_id, usuario_id=7)
+    assert estado['status'] == jobs.ESTADO_CONCLUIDO
+    assert estado['result'] == {'total': 6} and estado['attempts'] == 1
+    assert not fila.executar_pendente()
+
+
+def test_estado_nao_e_visivel_para_outro_utilizador(fila):
+    fila.registar('nada', lambda job: None)
+    job_id = fila.enfileirar('nada', {}, usuario_id=7)
+    assert fila.obter(job_id, usuario_id=8) is None
+
+
+def test_tipo_desconhecido_e_recusado(fila):
+    with pytest.raises(ValueError):
+        fila.enfileirar('inexistente', {})
+
+
+def test_chave_torna_o_enfileiramento_idempotente(fila):
+    fila.registar('nada', lambda job: None)
+    primeiro = fila.enfileirar('nada', {}, chave='outbox:1')
+    assert fila.enfileirar('nada', {}, chave='outbox:1') == primeiro
+    fila.executar_pendente()
+    # Concluída a tarefa, a mesma chave volta a criar uma nova
+    assert fila.enfileirar('nada', {}, chave='outbox:1') != primeiro
+
+
+def test_reserva_e_exclusiva_enquanto_o_prazo_nao_expira(fila):
+    fila.registar('nada', lambda job: None)
+    job_id = fila.enfileirar('nada', {})
+    job = fila._reservar()
+    assert job.id == job_id and job.tentativa == 1
+    assert fila.obter(job_id)['status'] == jobs.ESTADO_EM_CURSO
+    assert fila._reservar() is None
+
+
+def test_tarefa_abandonada_e_retomada_depois_do_prazo(fila, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_LEASE_SECONDS', 0.05)
+    fila.registar('nada', lambda job: 'feito')
+    job_id = fila.enfileirar('nada', {})
+    # O trabalhador reserva a tarefa e "morre" sem a concluir
+    assert fila._reservar().id == job_id
+    assert fila._reservar() is None
+    time.sleep(0.06)
+    retomada = fila._reservar()
+    assert retomada.id == job_id and retomada.tentativa == 2
+    fila._executar(retomada)
+    assert fila.obter(job_id)['status'] == jobs.ESTADO_CONCLUIDO
+
+
+def test_falha_transitoria_e_repetida_depois_da_espera(fila):
+    tentativas = []
+
+    def instavel(job):
+        tentativas.append(job.tentativa)
+        if job.tentativa == 1:
+            raise ErroTransitorio("503", retry_after=0.2)
+        return 'ok'
+
+    fila.registar('instavel', instavel)
+    job_id = fila.enfileirar('instavel', {})
+    assert fila.executar_pendente()
+    estado = fila.obter(job_id)
+    assert estado['status'] == jobs.ESTADO_PENDENTE and estado['error'] == '503'
+    assert estado['next_attempt_in'] > 0
+    # Ainda dentro da espera: nada para executar
+    assert not fila.executar_pendente()
+    time.sleep(0.21)
+    assert fila.executar_pendente()
+    estado = fila.obter(job_id)
+    assert estado['status'] == jobs.ESTADO_CONCLUIDO and estado['error'] is None
+    assert tentativas == [1, 2]
+
+
+def test_backoff_exponencial_sem_retry_after(fila, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_BACKOFF_BASE', 3)
+
+    def falha(job):
+        raise ErroTransitorio("timeout")
+
+    fila.registar('falha', falha)
+    job_id = fila.enfileirar('falha', {})
+    fila.executar_pendente()
+    assert 2.5 < fila.obter(job_id)['next_attempt_in'] <= 3
+
+
+def test_falha_transitoria_esgota_as_tentativas(fila):
+    def falha(job):
+        raise ErroTransitorio("503", retry_after=0.001)
+
+    fila.registar('falha', falha)
+    job_id = fila.enfileirar('falha', {}, max_tentativas=2)
+    fila.executar_pendente()
+    time.sleep(0.01)
+    fila.executar_pendente()
+    estado = fila.obter(job_id)
+    assert estado['status'] == jobs.ESTADO_FALHADO and estado['attempts'] == 2
+
+
+def test_outras_excecoes_falham_de_imediato(fila):
+    def erro(job):
+        raise RuntimeError("pedido inválido")
+
+    fila.registar('erro', erro)
+    job_id = fila.enfileirar('erro', {})
+    fila.executar_pendente()
+    estado = fila.obter(job_id)
+    assert estado['status'] == jobs.ESTADO_FALHADO
+    assert estado['error'] == 'pedido inválido' and estado['attempts'] == 1
+
+
+def test_sem_trabalhadores_executa_no_proprio_pedido(db):
+    fila = JobQueue(db, workers=0)
+    fila.registar('nada', lambda job: 'ok')
+    job_id = fila.enfileirar('nada', {})
+    assert fila.obter(job_id)['status'] == jobs.ESTADO_CONCLUIDO
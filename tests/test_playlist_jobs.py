@@ -0,0 +1,149 @@
+# Nome do ficheiro: tests/test_playlist_jobs.py
+"""Tarefa de playlist remota: o cliente do utilizador é recriado a partir da sessão no servidor."""
+import pytest
+
+from app import server
+from app.errors import SpotifyRateLimitError
+from app.jobs import ErroTransitorio, Job
+from app.playlist_persistence import PlaylistPersistence
+from app.session_store import SessionStore, criar_fernet
+
+
+class _ClientesFalsos:
+    """Como UserClientCache, sem rede: só tem os clientes criados neste "processo"."""
+
+    def __init__(self):
+        self.clientes = {}
+        self.tokens = []
+
+    def get_spotify_client(self, user_id, token_info):
+        self.tokens.append(token_info)
+        if ('spotify', user_id) not in self.clientes:
+            if not token_info:
+                raise server.importar('.client_cache', 'app').ClienteIndisponivelError(('spotify', user_id))
+            self.clientes[('spotify', user_id)] = f"cliente:{token_info['access_token']}"
+        return self.clientes[('spotify', user_id)], token_info
+
+
+class _PlaylistsFalsas:
+    def __init__(self):
+        self.executadas = []
+
+    def resultado(self, outbox_id):
+        return None
+
+    def executar(self, outbox_id, usuario_id, servico, user_client):
+        self.executadas.append((outbox_id, usuario_id, user_client))
+        return 'https://open.spotify.com/playlist/x', 'criada'
+
+
+class _FilaFalsa:
+    def __init__(self):
+        self.payloads = []
+
+    def enfileirar(self, tipo, payload, usuario_id=None, chave=None):
+        self.payloads.append(payload)
+        return 'job-1'
+
+
+@pytest.fixture
+def contexto(db, monkeypatch):
+    componentes = {
+        'db': db,
+        'sessions': SessionStore(db, criar_fernet(server.app.secret_key)),
+        'user_clients': _ClientesFalsos(),
+        'playlists': _PlaylistsFalsas(),
+        'jobs': _FilaFalsa(),
+        'services': {'spotify': object()},
+    }
+    for nome, valor in componentes.items():
+        monkeypatch.setattr(server.app_context._componentes[nome], '_valor', valor)
+    monkeypatch.setattr(server, 'SESSOES_SERVIDOR', True)
+    return componentes
+
+
+def _enfileirar_com_sessao(contexto):
+    """Login (sessão no servidor) e enfileiramento, como em /api/create_playlist."""
+    cliente = server.app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao.update({'service': 'spotify', 'internal_user_id': 7,
+                       'token_info': {'access_token': 'abc', 'refresh_token': 'r1', 'expires_at': 2 ** 40}})
+    sid = cliente.get_cookie('session').value
+    with server.app.test_request_context(headers={'Cookie': f'session={sid}'}):
+        resposta, estado = server._enfileirar_playlist_remota(server.app_context, 1, 'spotify', 'A guardar...')
+    assert estado == 202
+    return sid, contexto['jobs'].payloads[-1]
+
+
+def _job(payload):
+    return Job(None, 'job-1', server.JOB_PLAYLIST_REMOTA, payload, 7, 1)
+
+
+def test_payload_tem_referencia_a_sessao_e_nao_o_cookie(contexto):
+    sid, payload = _enfileirar_com_sessao(contexto)
+    assert payload['sessao'] and payload['sessao'] != sid
+    assert sid not in str(payload)
+
+
+def test_outro_processo_recria_o_cliente_com_o_token_da_sessao(contexto, monkeypatch):
+    _, payload = _enfileirar_com_sessao(contexto)
+    # Outro worker (ou o mesmo depois de reiniciar): cache de clientes vazia
+    monkeypatch.setattr(server.app_context._componentes['user_clients'], '_valor', _ClientesFalsos())
+    monkeypatch.setattr(Job, 'progresso', lambda self, mensagem: None)
+    resultado = server._job_playlist_remota(_job(payload))
+    assert resultado['operation'] == 'criada'
+    assert contexto['playlists'].executadas == [(1, 7, 'cliente:abc')]
+
+
+def test_sessao_terminada_falha_a_tarefa(contexto, monkeypatch):
+    sid, payload = _enfileirar_com_sessao(contexto)
+    contexto['sessions'].apagar(sid)
+    monkeypatch.setattr(server.app_context._componentes['user_clients'], '_valor', _ClientesFalsos())
+    with pytest.raises(RuntimeError, match='Sessão expirada'):
+        server._job_playlist_remota(_job(payload))
+
+
+def test_sem_sessao_no_servidor_o_cliente_em_falta_e_transitorio(contexto, monkeypatch):
+    monkeypatch.setattr(server.app_context._componentes['user_clients'], '_valor', _ClientesFalsos())
+    with pytest.raises(ErroTransitorio):
+        server._job_playlist_remota(_job({'outbox_id': 1, 'service_name': 'spotify'}))
+
+
+class _SpotifyFalso:
+    """Serviço cuja primeira criação falha (429) depois de a playlist remota já existir."""
+
+    def __init__(self):
+        self.criadas, self.sincronizadas = [], []
+
+    def create_playlist(self, user_client, playlist_name, tracks, ao_criar=None):
+        nova = {'id': f"remota{len(self.criadas)}",
+                'external_urls': {'spotify': f"https://open.spotify.com/playlist/remota{len(self.criadas)}"}}
+        self.criadas.append(playlist_name)
+        if ao_criar:
+            ao_criar(nova)
+        # As faixas são adicionadas em lotes: o segundo lote recebe um 429
+        raise SpotifyRateLimitError(30, 'playlists/{id}/tracks')
+
+    def sync_playlist(self, user_client, playlist_id, tracks):
+        self.sincronizadas.append((playlist_id, [t['spotify_id'] for t in tracks]))
+
+
+def test_repeticao_depois_de_criar_sincroniza_em_vez_de_criar_outra(contexto, db, monkeypatch):
+    servico = _SpotifyFalso()
+    playlists = PlaylistPersistence(db)
+    monkeypatch.setattr(server.app_context._componentes['playlists'], '_valor', playlists)
+    monkeypatch.setattr(server.app_context._componentes['services'], '_valor', {'spotify': servico})
+    monkeypatch.setattr(Job, 'progresso', lambda self, mensagem: None)
+    with db.transacao() as cursor:
+        cursor.execute("INSERT INTO usuarios (id, service_user_id, service_name) VALUES (7, 'u7', 'spotify')")
+    outbox_id = playlists.preparar_remota(7, 'Chuva', 'spotify', [{'spotify_id': 'a'}, {'spotify_id': 'b'}])
+    contexto['user_clients'].clientes[('spotify', 7)] = 'cliente'
+    payload = {'outbox_id': outbox_id, 'service_name': 'spotify'}
+
+    with pytest.raises(ErroTransitorio):
+        server._job_playlist_remota(_job(payload))
+    resultado = server._job_playlist_remota(_job(payload))
+
+    assert servico.criadas == ['Chuva']
+    assert servico.sincronizadas == [('remota0', ['a', 'b'])]
+    assert resultado['playlist_url'] == 'https://open.spotify.com/playlist/remota0'
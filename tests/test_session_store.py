@@ -0,0 +1,147 @@
+# Nome do ficheiro: tests/test_session_store.py
+"""Sessões no servidor: cookie opaco, renovação do identificador, cifra e expiração."""
+import time
+
+import pytest
+from cryptography.fernet import Fernet
+from flask import Flask, session
+
+from app import session_store
+from app.session_store import ServerSessionInterface, SessionStore, criar_fernet, referencia
+
+
+@pytest.fixture
+def store(db):
+    return SessionStore(db, criar_fernet('segredo'))
+
+
+@pytest.fixture
+def cliente(store):
+    app = Flask(__name__)
+    app.secret_key = 'segredo'
+    app.session_interface = ServerSessionInterface(lambda: store)
+
+    @app.route('/login/<int:uid>')
+    def login(uid):
+        session.update({'internal_user_id': uid, 'token_info': {'refresh_token': 'segredo-do-token'}})
+        return 'ok'
+
+    @app.route('/anonimo')
+    def anonimo():
+        session['oauth_state'] = 'abc'
+        return 'ok'
+
+    @app.route('/quem')
+    def quem():
+        return {'utilizador': session.get('internal_user_id')}
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return 'ok'
+
+    return app.test_client()
+
+
+def _sid(cliente):
+    cookie = cliente.get_cookie('session')
+    return cookie.value if cookie else None
+
+
+def test_cookie_leva_so_um_identificador_opaco(cliente, db):
+    cliente.get('/login/7')
+    sid = _sid(cliente)
+    assert len(sid) < 64 and 'segredo' not in sid
+    assert cliente.get('/quem').json == {'utilizador': 7}
+    with db.conexao() as conn:
+        chave, dados = conn.execute("SELECT id, dados FROM sessoes").fetchone()
+    # A tabela não guarda o identificador do cookie nem os dados em claro
+    assert chave == referencia(sid) and chave != sid
+    assert b'segredo-do-token' not in dados
+
+
+def test_identificador_muda_no_login_e_o_anterior_deixa_de_valer(cliente, store):
+    cliente.get('/anonimo')
+    anterior = _sid(cliente)
+    cliente.get('/login/7')
+    atual = _sid(cliente)
+    assert atual != anterior
+    assert store.carregar(anterior) is None
+    # Troca de conta também renova
+    cliente.get('/login/8')
+    assert _sid(cliente) != atual and store.carregar(atual) is None
+
+
+def test_pedido_sem_alteracoes_nao_reenvia_o_cookie(cliente):
+    cliente.get('/login/7')
+    resposta = cliente.get('/quem')
+    assert 'Set-Cookie' not in resposta.headers
+
+
+def test_logout_apaga_a_sessao(cliente, store):
+    cliente.get('/login/7')
+    sid = _sid(cliente)
+    cliente.get('/logout')
+    assert _sid(cliente) is None and store.carregar(sid) is None
+
+
+def test_cookie_forjado_comeca_sessao_vazia(cliente):
+    cliente.set_cookie('session', 'identificador-inventado')
+    assert cliente.get('/quem').json == {'utilizador': None}
+
+
+def test_dados_adulterados_na_tabela_sao_rejeitados(cliente, db, store):
+    cliente.get('/login/7')
+    sid = _sid(cliente)
+    with db.transacao() as cursor:
+        dados = cursor.execute("SELECT dados FROM sessoes").fetchone()[0]
+        adulterados = dados[:-5] + bytes(b ^ 1 for b in dados[-5:])
+        cursor.execute("UPDATE sessoes SET dados = ?, versao = versao + 1", (adulterados,))
+    assert store.carregar(sid) is None
+    assert cliente.get('/quem').json == {'utilizador': None}
+
+
+def test_alteracao_noutro_processo_e_vista_apesar_da_memoria(db, store):
+    outro = SessionStore(db, criar_fernet('segredo'))
+    store.guardar('sid', '{"a": 1}', time.time() + 60)
+    assert outro.carregar('sid')[0] == '{"a": 1}'
+    store.guardar('sid', '{"a": 2}', time.time() + 60)
+    assert outro.carregar('sid')[0] == '{"a": 2}'
+    store.apagar('sid')
+    assert outro.carregar('sid') is None
+
+
+def test_sessoes_expiradas_nao_carregam_e_sao_removidas(store):
+    store.guardar('velha', '{}', time.time() - 1)
+    store.guardar('nova', '{}', time.time() + 60)
+    assert store.carregar('velha') is None
+    assert store.limpar_expiradas() == 1
+    assert store.carregar('nova') is not None
+
+
+def test_chave_diferente_nao_decifra(db, store):
+    store.guardar('sid', '{}', time.time() + 60)
+    assert SessionStore(db, criar_fernet('outro-segredo')).carregar('sid') is None
+
+
+def test_rotacao_de_chaves(db, monkeypatch):
+    antiga, nova = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+    monkeypatch.setattr(session_store, 'SESSAO_CHAVES', antiga)
+    SessionStore(db, criar_fernet('x')).guardar('sid', '{"a": 1}', time.time() + 60)
+    # A nova chave cifra; a antiga continua a decifrar as sessões existentes
+    monkeypatch.setattr(session_store, 'SESSAO_CHAVES', f"{nova},{antiga}")
+    assert SessionStore(db, criar_fernet('x')).carregar('sid')[0] == '{"a": 1}'
+
+
+def test_gravacoes_concorrentes_noutros_processos_nao_deixam_copia_obsoleta(db):
+    primeiro = SessionStore(db, criar_fernet('segredo'))
+    segundo = SessionStore(db, criar_fernet('segredo'))
+    primeiro.guardar('sid', '{"pedido": 0}', time.time() + 60)
+    assert segundo.carregar('sid')[0] == '{"pedido": 0}'
+    # Dois pedidos simultâneos partiram da mesma versão e gravam cada um a sua cópia
+    v1 = primeiro.guardar('sid', '{"pedido": 1}', time.time() + 60)
+    v2 = segundo.guardar('sid', '{"pedido": 2}', time.time() + 60)
+    assert v2 == v1 + 1
+    # O primeiro tem em memória a versão que perdeu: tem de ler a que ficou gravada
+    assert primeiro.carregar('sid')[0] == '{"pedido": 2}'
+    assert segundo.carregar('sid')[0] == '{"pedido": 2}'
@@ -0,0 +1,152 @@
+# Nome do ficheiro: tests/test_spotify_client.py
+"""Token bucket e tratamento de 429/Retry-After do cliente Spotify partilhado."""
+import asyncio
+import time
+
+import pytest
+import spotipy
+from spotipy.exceptions import SpotifyException
+
+from app import spotify_client
+from app.errors import SpotifyRateLimitError
+from app.spotify_client import RateLimitedSpotify, SpotifyCallStats, TokenBucket
+
+
+def test_acquire_consome_o_burst_e_depois_espera():
+    bucket = TokenBucket(rate=20, capacity=2)
+    inicio = time.monotonic()
+    assert bucket.acquire() and bucket.acquire()
+    assert time.monotonic() - inicio < 0.02
+    assert bucket.acquire()
+    # A terceira ficha só chega ao fim de 1/rate segundos
+    assert time.monotonic() - inicio >= 0.04
+
+
+def test_acquire_com_timeout_curto_devolve_false():
+    bucket = TokenBucket(rate=1, capacity=1)
+    assert bucket.acquire()
+    inicio = time.monotonic()
+    assert bucket.acquire(timeout=0.1) is False
+    # Não espera pelo timeout: a ficha só chegaria depois dele
+    assert time.monotonic() - inicio < 0.05
+
+
+def test_pausa_suspende_as_fichas_ate_ao_fim():
+    bucket = TokenBucket(rate=100, capacity=5)
+    bucket.pause(0.1)
+    assert bucket.paused_for() > 0.05
+    assert bucket.acquire(timeout=0.01) is False
+    inicio = time.monotonic()
+    assert bucket.acquire()
+    assert time.monotonic() - inicio >= 0.05
+    assert bucket.paused_for() == 0.0
+
+
+class _Respostas:
+    """Substitui spotipy.Spotify._internal_call por uma sequência de respostas/exceções."""
+
+    def __init__(self, *respostas):
+        self.respostas = list(respostas)
+        self.chamadas = 0
+
+    def __call__(self, *args):
+        self.chamadas += 1
+        resposta = self.respostas.pop(0) if len(self.respostas) > 1 else self.respostas[0]
+        if isinstance(resposta, Exception):
+            raise resposta
+        return resposta
+
+
+def _erro_429(retry_after):
+    return SpotifyException(429, -1, 'rate limited', headers={'Retry-After': str(retry_after)})
+
+
+@pytest.fixture
+def cliente():
+    return RateLimitedSpotify(auth='token', limiter=TokenBucket(rate=100, capacity=10),
+                              stats=SpotifyCallStats(), max_retry_after=1)
+
+
+def test_429_com_retry_after_curto_espera_e_repete(monkeypatch, cliente):
+    respostas = _Respostas(_erro_429(0.05), {'ok': True})
+    monkeypatch.setattr(spotipy.Spotify, '_internal_call', respostas)
+    inicio = time.monotonic()
+    assert cliente.search('x') == {'ok': True}
+    assert respostas.chamadas == 2
+    assert time.monotonic() - inicio >= 0.05
+    assert cliente.stats.snapshot()['search']['rate_limited'] == 1
+
+
+def test_429_com_retry_after_longo_falha_logo_e_pausa_o_processo(monkeypatch, cliente):
+    respostas = _Respostas(_erro_429(3600))
+    monkeypatch.setattr(spotipy.Spotify, '_internal_call', respostas)
+    with pytest.raises(SpotifyRateLimitError) as erro:
+        cliente.search('x')
+    assert erro.value.retry_after == 3600
+    # Os pedidos seguintes falham de imediato, sem chamar o Spotify nem bloquear a thread
+    inicio = time.monotonic()
+    with pytest.raises(SpotifyRateLimitError) as erro:
+        cliente.search('y')
+    assert time.monotonic() - inicio < 0.1
+    assert erro.value.retry_after > 3000
+    assert respostas.chamadas == 1
+
+
+def test_429_repetido_desiste_ao_fim_de_max_tentativas(monkeypatch, cliente):
+    respostas = _Respostas(_erro_429(0))
+    monkeypatch.setattr(spotipy.Spotify, '_internal_call', respostas)
+    with pytest.raises(SpotifyRateLimitError):
+        cliente.search('x')
+    assert respostas.chamadas == spotify_client.MAX_429_RETRIES + 1
+
+
+def test_outros_erros_propagam_sem_repetir(monkeypatch, cliente):
+    respostas = _Respostas(SpotifyException(404, -1, 'not found'))
+    monkeypatch.setattr(spotipy.Spotify, '_internal_call', respostas)
+    with pytest.raises(SpotifyException):
+        cliente.search('x')
+    assert respostas.chamadas == 1
+    assert cliente.stats.snapshot()['search']['errors'] == 1
+
+
+def test_acquire_async_espera_pela_ficha():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    async def obter_duas():
+        assert await bucket.acquire_async()
+        inicio = time.monotonic()
+        assert await bucket.acquire_async()
+        return time.monotonic() - inicio
+
+    assert asyncio.run(obter_duas()) >= 0.04
+
+
+def test_acquire_async_durante_pausa_longa_devolve_false():
+    bucket = TokenBucket(rate=100, capacity=5)
+    bucket.pause(3600)
+
+    async def obter():
+        inicio = time.monotonic()
+        obtida = await bucket.acquire_async(timeout=1)
+        return obtida, time.monotonic() - inicio
+
+    obtida, duracao = asyncio.run(obter())
+    assert obtida is False and duracao < 0.1
+
+
+def test_acquire_async_nao_bloqueia_o_event_loop():
+    bucket = TokenBucket(rate=10, capacity=1)
+    bucket.acquire()
+    marcas = []
+
+    async def relogio():
+        for _ in range(5):
+            marcas.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def principal():
+        await asyncio.gather(bucket.acquire_async(), relogio())
+
+    asyncio.run(principal())
+    # O relógio continuou a andar enquanto a ficha era esperada
+    assert len(marcas) == 5 and marcas[-1] - marcas[0] < 0.09
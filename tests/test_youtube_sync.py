@@ -0,0 +1,105 @@
+# Nome do ficheiro: tests/test_youtube_sync.py
+"""Sincronização incremental de playlists do YouTube com um cliente da API falso."""
+import pytest
+
+from app.services.youtube_service import YouTubeMusicService
+
+
+class _ErroHttp(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type('Resp', (), {'status': status})()
+
+
+class _Pedido:
+    def __init__(self, executar):
+        self.executar = executar
+
+    def execute(self):
+        return self.executar()
+
+
+class _Lote:
+    def __init__(self, callback, falhas):
+        self.callback, self.falhas, self.pedidos = callback, falhas, []
+
+    def add(self, pedido):
+        self.pedidos.append(pedido)
+
+    def execute(self):
+        for i, pedido in enumerate(self.pedidos):
+            try:
+                resposta, erro = pedido.execute(), None
+            except Exception as e:
+                resposta, erro = None, e
+            if self.callback:
+                self.callback(str(i), resposta, erro)
+
+
+class _YouTubeFalso:
+    """Playlist remota em memória: itens (playlistItemId, videoId) pela ordem."""
+
+    def __init__(self, videos, falhar_remocao=None):
+        self.itens = [(f"item-{v}", v) for v in videos]
+        self.falhar_remocao = falhar_remocao or {}
+        self.operacoes = []
+
+    def playlistItems(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return _Lote(callback, self.falhar_remocao)
+
+    def list(self, **kwargs):
+        return _Pedido(lambda: {'items': [{'id': i, 'snippet': {'resourceId': {'videoId': v}}} for i, v in self.itens]})
+
+    def list_next(self, pedido, resposta):
+        return None
+
+    def delete(self, id):
+        def executar():
+            if id in self.falhar_remocao:
+                raise _ErroHttp(self.falhar_remocao[id])
+            self.operacoes.append(('delete', id))
+            self.itens = [(i, v) for i, v in self.itens if i != id]
+        return _Pedido(executar)
+
+    def insert(self, part, body):
+        def executar():
+            video = body['snippet']['resourceId']['videoId']
+            self.operacoes.append(('insert', video))
+            self.itens.insert(body['snippet']['position'], (f"item-{video}", video))
+            return {'id': f"item-{video}"}
+        return _Pedido(executar)
+
+    def update(self, part, body):
+        def executar():
+            self.operacoes.append(('update', body['id']))
+            item = next(x for x in self.itens if x[0] == body['id'])
+            self.itens.remove(item)
+            self.itens.insert(body['snippet']['position'], item)
+        return _Pedido(executar)
+
+
+def _faixas(videos):
+    return [{'spotify_id': v} for v in videos]
+
+
+def test_sincroniza_remocoes_insercoes_e_movimentos():
+    cliente = _YouTubeFalso(['a', 'b', 'c', 'd'])
+    YouTubeMusicService().sync_playlist(cliente, 'pl', _faixas(['d', 'a', 'e', 'c']))
+    assert [v for _, v in cliente.itens] == ['d', 'a', 'e', 'c']
+
+
+def test_remocao_falhada_aborta_antes_das_insercoes():
+    cliente = _YouTubeFalso(['a', 'b', 'c'], falhar_remocao={'item-b': 500})
+    with pytest.raises(_ErroHttp):
+        YouTubeMusicService().sync_playlist(cliente, 'pl', _faixas(['x', 'a', 'c']))
+    # Nada foi inserido nem movido com base em posições erradas
+    assert not [op for op in cliente.operacoes if op[0] != 'delete']
+
+
+def test_remocao_de_item_que_ja_nao_existe_nao_aborta():
+    cliente = _YouTubeFalso(['a', 'b', 'c'], falhar_remocao={'item-b': 404})
+    YouTubeMusicService().sync_playlist(cliente, 'pl', _faixas(['a', 'c', 'x']))
+    assert ('insert', 'x') in cliente.operacoes